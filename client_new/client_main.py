@@ -9,15 +9,32 @@ import socket
 import threading
 import json
 import os
+import hashlib
+import tempfile
 import time
 import platform
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from core.address_pool import AddressPool
 from core.task_executor import TaskExecutor
 from core.system_monitor import SystemMonitor
-from core.client_updater import ClientUpdater
+from core.client_updater import ClientUpdater, MANIFEST_HASHES, MANIFEST_FORMAT_VERSION
+from core.heartbeat_sender import HeartbeatSender
+from core.command_pool import BusyRejector, CommandWorkerPool
+from core.keep_alive import KeepAliveManager, KEEP_ALIVE_IDLE_TIMEOUT, KEEP_ALIVE_MAX_CONNECTIONS, is_reusable, read_request
+from core.relay import RelayFanout, RELAY_TIMEOUT, chunk_digest
+from core.content_cache import ContentCache
+from core.compression import DEFAULT_PROFILE
+from core.transfer import receive_file, receive_range, send_ready
+
+# 可以放在 batch 请求中执行的命令（请求/应答型，不涉及额外的数据传输）
+BATCH_COMMANDS = (
+    'start_monitor', 'stop_monitor', 'execute_command',
+    'get_system_info', 'get_version', 'get_worker_stats', 'get_files_manifest',
+    'get_staged_manifest', 'get_manifest_tree', 'get_dir_manifest', 'ping'
+)
 
 
 class Client:
@@ -81,6 +98,18 @@ class Client:
         # 初始化更新器（使用日志目录的父目录作为客户端目录）
         self.updater = ClientUpdater(self.log_dir.parent)
         
+        # 接收过的文件按内容缓存，服务端再次发送相同内容时不必重传；放在 updates/ 下，
+        # 不计入备份和更新包
+        cache_dir = self.updater.client_dir / 'updates' / 'cache'
+        legacy_cache_dir = self.updater.client_dir / 'cache'
+        if legacy_cache_dir.is_dir() and not cache_dir.exists():
+            try:
+                cache_dir.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(legacy_cache_dir, cache_dir)
+            except OSError as e:
+                self.logger.warning(f"迁移内容缓存目录失败: {e}")
+        self.content_cache = ContentCache(cache_dir, self.config.get('content_cache_mb', 512) * 1024 * 1024)
+        
         # 网络配置
         # 兼容旧配置：如果存在command_port，使用它作为client_listen_port
         if 'command_port' in self.config and 'client_listen_port' not in self.config:
@@ -94,12 +123,46 @@ class Client:
             self.server_command_port = self.config.get('server_command_port', 8888)
             self.server_monitor_port = self.config.get('server_monitor_port', 8889)
         
+        # 心跳发送器（间隔可由服务端在应答中调整）
+        self.heartbeat = HeartbeatSender(
+            self.address_pool,
+            self.server_command_port,
+            self.logger,
+            interval=self.config.get('heartbeat_interval', 10),
+            jitter=self.config.get('heartbeat_jitter', 0.2),
+            max_backoff=self.config.get('heartbeat_max_backoff', 120)
+        )
+        
         self.logger.info(f"客户端配置 - 监听端口: {self.client_listen_port}, 服务端命令端口: {self.server_command_port}, 服务端监控端口: {self.server_monitor_port}")
     
     def start(self):
         """启动客户端"""
         self.running = True
         
+        # 命令工作池：限制并发处理的连接数和排队深度
+        self.command_pool = CommandWorkerPool(
+            self._handle_command,
+            max_workers=self.config.get('max_workers', 8),
+            max_queue=self.config.get('max_queue', 32),
+            logger=self.logger
+        )
+        self.command_pool.start()
+        self.busy_rejector = BusyRejector()
+        self.busy_rejector.start()
+        
+        # 服务端连接池的长连接：空闲时统一等待，请求到达时提交给工作池
+        self.keep_alive = KeepAliveManager(
+            lambda conn, addr: self.command_pool.submit(conn, addr, self._handle_keep_alive),
+            self._reject_busy,
+            idle_timeout=self.config.get('keep_alive_idle', KEEP_ALIVE_IDLE_TIMEOUT),
+            max_connections=self.config.get('keep_alive_max', KEEP_ALIVE_MAX_CONNECTIONS),
+            logger=self.logger
+        )
+        self.keep_alive.start()
+        
+        # 后台保持文件清单缓存为最新（0 表示不启用）
+        self.updater.start_manifest_watcher(self.config.get('manifest_watch_interval', 0))
+        
         # 启动命令端口监听线程（客户端监听命令端口，接收服务端命令）
         command_thread = threading.Thread(target=self._listen_commands, daemon=True)
         command_thread.start()
@@ -149,7 +212,9 @@ class Client:
                         continue
                     
                     self.logger.info(f"接受来自 {addr[0]} 的连接")
-                    threading.Thread(target=self._handle_command, args=(conn, addr), daemon=True).start()
+                    if not self.command_pool.submit(conn, addr):
+                        # 工作池已满，明确返回busy，由服务端决定稍后重试
+                        self._reject_busy(conn, addr)
                 except Exception as e:
                     if self.running:
                         self.logger.error(f"命令端口接受连接错误: {e}")
@@ -162,14 +227,58 @@ class Client:
             except:
                 pass
     
+    def _reject_busy(self, conn, addr):
+        """工作池饱和时拒绝连接（由 busy_rejector 回复，不阻塞接受连接和长连接等待）"""
+        stats = self.command_pool.get_stats()
+        self.logger.warning(f"命令工作池已满，拒绝来自 {addr[0]} 的连接 (处理中: {stats['active']}, 排队: {stats['queued']})")
+        self.busy_rejector.reject(conn, {
+            'status': 'busy',
+            'message': '客户端繁忙，请稍后重试',
+            'active': stats['active'],
+            'queued': stats['queued']
+        })
+    
     def _handle_command(self, conn, addr):
-        """处理命令"""
+        """处理新连接上的请求"""
+        kept = False
         try:
             data = conn.recv(4096).decode('utf-8')
             if not data:
                 return
             
             msg = json.loads(data)
+            if msg.get('type') == 'keep_alive':
+                # 服务端连接池的长连接：确认后连接交给 keep_alive 等待后续请求
+                kept = self.keep_alive.accept(conn, addr, msg)
+                return
+            self._handle_message(conn, addr, msg)
+        except Exception as e:
+            self.logger.error(f"处理命令错误: {e}")
+            try:
+                conn.send(json.dumps({'status': 'error', 'message': str(e)}).encode('utf-8'))
+            except:
+                pass
+        finally:
+            if not kept:
+                conn.close()
+    
+    def _handle_keep_alive(self, conn, addr):
+        """处理长连接上的一个请求，请求/应答型的请求处理完后连接放回 keep_alive"""
+        msg = read_request(conn)
+        if msg is None:
+            self.keep_alive.close(conn)
+            return
+        try:
+            self._handle_message(conn, addr, msg)
+        finally:
+            if is_reusable(msg):
+                self.keep_alive.park(conn, addr)
+            else:
+                self.keep_alive.close(conn)
+    
+    def _handle_message(self, conn, addr, msg):
+        """处理一个请求（连接由调用方关闭或放回长连接）"""
+        try:
             msg_type = msg.get('type')
             
             if msg_type == 'command':
@@ -197,63 +306,62 @@ class Client:
                     # 在后台线程中执行备份和发送文件
                     def backup_async():
                         try:
-                            backup_result = self.task_executor.backup_files(server_ip, self.config.get('server_addresses', []), self.server_command_port)
+                            # 压缩档位：服务端按节点分组指定，否则使用本地配置
+                            profile = params.get('compression') or self.config.get('compression_profile', DEFAULT_PROFILE)
+                            # 压缩线程数默认为 CPU 核数的一半，留出 CPU 给 Web 服务
+                            workers = self.config.get('backup_workers') or max(1, (os.cpu_count() or 2) // 2)
+                            backup_result = self.task_executor.backup_files(server_ip, self.config.get('server_addresses', []), self.server_command_port, profile, workers)
                             self.logger.info(f"备份完成: {backup_result}")
                         except Exception as e:
                             self.logger.error(f"备份过程出错: {e}")
                     threading.Thread(target=backup_async, daemon=True).start()
-                elif command == 'start_monitor':
-                    self.monitor.start_monitoring()
-                    self.logger.info("监控已启动，开始上报数据")
-                    result = {'status': 'success', 'message': '监控已启动'}
-                    # 发送结果
+                elif command == 'rollback_update':
+                    # 优先切换回上一个暂存版本，没有时从更新前的备份恢复，成功后重启
+                    previous = self.updater.get_previous_staged_version()
+                    if previous:
+                        result = self.updater.activate_staged(previous)
+                    else:
+                        result = self.updater.rollback()
                     conn.send(json.dumps(result).encode('utf-8'))
                     self.logger.info(f"执行命令: {command}, 结果: {result}")
-                elif command == 'stop_monitor':
-                    self.monitor.stop_monitoring()
-                    self.logger.info("监控已停止")
-                    result = {'status': 'success', 'message': '监控已停止'}
-                    # 发送结果
+                    if result.get('status') == 'success':
+                        self._schedule_restart(delay=2)
+                elif command == 'activate_update':
+                    # 激活已预分发的版本（只做文件切换），成功后重启
+                    result = self.updater.activate_staged(params.get('version'))
                     conn.send(json.dumps(result).encode('utf-8'))
-                    self.logger.info(f"执行命令: {command}, 结果: {result}")
-                elif command == 'execute_command':
-                    # 执行远程命令
+                    self.logger.info(f"执行命令: {command}, 结果: {result.get('status')}, {result.get('message')}")
+                    if result.get('status') == 'success':
+                        self._schedule_restart(delay=2)
+                elif command in BATCH_COMMANDS:
+                    result = self._run_simple_command(command, params)
+                    conn.sendall(json.dumps(result).encode('utf-8'))
+                elif command == 'execute_command_stream':
+                    # 流式执行远程命令，输出分块实时回传
                     cmd = params.get('cmd', '')
-                    timeout = params.get('timeout', 30)
                     if not cmd:
                         result = {'status': 'error', 'message': '命令不能为空'}
+                        conn.send(json.dumps(result).encode('utf-8'))
                     else:
-                        self.logger.info(f"执行远程命令: {cmd}")
-                        result = self.task_executor.execute_command(cmd, timeout)
-                        self.logger.info(f"命令执行结果: {result.get('return_code', -1)}")
-                    conn.send(json.dumps(result).encode('utf-8'))
-                elif command == 'get_system_info':
-                    # 获取系统详细信息
-                    result = self.task_executor.get_system_info()
-                    result['status'] = 'success'
-                    conn.send(json.dumps(result).encode('utf-8'))
-                    self.logger.info(f"获取系统信息: {result.get('hostname', 'unknown')}")
-                elif command == 'get_version':
-                    # 获取客户端版本
-                    result = {
-                        'status': 'success',
-                        'version': self.updater.get_local_version()
-                    }
-                    conn.send(json.dumps(result).encode('utf-8'))
-                elif command == 'get_files_manifest':
-                    # 获取客户端文件清单
-                    manifest = self.updater.get_local_files_manifest()
-                    result = {
-                        'status': 'success',
-                        'manifest': manifest
-                    }
-                    conn.send(json.dumps(result).encode('utf-8'))
+                        self.logger.info(f"流式执行远程命令: {cmd}")
+                        result = self._execute_command_stream(
+                            conn, cmd,
+                            params.get('timeout', 300),
+                            params.get('buffer_size', 262144)
+                        )
+                        self.logger.info(f"流式命令执行结果: {result.get('return_code', -1)}, {result.get('message')}")
                 else:
                     result = {'status': 'error', 'message': f'未知命令: {command}'}
                     # 发送结果
                     conn.send(json.dumps(result).encode('utf-8'))
                     self.logger.info(f"执行命令: {command}, 结果: {result}")
             
+            elif msg_type == 'batch':
+                # 批量命令：一次往返执行多条命令，结果按请求顺序整体返回
+                result = self._handle_batch(msg)
+                conn.sendall((json.dumps(result) + '\n').encode('utf-8'))
+                self.logger.info(f"批量命令执行完成: {len(result.get('results', []))} 条, 耗时 {result.get('duration')}s")
+            
             elif msg_type == 'file_update':
                 # 文件更新
                 remote_path = msg.get('remote_path')
@@ -261,6 +369,17 @@ class Client:
                 is_zip = msg.get('is_zip', False)
                 update_type = msg.get('update_type', 'single_file')
 
+                if msg.get('sha256'):
+                    # 逐块校验、可续传
+                    path, result = self._receive_transfer(conn, msg)
+                    if path:
+                        with open(path, 'rb') as f:
+                            result = self.task_executor.store_file(f, remote_path, is_zip)
+                        self.content_cache.add(path, msg['sha256'])
+                    conn.sendall(json.dumps(result).encode('utf-8'))
+                    self.logger.info(f"文件更新 ({update_type}): {remote_path}, 结果: {result}")
+                    return
+
                 # 发送准备就绪
                 conn.send('ready'.encode('utf-8'))
 
@@ -279,6 +398,45 @@ class Client:
                 conn.send(json.dumps(result).encode('utf-8'))
                 self.logger.info(f"文件更新 ({update_type}): {remote_path}, 结果: {result}")
 
+            elif msg_type == 'range_put':
+                # 大文件分段并行传输中的一段
+                conn.settimeout(300)
+                result = receive_range(conn, msg, self._partial_dir(), self.logger, self.content_cache)
+                conn.sendall(json.dumps(result).encode('utf-8'))
+
+            elif msg_type == 'relay':
+                # 接力分发：接收的同时转发给下游节点
+                self._handle_relay(conn, msg)
+
+            elif msg_type == 'bandwidth_probe':
+                # 带宽探测：接收服务端发送的 size 字节（丢弃），收完后确认
+                size = int(msg.get('size', 0))
+                send_ready(conn, 0)
+                conn.settimeout(300)
+                received = 0
+                while received < size:
+                    chunk = conn.recv(min(262144, size - received))
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                conn.sendall(json.dumps({'status': 'success', 'received': received}).encode('utf-8'))
+
+            elif msg_type == 'dir_sync':
+                # 目录同步：只接收变化的文件，并删除服务端目录中没有的文件
+                remote_dir = msg.get('remote_dir', '')
+                if self.task_executor.resolve_sync_dir(remote_dir) is None:
+                    conn.sendall(json.dumps({'status': 'error', 'message': f'无效的目录: {remote_dir}'}).encode('utf-8'))
+                    return
+                conn.send('ready'.encode('utf-8'))
+                conn.settimeout(300)
+                reader = conn.makefile('rb')
+                try:
+                    result = self.task_executor.sync_directory(reader, remote_dir, msg.get('hash', 'blake2b'))
+                finally:
+                    reader.close()
+                conn.sendall(json.dumps(result).encode('utf-8'))
+                self.logger.info(f"目录同步: {remote_dir}, 结果: {result.get('status')}, {result.get('message')}")
+
             elif msg_type == 'update':
                 # 客户端更新
                 new_version = msg.get('version')
@@ -286,6 +444,38 @@ class Client:
 
                 self.logger.info(f"收到更新请求: 版本 {new_version}, 类型: {update_type}")
 
+                if update_type == 'full' and msg.get('sha256'):
+                    # 全量更新包逐块校验、可续传
+                    path, result = self._receive_transfer(conn, msg)
+                    if path:
+                        with open(path, 'rb') as f:
+                            update_data = f.read()
+                        # 回滚后重新分发同一版本时可直接使用缓存
+                        self.content_cache.add(path, msg['sha256'])
+                        result = self.updater.apply_update(update_data, new_version, 'full')
+                    conn.sendall(json.dumps(result).encode('utf-8'))
+                    self.logger.info(f"更新结果: {result}")
+                    if result.get('status') == 'success':
+                        self.updater.cleanup_old_backups(keep_count=3)
+                        self._schedule_restart(delay=2)
+                    return
+
+                if update_type == 'stage' and msg.get('sha256'):
+                    # 预分发：更新数据按块校验、可续传地接收到文件，再写入暂存目录，
+                    # 不影响当前运行的版本
+                    path, result = self._receive_transfer(conn, msg)
+                    if path:
+                        header, entries, result = self._read_update_entries(path)
+                        if not result:
+                            result = self.updater.stage_update(entries, new_version, header.get('files', {}))
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                    conn.sendall(json.dumps(result).encode('utf-8'))
+                    self.logger.info(f"预分发结果: {result.get('status')}, {result.get('message')}")
+                    return
+
                 # 发送准备就绪
                 conn.send('ready'.encode('utf-8'))
 
@@ -293,6 +483,27 @@ class Client:
                 update_data = b''
                 conn.settimeout(300)  # 5分钟超时
 
+                if update_type == 'delta':
+                    # 块级差异更新：一行JSON头 + 各条目的原始字节
+                    result = self._receive_delta_update(conn, new_version)
+                    conn.sendall(json.dumps(result).encode('utf-8'))
+                    self.logger.info(f"更新结果: {result}")
+                    if result.get('status') == 'success':
+                        self.updater.cleanup_old_backups(keep_count=3)
+                        self._schedule_restart(delay=2)
+                    return
+
+                if update_type == 'stage':
+                    # 旧版服务端的预分发：整体发送，不可续传
+                    header, entries, error = self._read_update_entries(conn)
+                    if error:
+                        result = error
+                    else:
+                        result = self.updater.stage_update(entries, new_version, header.get('files', {}))
+                    conn.sendall(json.dumps(result).encode('utf-8'))
+                    self.logger.info(f"预分发结果: {result.get('status')}, {result.get('message')}")
+                    return
+
                 while True:
                     try:
                         chunk = conn.recv(65536)  # 64KB chunks
@@ -357,61 +568,347 @@ class Client:
                 conn.send(json.dumps({'status': 'error', 'message': str(e)}).encode('utf-8'))
             except:
                 pass
+    
+    def _run_simple_command(self, command, params):
+        """
+        执行请求/应答型命令
+        
+        Args:
+            command: 命令名称，必须在 BATCH_COMMANDS 中
+            params: 命令参数
+            
+        Returns:
+            dict: 命令结果
+        """
+        if command == 'start_monitor':
+            self.monitor.start_monitoring()
+            self.logger.info("监控已启动，开始上报数据")
+            result = {'status': 'success', 'message': '监控已启动'}
+            self.logger.info(f"执行命令: {command}, 结果: {result}")
+        elif command == 'stop_monitor':
+            self.monitor.stop_monitoring()
+            self.logger.info("监控已停止")
+            result = {'status': 'success', 'message': '监控已停止'}
+            self.logger.info(f"执行命令: {command}, 结果: {result}")
+        elif command == 'execute_command':
+            # 执行远程命令
+            cmd = params.get('cmd', '')
+            timeout = params.get('timeout', 30)
+            if not cmd:
+                result = {'status': 'error', 'message': '命令不能为空'}
+            else:
+                self.logger.info(f"执行远程命令: {cmd}")
+                result = self.task_executor.execute_command(cmd, timeout)
+                self.logger.info(f"命令执行结果: {result.get('return_code', -1)}")
+        elif command == 'get_system_info':
+            # 获取系统详细信息
+            result = self.task_executor.get_system_info()
+            result['status'] = 'success'
+            self.logger.info(f"获取系统信息: {result.get('hostname', 'unknown')}")
+        elif command == 'get_version':
+            # 获取客户端版本
+            result = {
+                'status': 'success',
+                'version': self.updater.get_local_version(),
+                'capabilities': ['batch', 'delta', 'stage', 'merkle', 'relay', 'range', 'dir_sync', 'keep_alive', 'ping']
+            }
+        elif command == 'ping':
+            # 链路测量：服务端据此和自己的收发时间计算 RTT 和时钟偏差
+            result = {'status': 'success', 'time': time.time()}
+        elif command == 'get_worker_stats':
+            # 获取命令工作池的队列和延迟统计
+            result = {
+                'status': 'success',
+                'stats': dict(self.command_pool.get_stats(),
+                              keep_alive=self.keep_alive.get_stats()['connections'])
+            }
+        elif command == 'get_files_manifest':
+            # 获取客户端文件清单，hash 为服务端要求的算法，不支持时退回 md5
+            hash_name = params.get('hash', 'md5')
+            if hash_name not in MANIFEST_HASHES:
+                hash_name = 'md5'
+            result = {
+                'status': 'success',
+                'manifest': self.updater.get_local_files_manifest(hash_name=hash_name),
+                'hash': hash_name,
+                'manifest_version': MANIFEST_FORMAT_VERSION
+            }
+        elif command == 'get_manifest_tree':
+            # 按目录 Merkle 哈希比较，只返回与服务端不同的目录中的文件
+            hash_name = params.get('hash', 'blake2b')
+            if hash_name not in MANIFEST_HASHES:
+                hash_name = 'blake2b'
+            result = self.updater.get_manifest_tree(hash_name, params.get('dirs'))
+        elif command == 'get_staged_manifest':
+            # 获取某个版本已暂存的文件清单（用于续传预分发）
+            result = self.updater.get_staged_manifest(params.get('version'))
+        elif command == 'get_dir_manifest':
+            # 获取 Transfer Files 下某个目录的文件清单（用于目录同步）
+            hash_name = params.get('hash', 'blake2b')
+            if hash_name not in MANIFEST_HASHES:
+                hash_name = 'blake2b'
+            result = self.task_executor.get_dir_manifest(params.get('remote_dir', ''), hash_name)
+        else:
+            result = {'status': 'error', 'message': f'未知命令: {command}'}
+        return result
+    
+    def _handle_batch(self, msg):
+        """
+        执行批量命令
+        
+        Args:
+            msg: batch 消息，commands 为 [{'command', 'params'}] 列表；
+                 parallel 为 True 时各命令并发执行（命令之间须互不依赖）；
+                 stop_on_error 为 True 时顺序执行遇到失败即跳过后续命令
+            
+        Returns:
+            dict: {'status', 'results': 与 commands 一一对应的结果列表, 'duration'}
+        """
+        commands = msg.get('commands') or []
+        parallel = msg.get('parallel', False)
+        stop_on_error = msg.get('stop_on_error', False)
+        started = time.time()
+        
+        def run_one(item):
+            command = item.get('command')
+            if command not in BATCH_COMMANDS:
+                return {'status': 'error', 'message': f'批量请求不支持的命令: {command}'}
+            try:
+                return self._run_simple_command(command, item.get('params') or {})
+            except Exception as e:
+                return {'status': 'error', 'message': str(e)}
+        
+        if parallel and len(commands) > 1:
+            workers = min(len(commands), self.config.get('batch_max_parallel', 4))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(run_one, commands))
+        else:
+            results = []
+            failed = False
+            for item in commands:
+                if failed and stop_on_error:
+                    results.append({'status': 'skipped', 'message': '前序命令失败，已跳过'})
+                    continue
+                result = run_one(item)
+                failed = failed or result.get('status') != 'success'
+                results.append(result)
+        
+        return {
+            'status': 'success',
+            'results': results,
+            'duration': round(time.time() - started, 3)
+        }
+    
+    def _read_update_entries(self, source):
+        """
+        读取一行JSON头 + 各条目原始字节格式的更新数据
+        
+        Args:
+            source: 连接，或已完整接收的更新数据文件路径
+        
+        Returns:
+            tuple: (header, entries, error)，error 不为 None 时表示读取失败
+        """
+        try:
+            reader = open(source, 'rb') if isinstance(source, Path) else source.makefile('rb')
+        except OSError as e:
+            return None, None, {'status': 'error', 'message': f'读取更新数据失败: {e}'}
+        try:
+            header = json.loads(reader.readline().decode('utf-8'))
+            entries = []
+            for entry in header.get('entries', []):
+                data = reader.read(entry['size'])
+                if len(data) != entry['size']:
+                    return None, None, {'status': 'error', 'message': f"更新数据不完整: {entry['path']}"}
+                entries.append(dict(entry, data=data))
+        except Exception as e:
+            return None, None, {'status': 'error', 'message': f'解析更新数据失败: {str(e)}'}
         finally:
-            conn.close()
+            reader.close()
+        
+        received = sum(entry['size'] for entry in entries)
+        self.logger.info(f"更新数据接收完成: {len(entries)} 个文件, {received} 字节")
+        return header, entries, None
+    
+    def _receive_transfer(self, conn, msg):
+        """
+        按可续传协议接收一个文件（请求带 sha256 时使用），未完成的部分保存在 updates/partial/，
+        内容缓存中已有相同内容时不再接收数据；使用完文件后由调用方移入内容缓存
+        
+        Returns:
+            tuple: (完成的文件路径, 错误结果)
+        """
+        conn.settimeout(300)
+        return receive_file(conn, msg, self._partial_dir(), self.logger, self.content_cache)
+    
+    def _partial_dir(self):
+        """未完成的传输（含分段并行传输）保存的目录"""
+        return self.updater.client_dir / 'updates' / 'partial'
+    
+    def _receive_delta_update(self, conn, new_version):
+        """
+        接收并应用块级差异更新
+        
+        Returns:
+            dict: 更新结果
+        """
+        _header, entries, error = self._read_update_entries(conn)
+        if error:
+            return error
+        return self.updater.apply_update(entries, new_version, 'delta')
+    
+    def _receive_relay_chunks(self, reader, header, fanout, out):
+        """
+        逐块接收、校验并转发接力数据，写入 out
+
+        Returns:
+            dict: 出错时返回错误结果，成功返回 None
+        """
+        file_size = header['file_size']
+        chunk_size = header['chunk_size']
+        chunk_hashes = header['chunk_hashes']
+        whole = hashlib.sha256()
+        for index, expected in enumerate(chunk_hashes):
+            size = min(chunk_size, file_size - index * chunk_size)
+            chunk = reader.read(size)
+            if len(chunk) != size:
+                return {'status': 'error', 'message': f'接力数据不完整: 第 {index} 块'}
+            # 先校验再转发，损坏的数据不会扩散到下游
+            if chunk_digest(chunk) != expected:
+                return {'status': 'error', 'message': f'接力数据校验失败: 第 {index} 块'}
+            fanout.forward(chunk)
+            out.write(chunk)
+            whole.update(chunk)
+        if whole.hexdigest() != header.get('sha256', whole.hexdigest()):
+            return {'status': 'error', 'message': '接力数据整体校验失败'}
+        return None
+    
+    def _handle_relay(self, conn, msg):
+        """
+        处理接力分发：一行JSON头（分块哈希和下游子树）+ 原始数据块。
+        每块校验后立即转发给下游，本节点全部收完后保存文件或应用全量更新，
+        再汇总整棵子树的结果一并返回上游
+        """
+        purpose = msg.get('purpose', 'file')
+        conn.send('ready'.encode('utf-8'))
+        conn.settimeout(RELAY_TIMEOUT)
+        reader = conn.makefile('rb')
+        try:
+            header = json.loads(reader.readline().decode('utf-8'))
+        except Exception as e:
+            reader.close()
+            conn.sendall((json.dumps({'status': 'error', 'message': f'解析接力数据失败: {e}'}) + '\n').encode('utf-8'))
+            return
+        
+        fanout = RelayFanout(msg, header, self.client_listen_port, self.logger)
+        fanout.connect(header.get('children', []))
+        self.logger.info(f"接力分发 ({purpose}): {header['file_size']} 字节, 下游 {len(fanout.links)} 个节点")
+        
+        with tempfile.TemporaryFile() as tmp:
+            try:
+                result = self._receive_relay_chunks(reader, header, fanout, tmp)
+            except Exception as e:
+                result = {'status': 'error', 'message': f'接收接力数据失败: {e}'}
+            finally:
+                reader.close()
+            
+            if result:
+                fanout.abort(f"上游节点出错: {result['message']}")
+            else:
+                tmp.seek(0)
+                if purpose == 'update':
+                    result = self.updater.apply_update(tmp.read(), msg.get('version'), 'full')
+                else:
+                    result = self.task_executor.store_file(tmp, msg.get('remote_path'), msg.get('is_zip', False))
+                if result.get('status') == 'success' and header.get('sha256'):
+                    tmp.seek(0)
+                    self.content_cache.add_fileobj(tmp, header['sha256'])
+        
+        results = fanout.collect()
+        conn.sendall((json.dumps({
+            'status': result.get('status'),
+            'result': result,
+            'results': results
+        }) + '\n').encode('utf-8'))
+        failed = sum(1 for r in results.values() if r.get('status') != 'success')
+        self.logger.info(f"接力分发结果: {result.get('status')}, 下游 {len(results)} 个节点, 失败 {failed} 个")
+        
+        if purpose == 'update' and result.get('status') == 'success':
+            self.updater.cleanup_old_backups(keep_count=3)
+            self._schedule_restart(delay=2)
+    
+    def _execute_command_stream(self, conn, cmd, timeout, buffer_size):
+        """
+        流式执行命令：按行发送JSON帧（stream_output ... stream_end），
+        执行期间监听服务端发来的 stream_cancel 帧
+        """
+        cancel_event = threading.Event()
+        send_lock = threading.Lock()
+        seq = [0]
+        
+        def send_frame(frame):
+            with send_lock:
+                conn.sendall((json.dumps(frame) + '\n').encode('utf-8'))
+        
+        def emit(stream, text):
+            seq[0] += 1
+            send_frame({'type': 'stream_output', 'seq': seq[0], 'stream': stream, 'data': text})
+        
+        def is_cancel_frame(line):
+            try:
+                frame = json.loads(line.decode('utf-8'))
+            except ValueError:
+                return False
+            return isinstance(frame, dict) and frame.get('type') == 'stream_cancel'
+        
+        def listen_cancel():
+            # 服务端按行发送 JSON 帧，逐行解析，只有 stream_cancel 帧表示取消
+            buffer = b''
+            try:
+                while not cancel_event.is_set():
+                    data = conn.recv(1024)
+                    if not data:
+                        break
+                    buffer += data
+                    *lines, buffer = buffer.split(b'\n')
+                    if any(is_cancel_frame(line) for line in lines if line.strip()):
+                        self.logger.info(f"服务端取消流式命令: {cmd}")
+                        break
+            except Exception:
+                pass
+            cancel_event.set()
+        
+        conn.settimeout(None)
+        send_frame({'type': 'stream_start', 'command': cmd})
+        listener = threading.Thread(target=listen_cancel, daemon=True)
+        listener.start()
+        
+        result = self.task_executor.execute_command_stream(cmd, emit, cancel_event, timeout, buffer_size)
+        
+        # 结束监听线程（不再关心取消帧）
+        cancel_event.set()
+        try:
+            send_frame({'type': 'stream_end', 'result': result})
+            conn.shutdown(socket.SHUT_WR)
+        except Exception:
+            pass
+        return result
     
     def _send_heartbeat_immediate(self):
         """立即发送心跳（用于启动时注册）"""
-        for server_ip in self.address_pool.allowed_addresses:
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(3)
-                sock.connect((server_ip, self.server_command_port))
-                
-                msg = {
-                    'type': 'heartbeat',
-                    'os': platform.system(),
-                    'info': {
-                        'hostname': platform.node(),
-                        'os_version': platform.version()
-                    }
-                }
-                sock.send(json.dumps(msg).encode('utf-8'))
-                response = sock.recv(1024)
-                sock.close()
+        results = self.heartbeat.send_all()
+        for server_ip, ok in results.items():
+            if ok:
                 self.logger.info(f"已向服务端 {server_ip} 注册")
-            except Exception as e:
-                self.logger.warning(f"注册失败 {server_ip}: {e}")
+            else:
+                self.logger.warning(f"注册失败 {server_ip}")
     
     def _heartbeat_loop(self):
-        """心跳循环"""
+        """心跳循环（各服务端并发发送，带随机抖动和失败退避）"""
         time.sleep(2)  # 等待2秒，让立即发送的心跳先完成
         while self.running:
             try:
-                # 向所有允许的服务端地址发送心跳
-                for server_ip in self.address_pool.allowed_addresses:
-                    try:
-                        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        sock.settimeout(3)
-                        sock.connect((server_ip, self.server_command_port))
-                        
-                        # 发送注册/心跳信息
-                        msg = {
-                            'type': 'heartbeat',
-                            'os': platform.system(),
-                            'info': {
-                                'hostname': platform.node(),
-                                'os_version': platform.version()
-                            }
-                        }
-                        sock.send(json.dumps(msg).encode('utf-8'))
-                        
-                        response = sock.recv(1024)
-                        sock.close()
-                    except Exception as e:
-                        self.logger.debug(f"心跳发送失败 {server_ip}: {e}")
-                
-                time.sleep(10)  # 每10秒发送一次心跳
+                self.heartbeat.run(lambda: self.running)
             except Exception as e:
                 self.logger.error(f"心跳循环错误: {e}")
                 time.sleep(10)
@@ -497,6 +994,12 @@ class Client:
     def stop(self):
         """停止客户端"""
         self.running = False
+        if hasattr(self, 'keep_alive'):
+            self.keep_alive.stop()
+        if hasattr(self, 'command_pool'):
+            self.command_pool.stop()
+        if hasattr(self, 'busy_rejector'):
+            self.busy_rejector.stop()
         self.logger.info("客户端已停止")
 
 
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+块级二进制差异 - 应用端
+解析服务端 UpdateManager 生成的块级差异（格式见服务端 core/block_delta.py）
+"""
+
+import hashlib
+import struct
+
+MAGIC = b'WCD1'
+HEADER = struct.Struct('>4sI16s16sQ')
+COPY = struct.Struct('>cII')
+DATA = struct.Struct('>cI')
+
+
+def read_header(delta):
+    """
+    解析差异头部
+
+    Returns:
+        dict: block_size, basis_md5, target_md5, target_size
+    """
+    magic, block_size, basis_md5, target_md5, target_size = HEADER.unpack_from(delta, 0)
+    if magic != MAGIC:
+        raise ValueError('无效的差异数据')
+    return {
+        'block_size': block_size,
+        'basis_md5': basis_md5.hex(),
+        'target_md5': target_md5.hex(),
+        'target_size': target_size
+    }
+
+
+def apply_delta(basis, delta):
+    """
+    把差异应用到旧文件内容上
+
+    Args:
+        basis: 旧文件内容（bytes）
+        delta: 差异数据（bytes）
+
+    Returns:
+        bytes: 新文件内容，旧文件或结果的 md5 不匹配时抛出 ValueError
+    """
+    header = read_header(delta)
+    if hashlib.md5(basis).hexdigest() != header['basis_md5']:
+        raise ValueError('本地文件与差异的基准版本不一致')
+
+    block_size = header['block_size']
+    parts = []
+    pos = HEADER.size
+    while pos < len(delta):
+        op = delta[pos:pos + 1]
+        if op == b'C':
+            _, start, count = COPY.unpack_from(delta, pos)
+            parts.append(basis[start * block_size:(start + count) * block_size])
+            pos += COPY.size
+        elif op == b'D':
+            _, length = DATA.unpack_from(delta, pos)
+            pos += DATA.size
+            parts.append(delta[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError(f'未知的差异指令: {op!r}')
+
+    result = b''.join(parts)
+    if len(result) != header['target_size'] or hashlib.md5(result).hexdigest() != header['target_md5']:
+        raise ValueError('差异应用结果校验失败')
+    return result
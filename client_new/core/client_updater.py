@@ -11,10 +11,34 @@ import hashlib
 import shutil
 import zipfile
 import tempfile
+import threading
 import time
 from pathlib import Path
 from datetime import datetime
 
+from core.block_delta import apply_delta
+from core.merkle import dir_hashes, parent_dir
+
+# 增量更新时保留本地的文件（用户配置）
+PRESERVED_FILES = ['config.json']
+
+# 节点本地的文件（配置和版本记录）：不参与预分发/激活切换，也不计入 Merkle 哈希
+NODE_LOCAL_FILES = PRESERVED_FILES + ['version.json']
+STAGED_MARKER = '.staged.json'
+
+# 文件清单支持的哈希算法（名称与服务端 shared/protocol.py 保持一致）
+MANIFEST_HASHES = {
+    'md5': hashlib.md5,
+    'blake2b': lambda: hashlib.blake2b(digest_size=16)
+}
+MANIFEST_FORMAT_VERSION = 2
+# 更新包包含的文件（与服务端 shared/protocol.py 保持一致），只有这些文件参与 Merkle 比较
+PACKAGE_ROOT_FILES = ['client_main.py', 'config.json', 'requirements.txt', 'start.bat']
+PACKAGE_DIRS = ['core']
+MANIFEST_CACHE_VERSION = 1
+# 修改时间距今不足该值（纳秒）的文件不写入缓存，避免同一时间戳内再次修改而漏检
+MANIFEST_RACY_NS = 2 * 10 ** 9
+
 
 class ClientUpdater:
     """客户端更新器 - 处理版本检查、增量更新、原子更新"""
@@ -46,6 +70,18 @@ class ClientUpdater:
         # 更新锁文件
         self.lock_file = self.client_dir / '.update_lock'
 
+        # 预分发目录 updates/staged/<版本>/ 和激活日志
+        self.staged_dir = self.client_dir / 'updates' / 'staged'
+        self.activation_journal = self.client_dir / 'updates' / 'activation.json'
+        self._recover_activation()
+
+        # 文件清单缓存 {相对路径: {'stat': [大小, 修改时间ns, inode], 算法: 哈希}}
+        self.manifest_cache_file = self.client_dir / 'updates' / 'manifest_cache.json'
+        self._manifest_cache = None
+        self._manifest_lock = threading.Lock()
+        self._watcher_thread = None
+        self._last_hash_name = 'md5'
+
     def _load_local_version(self):
         """加载本地版本信息"""
         if self.version_file.exists():
@@ -62,9 +98,46 @@ class ClientUpdater:
         }
 
     def _save_local_version(self):
-        """保存本地版本信息"""
-        with open(self.version_file, 'w', encoding='utf-8') as f:
-            json.dump(self.local_version, f, indent=2, ensure_ascii=False)
+        """保存本地版本信息（替换而不是覆盖写，不影响快照中硬链接的旧文件）"""
+        self._write_json_atomic(self.version_file, self.local_version)
+
+    def _replace_file(self, target_path, content=None, source_path=None):
+        """
+        写入新文件后原子替换目标文件
+
+        目标文件可能与备份快照共用同一份数据（硬链接），
+        所以更新文件时总是替换目录项而不原地改写
+
+        Args:
+            target_path: 目标文件
+            content: 新文件内容（bytes）
+            source_path: 或者从该文件复制
+        """
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target_path.with_name(target_path.name + '.tmp')
+        if source_path is not None:
+            shutil.copy2(source_path, tmp_path)
+        else:
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+        os.replace(tmp_path, target_path)
+
+    def _snapshot_file(self, source_path, target_path):
+        """
+        把文件放入快照：优先建立硬链接，不支持时（跨分区、文件系统限制）复制
+
+        Returns:
+            bool: 是否为硬链接
+        """
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        if target_path.exists():
+            target_path.unlink()
+        try:
+            os.link(source_path, target_path)
+            return True
+        except OSError:
+            shutil.copy2(source_path, target_path)
+            return False
 
     def get_local_version(self):
         """获取本地版本号"""
@@ -72,49 +145,161 @@ class ClientUpdater:
 
     def calculate_file_md5(self, file_path):
         """计算文件MD5值"""
-        md5 = hashlib.md5()
+        return self.calculate_file_hash(file_path, 'md5')
+
+    def calculate_file_hash(self, file_path, hash_name='md5'):
+        """按 MANIFEST_HASHES 中的算法计算文件哈希"""
+        hasher = MANIFEST_HASHES[hash_name]()
         with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(8192), b''):
-                md5.update(chunk)
-        return md5.hexdigest()
+            for chunk in iter(lambda: f.read(65536), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def _load_manifest_cache(self):
+        if self._manifest_cache is None:
+            self._manifest_cache = {}
+            if self.manifest_cache_file.exists():
+                try:
+                    with open(self.manifest_cache_file, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    if data.get('version') == MANIFEST_CACHE_VERSION:
+                        self._manifest_cache = data.get('entries', {})
+                except Exception:
+                    pass
+        return self._manifest_cache
 
-    def get_local_files_manifest(self, exclude_dirs=None):
+    def get_local_files_manifest(self, exclude_dirs=None, hash_name='md5'):
         """
         生成本地文件清单
 
+        大小、修改时间和 inode 都未变化的文件直接使用缓存的哈希，只重新计算变化的文件；
+        缓存保存在 updates/manifest_cache.json，进程重启后仍然有效
+
         Args:
             exclude_dirs: 排除的目录列表
+            hash_name: 哈希算法，见 MANIFEST_HASHES
 
         Returns:
-            dict: 文件清单 {相对路径: md5}
+            dict: 文件清单 {相对路径: 哈希}
         """
+        full_scan = exclude_dirs is None
         if exclude_dirs is None:
-            exclude_dirs = ['backup', 'Transfer Files', '__pycache__', 'log', 'updates', '__pycache__']
+            exclude_dirs = ['backup', 'Transfer Files', '__pycache__', 'log', 'updates']
 
         manifest = {}
+        now_ns = time.time_ns()
+        self._last_hash_name = hash_name
 
-        for root, dirs, files in os.walk(self.client_dir):
-            # 排除指定目录
-            dirs[:] = [d for d in dirs if d not in exclude_dirs and not d.startswith('.')]
+        with self._manifest_lock:
+            cache = self._load_manifest_cache()
+            changed = False
 
-            for file in files:
-                # 跳过隐藏文件和临时文件
-                if file.startswith('.') or file.endswith('.tmp') or file.endswith('.bak'):
-                    continue
+            for root, dirs, files in os.walk(self.client_dir):
+                # 排除指定目录
+                dirs[:] = [d for d in dirs if d not in exclude_dirs and not d.startswith('.')]
 
-                file_path = Path(root) / file
+                for file in files:
+                    # 跳过隐藏文件和临时文件
+                    if file.startswith('.') or file.endswith('.tmp') or file.endswith('.bak'):
+                        continue
+
+                    file_path = Path(root) / file
+                    try:
+                        rel_path = str(file_path.relative_to(self.client_dir)).replace('\\', '/')
+                        st = os.stat(file_path)
+                        key = [st.st_size, st.st_mtime_ns, st.st_ino]
+                        entry = cache.get(rel_path)
+                        if entry and entry['stat'] == key and hash_name in entry:
+                            manifest[rel_path] = entry[hash_name]
+                            continue
+
+                        digest = self.calculate_file_hash(file_path, hash_name)
+                        manifest[rel_path] = digest
+                        if now_ns - st.st_mtime_ns < MANIFEST_RACY_NS:
+                            cache.pop(rel_path, None)
+                        else:
+                            if not entry or entry['stat'] != key:
+                                entry = cache[rel_path] = {'stat': key}
+                            entry[hash_name] = digest
+                        changed = True
+                    except Exception:
+                        continue
+
+            # 完整扫描时清理已删除文件的缓存项
+            if full_scan:
+                for rel_path in [p for p in cache if p not in manifest]:
+                    del cache[rel_path]
+                    changed = True
+
+            if changed:
                 try:
-                    rel_path = file_path.relative_to(self.client_dir)
-                    md5 = self.calculate_file_md5(file_path)
-                    manifest[str(rel_path).replace('\\', '/')] = md5
+                    self._write_json_atomic(self.manifest_cache_file, {
+                        'version': MANIFEST_CACHE_VERSION,
+                        'entries': cache
+                    })
                 except Exception:
-                    continue
+                    pass
 
         return manifest
 
+    def get_manifest_tree(self, hash_name='blake2b', server_dirs=None):
+        """
+        按目录级 Merkle 哈希与服务端比较文件清单
+
+        根哈希相同时只返回根哈希；否则返回哈希相同的目录名和哈希不同的目录中的文件
+
+        Args:
+            hash_name: 文件哈希算法
+            server_dirs: 服务端目标版本的 {目录路径: 目录哈希}
+
+        Returns:
+            dict: root、in_sync，不一致时 same_dirs 为与服务端相同的目录，entries 为 {相对路径: 哈希}
+        """
+        server_dirs = server_dirs or {}
+        files = {path: digest for path, digest
+                 in self.get_local_files_manifest(hash_name=hash_name).items()
+                 if (path in PACKAGE_ROOT_FILES or path.split('/')[0] in PACKAGE_DIRS)
+                 and path not in NODE_LOCAL_FILES}
+        hashes = dir_hashes(files)
+        result = {'status': 'success', 'hash': hash_name, 'root': hashes['']}
+        if server_dirs.get('') == hashes['']:
+            result['in_sync'] = True
+            return result
+
+        differing = {directory for directory, digest in hashes.items() if server_dirs.get(directory) != digest}
+        result['in_sync'] = False
+        result['same_dirs'] = sorted(set(hashes) - differing)
+        result['entries'] = {path: digest for path, digest in files.items() if parent_dir(path) in differing}
+        return result
+
+    def start_manifest_watcher(self, interval):
+        """
+        后台定期扫描客户端目录，按服务端最近请求的算法提前为变化的文件计算哈希，
+        使 get_files_manifest 只需比对文件状态
+
+        Args:
+            interval: 扫描间隔（秒）
+        """
+        if self._watcher_thread is not None or interval <= 0:
+            return
+
+        def watch():
+            while True:
+                try:
+                    self.get_local_files_manifest(hash_name=self._last_hash_name)
+                except Exception:
+                    pass
+                time.sleep(interval)
+
+        self._watcher_thread = threading.Thread(target=watch, daemon=True)
+        self._watcher_thread.start()
+
     def create_backup(self):
         """
-        创建更新前的备份
+        创建更新前的快照备份
+
+        文件以硬链接放入快照，不复制数据；更新时所有文件都是替换而不是原地改写，
+        快照中的旧文件因此保持不变
 
         Returns:
             Path: 备份目录路径
@@ -125,6 +310,8 @@ class ClientUpdater:
 
         # 备份关键文件
         exclude_dirs = ['backup', 'Transfer Files', '__pycache__', 'log', 'updates']
+        linked = 0
+        copied = 0
 
         for root, dirs, files in os.walk(self.client_dir):
             dirs[:] = [d for d in dirs if d not in exclude_dirs and not d.startswith('.')]
@@ -135,15 +322,18 @@ class ClientUpdater:
 
                 file_path = Path(root) / file
                 rel_path = file_path.relative_to(self.client_dir)
-                target_path = backup_path / rel_path
-                target_path.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(file_path, target_path)
+                if self._snapshot_file(file_path, backup_path / rel_path):
+                    linked += 1
+                else:
+                    copied += 1
 
         # 保存备份信息
         backup_info = {
             'timestamp': timestamp,
             'version': self.get_local_version(),
-            'created_at': datetime.now().isoformat()
+            'created_at': datetime.now().isoformat(),
+            'linked_files': linked,
+            'copied_files': copied
         }
         with open(backup_path / 'backup_info.json', 'w', encoding='utf-8') as f:
             json.dump(backup_info, f, indent=2)
@@ -154,6 +344,10 @@ class ClientUpdater:
         """
         回滚到之前的版本
 
+        快照与客户端目录在同一分区时，直接把快照的各个顶层目录和文件重命名回原位置，
+        耗时与安装大小无关，快照随之用掉；否则（或重命名失败，如有文件被占用）
+        逐个文件复制回去
+
         Args:
             backup_path: 备份路径，如果为None则使用最新的备份
 
@@ -181,23 +375,18 @@ class ClientUpdater:
             else:
                 backup_info = {}
 
-            # 恢复文件
-            exclude_dirs = ['backup', 'Transfer Files', '__pycache__', 'log', 'updates']
-
-            for root, dirs, files in os.walk(backup_path):
-                dirs[:] = [d for d in dirs if d not in exclude_dirs]
-
-                for file in files:
-                    if file == 'backup_info.json':
-                        continue
-
-                    file_path = Path(root) / file
-                    rel_path = file_path.relative_to(backup_path)
-                    target_path = self.client_dir / rel_path
-                    target_path.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.copy2(file_path, target_path)
+            mode = 'copy'
+            if os.stat(backup_path).st_dev == os.stat(self.client_dir).st_dev:
+                try:
+                    self._restore_by_rename(backup_path)
+                    mode = 'rename'
+                except OSError:
+                    pass
+            if mode == 'copy':
+                self._restore_by_copy(backup_path)
 
             # 恢复版本信息
+            self.local_version = self._load_local_version()
             if backup_info.get('version'):
                 self.local_version['version'] = backup_info['version']
                 self._save_local_version()
@@ -205,20 +394,76 @@ class ClientUpdater:
             return {
                 'status': 'success',
                 'message': f'已回滚到版本 {backup_info.get("version", "unknown")}',
-                'backup_path': str(backup_path)
+                'backup_path': str(backup_path),
+                'mode': mode
             }
 
         except Exception as e:
             return {'status': 'error', 'message': f'回滚失败: {str(e)}'}
 
+    def _restore_by_rename(self, backup_path):
+        """
+        把快照的顶层条目重命名回客户端目录，被替换的条目移到回收目录后删除
+
+        失败时撤销已做的重命名（快照保持完整，可改为复制恢复）后抛出 OSError
+        """
+        trash_path = self.backup_dir / f'.replaced_{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}'
+        trash_path.mkdir(parents=True)
+        restored = []
+        try:
+            for entry in sorted(backup_path.iterdir()):
+                if entry.name == 'backup_info.json':
+                    continue
+                target_path = self.client_dir / entry.name
+                if target_path.exists():
+                    os.rename(target_path, trash_path / entry.name)
+                os.rename(entry, target_path)
+                restored.append(entry.name)
+        except OSError:
+            # 已换上的条目放回快照，已移走的条目放回原位置
+            for name in restored:
+                try:
+                    os.rename(self.client_dir / name, backup_path / name)
+                except OSError:
+                    pass
+            for moved in trash_path.iterdir():
+                target_path = self.client_dir / moved.name
+                try:
+                    if not target_path.exists():
+                        os.rename(moved, target_path)
+                except OSError:
+                    pass
+            try:
+                trash_path.rmdir()
+            except OSError:
+                pass
+            raise
+        shutil.rmtree(trash_path, ignore_errors=True)
+        shutil.rmtree(backup_path, ignore_errors=True)
+
+    def _restore_by_copy(self, backup_path):
+        """逐个文件从快照复制回客户端目录"""
+        exclude_dirs = ['backup', 'Transfer Files', '__pycache__', 'log', 'updates']
+
+        for root, dirs, files in os.walk(backup_path):
+            dirs[:] = [d for d in dirs if d not in exclude_dirs]
+
+            for file in files:
+                if file == 'backup_info.json':
+                    continue
+
+                file_path = Path(root) / file
+                rel_path = file_path.relative_to(backup_path)
+                self._replace_file(self.client_dir / rel_path, source_path=file_path)
+
     def apply_update(self, update_data, new_version, update_type='incremental'):
         """
         应用更新（原子操作）
 
         Args:
-            update_data: 更新数据（bytes或dict）
+            update_data: 更新数据（全量为bytes，增量为dict，差异为条目列表）
             new_version: 新版本号
-            update_type: 更新类型 'incremental' 或 'full'
+            update_type: 更新类型 'incremental'、'delta' 或 'full'
 
         Returns:
             dict: 更新结果
@@ -239,6 +484,9 @@ class ClientUpdater:
                 if update_type == 'full':
                     # 全量更新：解压整个包
                     result = self._apply_full_update(update_data)
+                elif update_type == 'delta':
+                    # 块级差异更新：基于本地文件重建新文件
+                    result = self._apply_delta_update(update_data)
                 else:
                     # 增量更新：逐个文件更新
                     result = self._apply_incremental_update(update_data)
@@ -254,7 +502,11 @@ class ClientUpdater:
                     })
                     # 保留最近10条更新记录
                     self.local_version['update_history'] = self.local_version['update_history'][-10:]
+                    # 就地更新后回滚应使用刚创建的备份，暂存的上一个版本不再是"上一个"
+                    previous = self.local_version.pop('previous_version', None)
                     self._save_local_version()
+                    if previous:
+                        shutil.rmtree(self.staged_dir / previous, ignore_errors=True)
 
                     return result
                 else:
@@ -303,9 +555,7 @@ class ClientUpdater:
 
                         file_path = Path(root) / file
                         rel_path = file_path.relative_to(extract_dir)
-                        target_path = self.client_dir / rel_path
-                        target_path.parent.mkdir(parents=True, exist_ok=True)
-                        shutil.copy2(file_path, target_path)
+                        self._replace_file(self.client_dir / rel_path, source_path=file_path)
 
                 return {'status': 'success', 'message': '全量更新完成'}
 
@@ -318,15 +568,14 @@ class ClientUpdater:
             # update_data 应该是 dict: {文件路径: 文件内容(bytes)}
             updated_files = []
             failed_files = []
+            skipped_files = []
 
             for file_path, content in update_data.items():
+                if file_path in PRESERVED_FILES and (self.client_dir / file_path).exists():
+                    skipped_files.append(file_path)
+                    continue
                 try:
-                    target_path = self.client_dir / file_path
-                    target_path.parent.mkdir(parents=True, exist_ok=True)
-
-                    with open(target_path, 'wb') as f:
-                        f.write(content)
-
+                    self._replace_file(self.client_dir / file_path, content)
                     updated_files.append(file_path)
                 except Exception as e:
                     failed_files.append(f'{file_path}: {str(e)}')
@@ -350,6 +599,347 @@ class ClientUpdater:
         except Exception as e:
             return {'status': 'error', 'message': f'增量更新失败: {str(e)}'}
 
+    def _apply_delta_update(self, entries):
+        """
+        应用块级差异更新
+
+        先在内存中重建并校验所有文件，全部通过后再逐个原子替换，
+        任何一个文件校验失败都不会改动本地文件
+
+        Args:
+            entries: [{'path', 'kind': 'delta'|'full', 'md5', 'data'}]
+        """
+        try:
+            new_contents = []
+            skipped_files = []
+            sent_bytes = 0
+            full_bytes = 0
+
+            for entry in entries:
+                file_path = entry['path']
+                if file_path in PRESERVED_FILES and (self.client_dir / file_path).exists():
+                    skipped_files.append(file_path)
+                    continue
+
+                target_path = self.client_dir / file_path
+                if entry['kind'] == 'delta':
+                    if not target_path.exists():
+                        return {'status': 'error', 'message': f'差异更新缺少本地文件: {file_path}'}
+                    with open(target_path, 'rb') as f:
+                        content = apply_delta(f.read(), entry['data'])
+                else:
+                    content = entry['data']
+
+                if entry.get('md5') and hashlib.md5(content).hexdigest() != entry['md5']:
+                    return {'status': 'error', 'message': f'文件校验失败: {file_path}'}
+                new_contents.append((target_path, content))
+                sent_bytes += len(entry['data'])
+                full_bytes += len(content)
+
+            updated_files = []
+            for target_path, content in new_contents:
+                self._replace_file(target_path, content)
+                updated_files.append(str(target_path.relative_to(self.client_dir)).replace('\\', '/'))
+
+            return {
+                'status': 'success',
+                'message': f'差异更新完成，更新了 {len(updated_files)} 个文件'
+                           f'（传输 {sent_bytes} 字节 / 文件共 {full_bytes} 字节）',
+                'updated_files': updated_files,
+                'skipped_files': skipped_files,
+                'transferred_bytes': sent_bytes,
+                'full_bytes': full_bytes
+            }
+
+        except Exception as e:
+            return {'status': 'error', 'message': f'差异更新失败: {str(e)}'}
+
+    # ── 预分发与激活 ──────────────────────────────────
+
+    def _write_json_atomic(self, path, data):
+        """先写临时文件再替换，避免中途退出留下半个 JSON"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _read_staged_marker(self, version):
+        marker = self.staged_dir / version / STAGED_MARKER
+        if marker.exists():
+            try:
+                with open(marker, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception:
+                pass
+        return None
+
+    def get_staged_manifest(self, version):
+        """
+        获取某个版本已暂存的文件清单
+
+        Args:
+            version: 版本号
+
+        Returns:
+            dict: manifest 为 {相对路径: md5}，complete 表示该版本已可激活
+        """
+        if not version:
+            return {'status': 'error', 'message': '缺少版本号'}
+
+        version_dir = self.staged_dir / version
+        marker = self._read_staged_marker(version)
+        if marker:
+            return {'status': 'success', 'version': version, 'complete': True, 'manifest': marker['files']}
+
+        manifest = {}
+        if version_dir.exists():
+            for file_path in version_dir.rglob('*'):
+                if file_path.is_file() and not file_path.name.endswith('.tmp') and file_path.name != STAGED_MARKER:
+                    rel_path = str(file_path.relative_to(version_dir)).replace('\\', '/')
+                    manifest[rel_path] = self.calculate_file_md5(file_path)
+        return {'status': 'success', 'version': version, 'complete': False, 'manifest': manifest}
+
+    def stage_update(self, entries, version, files):
+        """
+        把新版本写入暂存目录，不改动当前运行的文件
+
+        中断后已写入的文件会保留，下次预分发只需补齐缺少的部分
+
+        Args:
+            entries: [{'path', 'kind': 'delta'|'full', 'md5', 'data'}]，差异以当前运行的文件为基准
+            version: 新版本号
+            files: 新版本完整文件清单 {相对路径: md5}
+
+        Returns:
+            dict: 预分发结果
+        """
+        if not version:
+            return {'status': 'error', 'message': '缺少版本号'}
+        if version == self.get_local_version():
+            return {'status': 'error', 'message': f'版本 {version} 已在运行'}
+        if self.lock_file.exists():
+            return {'status': 'error', 'message': '正在执行其他更新操作'}
+
+        version_dir = self.staged_dir / version
+        files = {path: md5 for path, md5 in files.items() if path not in NODE_LOCAL_FILES}
+        received = 0
+        try:
+            for entry in entries:
+                file_path = entry['path']
+                if file_path not in files:
+                    continue
+                if entry['kind'] == 'delta':
+                    basis_path = self.client_dir / file_path
+                    if not basis_path.exists():
+                        return {'status': 'error', 'message': f'差异预分发缺少本地文件: {file_path}'}
+                    with open(basis_path, 'rb') as f:
+                        content = apply_delta(f.read(), entry['data'])
+                else:
+                    content = entry['data']
+                if hashlib.md5(content).hexdigest() != files[file_path]:
+                    return {'status': 'error', 'message': f'文件校验失败: {file_path}'}
+
+                self._replace_file(version_dir / file_path, content)
+                received += 1
+
+            # 未传输的文件与当前运行的版本相同，从本地复制
+            copied = 0
+            missing = []
+            for file_path, md5 in files.items():
+                target_path = version_dir / file_path
+                if target_path.exists() and self.calculate_file_md5(target_path) == md5:
+                    continue
+                active_path = self.client_dir / file_path
+                if active_path.exists() and self.calculate_file_md5(active_path) == md5:
+                    target_path.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copy2(active_path, target_path)
+                    copied += 1
+                else:
+                    missing.append(file_path)
+
+            if missing:
+                return {
+                    'status': 'error',
+                    'message': f'预分发未完成，缺少 {len(missing)} 个文件: {", ".join(missing[:5])}',
+                    'missing_files': missing
+                }
+
+            self._write_json_atomic(version_dir / STAGED_MARKER, {
+                'version': version,
+                'files': files,
+                'completed_at': datetime.now().isoformat()
+            })
+            return {
+                'status': 'success',
+                'message': f'版本 {version} 已预分发（接收 {received} 个文件，复制 {copied} 个未变文件）',
+                'received_files': received,
+                'copied_files': copied
+            }
+
+        except Exception as e:
+            return {'status': 'error', 'message': f'预分发失败: {str(e)}'}
+
+    def _active_code_files(self):
+        """当前运行版本中参与切换的文件：core 目录下的代码"""
+        core_dir = self.client_dir / 'core'
+        paths = set()
+        if core_dir.exists():
+            for file_path in core_dir.rglob('*'):
+                if '__pycache__' in file_path.parts or not file_path.is_file():
+                    continue
+                if file_path.name.endswith('.tmp'):
+                    continue
+                paths.add(str(file_path.relative_to(self.client_dir)).replace('\\', '/'))
+        return paths
+
+    def activate_staged(self, version):
+        """
+        激活已预分发的版本
+
+        逐个文件做重命名切换：当前文件移入 staged/<当前版本>/，暂存文件移到运行位置，
+        切换过程记录在激活日志中，中途退出时下次启动自动恢复为切换前的状态。
+        被换下的当前版本保留为完整的暂存版本，回滚即反向激活。
+
+        Args:
+            version: 要激活的版本号
+
+        Returns:
+            dict: 激活结果
+        """
+        if not version:
+            return {'status': 'error', 'message': '缺少版本号'}
+        current_version = self.get_local_version()
+        if version == current_version:
+            return {'status': 'error', 'message': f'版本 {version} 已在运行'}
+        marker = self._read_staged_marker(version)
+        if not marker:
+            return {'status': 'error', 'message': f'版本 {version} 未完成预分发'}
+        if self.lock_file.exists():
+            return {'status': 'error', 'message': '正在执行其他更新操作'}
+
+        try:
+            with open(self.lock_file, 'w') as f:
+                f.write(f'Activation started at {datetime.now().isoformat()}')
+
+            # 被换下的文件组成上一个版本的暂存目录
+            previous_dir = self.staged_dir / current_version
+            if previous_dir.exists():
+                shutil.rmtree(previous_dir)
+
+            paths = sorted(set(marker['files']) | self._active_code_files())
+            previous_files = {}
+            for file_path in paths:
+                active_path = self.client_dir / file_path
+                if file_path not in NODE_LOCAL_FILES and active_path.exists():
+                    previous_files[file_path] = self.calculate_file_md5(active_path)
+
+            journal = {
+                'from': current_version,
+                'to': version,
+                'paths': paths,
+                'new_files': sorted(marker['files']),
+                'previous_files': previous_files,
+                'state': 'swapping'
+            }
+            self._write_json_atomic(self.activation_journal, journal)
+
+            for file_path in paths:
+                self._swap_file(file_path, version, current_version)
+
+            journal['state'] = 'swapped'
+            self._write_json_atomic(self.activation_journal, journal)
+            self._finish_activation(journal)
+
+            return {
+                'status': 'success',
+                'message': f'已从版本 {current_version} 切换到 {version}',
+                'from_version': current_version,
+                'switched_files': len(paths)
+            }
+
+        except Exception as e:
+            # 切换失败，立即按激活日志恢复
+            self._recover_activation()
+            return {'status': 'error', 'message': f'激活失败，已恢复: {str(e)}'}
+
+        finally:
+            if self.lock_file.exists():
+                self.lock_file.unlink()
+
+    def _swap_file(self, file_path, new_version, old_version):
+        active_path = self.client_dir / file_path
+        new_path = self.staged_dir / new_version / file_path
+        old_path = self.staged_dir / old_version / file_path
+        if active_path.exists():
+            old_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(active_path, old_path)
+        if new_path.exists():
+            active_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(new_path, active_path)
+
+    def _finish_activation(self, journal):
+        """文件切换完成后的收尾：记录上一个版本、更新版本信息、删除激活日志"""
+        self._write_json_atomic(self.staged_dir / journal['from'] / STAGED_MARKER, {
+            'version': journal['from'],
+            'files': journal['previous_files'],
+            'completed_at': datetime.now().isoformat()
+        })
+
+        self.local_version['version'] = journal['to']
+        self.local_version['previous_version'] = journal['from']
+        self.local_version['last_update'] = datetime.now().isoformat()
+        self.local_version.setdefault('update_history', []).append({
+            'version': journal['to'],
+            'timestamp': datetime.now().isoformat(),
+            'type': 'staged'
+        })
+        self.local_version['update_history'] = self.local_version['update_history'][-10:]
+        self._save_local_version()
+
+        self.activation_journal.unlink()
+        shutil.rmtree(self.staged_dir / journal['to'], ignore_errors=True)
+
+    def _recover_activation(self):
+        """
+        处理上次未完成的激活
+
+        文件已全部切换时补完收尾，否则按相反顺序撤销已切换的文件
+        """
+        if not self.activation_journal.exists():
+            return
+        try:
+            with open(self.activation_journal, 'r', encoding='utf-8') as f:
+                journal = json.load(f)
+        except Exception:
+            # 激活日志在开始切换前原子写入，读不出来说明切换尚未开始
+            self.activation_journal.unlink()
+            return
+
+        if journal.get('state') == 'swapped':
+            self._finish_activation(journal)
+            return
+
+        new_files = set(journal['new_files'])
+        for file_path in reversed(journal['paths']):
+            active_path = self.client_dir / file_path
+            new_path = self.staged_dir / journal['to'] / file_path
+            old_path = self.staged_dir / journal['from'] / file_path
+            if file_path in new_files and active_path.exists() and not new_path.exists():
+                new_path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(active_path, new_path)
+            if old_path.exists() and not active_path.exists():
+                active_path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(old_path, active_path)
+        self.activation_journal.unlink()
+
+    def get_previous_staged_version(self):
+        """上一个运行过且仍完整保留在暂存目录中的版本，没有时返回 None"""
+        previous = self.local_version.get('previous_version')
+        if previous and previous != self.get_local_version() and self._read_staged_marker(previous):
+            return previous
+        return None
+
     def delete_files(self, files_to_delete):
         """删除指定的文件"""
         deleted = []
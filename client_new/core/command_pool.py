@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+命令工作线程池
+限制并发处理的连接数和排队深度，饱和时拒绝新连接
+"""
+
+import json
+import queue
+import selectors
+import socket
+import threading
+import time
+
+BUSY_MAX_PENDING = 64      # 等待回复 busy 的连接数上限，超出后直接关闭
+BUSY_DRAIN_TIMEOUT = 2     # 回复 busy 后等待对端关闭的时间（秒）
+
+
+class CommandWorkerPool:
+    """有界命令工作池 - 固定数量的工作线程 + 有界等待队列"""
+
+    def __init__(self, handler, max_workers=8, max_queue=32, logger=None):
+        """
+        初始化工作池
+
+        Args:
+            handler: 连接处理函数，签名为 handler(conn, addr)
+            max_workers: 最大并发处理数
+            max_queue: 最大排队连接数，超过后拒绝
+            logger: 日志对象
+        """
+        self.handler = handler
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(1, int(max_queue))
+        self.logger = logger
+
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._workers = []
+        self._running = False
+
+        self.lock = threading.Lock()
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+        self._failed = 0
+        self._total_wait = 0.0
+        self._total_handle = 0.0
+        self._max_wait = 0.0
+        self._max_handle = 0.0
+
+    def start(self):
+        """启动工作线程"""
+        self._running = True
+        for i in range(self.max_workers):
+            t = threading.Thread(target=self._worker_loop, name=f'cmd-worker-{i}', daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    def stop(self):
+        """停止工作线程（已排队的连接直接关闭）"""
+        self._running = False
+        while True:
+            try:
+                conn, _addr, _queued_at, _handler = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    def submit(self, conn, addr, handler=None):
+        """
+        提交一个连接
+
+        Args:
+            conn: 连接
+            addr: 对端地址
+            handler: 处理函数，默认为创建工作池时指定的 handler
+
+        Returns:
+            bool: True 表示已接收，False 表示队列已满（调用方应返回 busy）
+        """
+        try:
+            self._queue.put_nowait((conn, addr, time.time(), handler or self.handler))
+            return True
+        except queue.Full:
+            with self.lock:
+                self._rejected += 1
+            return False
+
+    def _worker_loop(self):
+        while self._running:
+            item = self._queue.get()
+            if item is None:
+                break
+            conn, addr, queued_at, handler = item
+            started = time.time()
+            wait = started - queued_at
+            with self.lock:
+                self._active += 1
+            try:
+                handler(conn, addr)
+                failed = False
+            except Exception as e:
+                failed = True
+                if self.logger:
+                    self.logger.error(f"工作线程处理连接 {addr[0]} 出错: {e}")
+            finally:
+                elapsed = time.time() - started
+                with self.lock:
+                    self._active -= 1
+                    self._completed += 1
+                    if failed:
+                        self._failed += 1
+                    self._total_wait += wait
+                    self._total_handle += elapsed
+                    self._max_wait = max(self._max_wait, wait)
+                    self._max_handle = max(self._max_handle, elapsed)
+
+    def get_stats(self):
+        """获取队列和延迟统计"""
+        with self.lock:
+            completed = self._completed
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'active': self._active,
+                'queued': self._queue.qsize(),
+                'completed': completed,
+                'rejected': self._rejected,
+                'failed': self._failed,
+                'avg_wait_ms': round(self._total_wait * 1000 / completed, 2) if completed else 0.0,
+                'max_wait_ms': round(self._max_wait * 1000, 2),
+                'avg_handle_ms': round(self._total_handle * 1000 / completed, 2) if completed else 0.0,
+                'max_handle_ms': round(self._max_handle * 1000, 2)
+            }
+
+
+class BusyRejector:
+    """
+    工作池饱和时回复 busy 并关闭连接
+
+    回复后关闭写方向，再读完服务端已发来的请求直到对端关闭：接收缓冲区里还有
+    未读数据时直接 close 会发出 RST，服务端可能收不到 busy 应答。全部被拒绝的
+    连接由一个 selector 线程处理，突发的拒绝不会按连接数创建线程。
+    """
+
+    def __init__(self, max_pending=BUSY_MAX_PENDING, drain_timeout=BUSY_DRAIN_TIMEOUT):
+        self.max_pending = max(1, int(max_pending))
+        self.drain_timeout = drain_timeout
+
+        self.lock = threading.Lock()
+        self._pending = []          # 待回复的 (conn, reply)
+        self._draining = 0
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._running = False
+        self._dropped = 0
+
+    def start(self):
+        self._running = True
+        threading.Thread(target=self._run, name='busy-rejector', daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup()
+
+    def reject(self, conn, reply):
+        """回复 reply（busy 应答）并关闭连接；积压过多时直接关闭"""
+        with self.lock:
+            accepted = self._running and len(self._pending) + self._draining < self.max_pending
+            if accepted:
+                self._pending.append((conn, reply))
+            else:
+                self._dropped += 1
+        if accepted:
+            self._wakeup()
+        else:
+            self._close(conn)
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'x')
+        except OSError:
+            pass
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def _finish(self, draining, conn):
+        del draining[conn]
+        self._selector.unregister(conn)
+        with self.lock:
+            self._draining -= 1
+        self._close(conn)
+
+    def _run(self):
+        draining = {}   # conn -> 等待对端关闭的截止时间
+        while self._running:
+            with self.lock:
+                pending, self._pending = self._pending, []
+                self._draining += len(pending)
+            for conn, reply in pending:
+                try:
+                    conn.setblocking(False)
+                    # 应答很短，新连接的发送缓冲区足以一次写入
+                    conn.send(json.dumps(reply).encode('utf-8'))
+                    conn.shutdown(socket.SHUT_WR)
+                    self._selector.register(conn, selectors.EVENT_READ)
+                    draining[conn] = time.time() + self.drain_timeout
+                except (OSError, ValueError):
+                    with self.lock:
+                        self._draining -= 1
+                    self._close(conn)
+
+            for key, _ in self._selector.select(timeout=0.5 if draining else None):
+                if key.fileobj is self._wakeup_r:
+                    try:
+                        while self._wakeup_r.recv(1024):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    if key.fileobj.recv(4096):
+                        continue
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    pass
+                self._finish(draining, key.fileobj)
+
+            now = time.time()
+            for conn, deadline in list(draining.items()):
+                if now > deadline:
+                    self._finish(draining, conn)
+
+        for conn in list(draining):
+            self._finish(draining, conn)
+        with self.lock:
+            pending, self._pending = self._pending, []
+        for conn, _ in pending:
+            self._close(conn)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+自适应压缩策略
+选择方式与服务端 core/compression.py 一致：已压缩格式的扩展名或采样探测
+压缩率达不到 STORE_RATIO 的文件直接存储，高度可压缩的文件按档位用 LZMA，
+其余用 deflate。用于备份压缩（见 core/zip_writer.py）和目录同步数据的解压。
+"""
+
+import lzma
+import os
+import threading
+import zlib
+from pathlib import Path
+
+STORE = 'store'
+DEFLATE = 'deflate'
+LZMA = 'lzma'
+
+COMPRESSION_PROFILES = {
+    'fast': {'deflate_level': 1, 'lzma_ratio': 0.0},
+    'balanced': {'deflate_level': 6, 'lzma_ratio': 0.2},
+    'max': {'deflate_level': 9, 'lzma_ratio': 0.6},
+}
+DEFAULT_PROFILE = 'balanced'
+
+STORE_RATIO = 0.9
+SAMPLE_SIZE = 64 * 1024
+LZMA_MIN_SIZE = 64 * 1024
+
+INCOMPRESSIBLE_EXTENSIONS = frozenset({
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.lzma', '.7z', '.rar', '.zst', '.lz4',
+    '.jar', '.war', '.ear', '.whl', '.egg', '.apk', '.cab', '.msi',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.ico', '.heic',
+    '.mp3', '.mp4', '.m4a', '.aac', '.ogg', '.flac', '.avi', '.mkv', '.mov', '.webm',
+    '.woff', '.woff2', '.pdf', '.docx', '.xlsx', '.pptx', '.odt',
+})
+
+
+def read_sample(path):
+    """读取文件开头、中间、结尾各 SAMPLE_SIZE 字节（小文件读取全部内容）"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if size <= SAMPLE_SIZE * 3:
+            return f.read()
+        parts = []
+        for offset in (0, (size - SAMPLE_SIZE) // 2, size - SAMPLE_SIZE):
+            f.seek(offset)
+            parts.append(f.read(SAMPLE_SIZE))
+        return b''.join(parts)
+
+
+def probe_ratio(sample):
+    """样本以最快的 deflate 级别压缩后的大小与原大小之比"""
+    if not sample:
+        return 1.0
+    return len(zlib.compress(sample, 1)) / len(sample)
+
+
+class CompressionPolicy:
+    """按档位为每个文件选择压缩方式"""
+
+    def __init__(self, profile=DEFAULT_PROFILE):
+        """
+        Args:
+            profile: 档位名称，见 COMPRESSION_PROFILES，未知时使用默认档位
+        """
+        self.profile = profile if profile in COMPRESSION_PROFILES else DEFAULT_PROFILE
+        settings = COMPRESSION_PROFILES[self.profile]
+        self.deflate_level = settings['deflate_level']
+        self.lzma_ratio = settings['lzma_ratio']
+
+    def choose_file(self, path):
+        """
+        为文件选择压缩方式
+
+        Returns:
+            tuple: (方式, deflate 级别)
+        """
+        if Path(path).suffix.lower() in INCOMPRESSIBLE_EXTENSIONS:
+            return STORE, 0
+        return self.choose(str(path), read_sample(path))
+
+    def choose(self, name, sample):
+        """
+        按文件名和内容样本选择压缩方式
+
+        Returns:
+            tuple: (方式, deflate 级别)
+        """
+        if Path(name).suffix.lower() in INCOMPRESSIBLE_EXTENSIONS:
+            return STORE, 0
+        ratio = probe_ratio(sample)
+        if ratio >= STORE_RATIO:
+            return STORE, 0
+        if ratio <= self.lzma_ratio and len(sample) >= LZMA_MIN_SIZE:
+            return LZMA, 0
+        return DEFLATE, self.deflate_level
+
+
+class _StoreDecompressor:
+    def decompress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+class _LZMADecompressor:
+    def __init__(self):
+        self._decompressor = lzma.LZMADecompressor()
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        if not self._decompressor.eof:
+            raise lzma.LZMAError('压缩数据不完整')
+        return b''
+
+
+def decompressor(method):
+    """
+    流式解压对象（decompress / flush），与服务端 compressor 对应
+
+    Raises:
+        ValueError: 不支持的压缩方式
+    """
+    if method == DEFLATE:
+        return zlib.decompressobj()
+    if method == LZMA:
+        return _LZMADecompressor()
+    if method == STORE:
+        return _StoreDecompressor()
+    raise ValueError(f'不支持的压缩方式: {method}')
+
+
+class CompressionStats:
+    """按压缩方式累计文件数、压缩前后字节数和 CPU 时间（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.methods = {}
+
+    def add(self, method, bytes_in, bytes_out, cpu_seconds):
+        with self._lock:
+            item = self.methods.setdefault(method, {'files': 0, 'bytes_in': 0, 'bytes_out': 0,
+                                                    'cpu_seconds': 0.0})
+            item['files'] += 1
+            item['bytes_in'] += bytes_in
+            item['bytes_out'] += bytes_out
+            item['cpu_seconds'] += cpu_seconds
+
+    def report(self):
+        """
+        Returns:
+            dict: {'files', 'bytes_in', 'bytes_out', 'saved', 'cpu_seconds', 'methods': {方式: 统计}}
+        """
+        with self._lock:
+            methods = {name: dict(item, cpu_seconds=round(item['cpu_seconds'], 3))
+                       for name, item in self.methods.items()}
+        bytes_in = sum(item['bytes_in'] for item in methods.values())
+        bytes_out = sum(item['bytes_out'] for item in methods.values())
+        return {
+            'files': sum(item['files'] for item in methods.values()),
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'saved': bytes_in - bytes_out,
+            'cpu_seconds': round(sum(item['cpu_seconds'] for item in methods.values()), 3),
+            'methods': methods
+        }
+
+
+def format_report(report):
+    """把 CompressionStats.report() 的结果格式化为一行说明"""
+    bytes_in = report.get('bytes_in', 0)
+    saved = report.get('saved', 0)
+    cpu = report.get('cpu_seconds', 0.0)
+    methods = '，'.join(f"{name} {item['files']} 个"
+                       for name, item in sorted(report.get('methods', {}).items()))
+    text = (f"{bytes_in} → {report.get('bytes_out', 0)} 字节，"
+            f"节省 {saved / bytes_in if bytes_in else 0:.1%}（{methods or '无文件'}），CPU {cpu:.2f} 秒")
+    if cpu > 0:
+        text += f"，每 CPU 秒节省 {saved / cpu / 1024 / 1024:.1f} MB"
+    return text
+
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按内容寻址的接收文件缓存
+接收完成并校验过的文件（单文件传输、全量更新包、接力分发的数据）按整个文件的
+sha256 保存在缓存目录中。服务端再次发送相同内容时，接收方在就绪应答中直接报告
+已有全部数据（见 core/transfer.py），服务端只等待结果，不再发送数据；回滚后
+重新分发同一版本的更新包时同样不必再传一遍。
+"""
+
+import os
+import shutil
+import threading
+
+CONTENT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ContentCache:
+    """按 sha256 存放文件，超过容量上限时删除最久未使用的内容"""
+
+    def __init__(self, root, max_bytes=CONTENT_CACHE_MAX_BYTES):
+        """
+        Args:
+            root: 缓存目录
+            max_bytes: 缓存总大小上限（字节），0 表示不缓存
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path(self, sha256):
+        return self.root / sha256[:2] / sha256
+
+    def contains(self, sha256):
+        return self.enabled and self.path(sha256).is_file()
+
+    def seed(self, sha256, dest, size):
+        """
+        在 dest 放一份缓存的内容（优先使用硬链接，不支持时复制）
+
+        Args:
+            sha256: 内容的 sha256
+            dest: 目标路径
+            size: 内容的大小，与缓存不符时说明缓存已损坏，删除后返回 False
+
+        Returns:
+            bool: 缓存中有该内容并已放到 dest 时返回 True
+        """
+        if not self.contains(sha256):
+            return False
+        source = self.path(sha256)
+        with self._lock:
+            try:
+                if source.stat().st_size != size:
+                    source.unlink()
+                    return False
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                if dest.exists():
+                    dest.unlink()
+                try:
+                    os.link(source, dest)
+                except OSError:
+                    shutil.copyfile(source, dest)
+                # 修改时间作为最近使用时间，淘汰时参考
+                os.utime(source)
+                return True
+            except OSError:
+                return False
+
+    def add(self, path, sha256):
+        """把已校验的文件移入缓存（不缓存时直接删除）"""
+        if not self.enabled:
+            os.remove(path)
+            return
+        target = self.path(sha256)
+        with self._lock:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(path, target)
+            os.utime(target)
+            self._evict()
+
+    def add_fileobj(self, fileobj, sha256):
+        """把已校验的数据（文件对象，从当前位置读到末尾）复制进缓存"""
+        if not self.enabled or self.contains(sha256):
+            return
+        target = self.path(sha256)
+        temp = target.with_name(f'{sha256}.tmp')
+        with self._lock:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with open(temp, 'wb') as out:
+                shutil.copyfileobj(fileobj, out, 1024 * 1024)
+            os.replace(temp, target)
+            self._evict()
+
+    def discard(self, sha256):
+        """删除缓存的内容（如校验发现已损坏）"""
+        try:
+            os.remove(self.path(sha256))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """总大小超过上限时按最近使用时间从旧到新删除（调用方持有 _lock）"""
+        entries = []
+        total = 0
+        for path in self.root.glob('*/*'):
+            if path.suffix == '.tmp':
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
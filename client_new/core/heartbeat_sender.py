@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+心跳发送器
+并发向所有服务端发送心跳，支持随机抖动、失败退避和服务端自适应间隔。
+服务端应答带有收到心跳和发出应答的时间，下一次心跳把这次往返的四个时间
+（link）带给服务端，由服务端计算 RTT 和时钟偏差
+"""
+
+import socket
+import json
+import random
+import threading
+import time
+import platform
+
+
+class HeartbeatSender:
+    """心跳发送器 - 每个服务端独立调度，单个服务端不可达不会拖慢其他服务端"""
+
+    def __init__(self, address_pool, server_port, logger=None, interval=10,
+                 jitter=0.2, max_backoff=120, timeout=3):
+        """
+        初始化心跳发送器
+
+        Args:
+            address_pool: 服务端地址池
+            server_port: 服务端命令端口
+            logger: 日志对象
+            interval: 默认心跳间隔（秒），服务端可在应答中调整
+            jitter: 随机抖动比例，0.2 表示在间隔基础上 ±20%
+            max_backoff: 服务端不可达时的最大退避间隔（秒）
+            timeout: 单次心跳的连接/应答超时（秒）
+        """
+        self.address_pool = address_pool
+        self.server_port = server_port
+        self.logger = logger
+        self.default_interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        # 每个服务端的调度状态 {server_ip: {'next_at', 'interval', 'failures', 'in_flight', 'link'}}
+        self._states = {}
+        self.lock = threading.Lock()
+
+    def _build_message(self, server_ip):
+        """构造心跳消息，附带与该服务端上一次心跳往返的时间"""
+        message = {
+            'type': 'heartbeat',
+            'os': platform.system(),
+            'info': {
+                'hostname': platform.node(),
+                'os_version': platform.version()
+            }
+        }
+        with self.lock:
+            link = self._get_state(server_ip).pop('link', None)
+        if link:
+            message['link'] = link
+        return message
+
+    def _jittered(self, delay):
+        """给延迟加上随机抖动，避免大量客户端同时发送"""
+        if self.jitter <= 0:
+            return delay
+        return max(0.5, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _get_state(self, server_ip):
+        state = self._states.get(server_ip)
+        if state is None:
+            # 首次调度随机分布在一个间隔内，打散集中重启后的心跳
+            state = {
+                'next_at': time.time() + random.uniform(0, self.default_interval),
+                'interval': self.default_interval,
+                'failures': 0,
+                'in_flight': False
+            }
+            self._states[server_ip] = state
+        return state
+
+    def _send_one(self, server_ip):
+        """向单个服务端发送心跳，返回服务端应答"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect((server_ip, self.server_port))
+            message = json.dumps(self._build_message(server_ip)).encode('utf-8')
+            sent_at = time.time()
+            sock.sendall(message)
+            response = sock.recv(1024)
+            received_at = time.time()
+        finally:
+            sock.close()
+        try:
+            ack = json.loads(response.decode('utf-8')) if response else {}
+        except ValueError:
+            return {}
+        # [t0, t1, t2, t3]：发出、服务端收到、服务端应答、收到应答（旧版服务端不带时间）
+        if isinstance(ack, dict) and 'server_recv' in ack and 'server_send' in ack:
+            with self.lock:
+                self._get_state(server_ip)['link'] = [sent_at, ack['server_recv'], ack['server_send'], received_at]
+        return ack
+
+    def _on_result(self, server_ip, ack, error=None):
+        """根据发送结果更新下一次调度时间"""
+        with self.lock:
+            state = self._get_state(server_ip)
+            state['in_flight'] = False
+            if error is None:
+                state['failures'] = 0
+                suggested = ack.get('heartbeat_interval') if isinstance(ack, dict) else None
+                if isinstance(suggested, (int, float)) and suggested > 0:
+                    state['interval'] = suggested
+                delay = state['interval']
+            else:
+                # 指数退避：间隔 × 2^失败次数，不超过 max_backoff
+                state['failures'] += 1
+                delay = min(state['interval'] * (2 ** state['failures']), self.max_backoff)
+            state['next_at'] = time.time() + self._jittered(delay)
+            failures = state['failures']
+
+        if error is not None and self.logger:
+            self.logger.debug(f"心跳发送失败 {server_ip} (连续失败 {failures} 次): {error}")
+
+    def _send_and_record(self, server_ip):
+        try:
+            ack = self._send_one(server_ip)
+        except Exception as e:
+            self._on_result(server_ip, None, e)
+            return False
+        self._on_result(server_ip, ack)
+        return True
+
+    def send_all(self):
+        """
+        立即并发向所有服务端发送一次心跳（用于启动注册）
+
+        Returns:
+            dict: {server_ip: 是否成功}
+        """
+        results = {}
+        lock = threading.Lock()
+
+        def do_one(ip):
+            ok = self._send_and_record(ip)
+            with lock:
+                results[ip] = ok
+
+        threads = [threading.Thread(target=do_one, args=(ip,), daemon=True)
+                   for ip in list(self.address_pool.allowed_addresses)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=self.timeout + 1)
+        return results
+
+    def run(self, is_running, tick=0.5):
+        """
+        心跳主循环：到期的服务端各自在独立线程中发送
+
+        Args:
+            is_running: 返回是否继续运行的回调
+            tick: 调度检查间隔（秒）
+        """
+        while is_running():
+            now = time.time()
+            due = []
+            with self.lock:
+                addresses = set(self.address_pool.allowed_addresses)
+                # 清理已从地址池移除的服务端
+                for ip in list(self._states):
+                    if ip not in addresses:
+                        del self._states[ip]
+                for ip in addresses:
+                    state = self._get_state(ip)
+                    if not state['in_flight'] and state['next_at'] <= now:
+                        state['in_flight'] = True
+                        due.append(ip)
+
+            for ip in due:
+                threading.Thread(target=self._send_and_record, args=(ip,), daemon=True).start()
+
+            time.sleep(tick)
+
+    def get_stats(self):
+        """获取各服务端的心跳调度状态"""
+        now = time.time()
+        with self.lock:
+            return {
+                ip: {
+                    'interval': state['interval'],
+                    'failures': state['failures'],
+                    'next_in': max(0.0, round(state['next_at'] - now, 2))
+                }
+                for ip, state in self._states.items()
+            }
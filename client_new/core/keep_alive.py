@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+服务端连接池的长连接
+服务端以 keep_alive 消息开始一个长连接后，请求/应答型的请求（命令、批量命令）
+处理完不关闭连接，而是放回这里等待下一个请求：空闲的连接由一个 selector 线程
+统一等待，不占用命令工作线程；请求到达时再提交给命令工作池处理。空闲超过
+idle_timeout 的连接关闭（服务端会在此之前回收）。
+文件传输、流式命令等请求处理完后关闭连接。
+"""
+
+import json
+import selectors
+import socket
+import threading
+import time
+
+KEEP_ALIVE_IDLE_TIMEOUT = 120   # 保留空闲长连接的时间（秒）
+KEEP_ALIVE_MAX_CONNECTIONS = 64 # 同时保留的长连接数上限，超过后拒绝新的长连接
+REQUEST_TIMEOUT = 30            # 连接可读后读取完整请求的超时
+
+TCP_KEEPIDLE = 10
+TCP_KEEPINTVL = 5
+TCP_KEEPCNT = 3
+
+
+def configure_keepalive(sock, idle=TCP_KEEPIDLE, interval=TCP_KEEPINTVL, count=TCP_KEEPCNT):
+    """开启 TCP keepalive 并设置探测参数（平台不支持的选项跳过）"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'SIO_KEEPALIVE_VALS'):
+        # Windows：只能设置空闲时间和探测间隔（毫秒）
+        sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+        return
+    for name, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPALIVE', idle),
+                        ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count)):
+        if hasattr(socket, name):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+            except OSError:
+                pass
+
+
+def is_reusable(msg):
+    """请求处理完后连接能否继续使用（只回一个 JSON 应答的请求）"""
+    msg_type = msg.get('type')
+    if msg_type == 'batch':
+        return True
+    return msg_type == 'command' and msg.get('command') != 'execute_command_stream'
+
+
+def read_request(conn, timeout=REQUEST_TIMEOUT):
+    """
+    读取长连接上的一个请求（服务端发送一个 JSON 后等待应答，不会连续发送）
+
+    Returns:
+        dict: 请求消息，连接已关闭或读取失败时返回 None
+    """
+    conn.settimeout(timeout)
+    data = b''
+    try:
+        while True:
+            chunk = conn.recv(4096)
+            if not chunk:
+                return None
+            data += chunk
+            try:
+                return json.loads(data.decode('utf-8'))
+            except ValueError:
+                continue
+    except OSError:
+        return None
+
+
+class KeepAliveManager:
+    """保留服务端的长连接，空闲时统一等待，请求到达时提交给命令工作池"""
+
+    def __init__(self, submit, on_busy, idle_timeout=KEEP_ALIVE_IDLE_TIMEOUT,
+                 max_connections=KEEP_ALIVE_MAX_CONNECTIONS, logger=None):
+        """
+        Args:
+            submit: 提交请求的函数 submit(conn, addr)，返回 False 表示工作池已满
+            on_busy: 工作池已满时的处理函数 on_busy(conn, addr)，负责回复 busy 并关闭连接
+            idle_timeout: 空闲连接保留时间（秒）
+            max_connections: 同时保留的长连接数上限
+            logger: 日志对象
+        """
+        self.submit = submit
+        self.on_busy = on_busy
+        self.idle_timeout = idle_timeout
+        self.max_connections = max(1, int(max_connections))
+        self.logger = logger
+
+        self.lock = threading.Lock()
+        self._connections = set()   # 全部长连接（等待中和处理中）
+        self._pending = []          # 待放回 selector 的连接
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._running = False
+        self._thread = None
+        self._accepted = 0
+        self._refused = 0
+        self._requests = 0
+        self._expired = 0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='keep-alive', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止等待线程并关闭全部长连接"""
+        self._running = False
+        self._wakeup()
+        with self.lock:
+            connections, self._connections = list(self._connections), set()
+        for conn in connections:
+            self._close(conn)
+
+    def accept(self, conn, addr, msg):
+        """
+        处理服务端的 keep_alive 请求：确认后连接进入等待，超过上限时拒绝（连接由调用方关闭）
+
+        Returns:
+            bool: True 表示连接已转为长连接，调用方不应关闭
+        """
+        with self.lock:
+            accepted = self._running and len(self._connections) < self.max_connections
+            if accepted:
+                self._connections.add(conn)
+                self._accepted += 1
+            else:
+                self._refused += 1
+        if not accepted:
+            try:
+                conn.sendall(json.dumps({'status': 'busy', 'keep_alive': False,
+                                         'message': '长连接数已达上限'}).encode('utf-8'))
+            except OSError:
+                pass
+            return False
+        try:
+            configure_keepalive(conn)
+        except OSError:
+            pass
+        try:
+            conn.sendall(json.dumps({
+                'status': 'success',
+                'keep_alive': True,
+                'idle_timeout': self.idle_timeout
+            }).encode('utf-8'))
+        except OSError:
+            self.close(conn)
+            return True
+        self.park(conn, addr)
+        return True
+
+    def park(self, conn, addr):
+        """请求处理完后把连接放回，等待下一个请求"""
+        with self.lock:
+            if conn not in self._connections:
+                return
+            self._pending.append((conn, addr))
+        self._wakeup()
+
+    def close(self, conn):
+        """关闭一个长连接"""
+        with self.lock:
+            self._connections.discard(conn)
+        self._close(conn)
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'x')
+        except OSError:
+            pass
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def _run(self):
+        parked = {}   # conn -> (addr, 放回的时间)
+        while self._running:
+            with self.lock:
+                pending, self._pending = self._pending, []
+            now = time.time()
+            for conn, addr in pending:
+                try:
+                    conn.setblocking(False)
+                    self._selector.register(conn, selectors.EVENT_READ)
+                    parked[conn] = (addr, now)
+                except (OSError, ValueError):
+                    self.close(conn)
+
+            for key, _ in self._selector.select(timeout=1):
+                if key.fileobj is self._wakeup_r:
+                    try:
+                        while self._wakeup_r.recv(1024):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                conn = key.fileobj
+                addr, _ = parked.pop(conn)
+                self._selector.unregister(conn)
+                self._dispatch(conn, addr)
+
+            # 空闲超时
+            now = time.time()
+            for conn, (addr, parked_at) in list(parked.items()):
+                if now - parked_at > self.idle_timeout:
+                    del parked[conn]
+                    self._selector.unregister(conn)
+                    with self.lock:
+                        self._expired += 1
+                    self.close(conn)
+
+        for conn in parked:
+            try:
+                self._selector.unregister(conn)
+            except (KeyError, ValueError):
+                pass
+
+    def _dispatch(self, conn, addr):
+        """连接可读：服务端已关闭时直接关闭，否则提交给工作池读取并处理请求"""
+        try:
+            conn.setblocking(True)
+            if not conn.recv(1, socket.MSG_PEEK):
+                self.close(conn)
+                return
+        except OSError:
+            self.close(conn)
+            return
+        if self.submit(conn, addr):
+            with self.lock:
+                self._requests += 1
+            return
+        with self.lock:
+            self._connections.discard(conn)
+        self.on_busy(conn, addr)
+
+    def get_stats(self):
+        """长连接数和累计计数"""
+        with self.lock:
+            return {
+                'connections': len(self._connections),
+                'max_connections': self.max_connections,
+                'accepted': self._accepted,
+                'refused': self._refused,
+                'requests': self._requests,
+                'expired': self._expired
+            }
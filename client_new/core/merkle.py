@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+文件清单的目录级 Merkle 哈希
+计算方式与服务端 core/merkle.py 一致
+"""
+
+import hashlib
+
+
+def dir_hashes(files):
+    """
+    计算目录哈希
+
+    Args:
+        files: {相对路径: 文件哈希}
+
+    Returns:
+        dict: {目录路径: 目录哈希}，根目录为 ''
+    """
+    children = {'': {}}
+    for path, digest in files.items():
+        parts = path.split('/')
+        for depth in range(len(parts) - 1):
+            parent = '/'.join(parts[:depth])
+            children.setdefault(parent, {}).setdefault(parts[depth], ('d', ''))
+            children.setdefault('/'.join(parts[:depth + 1]), {})
+        children.setdefault('/'.join(parts[:-1]), {})[parts[-1]] = ('f', digest)
+
+    hashes = {}
+    # 由深到浅计算，子目录先于父目录
+    for directory in sorted(children, key=lambda d: d.count('/') + bool(d), reverse=True):
+        h = hashlib.blake2b(digest_size=16)
+        for name in sorted(children[directory]):
+            kind, value = children[directory][name]
+            if kind == 'd':
+                value = hashes[f'{directory}/{name}' if directory else name]
+            h.update(f'{kind} {name} {value}\n'.encode('utf-8'))
+        hashes[directory] = h.hexdigest()
+    return hashes
+
+
+def parent_dir(path):
+    """文件所在目录的相对路径，根目录为 ''"""
+    return path.rpartition('/')[0]
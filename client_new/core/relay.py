@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+分块接力分发 - 节点端
+服务端只把数据发给少数种子节点，节点边接收、边逐块校验、边转发给下游节点，
+下游节点的结果逐级汇总后返回（格式见服务端 core/relay.py）
+"""
+
+import hashlib
+import json
+import socket
+
+RELAY_CONNECT_TIMEOUT = 10
+RELAY_TIMEOUT = 300
+
+
+def chunk_digest(data):
+    """计算单个数据块的 sha256"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def subtree_ips(node):
+    """返回子树中所有节点的 IP（含根）"""
+    ips = []
+    pending = [node]
+    while pending:
+        current = pending.pop()
+        ips.append(current['ip'])
+        pending.extend(current.get('children', []))
+    return ips
+
+
+class RelayFanout:
+    """把同一份数据转发给下游节点，并汇总整棵子树的结果"""
+
+    def __init__(self, request, header, port, logger=None):
+        """
+        Args:
+            request: 原样转发给下游的接力请求
+            header: 数据头（不含 children，转发时按下游子树填入）
+            port: 下游节点的监听端口
+            logger: 日志记录器
+        """
+        self.request = request
+        self.header = {k: v for k, v in header.items() if k != 'children'}
+        self.port = port
+        self.logger = logger
+        self.links = []      # [[子树, socket]]，转发失败后 socket 置为 None
+        self.results = {}    # {ip: 结果}
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.info(message)
+
+    def _fail_subtree(self, node, message):
+        for ip in subtree_ips(node):
+            self.results.setdefault(ip, {'status': 'error', 'message': message})
+
+    def _open(self, node):
+        sock = socket.create_connection((node['ip'], self.port), timeout=RELAY_CONNECT_TIMEOUT)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall(json.dumps(self.request).encode('utf-8'))
+            ack = sock.recv(1024).decode('utf-8')
+            if ack != 'ready':
+                raise ConnectionError(f'节点未就绪: {ack}')
+            sock.settimeout(RELAY_TIMEOUT)
+            header = dict(self.header, children=node.get('children', []))
+            sock.sendall((json.dumps(header) + '\n').encode('utf-8'))
+            return sock
+        except Exception:
+            sock.close()
+            raise
+
+    def connect(self, children):
+        """
+        连接下游节点；连接失败的节点由本节点直接接管其下游
+
+        Args:
+            children: 下游子树列表 [{'ip': ..., 'children': [...]}]
+        """
+        pending = list(children)
+        while pending:
+            node = pending.pop(0)
+            try:
+                self.links.append([node, self._open(node)])
+            except Exception as e:
+                self._log(f"接力节点 {node['ip']} 连接失败，接管其下游: {e}")
+                self.results[node['ip']] = {'status': 'error', 'message': f'无法连接: {e}'}
+                pending.extend(node.get('children', []))
+
+    def forward(self, chunk):
+        """把一个已校验的数据块发给所有下游；发送失败的下游整棵子树记为失败"""
+        for link in self.links:
+            node, sock = link
+            if sock is None:
+                continue
+            try:
+                sock.sendall(chunk)
+            except Exception as e:
+                self._log(f"向 {node['ip']} 转发失败: {e}")
+                self._fail_subtree(node, f'转发中断: {e}')
+                sock.close()
+                link[1] = None
+
+    def abort(self, message):
+        """上游数据出错，断开所有下游并把整棵子树记为失败"""
+        for link in self.links:
+            node, sock = link
+            if sock is not None:
+                sock.close()
+                link[1] = None
+                self._fail_subtree(node, message)
+
+    def collect(self):
+        """
+        等待下游返回结果并汇总
+
+        Returns:
+            dict: {ip: 结果}，包含所有下游子树的节点
+        """
+        for link in self.links:
+            node, sock = link
+            if sock is None:
+                continue
+            try:
+                reader = sock.makefile('rb')
+                try:
+                    response = json.loads(reader.readline().decode('utf-8'))
+                finally:
+                    reader.close()
+                self.results[node['ip']] = response.get('result', response)
+                self.results.update(response.get('results', {}))
+            except Exception as e:
+                self._log(f"接收 {node['ip']} 的接力结果失败: {e}")
+            finally:
+                sock.close()
+                link[1] = None
+            # 下游中途断开时没有带回结果的节点记为失败
+            self._fail_subtree(node, '未收到接力结果')
+        return self.results
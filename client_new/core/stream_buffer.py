@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+输出环形缓冲区
+在命令输出读取线程和网络发送之间做有界缓冲，发送跟不上时先反压、再丢弃最旧数据
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class OutputRingBuffer:
+    """有界输出缓冲区 - 按字符数限制容量"""
+
+    def __init__(self, capacity=262144, block_timeout=2.0):
+        """
+        初始化缓冲区
+
+        Args:
+            capacity: 最大缓存字符数
+            block_timeout: 缓冲区满时写入方最长阻塞秒数（反压），超时后丢弃最旧数据
+        """
+        self.capacity = max(1024, int(capacity))
+        self.block_timeout = block_timeout
+        self._chunks = deque()  # [(stream, text)]
+        self._size = 0
+        self._closed = False
+        self.dropped = 0
+        self._cond = threading.Condition()
+
+    def put(self, stream, text):
+        """写入一段输出"""
+        if not text:
+            return
+        with self._cond:
+            if len(text) > self.capacity:
+                # 单块超过容量时只保留尾部
+                self.dropped += len(text) - self.capacity
+                text = text[-self.capacity:]
+
+            deadline = time.time() + self.block_timeout
+            while self._size + len(text) > self.capacity and not self._closed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            # 反压超时仍放不下：丢弃最旧的数据
+            while self._size + len(text) > self.capacity and self._chunks:
+                _, old = self._chunks.popleft()
+                self._size -= len(old)
+                self.dropped += len(old)
+
+            self._chunks.append((stream, text))
+            self._size += len(text)
+            self._cond.notify_all()
+
+    def get(self, timeout=0.2, max_chars=65536):
+        """
+        取出缓存的输出，相邻同一流的数据会合并
+
+        Returns:
+            list: [(stream, text)]，超时无数据时返回空列表
+        """
+        with self._cond:
+            if not self._chunks and not self._closed:
+                self._cond.wait(timeout)
+
+            merged = []
+            taken = 0
+            while self._chunks and taken < max_chars:
+                stream, text = self._chunks.popleft()
+                self._size -= len(text)
+                taken += len(text)
+                if merged and merged[-1][0] == stream:
+                    merged[-1] = (stream, merged[-1][1] + text)
+                else:
+                    merged.append((stream, text))
+
+            if merged:
+                self._cond.notify_all()
+            return merged
+
+    def close(self):
+        """关闭缓冲区，唤醒所有等待方"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def is_empty(self):
+        with self._cond:
+            return not self._chunks
@@ -9,10 +9,32 @@ import time
 import logging
 import zipfile
 import io
+import shutil
+import signal
 import subprocess
 import platform
+import codecs
+import struct
+import uuid
 from pathlib import Path
 
+from core.stream_buffer import OutputRingBuffer
+from core.client_updater import MANIFEST_HASHES
+from core.compression import (
+    DEFLATE, DEFAULT_PROFILE, CompressionPolicy, CompressionStats, decompressor, format_report
+)
+from core.zip_writer import ParallelZipWriter
+from core.transfer import (
+    TRANSFER_CHUNK_SIZE, TRANSFER_RETRIES, TRANSFER_RETRY_DELAY, file_sha256, read_ready, send_chunks
+)
+
+# 目录同步接收中的临时文件后缀
+SYNC_TEMP_SUFFIX = '.sync.tmp'
+
+# 禁止执行的危险命令片段
+DANGEROUS_COMMANDS = ['rm -rf', 'del /', 'format', 'mkfs', 'dd if=', 
+                      '> /dev/', 'chmod 777', 'chown root']
+
 
 class TaskExecutor:
     """任务执行器"""
@@ -115,98 +137,160 @@ class TaskExecutor:
         except Exception as e:
             return {'status': 'error', 'message': f'清理日志失败: {str(e)}'}
     
-    def backup_files(self, server_ip, server_addresses, server_command_port):
-        """备份文件 - 压缩整个客户端目录并发送到服务端"""
+    def backup_files(self, server_ip, server_addresses, server_command_port, profile=DEFAULT_PROFILE,
+                     workers=1):
+        """
+        备份文件 - 压缩整个客户端目录并发送到服务端（逐块校验，中断后自动续传）
+        
+        Args:
+            profile: 压缩档位，每个文件按扩展名和采样探测选择存储、deflate 或 LZMA
+            workers: 压缩线程数，留出 CPU 给节点上的 Web 服务
+        """
         try:
             # 获取客户端目录（备份目录的父目录）
             client_dir = self.backup_path.parent
             
-            # 压缩整个客户端目录到内存
-            zip_buffer = io.BytesIO()
+            # 压缩整个客户端目录到备份目录下的临时文件（备份目录本身不会被压缩）
+            zip_path = self.backup_path / 'outgoing_backup.zip'
             folder_name = client_dir.name  # 获取文件夹名称（如 client_new）
+            policy = CompressionPolicy(profile)
+            stats = CompressionStats()
             
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # 遍历客户端目录下的所有文件
-                for root, dirs, files in os.walk(client_dir):
-                    # 排除备份目录、Transfer Files目录、__pycache__目录和日志目录
-                    dirs[:] = [d for d in dirs if d not in ['backup', 'Transfer Files', '__pycache__', 'log']]
-                    
-                    for file in files:
-                        file_path = Path(root) / file
-                        # 计算相对路径（相对于客户端目录）
-                        arcname = file_path.relative_to(client_dir)
-                        zipf.write(file_path, arcname)
-            
-            zip_data = zip_buffer.getvalue()
-            zip_size = len(zip_data)
+            # 多个文件（大文件按块）在线程池中并行压缩，按顺序写入 zip
+            writer = ParallelZipWriter(zip_path, policy, stats, workers)
+            # 遍历客户端目录下的所有文件
+            for root, dirs, files in os.walk(client_dir):
+                # 排除备份目录、Transfer Files目录、__pycache__目录、日志目录和更新工作目录
+                # （暂存版本、未完成的传输、内容缓存）
+                dirs[:] = [d for d in dirs if d not in ['backup', self.backup_path.name, 'Transfer Files', '__pycache__', 'log', 'updates']]
+                
+                for file in files:
+                    file_path = Path(root) / file
+                    # 计算相对路径（相对于客户端目录）
+                    arcname = file_path.relative_to(client_dir)
+                    writer.add(file_path, arcname)
+            started = time.time()
+            writer.write()
             
-            # 发送备份文件到服务端
+            report = stats.report()
+            if self.logger:
+                self.logger.info(f"备份压缩（{policy.profile}，{writer.workers} 线程，"
+                                 f"耗时 {time.time() - started:.2f} 秒）: {format_report(report)}")
+            try:
+                return self._send_backup(zip_path, folder_name, server_ip, server_command_port, report)
+            finally:
+                try:
+                    os.remove(zip_path)
+                except OSError:
+                    pass
+                    
+        except Exception as e:
+            import traceback
+            error_detail = traceback.format_exc()
+            return {'status': 'error', 'message': f'备份失败: {str(e)}'}
+    
+    def _send_backup(self, zip_path, folder_name, server_ip, server_command_port, compression=None):
+        """
+        发送备份文件到服务端；传输中断或块校验失败时重新连接，从服务端已收到的位置继续
+        
+        Args:
+            compression: 压缩统计（CompressionStats.report()），随请求发给服务端
+        
+        Returns:
+            dict: 发送结果
+        """
+        zip_size = os.path.getsize(zip_path)
+        msg = {
+            'type': 'backup_file',
+            'folder_name': folder_name,
+            'file_size': zip_size,
+            'chunk_size': TRANSFER_CHUNK_SIZE,
+            'sha256': file_sha256(zip_path),
+            # 续传时不变，服务端同时接收同一内容时据此区分部分文件
+            'transfer_id': uuid.uuid4().hex,
+            'compression': compression
+        }
+        result = {'status': 'error', 'message': '未发送'}
+        for attempt in range(TRANSFER_RETRIES + 1):
+            if attempt:
+                if self.logger:
+                    self.logger.warning(f"备份文件发送中断: {result.get('message')}，第 {attempt} 次续传")
+                time.sleep(TRANSFER_RETRY_DELAY)
+            started = False
+            sock = None
             try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(300)  # 5分钟超时
-                
                 # 连接到服务端命令端口
-                sock.connect((server_ip, server_command_port))
+                sock = socket.create_connection((server_ip, server_command_port), timeout=10)
                 
-                # 发送备份文件请求
-                msg = {
-                    'type': 'backup_file',
-                    'folder_name': folder_name,
-                    'file_size': zip_size
-                }
+                # 发送备份文件请求，等待服务端准备就绪
                 sock.sendall(json.dumps(msg).encode('utf-8'))
+                offset = read_ready(sock)
+                started = True
                 
-                # 等待服务端准备就绪
-                sock.settimeout(10)
-                ack = sock.recv(1024).decode('utf-8')
-                if ack != 'ready':
-                    sock.close()
-                    return {'status': 'error', 'message': f'服务端未准备就绪: {ack}'}
-                
-                # 发送压缩文件数据
                 sock.settimeout(300)
-                BUFFER_SIZE = 131072  # 128KB
-                sent = 0
-                while sent < zip_size:
-                    chunk = zip_data[sent:sent + BUFFER_SIZE]
-                    sock.sendall(chunk)
-                    sent += len(chunk)
+                if offset is None:
+                    # 旧版服务端：整体发送
+                    BUFFER_SIZE = 131072  # 128KB
+                    with open(zip_path, 'rb') as f:
+                        while True:
+                            chunk = f.read(BUFFER_SIZE)
+                            if not chunk:
+                                break
+                            sock.sendall(chunk)
+                else:
+                    send_chunks(sock, zip_path, offset, TRANSFER_CHUNK_SIZE)
                 
                 # 接收响应
                 sock.settimeout(30)
-                response_data = b''
-                while True:
-                    chunk = sock.recv(4096)
-                    if not chunk:
-                        break
-                    response_data += chunk
-                    try:
-                        response = json.loads(response_data.decode('utf-8'))
-                        sock.close()
-                        if response.get('status') == 'success':
-                            return {'status': 'success', 'message': '备份文件已发送到服务端'}
-                        else:
-                            return {'status': 'error', 'message': f"服务端接收失败: {response.get('message', '未知错误')}"}
-                    except json.JSONDecodeError:
-                        continue
-                
-                sock.close()
-                return {'status': 'error', 'message': '未收到服务端响应'}
-                
+                response = self._recv_json_response(sock)
+                if response is None:
+                    return {'status': 'error', 'message': '未收到服务端响应'}
+                if response.get('status') == 'success':
+                    return {'status': 'success', 'message': '备份文件已发送到服务端'}
+                result = {'status': 'error', 'message': f"服务端接收失败: {response.get('message', '未知错误')}"}
+                if not response.get('resumable'):
+                    return result
             except socket.timeout:
-                return {'status': 'error', 'message': '连接服务端超时'}
+                if not started:
+                    return {'status': 'error', 'message': '连接服务端超时'}
+                result = {'status': 'error', 'message': '发送备份文件超时'}
             except ConnectionRefusedError:
                 return {'status': 'error', 'message': '服务端拒绝连接'}
             except Exception as e:
-                return {'status': 'error', 'message': f'发送备份文件失败: {str(e)}'}
-                    
-        except Exception as e:
-            import traceback
-            error_detail = traceback.format_exc()
-            return {'status': 'error', 'message': f'备份失败: {str(e)}'}
+                if not started:
+                    return {'status': 'error', 'message': f'发送备份文件失败: {str(e)}'}
+                result = {'status': 'error', 'message': f'发送备份文件失败: {str(e)}'}
+            finally:
+                if sock:
+                    sock.close()
+        return result
+    
+    def _recv_json_response(self, sock):
+        """接收一个完整的JSON响应，连接关闭仍未收到时返回None"""
+        response_data = b''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return None
+            response_data += chunk
+            try:
+                return json.loads(response_data.decode('utf-8'))
+            except json.JSONDecodeError:
+                continue
     
     def update_file(self, file_data, remote_path, file_size, is_zip=False):
         """更新文件 - 保存到Transfer Files文件夹"""
+        return self.store_file(io.BytesIO(file_data), remote_path, is_zip)
+    
+    def store_file(self, source, remote_path, is_zip=False):
+        """
+        把已接收的数据保存到Transfer Files文件夹
+        
+        Args:
+            source: 可读的二进制文件对象（内存缓冲或接力分发的临时文件）
+            remote_path: 保存的文件名或解压目录名
+            is_zip: 是否为需要解压的zip文件
+        """
         try:
             # 创建Transfer Files文件夹（备份目录的父目录下的Transfer Files文件夹）
             transfer_dir = self.backup_path.parent / 'Transfer Files'
@@ -214,8 +298,7 @@ class TaskExecutor:
             
             if is_zip:
                 # 解压zip文件
-                zip_buffer = io.BytesIO(file_data)
-                with zipfile.ZipFile(zip_buffer, 'r') as zipf:
+                with zipfile.ZipFile(source, 'r') as zipf:
                     # 如果指定了remote_path，使用它作为解压目录名，否则使用默认名称
                     if remote_path:
                         target_path = transfer_dir / remote_path
@@ -237,25 +320,259 @@ class TaskExecutor:
                     target_path = transfer_dir / 'received_file'
                 
                 with open(target_path, 'wb') as f:
-                    f.write(file_data)
+                    shutil.copyfileobj(source, f)
                 
                 return {'status': 'success', 'message': f'文件保存完成: {target_path}'}
         except Exception as e:
             return {'status': 'error', 'message': f'文件保存失败: {str(e)}'}
     
+    def resolve_sync_dir(self, remote_dir):
+        """
+        目录同步的目标目录 Transfer Files/<remote_dir>
+
+        Returns:
+            Path: 目标目录；remote_dir 为空或超出 Transfer Files 时返回 None
+        """
+        transfer_dir = (self.backup_path.parent / 'Transfer Files').resolve()
+        if not remote_dir:
+            return None
+        root = (transfer_dir / remote_dir).resolve()
+        if root == transfer_dir or transfer_dir not in root.parents:
+            return None
+        return root
+    
+    def _sync_target(self, root, rel_path):
+        """同步条目的目标路径，路径不在目标目录内时返回 None"""
+        if not rel_path or Path(rel_path).is_absolute() or '..' in Path(rel_path).parts:
+            return None
+        target = (root / rel_path).resolve()
+        return target if root in target.parents else None
+    
+    def get_dir_manifest(self, remote_dir, hash_name='blake2b'):
+        """
+        获取 Transfer Files/<remote_dir> 的文件清单，供服务端目录同步比较
+        
+        Args:
+            remote_dir: 目录名
+            hash_name: 哈希算法，见 MANIFEST_HASHES
+            
+        Returns:
+            dict: {'status', 'manifest': {相对路径: 哈希}, 'hash'}
+        """
+        root = self.resolve_sync_dir(remote_dir)
+        if root is None:
+            return {'status': 'error', 'message': f'无效的目录: {remote_dir}'}
+        if hash_name not in MANIFEST_HASHES:
+            return {'status': 'error', 'message': f'不支持的哈希算法: {hash_name}'}
+        manifest = {}
+        if root.is_dir():
+            for path in root.rglob('*'):
+                if not path.is_file() or path.name.endswith(SYNC_TEMP_SUFFIX):
+                    continue
+                hasher = MANIFEST_HASHES[hash_name]()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        hasher.update(chunk)
+                manifest[path.relative_to(root).as_posix()] = hasher.hexdigest()
+        return {'status': 'success', 'manifest': manifest, 'hash': hash_name}
+    
+    def _read_sync_frames(self, reader, on_data):
+        """读取一个文件的数据帧（4 字节长度 + 数据，长度 0 结束），逐帧调用 on_data"""
+        while True:
+            header = reader.read(4)
+            if len(header) != 4:
+                raise ConnectionError('同步数据不完整')
+            length = struct.unpack('>I', header)[0]
+            if length == 0:
+                return
+            data = reader.read(length)
+            if len(data) != length:
+                raise ConnectionError('同步数据不完整')
+            on_data(data)
+    
+    def _receive_sync_entry(self, reader, root, entry, hash_name):
+        """
+        接收一个同步文件：解压后写入临时文件，校验大小和哈希后替换目标文件
+        
+        Returns:
+            str: 错误信息，成功时为 None
+        """
+        target = self._sync_target(root, entry.get('path'))
+        if target is None:
+            self._read_sync_frames(reader, lambda data: None)
+            return f"{entry.get('path')}: 无效的路径"
+        
+        state = {'error': None, 'size': 0}
+        try:
+            stream = decompressor(entry.get('codec', DEFLATE))
+        except ValueError as e:
+            self._read_sync_frames(reader, lambda data: None)
+            return f"{entry.get('path')}: {e}"
+        hasher = MANIFEST_HASHES[hash_name]()
+        temp = target.with_name(target.name + SYNC_TEMP_SUFFIX)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(temp, 'wb') as out:
+            def write(data):
+                if state['error']:
+                    return
+                try:
+                    chunk = stream.decompress(data)
+                except Exception as e:
+                    state['error'] = f'解压失败: {e}'
+                    return
+                out.write(chunk)
+                hasher.update(chunk)
+                state['size'] += len(chunk)
+            
+            try:
+                self._read_sync_frames(reader, write)
+                if not state['error']:
+                    try:
+                        tail = stream.flush()
+                    except Exception as e:
+                        state['error'] = f'解压失败: {e}'
+                    else:
+                        out.write(tail)
+                        hasher.update(tail)
+                        state['size'] += len(tail)
+            except Exception:
+                out.close()
+                os.remove(temp)
+                raise
+        
+        if not state['error'] and (state['size'] != entry.get('size') or hasher.hexdigest() != entry.get('hash')):
+            state['error'] = '校验失败'
+        if not state['error']:
+            try:
+                os.replace(temp, target)
+                return None
+            except OSError as e:
+                state['error'] = f'写入失败: {e}'
+        os.remove(temp)
+        return f"{entry.get('path')}: {state['error']}"
+    
+    def _remove_synced(self, root, rel_path):
+        """删除同步目录中多余的文件，并清理随之变空的上级目录"""
+        target = self._sync_target(root, rel_path)
+        if target is None:
+            return f'{rel_path}: 无效的路径'
+        try:
+            target.unlink()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            return f'{rel_path}: 删除失败: {e}'
+        parent = target.parent
+        while parent != root:
+            try:
+                parent.rmdir()
+            except OSError:
+                break
+            parent = parent.parent
+        return None
+    
+    def sync_directory(self, reader, remote_dir, hash_name='blake2b'):
+        """
+        接收目录同步数据并写入 Transfer Files/<remote_dir>（格式见服务端 core/dir_sync.py）
+        
+        Args:
+            reader: 连接的二进制读取对象
+            remote_dir: 目录名
+            hash_name: 文件哈希算法
+            
+        Returns:
+            dict: {'status', 'message', 'written', 'deleted', 'errors'}
+        """
+        root = self.resolve_sync_dir(remote_dir)
+        if root is None or hash_name not in MANIFEST_HASHES:
+            return {'status': 'error', 'message': f'无效的同步请求: {remote_dir}, {hash_name}'}
+        root.mkdir(parents=True, exist_ok=True)
+        
+        written = 0
+        deleted = 0
+        errors = []
+        try:
+            while True:
+                line = reader.readline()
+                if not line:
+                    raise ConnectionError('同步数据不完整')
+                entry = json.loads(line.decode('utf-8'))
+                if entry.get('end'):
+                    break
+                error = self._receive_sync_entry(reader, root, entry, hash_name)
+                if error:
+                    errors.append(error)
+                else:
+                    written += 1
+        except Exception as e:
+            return {'status': 'error', 'message': f'接收同步数据失败: {e}',
+                    'written': written, 'deleted': 0, 'errors': errors}
+        
+        for rel_path in entry.get('delete', []):
+            error = self._remove_synced(root, rel_path)
+            if error:
+                errors.append(error)
+            else:
+                deleted += 1
+        
+        message = f'已更新 {written} 个文件，删除 {deleted} 个: {root}'
+        if errors:
+            message += f'，失败 {len(errors)} 个'
+        return {
+            'status': 'success' if not errors else 'partial',
+            'message': message,
+            'written': written,
+            'deleted': deleted,
+            'errors': errors
+        }
+    
+    def _check_dangerous(self, command):
+        """安全检查：返回命中的危险命令片段，未命中返回None"""
+        for dangerous in DANGEROUS_COMMANDS:
+            if dangerous in command:
+                return dangerous
+        return None
+    
+    def _shell_args(self, command):
+        """根据操作系统返回shell参数和输出编码"""
+        if platform.system() == 'Windows':
+            # Windows使用cmd，编码使用系统默认（GBK/cp936）
+            return ['cmd', '/c', command], 'gbk'
+        # Linux/Unix使用bash，编码使用UTF-8
+        return ['bash', '-c', command], 'utf-8'
+    
+    def _process_group_kwargs(self):
+        """让命令在新的进程组中运行，终止时连同它启动的子进程一起结束"""
+        if platform.system() == 'Windows':
+            return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        return {'start_new_session': True}
+    
+    def _kill_process_tree(self, process):
+        """终止命令及其所在进程组中的所有进程（shell 启动的子进程不会残留）"""
+        try:
+            if platform.system() == 'Windows':
+                subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except (OSError, subprocess.SubprocessError):
+            pass
+        try:
+            process.kill()
+        except OSError:
+            pass
+    
     def execute_command(self, command, timeout=30):
         """执行远程命令"""
         try:
             # 安全检查：禁止危险命令
-            dangerous_commands = ['rm -rf', 'del /', 'format', 'mkfs', 'dd if=', 
-                                  '> /dev/', 'chmod 777', 'chown root']
-            for dangerous in dangerous_commands:
-                if dangerous in command:
-                    return {
-                        'status': 'error', 
-                        'message': f'禁止执行危险命令: {dangerous}',
-                        'return_code': -1
-                    }
+            dangerous = self._check_dangerous(command)
+            if dangerous:
+                return {
+                    'status': 'error', 
+                    'message': f'禁止执行危险命令: {dangerous}',
+                    'return_code': -1
+                }
             
             # 根据操作系统选择shell和编码
             if platform.system() == 'Windows':
@@ -318,6 +635,129 @@ class TaskExecutor:
                 'command': command
             }
     
+    def execute_command_stream(self, command, emit, cancel_event, timeout=300, buffer_size=262144):
+        """
+        流式执行远程命令，运行过程中持续回传输出
+        
+        Args:
+            command: 要执行的命令
+            emit: 输出回调 emit(stream, text)，stream 为 'stdout' 或 'stderr'；
+                  抛出异常表示对端已断开，命令将被终止
+            cancel_event: threading.Event，被置位时终止命令
+            timeout: 总超时秒数
+            buffer_size: 输出环形缓冲区容量（字符数）
+        
+        Returns:
+            dict: 执行结果（不含输出内容）
+        """
+        dangerous = self._check_dangerous(command)
+        if dangerous:
+            return {
+                'status': 'error',
+                'message': f'禁止执行危险命令: {dangerous}',
+                'return_code': -1,
+                'command': command
+            }
+        
+        args, encoding = self._shell_args(command)
+        try:
+            process = subprocess.Popen(
+                args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+                **self._process_group_kwargs()
+            )
+        except Exception as e:
+            return {
+                'status': 'error',
+                'message': f'命令执行失败: {str(e)}',
+                'return_code': -1,
+                'command': command
+            }
+        
+        ring = OutputRingBuffer(buffer_size)
+        
+        def read_pipe(pipe, stream):
+            # 增量解码，避免多字节字符被分块截断
+            decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+            try:
+                while True:
+                    data = pipe.read1(4096) if hasattr(pipe, 'read1') else pipe.read(4096)
+                    if not data:
+                        break
+                    ring.put(stream, decoder.decode(data))
+                ring.put(stream, decoder.decode(b'', final=True))
+            except Exception:
+                pass
+            finally:
+                pipe.close()
+        
+        readers = [
+            threading.Thread(target=read_pipe, args=(process.stdout, 'stdout'), daemon=True),
+            threading.Thread(target=read_pipe, args=(process.stderr, 'stderr'), daemon=True)
+        ]
+        for t in readers:
+            t.start()
+        
+        start_time = time.time()
+        killed_at = None
+        cancelled = False
+        timed_out = False
+        disconnected = False
+        
+        while True:
+            for stream, text in ring.get(timeout=0.2):
+                if disconnected:
+                    continue
+                try:
+                    emit(stream, text)
+                except Exception:
+                    # 对端断开，视为取消
+                    disconnected = True
+            
+            if process.poll() is not None and not any(t.is_alive() for t in readers) and ring.is_empty():
+                break
+            
+            # shell 已退出但后台子进程（cmd &、nohup）仍持有管道时同样检查取消和超时，
+            # 进程组中的剩余进程一并终止
+            if killed_at is None:
+                if cancel_event.is_set() or disconnected:
+                    cancelled = True
+                    killed_at = time.time()
+                    self._kill_process_tree(process)
+                elif time.time() - start_time > timeout:
+                    timed_out = True
+                    killed_at = time.time()
+                    self._kill_process_tree(process)
+            elif time.time() - killed_at > 2:
+                # 脱离进程组的子进程可能仍持有管道，终止后不再等待剩余输出
+                break
+        
+        ring.close()
+        return_code = process.wait()
+        
+        if cancelled:
+            status, message = 'error', '命令已取消'
+        elif timed_out:
+            status, message = 'error', f'命令执行超时（超过{timeout}秒）'
+        else:
+            status = 'success' if return_code == 0 else 'error'
+            message = '命令执行完成'
+        if ring.dropped:
+            message += f'（输出过快，丢弃 {ring.dropped} 个字符）'
+        
+        return {
+            'status': status,
+            'message': message,
+            'return_code': return_code,
+            'cancelled': cancelled,
+            'timed_out': timed_out,
+            'dropped_chars': ring.dropped,
+            'duration': round(time.time() - start_time, 3),
+            'command': command
+        }
+    
     def get_system_info(self):
         """获取系统详细信息"""
         try:
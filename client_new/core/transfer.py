@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+可续传、逐块校验的文件传输 - 客户端
+接收服务端发来的文件和全量更新包，发送备份文件（协议见服务端 core/transfer.py）
+
+    接收方就绪时回复 {"status": "ready", "offset": N}（N 为已校验保存的字节数），
+    发送方从 N 开始发送数据帧：32 字节块 sha256 + 块数据，最后校验整个文件的 sha256
+
+大文件可由多个并行连接分段发送（range_put），各段校验后按位置写入预分配的文件，
+全部完成后该文件改名为部分文件，随后的普通传输只做整体校验
+
+接收过的内容在缓存中（core/content_cache.py）时，先把缓存放到部分文件的位置，
+就绪应答即报告已有全部数据，发送方不再发送
+
+同一内容的多个传输同时进行时，后来的传输改用请求中 transfer_id 命名的专用部分文件；
+接收完成的文件改为唯一的名字后交给调用方，不会被之后的传输改动
+"""
+
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+DIGEST_SIZE = 32
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+TRANSFER_RETRIES = 3
+TRANSFER_RETRY_DELAY = 2
+PARTIAL_MAX_AGE = 7 * 86400
+# 未完成传输的文件：顺序传输的部分文件、分段传输的数据和块记录
+PARTIAL_SUFFIXES = ('.part', '.ranges', '.map')
+
+# 正在接收的部分文件路径，同一内容的并发传输不共用部分文件
+_receiving_lock = threading.Lock()
+_receiving = set()
+
+# 分段传输中各文件已完成的块 {数据文件路径: bytearray}，同一文件的多个连接共用
+# （可重入：receive_range 持有时会调用 cleanup_partials）
+_range_lock = threading.RLock()
+_range_maps = {}
+
+
+def file_sha256(path):
+    """计算文件的 sha256"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_ready(sock):
+    """
+    读取接收方的就绪应答（只取走应答这一行，之后的数据留给调用方）
+
+    Returns:
+        int: 续传偏移；旧版接收方回复 'ready' 时返回 None
+    """
+    data = b''
+    while True:
+        peek = sock.recv(1024, socket.MSG_PEEK)
+        if not peek:
+            break
+        if not data and peek == b'ready':
+            sock.recv(len(peek))
+            return None
+        end = peek.find(b'\n')
+        if end >= 0:
+            data += sock.recv(end + 1)
+            break
+        data += sock.recv(len(peek))
+    try:
+        reply = json.loads(data.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise ConnectionError(f'接收方未就绪: {data[:100]!r}')
+    if reply.get('status') != 'ready':
+        raise ConnectionError(f"接收方未就绪: {reply.get('message', reply)}")
+    return int(reply.get('offset', 0))
+
+
+def send_ready(sock, offset):
+    sock.sendall((json.dumps({'status': 'ready', 'offset': offset}) + '\n').encode('utf-8'))
+
+
+def send_chunks(sock, path, offset, chunk_size):
+    """从 offset 开始发送文件的数据帧"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sock.sendall(hashlib.sha256(chunk).digest() + chunk)
+
+
+def cleanup_partials(directory, max_age=PARTIAL_MAX_AGE):
+    """删除长时间未完成的传输留下的部分文件，同时丢弃已删除的分段传输的块记录"""
+    if not directory.is_dir():
+        return
+    deadline = time.time() - max_age
+    for path in directory.iterdir():
+        if path.suffix not in PARTIAL_SUFFIXES:
+            continue
+        try:
+            if path.stat().st_mtime < deadline:
+                path.unlink()
+                if path.suffix != '.part':
+                    with _range_lock:
+                        _range_maps.pop(str(path.with_suffix('.ranges')), None)
+        except OSError:
+            pass
+
+
+@contextmanager
+def _receiving_part(partial_dir, name, transfer_id=None):
+    """
+    在 with 块中占用本次传输的部分文件 <name>.part，已有传输在接收同一内容时改用
+    <name>-<transfer_id>.part（续传时 transfer_id 不变，仍能找到该文件）
+    """
+    with _receiving_lock:
+        part_path = partial_dir / f'{name}.part'
+        if str(part_path) in _receiving:
+            part_path = partial_dir / f'{name}-{transfer_id or uuid.uuid4().hex}.part'
+        if str(part_path) in _receiving:
+            part_path = partial_dir / f'{name}-{uuid.uuid4().hex}.part'
+        _receiving.add(str(part_path))
+    try:
+        yield part_path
+    finally:
+        with _receiving_lock:
+            _receiving.discard(str(part_path))
+
+
+class ChunkReceiver:
+    """把数据帧逐块校验后追加到部分文件，文件名由整个文件的 sha256 决定，中断后可续传"""
+
+    def __init__(self, part_path, file_size, chunk_size, sha256):
+        self.part_path = part_path
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.sha256 = sha256
+        self._hash = hashlib.sha256()
+        self.offset = 0
+
+    def prepare(self):
+        """
+        检查已有的部分文件：只保留整块的数据，并重新计算已有部分的哈希
+
+        Returns:
+            int: 可续传的偏移
+        """
+        self.part_path.parent.mkdir(parents=True, exist_ok=True)
+        size = self.part_path.stat().st_size if self.part_path.exists() else 0
+        if size == self.file_size:
+            # 已完整（如分段并行传输已全部完成），只需整体校验
+            offset = size
+        elif size > self.file_size:
+            offset = 0
+        else:
+            offset = size // self.chunk_size * self.chunk_size
+        with open(self.part_path, 'ab') as f:
+            f.truncate(offset)
+        with open(self.part_path, 'rb') as f:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                self._hash.update(chunk)
+        self.offset = offset
+        return offset
+
+    def receive(self, reader):
+        """
+        接收剩余的数据帧
+
+        Returns:
+            dict: 出错时返回错误结果（resumable=True 表示可续传），成功返回 None
+        """
+        with open(self.part_path, 'ab') as f:
+            while self.offset < self.file_size:
+                size = min(self.chunk_size, self.file_size - self.offset)
+                frame = reader.read(DIGEST_SIZE + size)
+                if len(frame) != DIGEST_SIZE + size:
+                    return {'status': 'error', 'message': f'传输中断，已接收 {self.offset}/{self.file_size} 字节',
+                            'resumable': True, 'offset': self.offset}
+                digest, chunk = frame[:DIGEST_SIZE], frame[DIGEST_SIZE:]
+                if hashlib.sha256(chunk).digest() != digest:
+                    return {'status': 'error', 'message': f'数据块校验失败，位置 {self.offset}',
+                            'resumable': True, 'offset': self.offset}
+                f.write(chunk)
+                f.flush()
+                self._hash.update(chunk)
+                self.offset += size
+
+        if self._hash.hexdigest() != self.sha256:
+            # 整体校验失败说明已保存的部分已损坏，下次从头传输
+            self.discard()
+            return {'status': 'error', 'message': '文件整体校验失败', 'resumable': True, 'offset': 0}
+        return None
+
+    def discard(self):
+        try:
+            os.remove(self.part_path)
+        except OSError:
+            pass
+
+
+def receive_file(conn, msg, partial_dir, logger=None, cache=None):
+    """
+    按请求中的 file_size、chunk_size、sha256 接收一个文件（已回复就绪之前调用）
+
+    Args:
+        conn: 连接
+        msg: 传输请求
+        partial_dir: 存放未完成传输的目录
+        logger: 日志记录器
+        cache: 内容缓存（ContentCache），其中已有该内容时不再接收数据
+
+    Returns:
+        tuple: (完成的文件路径, 错误结果)，成功时错误结果为 None
+    """
+    cleanup_partials(partial_dir)
+    with _receiving_part(partial_dir, msg['sha256'], msg.get('transfer_id')) as part_path:
+        receiver = ChunkReceiver(part_path, msg.get('file_size', 0),
+                                 msg.get('chunk_size', TRANSFER_CHUNK_SIZE), msg['sha256'])
+        cached = cache is not None and cache.seed(msg['sha256'], receiver.part_path, receiver.file_size)
+        offset = receiver.prepare()
+        if cached and logger:
+            logger.info(f"缓存中已有相同内容，跳过数据传输: {receiver.file_size} 字节")
+        elif offset and logger:
+            logger.info(f"从 {offset}/{receiver.file_size} 字节处续传")
+        send_ready(conn, offset)
+        reader = conn.makefile('rb')
+        try:
+            error = receiver.receive(reader)
+        except OSError as e:
+            error = {'status': 'error', 'message': f'传输中断: {e}', 'resumable': True, 'offset': receiver.offset}
+        finally:
+            reader.close()
+        if error:
+            if cached:
+                # 缓存的内容未通过整体校验
+                cache.discard(msg['sha256'])
+            return None, error
+        # 完成的文件交给调用方独占，之后同一内容的传输不会再续用它
+        done_path = partial_dir / f"{msg['sha256']}.{uuid.uuid4().hex}.part"
+        os.replace(part_path, done_path)
+        return done_path, None
+
+
+def _write_at(f, offset, data):
+    """按位置写入（支持时使用 pwrite，不移动共享的文件位置）"""
+    if hasattr(os, 'pwrite'):
+        os.pwrite(f.fileno(), data, offset)
+    else:
+        f.seek(offset)
+        f.write(data)
+
+
+def _open_range_map(data_path, map_path, file_size, chunks):
+    """取得分段传输的块记录，没有可用的记录时预分配数据文件并新建记录（调用方持有 _range_lock）"""
+    key = str(data_path)
+    valid = (data_path.exists() and data_path.stat().st_size == file_size
+             and map_path.exists() and map_path.stat().st_size == chunks)
+    done = _range_maps.get(key)
+    if done is not None and valid and len(done) == chunks:
+        return done
+    if valid:
+        # 内存中没有记录（如客户端重启后）时以磁盘上的记录为准
+        done = bytearray(map_path.read_bytes())
+    else:
+        with open(data_path, 'wb') as f:
+            f.truncate(file_size)
+        map_path.write_bytes(bytes(chunks))
+        done = bytearray(chunks)
+    _range_maps[key] = done
+    return done
+
+
+def receive_range(conn, msg, partial_dir, logger=None, cache=None):
+    """
+    接收分段并行传输中的一段（range_put）
+
+    校验后的块按位置写入预分配的数据文件 <sha256>.ranges，已完成的块记录在
+    <sha256>.map（每块一个字节），中断后按记录续传；所有块完成后数据文件改名为
+    <sha256>.part，随后的普通传输从文件末尾开始，只做整体校验。缓存（cache）中
+    已有该内容时直接放到 <sha256>.part，各段都不再接收数据。
+
+    Returns:
+        dict: 结果
+    """
+    sha256 = msg['sha256']
+    file_size = msg['file_size']
+    chunk_size = msg.get('chunk_size', TRANSFER_CHUNK_SIZE)
+    start, end = msg['start'], msg['end']
+    if start % chunk_size or not 0 <= start < end <= file_size:
+        return {'status': 'error', 'message': f'无效的分段: {start}-{end}'}
+
+    data_path = partial_dir / f'{sha256}.ranges'
+    map_path = partial_dir / f'{sha256}.map'
+    part_path = partial_dir / f'{sha256}.part'
+    chunks = -(-file_size // chunk_size)
+
+    with _range_lock:
+        if (cache is not None and not part_path.exists() and str(data_path) not in _range_maps
+                and cache.seed(sha256, part_path, file_size)):
+            if logger:
+                logger.info(f'缓存中已有相同内容，跳过分段传输: {file_size} 字节')
+        if part_path.exists() and part_path.stat().st_size == file_size:
+            # 其他连接已完成全部分段
+            send_ready(conn, end)
+            return {'status': 'success', 'message': '分段已存在'}
+        partial_dir.mkdir(parents=True, exist_ok=True)
+        cleanup_partials(partial_dir)
+        done = _open_range_map(data_path, map_path, file_size, chunks)
+
+    offset = start
+    while offset < end and done[offset // chunk_size]:
+        offset += chunk_size
+    offset = min(offset, end)
+    send_ready(conn, offset)
+
+    error = None
+    reader = conn.makefile('rb')
+    try:
+        with open(data_path, 'r+b') as f, open(map_path, 'r+b') as m:
+            while offset < end:
+                size = min(chunk_size, end - offset)
+                frame = reader.read(DIGEST_SIZE + size)
+                if len(frame) != DIGEST_SIZE + size:
+                    error = {'status': 'error', 'message': f'分段传输中断，位置 {offset}',
+                             'resumable': True, 'offset': offset}
+                    break
+                digest, chunk = frame[:DIGEST_SIZE], frame[DIGEST_SIZE:]
+                if hashlib.sha256(chunk).digest() != digest:
+                    error = {'status': 'error', 'message': f'数据块校验失败，位置 {offset}',
+                             'resumable': True, 'offset': offset}
+                    break
+                _write_at(f, offset, chunk)
+                f.flush()
+                index = offset // chunk_size
+                _write_at(m, index, b'\x01')
+                m.flush()
+                with _range_lock:
+                    done[index] = 1
+                offset += size
+    except OSError as e:
+        error = {'status': 'error', 'message': f'分段传输中断: {e}', 'resumable': True, 'offset': offset}
+    finally:
+        reader.close()
+    if error:
+        return error
+
+    with _range_lock:
+        if all(done) and data_path.exists():
+            try:
+                # 其他连接仍打开数据文件时（Windows）改名会失败，由最后关闭的连接完成
+                os.replace(data_path, part_path)
+                os.remove(map_path)
+                _range_maps.pop(str(data_path), None)
+                if logger:
+                    logger.info(f'分段传输完成: {file_size} 字节')
+            except OSError:
+                pass
+    return {'status': 'success', 'message': f'分段 {start}-{end} 已接收'}
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+多线程压缩的 zip 写入
+zlib 和 lzma 压缩时释放 GIL，用线程池即可利用多个 CPU 核：
+
+    - 小文件（不超过 CHUNK_SIZE）和存储的文件整个文件作为一个任务处理
+    - 大文件按 CHUNK_SIZE 切块用 deflate 并行压缩，每块以前一块末尾 32KB 作为
+      预置字典（与 pigz 相同），非最后一块以 Z_SYNC_FLUSH 结束，各块的压缩数据
+      直接拼接即为一个完整的 deflate 流；各块的 CRC32 用 crc32_combine 合并。
+      LZMA 流不能这样切块，单线程压缩大文件比分块 deflate 慢一个数量级以上，
+      所以策略选择 LZMA 的大文件也按档位的 deflate 级别分块压缩
+
+压缩结果按文件顺序写入 zip，同时在途的任务数不超过 workers * 2，内存占用有上限。
+生成的是标准 zip（大文件和大归档使用 zip64 扩展），可用 zipfile 读取。
+"""
+
+import os
+import struct
+import time
+import zlib
+import lzma
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from core.compression import (
+    DEFLATE, LZMA, SAMPLE_SIZE, STORE, CompressionPolicy, CompressionStats
+)
+
+CHUNK_SIZE = 4 * 1024 * 1024
+DICT_SIZE = 32 * 1024
+COPY_SIZE = 1024 * 1024
+
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_METHOD_IDS = {STORE: 0, DEFLATE: 8, LZMA: 14}
+ZIP_VERSIONS = {STORE: 20, DEFLATE: 20, LZMA: 63}
+ZIP64_VERSION = 45
+FLAG_LZMA_EOS = 0x02
+FLAG_UTF8 = 0x800
+
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+END_RECORD = struct.Struct('<4s4H2LH')
+END_RECORD64 = struct.Struct('<4sQ2H2L4Q')
+END_LOCATOR64 = struct.Struct('<4sLQL')
+
+# LZMA1 参数（与 preset 6 相同：lc=3, lp=0, pb=2, 8MB 字典），zip 中以属性头记录
+LZMA_FILTER = {'id': lzma.FILTER_LZMA1, 'dict_size': 8 * 1024 * 1024, 'lc': 3, 'lp': 0, 'pb': 2}
+LZMA_HEADER = struct.pack('<BBH', 9, 4, 5) + bytes([(2 * 5 + 0) * 9 + 3]) + struct.pack('<L', 8 * 1024 * 1024)
+
+
+def _gf2_times(matrix, vector):
+    result = 0
+    index = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[index]
+        vector >>= 1
+        index += 1
+    return result
+
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, row) for row in matrix]
+
+
+def crc32_combine(crc1, crc2, len2):
+    """
+    合并两段数据的 CRC32（同 zlib 的 crc32_combine）
+
+    Args:
+        crc1: 第一段的 CRC32
+        crc2: 第二段的 CRC32
+        len2: 第二段的长度
+
+    Returns:
+        int: 两段拼接后的 CRC32
+    """
+    if len2 <= 0:
+        return crc1
+    odd = [0xEDB88320] + [1 << n for n in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+    while True:
+        even = _gf2_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+        odd = _gf2_square(even)
+        if len2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+    return crc1 ^ crc2
+
+
+def _dos_datetime(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def _sample(data):
+    """与 read_sample 相同位置的样本"""
+    if len(data) <= SAMPLE_SIZE * 3:
+        return data
+    middle = (len(data) - SAMPLE_SIZE) // 2
+    return data[:SAMPLE_SIZE] + data[middle:middle + SAMPLE_SIZE] + data[-SAMPLE_SIZE:]
+
+
+class _Unit:
+    """一个压缩任务的结果"""
+
+    def __init__(self, method, level, crc, size, data, cpu):
+        self.method = method
+        self.level = level
+        self.crc = crc
+        self.size = size
+        self.data = data      # bytes，存储的大文件为 None
+        self.cpu = cpu
+
+
+class _Entry:
+    def __init__(self, path, arcname, stat):
+        self.path = path
+        self.arcname = arcname.replace(os.sep, '/')
+        self.stat = stat
+        self.method = None
+        self.level = 0
+        self.crc = 0
+        self.size = 0
+        self.compressed = 0
+        self.offset = 0
+        self.data_offset = 0
+        self.zip64 = False
+        self.cpu = 0.0
+
+
+class ParallelZipWriter:
+    """按压缩策略多线程压缩文件并按顺序写入 zip"""
+
+    def __init__(self, path, policy=None, stats=None, workers=1):
+        """
+        Args:
+            path: zip 文件路径
+            policy: CompressionPolicy，默认 balanced 档
+            stats: CompressionStats，记录各压缩方式的字节数和 CPU 时间
+            workers: 压缩线程数，小于 1 时按 1 处理
+        """
+        self.path = path
+        self.policy = policy or CompressionPolicy()
+        self.stats = stats if stats is not None else CompressionStats()
+        self.workers = max(1, int(workers))
+        self._entries = []
+
+    def add(self, path, arcname):
+        """登记要写入的文件（write 时按登记顺序写入）"""
+        self._entries.append(_Entry(path, str(arcname), os.stat(path)))
+
+    def _plan(self):
+        """按文件顺序产出 (条目, 任务函数, 是否为该条目的最后一个任务)"""
+        for entry in self._entries:
+            size = entry.stat.st_size
+            if size <= CHUNK_SIZE:
+                yield entry, (lambda e=entry: self._compress_file(e)), True
+                continue
+            method, level = self.policy.choose_file(entry.path)
+            if method == STORE:
+                yield entry, (lambda e=entry: self._compress_file(e, STORE)), True
+                continue
+            if method == LZMA:
+                level = self.policy.deflate_level
+            for offset in range(0, size, CHUNK_SIZE):
+                last = offset + CHUNK_SIZE >= size
+                yield entry, (lambda e=entry, o=offset, lv=level, is_last=last:
+                              self._compress_chunk(e, o, lv, is_last)), last
+
+    def _compress_file(self, entry, method=None):
+        """整个文件作为一个任务：小文件读入内存后选择压缩方式，存储的大文件由写入线程直接复制"""
+        started = time.thread_time()
+        if method is None:
+            with open(entry.path, 'rb') as f:
+                data = f.read()
+            method, level = self.policy.choose(entry.arcname, _sample(data))
+            crc = zlib.crc32(data)
+            if method == DEFLATE:
+                compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+                out = compressor.compress(data) + compressor.flush()
+            elif method == LZMA:
+                compressor = lzma.LZMACompressor(lzma.FORMAT_RAW, filters=[LZMA_FILTER])
+                out = LZMA_HEADER + compressor.compress(data) + compressor.flush()
+            else:
+                out = data
+            return _Unit(method, level, crc, len(data), out, time.thread_time() - started)
+
+        # 不压缩的大文件由写入线程直接从磁盘复制
+        return _Unit(STORE, 0, None, entry.stat.st_size, None, 0.0)
+
+    def _compress_chunk(self, entry, offset, level, last):
+        """大文件的一块：以前一块末尾作为预置字典压缩，非最后一块以同步刷新结束"""
+        started = time.thread_time()
+        with open(entry.path, 'rb') as f:
+            zdict = b''
+            if offset:
+                f.seek(offset - DICT_SIZE)
+                zdict = f.read(DICT_SIZE)
+            data = f.read(CHUNK_SIZE)
+        if zdict:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        out = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+        return _Unit(DEFLATE, level, zlib.crc32(data), len(data), out, time.thread_time() - started)
+
+    def write(self):
+        """压缩并写入所有登记的文件，写入中央目录"""
+        with open(self.path, 'wb') as out, ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            plan = self._plan()
+            window = self.workers * 2
+            current = None
+
+            def submit():
+                for entry, task, last in plan:
+                    pending.append((entry, pool.submit(task), last))
+                    if len(pending) >= window:
+                        return
+
+            submit()
+            while pending:
+                entry, future, last = pending.popleft()
+                unit = future.result()
+                submit()
+                if entry is not current:
+                    current = entry
+                    self._begin_entry(out, entry, unit)
+                self._write_unit(out, entry, unit)
+                if last:
+                    self._finish_entry(out, entry)
+            self._write_central_directory(out)
+
+    def _local_header(self, entry, zip64):
+        method = entry.method
+        dos_time, dos_date = _dos_datetime(entry.stat.st_mtime)
+        flags = FLAG_UTF8 | (FLAG_LZMA_EOS if method == LZMA else 0)
+        name = entry.arcname.encode('utf-8')
+        extra = b''
+        size = entry.size
+        compressed = entry.compressed
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, size, compressed)
+            size = compressed = 0xFFFFFFFF
+        version = max(ZIP_VERSIONS[method], ZIP64_VERSION if zip64 else 0)
+        return LOCAL_HEADER.pack(b'PK\x03\x04', version, 0, flags, ZIP_METHOD_IDS[method],
+                                 dos_time, dos_date, entry.crc, compressed, size,
+                                 len(name), len(extra)) + name + extra
+
+    def _begin_entry(self, out, entry, unit):
+        entry.method = unit.method
+        entry.level = unit.level
+        entry.offset = out.tell()
+        entry.zip64 = entry.stat.st_size > ZIP64_LIMIT
+        out.write(self._local_header(entry, entry.zip64))
+        entry.data_offset = out.tell()
+
+    def _write_unit(self, out, entry, unit):
+        entry.cpu += unit.cpu
+        if unit.data is None:
+            # 存储的大文件：边复制边计算 CRC
+            crc = 0
+            size = 0
+            with open(entry.path, 'rb') as f:
+                for chunk in iter(lambda: f.read(COPY_SIZE), b''):
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+                    out.write(chunk)
+            entry.crc = crc
+            entry.size = size
+            return
+        out.write(unit.data)
+        entry.crc = crc32_combine(entry.crc, unit.crc, unit.size) if entry.size else unit.crc
+        entry.size += unit.size
+
+    def _finish_entry(self, out, entry):
+        """数据写完后回到本地文件头，填入 CRC 和大小"""
+        end = out.tell()
+        entry.compressed = end - entry.data_offset
+        if not entry.zip64 and (entry.size > ZIP64_LIMIT or entry.compressed > ZIP64_LIMIT):
+            raise ValueError(f'文件在压缩过程中变大: {entry.path}')
+        out.seek(entry.offset)
+        out.write(self._local_header(entry, entry.zip64))
+        out.seek(end)
+        self.stats.add(entry.method, entry.size, entry.compressed, entry.cpu)
+
+    def _write_central_directory(self, out):
+        start = out.tell()
+        for entry in self._entries:
+            name = entry.arcname.encode('utf-8')
+            fields = []
+            size = entry.size
+            compressed = entry.compressed
+            offset = entry.offset
+            if size > ZIP64_LIMIT:
+                fields.append(size)
+                size = 0xFFFFFFFF
+            if compressed > ZIP64_LIMIT:
+                fields.append(compressed)
+                compressed = 0xFFFFFFFF
+            if offset > ZIP64_LIMIT:
+                fields.append(offset)
+                offset = 0xFFFFFFFF
+            extra = struct.pack(f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields) if fields else b''
+            version = max(ZIP_VERSIONS[entry.method], ZIP64_VERSION if fields else 0)
+            dos_time, dos_date = _dos_datetime(entry.stat.st_mtime)
+            flags = FLAG_UTF8 | (FLAG_LZMA_EOS if entry.method == LZMA else 0)
+            out.write(CENTRAL_HEADER.pack(
+                b'PK\x01\x02', version, 3 if os.sep == '/' else 0, version, 0, flags,
+                ZIP_METHOD_IDS[entry.method], dos_time, dos_date, entry.crc, compressed, size,
+                len(name), len(extra), 0, 0, 0, (entry.stat.st_mode & 0xFFFF) << 16, offset
+            ) + name + extra)
+        end = out.tell()
+        count = len(self._entries)
+        size = end - start
+        if count >= 0xFFFF or size > ZIP64_LIMIT or start > ZIP64_LIMIT:
+            out.write(END_RECORD64.pack(b'PK\x06\x06', 44, ZIP64_VERSION, ZIP64_VERSION, 0, 0,
+                                        count, count, size, start))
+            out.write(END_LOCATOR64.pack(b'PK\x06\x07', 0, end, 1))
+            count = min(count, 0xFFFF)
+            size = min(size, 0xFFFFFFFF)
+            start = min(start, 0xFFFFFFFF)
+        out.write(END_RECORD.pack(b'PK\x05\x06', 0, 0, count, count, size, start, 0))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+块级二进制差异（rsync 式滚动校验）
+把旧文件切成定长块，在新文件上滚动计算弱校验值查找相同的块，
+差异只包含“复制旧块”指令和新增的字节。
+
+差异格式（客户端 core/block_delta.py 按同一格式解析，两边需保持一致）：
+    头部   MAGIC(4) | 块大小 u32 | 旧文件 md5(16) | 新文件 md5(16) | 新文件大小 u64
+    指令   b'C' | 起始块 u32 | 块数 u32         复制旧文件的连续块
+           b'D' | 长度 u32 | 数据               新增数据
+"""
+
+import hashlib
+import math
+import struct
+
+MAGIC = b'WCD1'
+HEADER = struct.Struct('>4sI16s16sQ')
+COPY = struct.Struct('>cII')
+DATA = struct.Struct('>cI')
+
+MIN_BLOCK_SIZE = 512
+MAX_BLOCK_SIZE = 65536
+_MOD = 1 << 16
+
+
+def choose_block_size(basis_size: int) -> int:
+    """块大小取旧文件大小的平方根（对齐到 64 字节），限制在 [512, 64K]。"""
+    size = int(math.sqrt(basis_size)) // 64 * 64
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, size))
+
+
+def _weak_checksum(block: bytes) -> tuple[int, int]:
+    a = sum(block) % _MOD
+    n = len(block)
+    b = sum((n - i) * x for i, x in enumerate(block)) % _MOD
+    return a, b
+
+
+def make_delta(basis: bytes, target: bytes, block_size: int | None = None) -> bytes:
+    """生成把 basis 变为 target 的块级差异。"""
+    block_size = block_size or choose_block_size(len(basis))
+
+    # 旧文件块索引 {弱校验: [(强校验, 块号)]}，末尾不足一块的部分不参与匹配
+    index: dict[int, list[tuple[bytes, int]]] = {}
+    for number in range(len(basis) // block_size):
+        block = basis[number * block_size:(number + 1) * block_size]
+        a, b = _weak_checksum(block)
+        index.setdefault((b << 16) | a, []).append((hashlib.md5(block).digest(), number))
+
+    out = [HEADER.pack(MAGIC, block_size, hashlib.md5(basis).digest(),
+                       hashlib.md5(target).digest(), len(target))]
+    copy_start = copy_count = 0
+
+    def flush_copy() -> None:
+        nonlocal copy_count
+        if copy_count:
+            out.append(COPY.pack(b'C', copy_start, copy_count))
+            copy_count = 0
+
+    def emit_data(data: bytes) -> None:
+        if data:
+            flush_copy()
+            out.append(DATA.pack(b'D', len(data)))
+            out.append(data)
+
+    n = len(target)
+    pos = literal_start = 0
+    if index and n >= block_size:
+        a, b = _weak_checksum(target[:block_size])
+        while True:
+            matched = None
+            candidates = index.get((b << 16) | a)
+            if candidates:
+                strong = hashlib.md5(target[pos:pos + block_size]).digest()
+                for digest, number in candidates:
+                    if digest == strong:
+                        matched = number
+                        break
+
+            if matched is not None:
+                emit_data(target[literal_start:pos])
+                # 连续的块合并为一条复制指令
+                if copy_count and copy_start + copy_count == matched:
+                    copy_count += 1
+                else:
+                    flush_copy()
+                    copy_start, copy_count = matched, 1
+                pos += block_size
+                literal_start = pos
+                if pos + block_size > n:
+                    break
+                a, b = _weak_checksum(target[pos:pos + block_size])
+                continue
+
+            if pos + block_size >= n:
+                break
+            # 窗口右移一个字节
+            old, new = target[pos], target[pos + block_size]
+            a = (a - old + new) % _MOD
+            b = (b - block_size * old + a) % _MOD
+            pos += 1
+
+    emit_data(target[literal_start:])
+    flush_copy()
+    return b''.join(out)
+
+
+def read_header(delta: bytes) -> dict:
+    """解析差异头部。"""
+    magic, block_size, basis_md5, target_md5, target_size = HEADER.unpack_from(delta, 0)
+    if magic != MAGIC:
+        raise ValueError('无效的差异数据')
+    return {
+        'block_size': block_size,
+        'basis_md5': basis_md5.hex(),
+        'target_md5': target_md5.hex(),
+        'target_size': target_size
+    }
+
+
+def apply_delta(basis: bytes, delta: bytes) -> bytes:
+    """把差异应用到 basis 上，校验旧文件和结果的 md5。"""
+    header = read_header(delta)
+    if hashlib.md5(basis).hexdigest() != header['basis_md5']:
+        raise ValueError('旧文件与差异不匹配')
+
+    block_size = header['block_size']
+    parts = []
+    pos = HEADER.size
+    while pos < len(delta):
+        op = delta[pos:pos + 1]
+        if op == b'C':
+            _, start, count = COPY.unpack_from(delta, pos)
+            parts.append(basis[start * block_size:(start + count) * block_size])
+            pos += COPY.size
+        elif op == b'D':
+            _, length = DATA.unpack_from(delta, pos)
+            pos += DATA.size
+            parts.append(delta[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError(f'未知的差异指令: {op!r}')
+
+    result = b''.join(parts)
+    if len(result) != header['target_size'] or hashlib.md5(result).hexdigest() != header['target_md5']:
+        raise ValueError('差异应用结果校验失败')
+    return result
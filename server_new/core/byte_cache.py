@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按字节数限制容量的 LRU 缓存
+用于更新包、文件内容和预先构造好的更新内容，超出容量时淘汰最久未使用的条目
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class ByteLRUCache:
+    """线程安全的 LRU 缓存，容量按值的字节数计算。"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> bytes | None:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: bytes) -> None:
+        """放入缓存；单个值超过总容量时不缓存。"""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], bytes | None]) -> bytes | None:
+        """命中时直接返回，否则调用 loader 加载并缓存（loader 返回 None 时不缓存）。"""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """删除所有 predicate(key) 为真的条目，返回删除数量。"""
+        with self._lock:
+            keys = [key for key in self._items if predicate(key)]
+            for key in keys:
+                self._size -= len(self._items.pop(key))
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._items),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
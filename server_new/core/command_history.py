@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+批量命令结果分组与历史存储
+相同的（返回码, stdout, stderr）只保存一份，节点只记录结果哈希
+"""
+
+import difflib
+import gzip
+import hashlib
+import json
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+
+def result_fingerprint(result: dict[str, Any] | None) -> str:
+    """计算命令结果指纹：返回码 + stdout + stderr（无响应时使用 message）。"""
+    if not result:
+        key = ['no_response']
+    elif 'return_code' in result or 'stdout' in result or 'stderr' in result:
+        key = [result.get('return_code'), result.get('stdout', ''), result.get('stderr', '')]
+    else:
+        key = [result.get('status'), result.get('message', '')]
+    raw = json.dumps(key, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+class ResultGrouper:
+    """按结果指纹增量归并节点结果。"""
+
+    def __init__(self) -> None:
+        self.outputs: dict[str, dict[str, Any]] = {}   # {指纹: 结果}
+        self.nodes: dict[str, str] = {}                # {ip: 指纹}
+        self._lock = threading.Lock()
+
+    def add(self, ip: str, result: dict[str, Any] | None) -> str:
+        fp = result_fingerprint(result)
+        with self._lock:
+            if fp not in self.outputs:
+                r = result or {'status': 'error', 'message': '无响应'}
+                self.outputs[fp] = {
+                    'status': r.get('status'),
+                    'message': r.get('message', ''),
+                    'return_code': r.get('return_code'),
+                    'stdout': r.get('stdout', ''),
+                    'stderr': r.get('stderr', '')
+                }
+            self.nodes[ip] = fp
+        return fp
+
+    def clusters(self) -> list[dict[str, Any]]:
+        """返回按节点数降序排列的结果簇。"""
+        with self._lock:
+            members: dict[str, list[str]] = {}
+            for ip, fp in self.nodes.items():
+                members.setdefault(fp, []).append(ip)
+            clusters = [
+                {'fingerprint': fp, 'count': len(ips), 'ips': sorted(ips), 'result': self.outputs[fp]}
+                for fp, ips in members.items()
+            ]
+        clusters.sort(key=lambda c: (-c['count'], c['fingerprint']))
+        return clusters
+
+    def diff(self, base_fp: str, other_fp: str, context: int = 2) -> str:
+        """生成两个结果簇之间的统一 diff（stdout 和 stderr 分别比较）。"""
+        base = self.outputs.get(base_fp, {})
+        other = self.outputs.get(other_fp, {})
+        lines: list[str] = []
+        if base.get('return_code') != other.get('return_code'):
+            lines.append(f"返回码: {base.get('return_code')} -> {other.get('return_code')}\n")
+        for key in ('stdout', 'stderr'):
+            # 无输出的错误结果用 message 参与 stdout 比较
+            a = base.get(key) or (base.get('message', '') if key == 'stdout' else '')
+            b = other.get(key) or (other.get('message', '') if key == 'stdout' else '')
+            lines.extend(difflib.unified_diff(
+                a.splitlines(keepends=True), b.splitlines(keepends=True),
+                fromfile=f'{key}@{base_fp}', tofile=f'{key}@{other_fp}', n=context
+            ))
+        return ''.join(line if line.endswith('\n') else line + '\n' for line in lines)
+
+
+class CommandHistory:
+    """批量命令历史 —— 每次执行保存为一个 gzip 压缩的 JSON 文件。"""
+
+    def __init__(self, history_dir: str | Path | None = None,
+                 keep_runs: int = 500) -> None:
+        if history_dir:
+            self.history_dir = Path(history_dir)
+        else:
+            self.history_dir = Path(__file__).parent.parent / 'command_results'
+        self.history_dir.mkdir(parents=True, exist_ok=True)
+        self.keep_runs = keep_runs
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_run_id() -> str:
+        return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+    def save_run(self, run_id: str, command: str, grouper: ResultGrouper,
+                 started: float, finished: float | None = None) -> Path:
+        record = {
+            'run_id': run_id,
+            'command': command,
+            'started': started,
+            'finished': finished or time.time(),
+            'outputs': grouper.outputs,
+            'nodes': grouper.nodes
+        }
+        path = self.history_dir / f'{run_id}.json.gz'
+        with self._lock:
+            with gzip.open(path, 'wt', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+            self._cleanup()
+        return path
+
+    def _cleanup(self) -> None:
+        runs = sorted(self.history_dir.glob('*.json.gz'), reverse=True)
+        for old in runs[self.keep_runs:]:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+
+    def load_run(self, run_id: str) -> dict[str, Any] | None:
+        path = self.history_dir / f'{run_id}.json.gz'
+        if not path.exists():
+            return None
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def list_runs(self, limit: int = 50) -> list[dict[str, Any]]:
+        runs = []
+        for path in sorted(self.history_dir.glob('*.json.gz'), reverse=True)[:limit]:
+            record = self.load_run(path.name[:-len('.json.gz')])
+            if record:
+                runs.append({
+                    'run_id': record['run_id'],
+                    'command': record['command'],
+                    'started': record['started'],
+                    'node_count': len(record['nodes']),
+                    'distinct_outputs': len(record['outputs'])
+                })
+        return runs
+
+    def search(self, text: str, limit: int = 50) -> list[dict[str, Any]]:
+        """在命令和输出中搜索文本，返回匹配的（执行, 结果簇, 节点）列表。"""
+        matches: list[dict[str, Any]] = []
+        for path in sorted(self.history_dir.glob('*.json.gz'), reverse=True):
+            record = self.load_run(path.name[:-len('.json.gz')])
+            if not record:
+                continue
+            command_hit = text in record['command']
+            for fp, output in record['outputs'].items():
+                haystack = f"{output.get('stdout', '')}\n{output.get('stderr', '')}\n{output.get('message', '')}"
+                if command_hit or text in haystack:
+                    ips = sorted(ip for ip, h in record['nodes'].items() if h == fp)
+                    matches.append({
+                        'run_id': record['run_id'],
+                        'command': record['command'],
+                        'started': record['started'],
+                        'fingerprint': fp,
+                        'return_code': output.get('return_code'),
+                        'ips': ips
+                    })
+                    if len(matches) >= limit:
+                        return matches
+        return matches
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+自适应压缩策略
+备份、全量更新包和目录同步的数据按文件选择压缩方式：
+
+    - 扩展名属于已压缩的格式（图片、音视频、压缩包、jar 等）时直接存储
+    - 否则从文件开头、中间、结尾各取一段样本做一次快速压缩探测，
+      压缩率达不到 STORE_RATIO 时直接存储
+    - 样本压缩率不高于档位的 lzma_ratio 时用 LZMA（压缩率高、耗 CPU），其余用 deflate；
+      小于 LZMA_MIN_SIZE 的文件 LZMA 初始化的开销比压缩本身还大，一律用 deflate
+
+档位（fast / balanced / max）决定 deflate 级别和使用 LZMA 的门槛，服务端按
+节点分组选择档位（见 config.json 的 compression 段）。CompressionStats 统计
+各压缩方式的文件数、压缩前后字节数和 CPU 时间，用于比较节省的字节与花费的 CPU。
+客户端 core/compression.py 与本模块保持一致。
+"""
+
+import lzma
+import os
+import threading
+import time
+import zipfile
+import zlib
+from pathlib import Path
+from typing import Any
+
+STORE = 'store'
+DEFLATE = 'deflate'
+LZMA = 'lzma'
+
+ZIP_METHODS = {STORE: zipfile.ZIP_STORED, DEFLATE: zipfile.ZIP_DEFLATED, LZMA: zipfile.ZIP_LZMA}
+
+COMPRESSION_PROFILES: dict[str, dict[str, Any]] = {
+    'fast': {'deflate_level': 1, 'lzma_ratio': 0.0},       # CPU 紧张的节点：只用快速 deflate
+    'balanced': {'deflate_level': 6, 'lzma_ratio': 0.2},   # 文本类等高度可压缩的内容用 LZMA
+    'max': {'deflate_level': 9, 'lzma_ratio': 0.6},        # 带宽紧张时尽量压缩
+}
+DEFAULT_PROFILE = 'balanced'
+
+STORE_RATIO = 0.9            # 样本压缩后仍超过原大小的该比例时直接存储
+SAMPLE_SIZE = 64 * 1024      # 每段样本的大小
+LZMA_MIN_SIZE = 64 * 1024    # 小于该大小的内容不用 LZMA
+READ_SIZE = 1024 * 1024
+
+# 已压缩的格式，再压缩几乎没有收益
+INCOMPRESSIBLE_EXTENSIONS = frozenset({
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.lzma', '.7z', '.rar', '.zst', '.lz4',
+    '.jar', '.war', '.ear', '.whl', '.egg', '.apk', '.cab', '.msi',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.ico', '.heic',
+    '.mp3', '.mp4', '.m4a', '.aac', '.ogg', '.flac', '.avi', '.mkv', '.mov', '.webm',
+    '.woff', '.woff2', '.pdf', '.docx', '.xlsx', '.pptx', '.odt',
+})
+
+
+def read_sample(path: str | Path) -> bytes:
+    """读取文件开头、中间、结尾各 SAMPLE_SIZE 字节（小文件读取全部内容）。"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if size <= SAMPLE_SIZE * 3:
+            return f.read()
+        parts = []
+        for offset in (0, (size - SAMPLE_SIZE) // 2, size - SAMPLE_SIZE):
+            f.seek(offset)
+            parts.append(f.read(SAMPLE_SIZE))
+        return b''.join(parts)
+
+
+def probe_ratio(sample: bytes) -> float:
+    """样本以最快的 deflate 级别压缩后的大小与原大小之比。"""
+    if not sample:
+        return 1.0
+    return len(zlib.compress(sample, 1)) / len(sample)
+
+
+class CompressionPolicy:
+    """按档位为每个文件选择压缩方式，返回 (方式, 级别)。"""
+
+    def __init__(self, profile: str = DEFAULT_PROFILE) -> None:
+        self.profile = profile if profile in COMPRESSION_PROFILES else DEFAULT_PROFILE
+        settings = COMPRESSION_PROFILES[self.profile]
+        self.deflate_level: int = settings['deflate_level']
+        self.lzma_ratio: float = settings['lzma_ratio']
+
+    def choose(self, name: str, sample: bytes) -> tuple[str, int]:
+        if Path(name).suffix.lower() in INCOMPRESSIBLE_EXTENSIONS:
+            return STORE, 0
+        ratio = probe_ratio(sample)
+        if ratio >= STORE_RATIO:
+            return STORE, 0
+        if ratio <= self.lzma_ratio and len(sample) >= LZMA_MIN_SIZE:
+            return LZMA, 0
+        return DEFLATE, self.deflate_level
+
+    def choose_file(self, path: str | Path) -> tuple[str, int]:
+        if Path(path).suffix.lower() in INCOMPRESSIBLE_EXTENSIONS:
+            return STORE, 0
+        return self.choose(str(path), read_sample(path))
+
+
+class _StoreCompressor:
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b''
+
+
+def compressor(method: str, level: int) -> Any:
+    """流式压缩对象（compress / flush），与客户端 decompressor 对应。"""
+    if method == LZMA:
+        return lzma.LZMACompressor()
+    if method == DEFLATE:
+        return zlib.compressobj(level)
+    return _StoreCompressor()
+
+
+class CompressionStats:
+    """按压缩方式累计文件数、压缩前后字节数和 CPU 时间（线程安全）。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.methods: dict[str, dict[str, float]] = {}
+
+    def add(self, method: str, bytes_in: int, bytes_out: int, cpu_seconds: float) -> None:
+        with self._lock:
+            item = self.methods.setdefault(method, {'files': 0, 'bytes_in': 0, 'bytes_out': 0,
+                                                    'cpu_seconds': 0.0})
+            item['files'] += 1
+            item['bytes_in'] += bytes_in
+            item['bytes_out'] += bytes_out
+            item['cpu_seconds'] += cpu_seconds
+
+    def report(self) -> dict[str, Any]:
+        with self._lock:
+            methods = {name: dict(item, cpu_seconds=round(item['cpu_seconds'], 3))
+                       for name, item in self.methods.items()}
+        bytes_in = sum(item['bytes_in'] for item in methods.values())
+        bytes_out = sum(item['bytes_out'] for item in methods.values())
+        cpu = sum(item['cpu_seconds'] for item in methods.values())
+        return {
+            'files': sum(item['files'] for item in methods.values()),
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'saved': bytes_in - bytes_out,
+            'cpu_seconds': round(cpu, 3),
+            'methods': methods
+        }
+
+    def summary(self) -> str:
+        return format_report(self.report())
+
+
+def format_report(report: dict[str, Any]) -> str:
+    """把 CompressionStats.report() 的结果格式化为一行说明。"""
+    bytes_in = report.get('bytes_in', 0)
+    saved = report.get('saved', 0)
+    cpu = report.get('cpu_seconds', 0.0)
+    methods = '，'.join(f"{name} {item['files']} 个"
+                       for name, item in sorted(report.get('methods', {}).items()))
+    text = (f"{bytes_in} → {report.get('bytes_out', 0)} 字节，"
+            f"节省 {saved / bytes_in if bytes_in else 0:.1%}（{methods or '无文件'}），CPU {cpu:.2f} 秒")
+    if cpu > 0:
+        text += f"，每 CPU 秒节省 {saved / cpu / 1024 / 1024:.1f} MB"
+    return text
+
+
+def write_zip_entry(zipf: zipfile.ZipFile, policy: CompressionPolicy, stats: CompressionStats,
+                    arcname: str, path: str | Path | None = None, data: bytes | None = None) -> None:
+    """按策略把文件 path（或内存中的 data）写入 zip，并记录压缩统计。"""
+    if path is not None:
+        method, level = policy.choose_file(path)
+    else:
+        method, level = policy.choose(arcname, data[:SAMPLE_SIZE * 3])
+    started = time.thread_time()
+    if path is not None:
+        zipf.write(path, arcname, compress_type=ZIP_METHODS[method],
+                   compresslevel=level if method == DEFLATE else None)
+    else:
+        zipf.writestr(arcname, data, compress_type=ZIP_METHODS[method],
+                      compresslevel=level if method == DEFLATE else None)
+    info = zipf.infolist()[-1]
+    stats.add(method, info.file_size, info.compress_size, time.thread_time() - started)
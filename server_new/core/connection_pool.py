@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+服务端到客户端的连接池
+命令、批量命令等请求/应答型的请求复用到同一节点的 TCP 连接，省去每次的建连开销：
+
+    - 新连接先发送 keep_alive 消息，客户端确认后连接在应答之后保留，放回池中；
+      旧版客户端不认识该消息，该节点在 KEEP_ALIVE_RETRY 秒内改用一次性连接
+    - 每个节点同时使用的连接数不超过 max_per_node，超出的请求最多等待请求的超时
+      时间，仍没有名额时抛出 PoolExhaustedError
+    - 取出空闲连接前做健康检查（对端已关闭或有多余数据的连接直接丢弃），
+      空闲超过 idle_timeout 的连接由后台线程回收；idle_timeout 短于客户端的空闲
+      超时，避免复用客户端正要关闭的连接
+    - 复用的连接在发送请求时已断开（请求未送达）时，换一个新连接重发一次；请求
+      发出后才断开的，只有只读请求（idempotent=True）重发，其余抛出
+      RequestInterruptedError，避免同一命令在节点上执行两次
+    - 一次性连接（节点不支持长连接，即旧版客户端）上请求发出后对端未应答即正常
+      关闭的，抛出 UnsupportedRequestError：旧版客户端不认识的消息直接关闭连接
+    - 应答为繁忙（busy）的连接已被客户端关闭，不放回池中
+    - 连接开启 TCP keepalive 并缩短探测时间，对端宕机或断网时尽快发现
+
+文件传输、流式命令等一次性的连接可以通过 checkout 取走一个空闲连接（省去建连），
+用完由调用方关闭，不再放回池中。
+
+指定 health（core/node_health.py）时，熔断中的节点直接失败，不再建立连接；
+建连耗时和成败反馈给 health，连接超时按节点实测的 RTT 调整。请求的成败以应答为准：
+连接建立后请求超时或断开同样记为失败，能连接但不应答的节点也会熔断。
+"""
+
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from shared.protocol import (
+    CLIENT_LISTEN_PORT,
+    CONNECT_TIMEOUT,
+    KEEP_ALIVE_RETRY,
+    POOL_IDLE_TIMEOUT,
+    POOL_MAX_PER_NODE,
+    STATUS_BUSY,
+    TCP_KEEPCNT,
+    TCP_KEEPIDLE,
+    TCP_KEEPINTVL,
+    MsgType,
+    recv_json,
+    send_json,
+)
+from .node_health import NodeHealth
+
+IDLE_MARGIN = 5      # 按客户端空闲超时回收时预留的余量（秒）
+
+
+class PoolExhaustedError(socket.timeout):
+    """等待节点的连接名额超时（节点的命令连接都在使用中）。"""
+
+
+class RequestInterruptedError(OSError):
+    """请求已在复用的连接上发出，但连接在应答前断开；节点可能已执行该请求，不自动重发。"""
+
+
+class UnsupportedRequestError(ConnectionError):
+    """旧版客户端（不支持长连接）收到请求后未应答即关闭连接，即不认识该消息，请求未执行。"""
+
+
+def configure_keepalive(sock: socket.socket, idle: int = TCP_KEEPIDLE,
+                        interval: int = TCP_KEEPINTVL, count: int = TCP_KEEPCNT) -> None:
+    """开启 TCP keepalive 并设置探测参数（平台不支持的选项跳过）。"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'SIO_KEEPALIVE_VALS'):
+        # Windows：只能设置空闲时间和探测间隔（毫秒），探测次数由系统决定
+        sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+        return
+    options = (('TCP_KEEPIDLE', idle), ('TCP_KEEPALIVE', idle),   # macOS 上空闲时间的选项名为 TCP_KEEPALIVE
+               ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count))
+    for name, value in options:
+        if hasattr(socket, name):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+            except OSError:
+                pass
+
+
+def is_stale(sock: socket.socket) -> bool:
+    """空闲连接是否已不可用：对端已关闭（读到 EOF）或收到了不该有的数据。
+
+    以非阻塞方式窥探一个字节，不受 select 的文件描述符上限（1024）限制。
+    """
+    timeout = sock.gettimeout()
+    try:
+        sock.setblocking(False)
+        try:
+            sock.recv(1, socket.MSG_PEEK)
+        finally:
+            sock.settimeout(timeout)
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class PooledConnection:
+    """池中的一个连接。keep_alive 为 False 的是一次性连接，用完即关闭。"""
+
+    def __init__(self, sock: socket.socket, keep_alive: bool, idle_limit: float = 0.0) -> None:
+        self.sock = sock
+        self.keep_alive = keep_alive
+        self.idle_limit = idle_limit
+        self.returned_at = 0.0
+        self.uses = 0
+
+    def close(self) -> None:
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class _NodeConnections:
+    def __init__(self) -> None:
+        self.idle: list[PooledConnection] = []
+        self.active = 0
+        self.unsupported_until = 0.0
+
+
+class ConnectionPool:
+    """按节点管理可复用的命令连接，见模块说明。"""
+
+    def __init__(self, port: int = CLIENT_LISTEN_PORT, max_per_node: int = POOL_MAX_PER_NODE,
+                 idle_timeout: float = POOL_IDLE_TIMEOUT, connect_timeout: float = CONNECT_TIMEOUT,
+                 keepalive_idle: int = TCP_KEEPIDLE, keepalive_interval: int = TCP_KEEPINTVL,
+                 keepalive_count: int = TCP_KEEPCNT, health: NodeHealth | None = None,
+                 log_callback: Callable[[str], None] | None = None) -> None:
+        self.port = port
+        self.max_per_node = max(1, max_per_node)
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.keepalive = (keepalive_idle, keepalive_interval, keepalive_count)
+        self.health = health
+        self.log_callback = log_callback
+        self._cond = threading.Condition()
+        self._nodes: dict[str, _NodeConnections] = {}
+        self._metrics = {'created': 0, 'reused': 0, 'retried': 0, 'waited': 0,
+                         'evicted_idle': 0, 'evicted_stale': 0, 'discarded': 0, 'unsupported': 0}
+        self._janitor: threading.Thread | None = None
+        self._closed = False
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any], health: NodeHealth | None = None,
+                    log_callback: Callable[[str], None] | None = None) -> 'ConnectionPool':
+        """按 config.json 的 connection_pool 段创建（时间单位为秒）。"""
+        return cls(
+            max_per_node=config.get('max_per_node', POOL_MAX_PER_NODE),
+            idle_timeout=config.get('idle_timeout', POOL_IDLE_TIMEOUT),
+            keepalive_idle=config.get('keepalive_idle', TCP_KEEPIDLE),
+            keepalive_interval=config.get('keepalive_interval', TCP_KEEPINTVL),
+            keepalive_count=config.get('keepalive_count', TCP_KEEPCNT),
+            health=health,
+            log_callback=log_callback
+        )
+
+    def _log(self, message: str) -> None:
+        if self.log_callback:
+            self.log_callback(message)
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._cond:
+            self._metrics[name] += n
+
+    # ── 请求/应答 ──────────────────────────────────────
+
+    def request(self, ip: str, message: dict[str, Any], timeout: float,
+                idempotent: bool = False, timing: list[float] | None = None) -> dict[str, Any]:
+        """在到节点的连接上发送一个请求并等待应答。
+
+        idempotent 为 True（只读请求）时，复用的连接在请求发出后断开也换新连接
+        重发。指定 timing 时填入 [发送时间, 收到应答时间]（time.time()），不含等待
+        名额、建连和 keep_alive 协商的时间。连接、超时等错误按 socket 异常抛出，
+        由调用方处理；等待连接名额超时抛出 PoolExhaustedError，节点熔断中时抛出
+        NodeUnavailableError。
+        """
+        if self.health:
+            self.health.allow(ip)
+        with self._slot(ip, timeout):
+            conn, reused = self._acquire(ip)
+            sent = [False]
+            try:
+                response = self._exchange(conn, message, timeout, sent, timing)
+            except OSError as e:
+                self._discard(conn)
+                # recv_json 在对端正常关闭时抛出的就是 ConnectionError 本身，连接重置为其子类
+                if sent[0] and not conn.keep_alive and type(e) is ConnectionError:
+                    raise UnsupportedRequestError(f'节点不支持该请求: {e}') from e
+                # 复用的连接可能刚被对端关闭：请求未送达时换新连接重发一次；
+                # 已发出的只有只读请求重发；超时不重发
+                if not reused or isinstance(e, socket.timeout):
+                    self._request_failed(ip, e)
+                    raise
+                if sent[0] and not idempotent:
+                    self._request_failed(ip, e)
+                    raise RequestInterruptedError(f'请求已发出，连接在应答前断开: {e}') from e
+                self._count('retried')
+                conn = self._open(ip)
+                try:
+                    response = self._exchange(conn, message, timeout, timing=timing)
+                except Exception as retry_error:
+                    self._discard(conn)
+                    if isinstance(retry_error, OSError):
+                        self._request_failed(ip, retry_error)
+                    raise
+            except Exception:
+                self._discard(conn)
+                raise
+            if response.get('status') == STATUS_BUSY:
+                # 客户端回复繁忙后关闭连接
+                self._discard(conn)
+            else:
+                self._release(ip, conn)
+            if self.health:
+                self.health.record_success(ip)
+            return response
+
+    def _request_failed(self, ip: str, error: OSError) -> None:
+        """连接建立后请求超时或断开，计入节点的连续失败。"""
+        if self.health:
+            reason = '请求超时' if isinstance(error, socket.timeout) else f'请求失败: {error}'
+            self.health.record_failure(ip, reason)
+
+    @staticmethod
+    def _exchange(conn: PooledConnection, message: dict[str, Any], timeout: float,
+                  sent: list[bool] | None = None, timing: list[float] | None = None) -> dict[str, Any]:
+        started = time.time()
+        send_json(conn.sock, message)
+        if sent is not None:
+            sent[0] = True
+        response = recv_json(conn.sock, timeout=timeout)
+        if timing is not None:
+            timing[:] = [started, time.time()]
+        conn.uses += 1
+        return response
+
+    @contextmanager
+    def _slot(self, ip: str, wait: float) -> Iterator[None]:
+        """占用节点的一个连接名额，已满时最多等待 wait 秒，仍没有名额时抛出 PoolExhaustedError。"""
+        deadline = time.monotonic() + wait
+        with self._cond:
+            node = self._nodes.setdefault(ip, _NodeConnections())
+            if node.active >= self.max_per_node:
+                self._metrics['waited'] += 1
+                while node.active >= self.max_per_node:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhaustedError(f'节点 {ip} 的命令连接数已达上限 {self.max_per_node}')
+                    self._cond.wait(remaining)
+            node.active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                node.active -= 1
+                self._cond.notify_all()
+
+    def _take_idle(self, ip: str) -> PooledConnection | None:
+        """取出一个健康的空闲连接（后放回的优先），没有时返回 None。"""
+        now = time.monotonic()
+        with self._cond:
+            node = self._nodes.setdefault(ip, _NodeConnections())
+            while node.idle:
+                conn = node.idle.pop()
+                if now - conn.returned_at > conn.idle_limit:
+                    self._metrics['evicted_idle'] += 1
+                elif is_stale(conn.sock):
+                    self._metrics['evicted_stale'] += 1
+                else:
+                    self._metrics['reused'] += 1
+                    return conn
+                conn.close()
+        return None
+
+    def _acquire(self, ip: str) -> tuple[PooledConnection, bool]:
+        conn = self._take_idle(ip)
+        if conn:
+            return conn, True
+        return self._open(ip), False
+
+    def _timeout(self, ip: str) -> float:
+        return self.health.connect_timeout(ip) if self.health else self.connect_timeout
+
+    def _connect(self, ip: str, for_request: bool = False) -> socket.socket:
+        """建立连接。for_request 为 True 时建连成功只记录 RTT，成败由请求的应答决定。"""
+        started = time.monotonic()
+        try:
+            sock = socket.create_connection((ip, self.port), timeout=self._timeout(ip))
+        except OSError as e:
+            if self.health:
+                self.health.record_failure(ip, f'连接失败: {e}')
+            raise
+        if self.health:
+            if for_request:
+                self.health.record_connect(ip, time.monotonic() - started)
+            else:
+                self.health.record_success(ip, time.monotonic() - started)
+        # 自适应超时只用于建连，之后的等待（就绪应答等）仍按 connect_timeout
+        sock.settimeout(self.connect_timeout)
+        try:
+            configure_keepalive(sock, *self.keepalive)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+        self._count('created')
+        return sock
+
+    def _open(self, ip: str) -> PooledConnection:
+        """建立新连接；节点支持时协商为长连接，否则返回一次性连接。"""
+        with self._cond:
+            node = self._nodes.setdefault(ip, _NodeConnections())
+            keep_alive = time.monotonic() >= node.unsupported_until
+        sock = self._connect(ip, for_request=True)
+        if not keep_alive:
+            return PooledConnection(sock, keep_alive=False)
+        try:
+            send_json(sock, {'type': MsgType.KEEP_ALIVE, 'idle_timeout': self.idle_timeout})
+            ack = recv_json(sock, timeout=self._timeout(ip))
+        except ConnectionError:
+            # 旧版客户端不认识 keep_alive 消息，直接关闭连接
+            ack = {}
+        except OSError as e:
+            sock.close()
+            self._request_failed(ip, e)
+            raise
+        if ack.get('keep_alive'):
+            client_idle = ack.get('idle_timeout', self.idle_timeout + IDLE_MARGIN)
+            idle_limit = max(1.0, min(self.idle_timeout, client_idle - IDLE_MARGIN))
+            return PooledConnection(sock, keep_alive=True, idle_limit=idle_limit)
+        sock.close()
+        if ack.get('status') != STATUS_BUSY:
+            with self._cond:
+                node.unsupported_until = time.monotonic() + KEEP_ALIVE_RETRY
+                self._metrics['unsupported'] += 1
+            self._log(f"节点 {ip} 不支持长连接，{KEEP_ALIVE_RETRY} 秒内使用一次性连接")
+        return PooledConnection(self._connect(ip, for_request=True), keep_alive=False)
+
+    def _release(self, ip: str, conn: PooledConnection) -> None:
+        """用完的连接：长连接放回池中，一次性连接关闭。"""
+        if not conn.keep_alive:
+            conn.close()
+            return
+        with self._cond:
+            if not self._closed:
+                conn.returned_at = time.monotonic()
+                self._nodes.setdefault(ip, _NodeConnections()).idle.append(conn)
+                self._start_janitor()
+                return
+        conn.close()
+
+    def _discard(self, conn: PooledConnection) -> None:
+        self._count('discarded')
+        conn.close()
+
+    # ── 一次性使用 ──────────────────────────────────────
+
+    def checkout(self, ip: str) -> socket.socket:
+        """取走一个连接独占使用（文件传输、流式命令等），用完由调用方关闭。
+
+        有空闲的长连接时直接使用（客户端处理完这类请求后关闭连接），否则新建连接。
+        """
+        if self.health:
+            self.health.allow(ip)
+        conn = self._take_idle(ip)
+        if conn:
+            conn.sock.settimeout(self.connect_timeout)
+            return conn.sock
+        return self._connect(ip)
+
+    # ── 回收与统计 ──────────────────────────────────────
+
+    def _start_janitor(self) -> None:
+        if self._janitor is None:
+            self._janitor = threading.Thread(target=self._janitor_loop, name='pool-janitor', daemon=True)
+            self._janitor.start()
+
+    def _janitor_loop(self) -> None:
+        interval = max(1.0, min(5.0, self.idle_timeout / 2))
+        while True:
+            time.sleep(interval)
+            with self._cond:
+                if self._closed:
+                    return
+            self.evict_idle()
+
+    def evict_idle(self) -> int:
+        """关闭空闲超时和已失效的连接，返回关闭的数量。"""
+        now = time.monotonic()
+        evicted = []
+        with self._cond:
+            for node in self._nodes.values():
+                keep = []
+                for conn in node.idle:
+                    if now - conn.returned_at > conn.idle_limit:
+                        self._metrics['evicted_idle'] += 1
+                        evicted.append(conn)
+                    elif is_stale(conn.sock):
+                        self._metrics['evicted_stale'] += 1
+                        evicted.append(conn)
+                    else:
+                        keep.append(conn)
+                node.idle = keep
+        for conn in evicted:
+            conn.close()
+        return len(evicted)
+
+    def close_node(self, ip: str) -> None:
+        """关闭到节点的全部空闲连接（节点离线、重启时）。"""
+        with self._cond:
+            node = self._nodes.get(ip)
+            if not node:
+                return
+            idle, node.idle = node.idle, []
+        for conn in idle:
+            conn.close()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle = [conn for node in self._nodes.values() for conn in node.idle]
+            for node in self._nodes.values():
+                node.idle = []
+        for conn in idle:
+            conn.close()
+
+    def get_stats(self) -> dict[str, Any]:
+        """连接池统计：累计计数和当前各节点的空闲/使用中连接数。"""
+        now = time.monotonic()
+        with self._cond:
+            nodes = {ip: {'idle': len(node.idle), 'active': node.active,
+                          'keep_alive': now >= node.unsupported_until}
+                     for ip, node in self._nodes.items()}
+            metrics = dict(self._metrics)
+        metrics['idle'] = sum(node['idle'] for node in nodes.values())
+        metrics['active'] = sum(node['active'] for node in nodes.values())
+        requests = metrics['created'] + metrics['reused']
+        metrics['reuse_rate'] = round(metrics['reused'] / requests, 3) if requests else 0.0
+        return {'max_per_node': self.max_per_node, 'idle_timeout': self.idle_timeout,
+                'totals': metrics, 'nodes': nodes}
+
+    def node_summary(self, ip: str) -> str:
+        """节点连接状态的一行说明。"""
+        stats = self.get_stats()
+        node = stats['nodes'].get(ip)
+        if not node:
+            return '无连接'
+        totals = stats['totals']
+        mode = '长连接' if node['keep_alive'] else '一次性连接（客户端不支持长连接）'
+        return (f"{mode}，空闲 {node['idle']}，使用中 {node['active']}/{self.max_per_node}；"
+                f"全部节点：新建 {totals['created']}，复用 {totals['reused']}"
+                f"（{totals['reuse_rate']:.0%}），回收 {totals['evicted_idle'] + totals['evicted_stale']}")
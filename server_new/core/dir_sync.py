@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+目录同步（类似 rsync）
+服务端按文件清单比较本地目录和节点上的副本（客户端 Transfer Files/<remote_dir>），
+只发送新增或变化的文件，并删除节点上多余的文件。客户端 TaskExecutor.sync_directory
+实现接收端，两边需保持一致。
+
+协议：
+    服务端 → 客户端  请求 JSON（type=dir_sync，remote_dir、hash）
+    客户端 → 服务端  'ready'
+    服务端 → 客户端  每个文件：一行 JSON {path, size, hash, codec}，随后是压缩数据帧
+                     （4 字节大端长度 + 数据），长度为 0 的帧表示该文件结束；
+                     codec 为 store / deflate / lzma，按 core/compression.py 的策略逐个文件选择
+    服务端 → 客户端  一行 JSON {end: true, delete: [相对路径]}
+    客户端 → 服务端  结果 JSON {status, written, deleted, errors}
+"""
+
+import json
+import struct
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+from shared.protocol import MANIFEST_HASHES
+from .compression import CompressionStats, compressor
+
+FRAME_HEADER = struct.Struct('>I')
+END_FRAME = FRAME_HEADER.pack(0)
+READ_SIZE = 1024 * 1024
+
+
+def file_hash(path: Path, hash_name: str) -> str:
+    hasher = MANIFEST_HASHES[hash_name]()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def scan_directory(root: Path, hash_name: str) -> dict[str, dict[str, Any]]:
+    """返回目录下所有文件 {相对路径（/ 分隔）: {'hash', 'size'}}。"""
+    files: dict[str, dict[str, Any]] = {}
+    for path in sorted(root.rglob('*')):
+        if not path.is_file():
+            continue
+        rel_path = path.relative_to(root).as_posix()
+        files[rel_path] = {'hash': file_hash(path, hash_name), 'size': path.stat().st_size}
+    return files
+
+
+def diff_manifest(local: dict[str, dict[str, Any]], remote: dict[str, str],
+                  delete: bool = True) -> tuple[list[str], list[str]]:
+    """比较本地目录和节点的文件清单，返回 (需要发送的文件, 需要删除的文件)。"""
+    changed = [path for path, info in local.items() if remote.get(path) != info['hash']]
+    deleted = sorted(path for path in remote if path not in local) if delete else []
+    return changed, deleted
+
+
+def iter_frames(path: Path, method: str, level: int,
+                stats: CompressionStats | None = None) -> Iterator[bytes]:
+    """逐块读取并压缩文件，产出数据帧，最后是结束帧；stats 不为空时记录压缩统计。"""
+    stream = compressor(method, level)
+    size = 0
+    sent = 0
+    cpu = 0.0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            started = time.thread_time()
+            data = stream.compress(chunk)
+            cpu += time.thread_time() - started
+            if data:
+                sent += len(data)
+                yield FRAME_HEADER.pack(len(data)) + data
+    started = time.thread_time()
+    data = stream.flush()
+    cpu += time.thread_time() - started
+    if data:
+        sent += len(data)
+        yield FRAME_HEADER.pack(len(data)) + data
+    if stats is not None:
+        stats.add(method, size, sent, cpu)
+    yield END_FRAME
+
+
+def entry_line(rel_path: str, info: dict[str, Any], codec: str) -> bytes:
+    return (json.dumps({'path': rel_path, 'size': info['size'], 'hash': info['hash'],
+                        'codec': codec}) + '\n').encode('utf-8')
+
+
+def end_line(deleted: list[str]) -> bytes:
+    return (json.dumps({'end': True, 'delete': deleted}) + '\n').encode('utf-8')
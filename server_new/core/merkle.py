@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+文件清单的目录级 Merkle 哈希
+每个目录的哈希由其直接子项（文件哈希、子目录哈希）按名称排序后计算，
+根目录（键为空字符串）的哈希相同即两边文件完全一致。
+
+计算方式（客户端 core/merkle.py 按同一方式计算，两边需保持一致）：
+    blake2b(digest_size=16) 依次输入每个子项的 "<f|d> <名称> <哈希>\n"
+"""
+
+import hashlib
+
+
+def dir_hashes(files: dict[str, str]) -> dict[str, str]:
+    """由 {相对路径: 文件哈希} 计算 {目录路径: 目录哈希}，根目录为 ''。"""
+    children: dict[str, dict[str, tuple[str, str]]] = {'': {}}
+    for path, digest in files.items():
+        parts = path.split('/')
+        for depth in range(len(parts) - 1):
+            parent = '/'.join(parts[:depth])
+            children.setdefault(parent, {}).setdefault(parts[depth], ('d', ''))
+            children.setdefault('/'.join(parts[:depth + 1]), {})
+        children.setdefault('/'.join(parts[:-1]), {})[parts[-1]] = ('f', digest)
+
+    hashes: dict[str, str] = {}
+    # 由深到浅计算，子目录先于父目录
+    for directory in sorted(children, key=lambda d: d.count('/') + bool(d), reverse=True):
+        h = hashlib.blake2b(digest_size=16)
+        for name in sorted(children[directory]):
+            kind, value = children[directory][name]
+            if kind == 'd':
+                value = hashes[f'{directory}/{name}' if directory else name]
+            h.update(f'{kind} {name} {value}\n'.encode('utf-8'))
+        hashes[directory] = h.hexdigest()
+    return hashes
+
+
+def parent_dir(path: str) -> str:
+    return path.rpartition('/')[0]
@@ -5,22 +5,71 @@ import socket
 import threading
 import json
 import os
+import time
+import uuid
 from pathlib import Path
 from typing import Any, Callable
 
 from shared.protocol import (
+    BANDWIDTH_SAMPLE_MIN,
     CLIENT_LISTEN_PORT,
     STREAM_BUFFER_SIZE,
     FILE_BUFFER_SIZE,
+    LARGE_BUFFER_SIZE,
     CONNECT_TIMEOUT,
     COMMAND_TIMEOUT,
     FILE_TRANSFER_TIMEOUT,
+    DIR_SYNC_CACHE_FILE_MAX,
+    MANIFEST_HASH,
+    RELAY_CHUNK_SIZE,
+    RELAY_SEEDS,
+    RELAY_FANOUT,
+    TRANSFER_CHUNK_SIZE,
+    TRANSFER_RETRIES,
+    TRANSFER_RETRY_DELAY,
+    PARALLEL_MIN_SIZE,
+    PARALLEL_INITIAL_STREAMS,
+    PARALLEL_MAX_STREAMS,
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    READ_ONLY_COMMANDS,
+    STATUS_BUSY,
     MsgType,
+    JsonLineReader,
     recv_json,
     send_json,
     broadcast,
+    fan_out,
 )
+from .byte_cache import ByteLRUCache
+from .connection_pool import ConnectionPool, PoolExhaustedError, RequestInterruptedError, UnsupportedRequestError
+from .compression import DEFAULT_PROFILE, CompressionPolicy, CompressionStats, format_report
+from .dir_sync import end_line, entry_line, iter_frames
+from .node_health import NodeHealth, NodeUnavailableError
 from .node_manager import NodeManager
+from .node_metrics import NodeMetrics, ntp_sample
+from .relay import (
+    RelayFanout,
+    RelaySource,
+    build_relay_header,
+    build_relay_tree,
+    iter_chunks,
+    tree_depth,
+)
+from .transfer import (
+    ChunkReceiver,
+    StreamController,
+    TransferSource,
+    cleanup_partials,
+    ReceiverBusyError,
+    read_ready,
+    receiving_part,
+    send_chunks,
+    send_ready,
+    source_sha256,
+    split_ranges,
+)
+from .transfer_scheduler import EGRESS, INGRESS, TransferScheduler
 
 
 class NetworkManager:
@@ -28,7 +77,12 @@ class NetworkManager:
 
     def __init__(self, command_port: int, monitor_port: int,
                  node_manager: NodeManager,
-                 log_callback: Callable[[str], None]) -> None:
+                 log_callback: Callable[[str], None],
+                 transfer_dir: str | Path | None = None,
+                 scheduler: TransferScheduler | None = None,
+                 compression: dict[str, Any] | None = None,
+                 connection_pool: ConnectionPool | None = None,
+                 node_metrics: NodeMetrics | None = None) -> None:
         self.command_port = command_port
         self.monitor_port = monitor_port
         self.node_manager = node_manager
@@ -38,6 +92,29 @@ class NetworkManager:
         self.running = False
         self.pending_backups = {}  # 存储待处理的备份文件
         self.backup_lock = threading.Lock()  # 备份文件访问锁
+        # 可续传传输中接收到一半的文件
+        self.transfer_dir = Path(transfer_dir) if transfer_dir else Path(__file__).resolve().parent.parent / 'transfers'
+        # 各节点的 RTT、时钟偏差和带宽（心跳、ping 和带宽探测测得），用于超时和传输排序
+        self.node_metrics = node_metrics or NodeMetrics()
+        # 大流量传输（文件、更新包、备份）的并发和限速，命令、心跳等控制流量不经过调度器
+        self.scheduler = scheduler or TransferScheduler(group_of=node_manager.get_node_group,
+                                                        estimate_of=self.node_metrics.estimate_seconds,
+                                                        log_callback=log_callback)
+        # 压缩档位（config.json 的 compression 段）：默认档位和按分组指定的档位
+        compression = compression or {}
+        self.compression_profile_default: str = compression.get('default_profile', DEFAULT_PROFILE)
+        self.compression_group_profiles: dict[str, str] = dict(compression.get('group_profiles', {}))
+        # 到各节点的可复用连接：命令、批量命令复用长连接，传输优先取用空闲连接；
+        # 连接经过节点熔断（node_health），已知不可用的节点直接失败
+        self.connection_pool = connection_pool or ConnectionPool(
+            health=NodeHealth(node_manager, log_callback=log_callback, metrics=self.node_metrics),
+            log_callback=log_callback)
+        self.node_health = self.connection_pool.health
+    
+    def compression_profile(self, ip: str) -> str:
+        """节点使用的压缩档位：所在分组指定了档位时用分组的，否则用默认档位"""
+        group = self.node_manager.get_node_group(ip)
+        return self.compression_group_profiles.get(group, self.compression_profile_default)
     
     def start(self) -> None:
         self.running = True
@@ -45,6 +122,12 @@ class NetworkManager:
         threading.Thread(target=self._listen_commands, daemon=True).start()
         # 启动监控端口监听
         threading.Thread(target=self._listen_monitor, daemon=True).start()
+        # 后台探测熔断中的节点
+        if self.node_health:
+            self.node_health.start()
+        # 后台测量带宽已过期的节点
+        if self.node_metrics.probe_interval > 0:
+            threading.Thread(target=self._bandwidth_probe_loop, daemon=True).start()
     
     def _listen_commands(self) -> None:
         self.command_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -80,17 +163,27 @@ class NetworkManager:
         msg = None
         try:
             msg = recv_json(conn, timeout=CONNECT_TIMEOUT)
+            received_at = time.time()
 
             if msg.get('type') == MsgType.REGISTER:
                 self.node_manager.add_node(addr[0], msg.get('os'), msg.get('info'))
-                send_json(conn, {'status': 'ok'})
+                send_json(conn, {
+                    'status': 'ok',
+                    'heartbeat_interval': self.node_manager.get_heartbeat_interval()
+                })
             elif msg.get('type') == MsgType.HEARTBEAT:
                 self.node_manager.update_heartbeat(
                     addr[0],
                     msg.get('os'),
                     msg.get('info')
                 )
-                send_json(conn, {'status': 'ok'})
+                self._record_heartbeat_link(addr[0], msg.get('link'))
+                send_json(conn, {
+                    'status': 'ok',
+                    'heartbeat_interval': self.node_manager.get_heartbeat_interval(),
+                    'server_recv': received_at,
+                    'server_send': time.time()
+                })
             elif msg.get('type') == MsgType.TASK_RESULT:
                 self.log_callback(f"节点 {addr[0]} 任务执行结果: {msg.get('result')}")
             elif msg.get('type') == MsgType.BACKUP_FILE:
@@ -109,6 +202,14 @@ class NetworkManager:
             elif not msg:
                 conn.close()
     
+    def _record_heartbeat_link(self, ip: str, link: Any) -> None:
+        """记录心跳带回的上一次心跳往返 [t0, t1, t2, t3]（客户端为请求方）"""
+        if not (isinstance(link, list) and len(link) == 4
+                and all(isinstance(t, (int, float)) for t in link)):
+            return
+        rtt, server_minus_node = ntp_sample(*link)
+        self.node_metrics.record_exchange(ip, rtt, -server_minus_node)
+    
     def _receive_backup_file(self, conn: socket.socket, addr: tuple[str, int],
                               msg: dict[str, Any]) -> None:
         """接收备份文件"""
@@ -117,35 +218,47 @@ class NetworkManager:
             file_size = msg.get('file_size', 0)
             
             self.log_callback(f"开始接收节点 {addr[0]} 的备份文件，大小: {file_size} 字节")
+            if msg.get('compression'):
+                self.log_callback(f"节点 {addr[0]} 的备份压缩: {format_report(msg['compression'])}")
             
             # 优化TCP性能：设置接收缓冲区大小和禁用Nagle算法
             conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)  # 1MB接收缓冲区
             conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # 禁用Nagle算法
             
-            # 发送准备就绪
-            conn.send('ready'.encode('utf-8'))
-            
-            # 接收文件数据
-            file_data = b''
-            received = 0
-            conn.settimeout(FILE_TRANSFER_TIMEOUT)
-            last_log_percent = 0
-            while received < file_size:
-                chunk = conn.recv(min(FILE_BUFFER_SIZE, file_size - received))
-                if not chunk:
-                    break
-                file_data += chunk
-                received += len(chunk)
-                # 减少日志记录频率：每10%记录一次，避免频繁日志影响性能
-                current_percent = received * 100 // file_size if file_size > 0 else 0
-                if current_percent >= last_log_percent + 10 or received == file_size:
-                    self.log_callback(f"已接收 {received}/{file_size} 字节 ({current_percent}%)")
-                    last_log_percent = current_percent
+            # 客户端等待就绪的超时很短，备份不排队，只受入站限速约束
+            with self.scheduler.transfer(addr[0], INGRESS, PRIORITY_BULK,
+                                         f"{addr[0]} 备份", queue=False) as transfer:
+                if msg.get('sha256'):
+                    # 新版客户端：逐块校验、可续传
+                    self._receive_backup_chunked(conn, addr, msg, transfer.throttle)
+                    return
+
+                # 发送准备就绪
+                conn.send('ready'.encode('utf-8'))
+
+                # 接收文件数据
+                file_data = b''
+                received = 0
+                conn.settimeout(FILE_TRANSFER_TIMEOUT)
+                last_log_percent = 0
+                while received < file_size:
+                    chunk = conn.recv(min(FILE_BUFFER_SIZE, file_size - received))
+                    if not chunk:
+                        break
+                    file_data += chunk
+                    received += len(chunk)
+                    transfer.throttle(len(chunk))
+                    # 减少日志记录频率：每10%记录一次，避免频繁日志影响性能
+                    current_percent = received * 100 // file_size if file_size > 0 else 0
+                    if current_percent >= last_log_percent + 10 or received == file_size:
+                        self.log_callback(f"已接收 {received}/{file_size} 字节 ({current_percent}%)")
+                        last_log_percent = current_percent
             
             if received != file_size:
-                self.log_callback(f"警告：节点 {addr[0]} 的备份文件接收不完整，期望: {file_size} 字节，实际: {received} 字节")
-            else:
-                self.log_callback(f"成功接收节点 {addr[0]} 的备份文件，大小: {file_size} 字节")
+                self.log_callback(f"节点 {addr[0]} 的备份文件接收不完整，期望: {file_size} 字节，实际: {received} 字节")
+                send_json(conn, {'status': 'error', 'message': f'备份文件接收不完整: {received}/{file_size} 字节'})
+                return
+            self.log_callback(f"成功接收节点 {addr[0]} 的备份文件，大小: {file_size} 字节")
             
             # 将备份数据存储，等待GUI处理
             with self.backup_lock:
@@ -171,6 +284,63 @@ class NetworkManager:
         finally:
             conn.close()
     
+    def _receive_backup_chunked(self, conn: socket.socket, addr: tuple[str, int],
+                                msg: dict[str, Any], throttle: Callable[[int], None]) -> None:
+        """逐块校验接收备份文件；连接中断后客户端重发同一文件时从断点继续
+
+        每收到一块调用 throttle(字节数)，由调度器按入站限速控制接收节奏。
+        """
+        partial_dir = self.transfer_dir / 'backups'
+        cleanup_partials(partial_dir)
+        file_size = msg.get('file_size', 0)
+        # 同一节点同时重发同一备份时各用各的部分文件，完成的文件在释放前移走
+        with receiving_part(partial_dir, f"{addr[0]}-{msg['sha256']}", msg.get('transfer_id')) as part_path:
+            receiver = ChunkReceiver(part_path, file_size, msg.get('chunk_size', TRANSFER_CHUNK_SIZE), msg['sha256'])
+            offset = receiver.prepare()
+            if offset:
+                self.log_callback(f"节点 {addr[0]} 的备份文件从 {offset}/{file_size} 字节处续传")
+            send_ready(conn, offset)
+            conn.settimeout(FILE_TRANSFER_TIMEOUT)
+
+            last_log_percent = [0]
+            position = [offset]
+
+            def progress(received: int) -> None:
+                throttle(received - position[0])
+                position[0] = received
+                percent = received * 100 // file_size if file_size else 100
+                if percent >= last_log_percent[0] + 10 or received == file_size:
+                    self.log_callback(f"已接收 {received}/{file_size} 字节 ({percent}%)")
+                    last_log_percent[0] = percent
+
+            reader = conn.makefile('rb')
+            try:
+                error = receiver.receive(reader, progress)
+            except OSError as e:
+                error = {'status': 'error', 'message': f'传输中断: {e}', 'resumable': True, 'offset': receiver.offset}
+            finally:
+                reader.close()
+            if error:
+                self.log_callback(f"节点 {addr[0]} 的备份文件接收失败: {error['message']}")
+                send_json(conn, error)
+                return
+
+            backup_path = receiver.part_path.with_suffix('.zip')
+            os.replace(receiver.part_path, backup_path)
+        self.log_callback(f"成功接收节点 {addr[0]} 的备份文件，大小: {file_size} 字节")
+        with self.backup_lock:
+            previous = self.pending_backups.get(addr[0])
+            if previous and previous.get('path') and previous['path'] != str(backup_path):
+                Path(previous['path']).unlink(missing_ok=True)
+            self.pending_backups[addr[0]] = {
+                'path': str(backup_path),
+                'folder_name': msg.get('folder_name', 'backup'),
+                'size': file_size,
+                'received': file_size,
+                'compression': msg.get('compression')
+            }
+        send_json(conn, {'status': 'success', 'message': '备份文件已接收'})
+
     def _handle_monitor(self, conn: socket.socket, addr: tuple[str, int]) -> None:
         try:
             msg = recv_json(conn, timeout=CONNECT_TIMEOUT)
@@ -198,23 +368,27 @@ class NetworkManager:
                       params: dict[str, Any] | None = None) -> dict[str, Any] | None:
         """向指定节点发送命令"""
         try:
-            self.log_callback(f"尝试连接节点 {target_ip}:{CLIENT_LISTEN_PORT} 发送命令: {command}")
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(CONNECT_TIMEOUT)
-            sock.connect((target_ip, CLIENT_LISTEN_PORT))
-            self.log_callback(f"已连接到节点 {target_ip}:{CLIENT_LISTEN_PORT}")
-
-            send_json(sock, {
+            self.log_callback(f"向节点 {target_ip}:{CLIENT_LISTEN_PORT} 发送命令: {command}")
+            response = self.connection_pool.request(target_ip, {
                 'type': MsgType.COMMAND,
                 'command': command,
                 'params': params or {}
-            })
-            self.log_callback(f"命令已发送到节点 {target_ip}")
-
-            response = recv_json(sock, timeout=COMMAND_TIMEOUT)
-            self.log_callback(f"收到节点 {target_ip} 的响应: {response}")
-            sock.close()
+            }, COMMAND_TIMEOUT, idempotent=command in READ_ONLY_COMMANDS)
+            if response.get('status') == STATUS_BUSY:
+                self.log_callback(f"节点 {target_ip} 繁忙，命令 {command} 被拒绝 "
+                                  f"(处理中: {response.get('active')}, 排队: {response.get('queued')})")
+            else:
+                self.log_callback(f"收到节点 {target_ip} 的响应: {response}")
             return response
+        except NodeUnavailableError as e:
+            self.log_callback(f"节点 {target_ip} 不可用，跳过命令 {command}: {e}")
+            return {'status': 'error', 'message': f'节点不可用: {e}'}
+        except PoolExhaustedError as e:
+            self.log_callback(f"等待命令连接超时，命令 {command} 未发送: {e}")
+            return {'status': 'error', 'message': f'命令连接繁忙: {e}'}
+        except RequestInterruptedError as e:
+            self.log_callback(f"节点 {target_ip} 的命令 {command} 未收到响应，可能已执行: {e}")
+            return None
         except socket.timeout:
             self.log_callback(f"连接节点 {target_ip}:{CLIENT_LISTEN_PORT} 超时")
             return None
@@ -228,74 +402,286 @@ class NetworkManager:
             self.log_callback(f"发送命令到 {target_ip}:{CLIENT_LISTEN_PORT} 失败: {e}")
             return None
     
-    def send_file(self, target_ip: str, file_path: str,
-                   remote_path: str) -> dict[str, Any] | None:
-        """向指定节点发送文件（支持任意类型）"""
-        sock = None
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
-            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    def _send_resumable(self, target_ip: str, request: dict[str, Any], source: TransferSource,
+                        legacy_send: Callable[[socket.socket], None],
+                        response_timeout: float = COMMAND_TIMEOUT,
+                        on_progress: Callable[[int], None] | None = None,
+                        priority: int = PRIORITY_BULK, rate_limit: int = 0) -> dict[str, Any]:
+        """可续传发送
+
+        request 需带 file_size、chunk_size、sha256（分段请求另带 start/end）。接收方
+        就绪后报告已有的位置，从该位置起逐块发送；传输中断或块校验失败时重新连接
+        并从断点继续，最多 TRANSFER_RETRIES 次。接收方为旧版本时调用 legacy_send 整体发送。
+        发送经由传输调度器：按 priority 排队等待名额，并按各项限速发送；rate_limit
+        大于 0 时另按该速率（字节/秒）限速。
+        """
+        file_size = request['file_size']
+        # 重试时不变，接收方据此找到本次传输专用的部分文件（同一内容并发接收时）
+        request = dict(request, transfer_id=uuid.uuid4().hex)
+        last_log_percent = [0]
 
-            file_size = os.path.getsize(file_path) if Path(file_path).is_file() else 0
-            timeout = max(60, min(FILE_TRANSFER_TIMEOUT, 60 + (file_size // (1024 * 1024))))
-            sock.settimeout(timeout)
+        def log_progress(position: int) -> None:
+            percent = position * 100 // file_size if file_size else 100
+            if percent >= last_log_percent[0] + 5 or position == file_size:
+                self.log_callback(f"已发送 {position}/{file_size} 字节 ({percent}%)")
+                last_log_percent[0] = percent
 
-            sock.connect((target_ip, CLIENT_LISTEN_PORT))
+        progress = on_progress or log_progress
+
+        result: dict[str, Any] = {'status': 'error', 'message': '未发送'}
+        # 整个续传过程占用一个传输名额，重试之间不让出
+        with self.scheduler.transfer(target_ip, EGRESS, priority,
+                                     f"{request['type']} → {target_ip}",
+                                     nbytes=request.get('end', file_size) - request.get('start', 0),
+                                     rate_limit=rate_limit) as transfer:
+            for attempt in range(TRANSFER_RETRIES + 1):
+                if attempt:
+                    self.log_callback(f"{target_ip}: {result.get('message')}，{TRANSFER_RETRY_DELAY} 秒后续传"
+                                      f"（第 {attempt}/{TRANSFER_RETRIES} 次）")
+                    time.sleep(TRANSFER_RETRY_DELAY)
+                started = False
+                sock = None
+                try:
+                    sock = transfer.wrap(self.connection_pool.checkout(target_ip))
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    send_json(sock, request)
+                    offset = read_ready(sock)
+                    started = True
+                    # 停滞超时按实测带宽估算，链路中断时尽快续传
+                    sock.settimeout(self.node_metrics.stall_timeout(target_ip))
+                    if offset is None:
+                        legacy_send(sock)
+                        return recv_json(sock, timeout=response_timeout)
+                    if offset >= request.get('end', file_size):
+                        # 接收方已有全部数据（内容缓存或分段传输已完成），只等待校验结果
+                        self.log_callback(f"{target_ip}: 节点已有全部数据，跳过发送")
+                    elif offset > request.get('start', 0):
+                        self.log_callback(f"{target_ip}: 从 {offset}/{file_size} 字节处续传")
+                    sending_started = time.monotonic()
+                    send_chunks(sock, source, offset, request['chunk_size'], progress, request.get('end'))
+                    sent = request.get('end', file_size) - offset
+                    # 分段传输各连接只占节点带宽的一部分，由 _send_ranges 按整体记录
+                    if 'end' not in request and sent >= BANDWIDTH_SAMPLE_MIN:
+                        self.node_metrics.record_bandwidth(target_ip, sent, time.monotonic() - sending_started)
+                    result = recv_json(sock, timeout=response_timeout)
+                    if not result.get('resumable'):
+                        return result
+                except OSError as e:
+                    # 连接建立前失败（节点离线、拒绝连接）不重试
+                    if not started:
+                        raise
+                    result = {'status': 'error', 'message': f'传输中断: {e}', 'resumable': True}
+                finally:
+                    if sock:
+                        try:
+                            sock.close()
+                        except Exception:
+                            pass
+        return result
 
+    def _send_ranges(self, target_ip: str, request: dict[str, Any], source: TransferSource,
+                     max_streams: int = PARALLEL_MAX_STREAMS,
+                     priority: int = PRIORITY_BULK) -> bool:
+        """把文件分段，通过多个并行连接发送到节点的预分配文件中
+
+        连接数从 PARALLEL_INITIAL_STREAMS 开始，按实测吞吐量自动增减（不超过
+        max_streams，每个连接各占一个传输名额）。每段各自可续传。全部分段发送成功时返回 True；对端不支持
+        分段传输或有分段失败时返回 False，由调用方按顺序传输补齐。
+        """
+        file_size = request['file_size']
+        chunk_size = request['chunk_size']
+        pending = split_ranges(file_size, chunk_size, max_streams)
+        controller = StreamController(PARALLEL_INITIAL_STREAMS, max_streams)
+        lock = threading.Lock()
+        state = {'active': 0, 'sent': 0, 'failed': None, 'logged': 0}
+        started = time.time()
+
+        def unsupported(sock: socket.socket) -> None:
+            raise ConnectionError('节点不支持分段传输')
+
+        def send_one(start: int, end: int) -> None:
+            sent = [start]
+
+            def progress(position: int) -> None:
+                with lock:
+                    state['sent'] += position - sent[0]
+                    percent = state['sent'] * 100 // file_size
+                    if percent >= state['logged'] + 5:
+                        state['logged'] = percent
+                        self.log_callback(f"已发送 {state['sent']}/{file_size} 字节 ({percent}%)，"
+                                          f"{controller.target} 个连接")
+                controller.record(position - sent[0])
+                sent[0] = position
+
+            range_request = {
+                'type': MsgType.RANGE_PUT,
+                'sha256': request['sha256'],
+                'file_size': file_size,
+                'chunk_size': chunk_size,
+                'start': start,
+                'end': end
+            }
+            return self._send_resumable(target_ip, range_request, source, unsupported,
+                                        on_progress=progress, priority=priority)
+
+        def worker() -> None:
+            while True:
+                with lock:
+                    if state['failed'] or not pending or state['active'] > controller.target:
+                        state['active'] -= 1
+                        return
+                    start, end = pending.pop(0)
+                try:
+                    result = send_one(start, end)
+                except Exception as e:
+                    result = {'status': 'error', 'message': str(e)}
+                if result.get('status') != 'success':
+                    with lock:
+                        state['failed'] = result.get('message', '分段传输失败')
+
+        threads: list[threading.Thread] = []
+        while True:
+            with lock:
+                if state['failed'] or (not pending and state['active'] == 0):
+                    break
+                spawn = pending and state['active'] < controller.target
+                if spawn:
+                    state['active'] += 1
+            if spawn:
+                thread = threading.Thread(target=worker, daemon=True)
+                thread.start()
+                threads.append(thread)
+            else:
+                time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+
+        elapsed = max(time.time() - started, 1e-6)
+        if state['failed']:
+            self.log_callback(f"{target_ip}: 分段并行传输未完成（{state['failed']}），改为顺序传输")
+            return False
+        if state['sent'] >= BANDWIDTH_SAMPLE_MIN:
+            self.node_metrics.record_bandwidth(target_ip, state['sent'], elapsed)
+        self.log_callback(f"{target_ip}: 分段并行传输完成，{file_size / elapsed / 1024 / 1024:.1f} MB/s，"
+                          f"连接数变化: {[n for n, _ in controller.history]}")
+        return True
+
+    def send_file(self, target_ip: str, file_path: str,
+                   remote_path: str, digest: str | None = None,
+                   parallel: bool = False,
+                   priority: int = PRIORITY_INTERACTIVE) -> dict[str, Any] | None:
+        """向指定节点发送文件（支持任意类型），中断后自动续传
+
+        digest 为文件的 sha256，向多个节点发送同一文件时由调用方预先计算。
+        parallel 为 True 且文件不小于 PARALLEL_MIN_SIZE 时先分段并行发送，
+        全部分段完成时随后的顺序传输只做整体校验；有分段失败时顺序传输从头发送
+        整个文件，已收到的分段留在节点上，再次分段发送同一文件时按块记录续传。
+        priority 为传输调度的优先级，批量分发时为 PRIORITY_BULK。
+        """
+        try:
             path = Path(file_path)
             if not path.is_file():
                 self.log_callback(f"错误：{file_path} 不是文件")
-                sock.close()
                 return {'status': 'error', 'message': '选择的路径不是文件'}
 
-            send_json(sock, {
+            file_size = os.path.getsize(file_path)
+            request = {
                 'type': MsgType.FILE_UPDATE,
                 'update_type': 'single_file',
                 'remote_path': remote_path,
                 'file_size': file_size,
-                'is_zip': False
-            })
+                'is_zip': False,
+                'chunk_size': TRANSFER_CHUNK_SIZE,
+                'sha256': digest or source_sha256(file_path)
+            }
 
-            sock.settimeout(CONNECT_TIMEOUT)
-            ack = sock.recv(1024).decode('utf-8')
-            if ack == 'ready':
-                sent = 0
-                last_log_percent = 0
+            def legacy_send(sock: socket.socket) -> None:
                 with open(file_path, 'rb') as f:
-                    while sent < file_size:
+                    while True:
                         data = f.read(FILE_BUFFER_SIZE)
                         if not data:
                             break
                         sock.sendall(data)
-                        sent += len(data)
-                        current_percent = sent * 100 // file_size
-                        if current_percent >= last_log_percent + 5 or sent == file_size:
-                            self.log_callback(f"已发送 {sent}/{file_size} 字节 ({current_percent}%)")
-                            last_log_percent = current_percent
-
-            response = recv_json(sock, timeout=COMMAND_TIMEOUT)
-            sock.close()
-            return response
+
+            if parallel and file_size >= PARALLEL_MIN_SIZE:
+                self._send_ranges(target_ip, request, file_path, priority=priority)
+            return self._send_resumable(target_ip, request, file_path, legacy_send, priority=priority)
         except socket.timeout:
             self.log_callback(f"发送文件到 {target_ip} 超时")
-            if sock:
-                try:
-                    sock.close()
-                except Exception:
-                    pass
             return {'status': 'error', 'message': '文件传输超时'}
         except Exception as e:
             self.log_callback(f"发送文件到 {target_ip} 失败: {e}")
             import traceback
             self.log_callback(f"错误详情: {traceback.format_exc()}")
-            if sock:
-                try:
-                    sock.close()
-                except Exception:
-                    pass
             return {'status': 'error', 'message': str(e)}
     
+    def send_batch(self, target_ip: str,
+                   commands: list[tuple[str, dict[str, Any] | None]],
+                   parallel: bool = False,
+                   stop_on_error: bool = False) -> list[dict[str, Any] | None]:
+        """在一次往返中向节点发送多条命令。
+
+        commands 为 [(command, params)] 列表，返回与之一一对应的结果列表，
+        无响应的位置为 None。parallel=True 时客户端并发执行各命令（命令之间
+        须互不依赖）。旧版客户端不支持 batch 时自动退回逐条发送；支持 batch 的
+        节点在执行中断开时，只有全部为只读命令才逐条重发。
+        """
+        if not commands:
+            return []
+        names = ', '.join(command for command, _ in commands)
+        try:
+            self.log_callback(f"向节点 {target_ip}:{CLIENT_LISTEN_PORT} 发送批量命令: {names}")
+            # 顺序执行时总耗时随命令数增长
+            timeout = COMMAND_TIMEOUT if parallel else COMMAND_TIMEOUT * len(commands)
+            response = self.connection_pool.request(target_ip, {
+                'type': MsgType.BATCH,
+                'commands': [{'command': command, 'params': params or {}} for command, params in commands],
+                'parallel': parallel,
+                'stop_on_error': stop_on_error
+            }, timeout, idempotent=all(command in READ_ONLY_COMMANDS for command, _ in commands))
+        except NodeUnavailableError as e:
+            self.log_callback(f"节点 {target_ip} 不可用，跳过批量命令: {e}")
+            return [{'status': 'error', 'message': f'节点不可用: {e}'}] * len(commands)
+        except PoolExhaustedError as e:
+            self.log_callback(f"等待命令连接超时，批量命令未发送: {e}")
+            return [{'status': 'error', 'message': f'命令连接繁忙: {e}'}] * len(commands)
+        except RequestInterruptedError as e:
+            # 连接在应答前断开，命令可能已执行，不逐条重发
+            self.log_callback(f"节点 {target_ip} 的批量命令未收到响应，可能已执行: {e}")
+            return [None] * len(commands)
+        except socket.timeout:
+            self.log_callback(f"节点 {target_ip} 批量命令超时")
+            return [None] * len(commands)
+        except ConnectionRefusedError:
+            self.log_callback(f"节点 {target_ip}:{CLIENT_LISTEN_PORT} 拒绝连接，请检查客户端是否运行")
+            return [None] * len(commands)
+        except UnsupportedRequestError:
+            # 旧版客户端不认识 batch 消息，直接关闭连接
+            self.log_callback(f"节点 {target_ip} 不支持批量命令，逐条发送")
+            return [self.send_command(target_ip, command, params) for command, params in commands]
+        except ConnectionError as e:
+            # 支持批量命令的节点在执行中断开，命令可能已执行，只有只读命令逐条重发
+            if all(command in READ_ONLY_COMMANDS for command, _ in commands):
+                self.log_callback(f"节点 {target_ip} 的批量命令未收到响应，逐条重发: {e}")
+                return [self.send_command(target_ip, command, params) for command, params in commands]
+            self.log_callback(f"节点 {target_ip} 的批量命令未收到响应，可能已执行: {e}")
+            return [None] * len(commands)
+        except Exception as e:
+            self.log_callback(f"发送批量命令到 {target_ip}:{CLIENT_LISTEN_PORT} 失败: {e}")
+            return [None] * len(commands)
+
+        if response.get('status') == STATUS_BUSY:
+            self.log_callback(f"节点 {target_ip} 繁忙，批量命令被拒绝 "
+                              f"(处理中: {response.get('active')}, 排队: {response.get('queued')})")
+            return [response] * len(commands)
+
+        results = list(response.get('results') or [])
+        results += [None] * (len(commands) - len(results))
+        self.log_callback(f"收到节点 {target_ip} 的批量响应: {len(results)} 条, "
+                          f"耗时 {response.get('duration', 'N/A')}s")
+        return results[:len(commands)]
+
     def send_command_to_multiple(self, target_ips: list[str], command: str,
                                   params: dict[str, Any] | None = None) -> dict[str, Any]:
         """向多个节点发送命令（并发）"""
@@ -306,14 +692,120 @@ class NetworkManager:
         )
 
     def send_file_to_multiple(self, target_ips: list[str], file_path: str,
-                               remote_path: str) -> dict[str, Any]:
-        """向多个节点发送文件（并发）"""
-        return broadcast(
+                               remote_path: str, parallel: bool = False) -> dict[str, Any]:
+        """向多个节点发送文件（并发数由传输调度器控制）"""
+        digest = source_sha256(file_path) if Path(file_path).is_file() else None
+        return fan_out(
             target_ips,
-            lambda ip: self.send_file(ip, file_path, remote_path),
-            timeout=FILE_TRANSFER_TIMEOUT
+            lambda ip: self.send_file(ip, file_path, remote_path, digest, parallel, PRIORITY_BULK)
         )
 
+    def relay_to_multiple(self, target_ips: list[str], request: dict[str, Any],
+                          source: RelaySource, seeds: int = RELAY_SEEDS,
+                          fanout: int = RELAY_FANOUT,
+                          chunk_size: int = RELAY_CHUNK_SIZE) -> dict[str, Any]:
+        """以接力方式向多个节点分发同一份数据
+
+        服务端只向 seeds 个种子节点发送，每个节点逐块校验后转发给 fanout 个下游
+        节点。返回 {ip: 结果}，转发链路中断的节点记为失败，由调用方决定是否直连重发。
+        """
+        if not target_ips:
+            return {}
+        request = dict(request, type=MsgType.RELAY)
+        header = build_relay_header(source, chunk_size)
+        # 链路好的节点作为种子和上层转发节点
+        tree = build_relay_tree(self.node_metrics.order(target_ips), seeds, fanout)
+        self.log_callback(f"接力分发: {len(target_ips)} 个节点, {len(tree)} 个种子, "
+                          f"{tree_depth(tree)} 层, {header['file_size']} 字节")
+
+        # 服务端只向种子节点发送，占用一个传输名额，出站流量按种子连接数计入全局预算
+        with self.scheduler.transfer(None, EGRESS, PRIORITY_BULK,
+                                     f"接力分发 {len(target_ips)} 个节点") as transfer:
+            relay = RelayFanout(request, header, CLIENT_LISTEN_PORT, self.log_callback)
+            relay.connect(tree)
+            for chunk in iter_chunks(source, chunk_size):
+                transfer.throttle(len(chunk) * sum(1 for _, sock in relay.links if sock))
+                relay.forward(chunk)
+            results = relay.collect()
+        for ip in target_ips:
+            results.setdefault(ip, {'status': 'error', 'message': '未收到接力结果'})
+        return results
+
+    def send_file_relay(self, target_ips: list[str], file_path: str, remote_path: str,
+                        seeds: int = RELAY_SEEDS, fanout: int = RELAY_FANOUT) -> dict[str, Any]:
+        """以接力方式向多个节点发送文件"""
+        if not Path(file_path).is_file():
+            return {ip: {'status': 'error', 'message': '选择的路径不是文件'} for ip in target_ips}
+        request = {'purpose': 'file', 'remote_path': remote_path, 'is_zip': False}
+        return self.relay_to_multiple(target_ips, request, file_path, seeds, fanout)
+
+    def push_full_update_relay(self, target_ips: list[str], package: bytes, new_version: str,
+                               seeds: int = RELAY_SEEDS, fanout: int = RELAY_FANOUT) -> dict[str, Any]:
+        """以接力方式向多个客户端推送全量更新包"""
+        request = {'purpose': 'update', 'version': new_version}
+        return self.relay_to_multiple(target_ips, request, package, seeds, fanout)
+
+    def get_dir_manifest(self, target_ip: str, remote_dir: str) -> dict[str, Any] | None:
+        """获取节点上 Transfer Files/<remote_dir> 的文件清单"""
+        return self.send_command(target_ip, 'get_dir_manifest',
+                                 {'remote_dir': remote_dir, 'hash': MANIFEST_HASH})
+
+    def sync_directory(self, target_ip: str, root: Path, remote_dir: str,
+                       files: dict[str, dict[str, Any]], deleted: list[str],
+                       payload_cache: ByteLRUCache | None = None,
+                       priority: int = PRIORITY_BULK,
+                       stats: CompressionStats | None = None) -> dict[str, Any]:
+        """把本地目录 root 中的部分文件同步到节点（格式见 core/dir_sync.py）
+
+        files 为需要发送的文件 {相对路径: {'hash', 'size'}}，deleted 为节点上需要
+        删除的文件。文件按节点的压缩档位逐个选择压缩方式，压缩后流式发送；不超过
+        DIR_SYNC_CACHE_FILE_MAX 的文件压缩结果放入 payload_cache，向多个档位相同的
+        节点同步时只压缩一次。stats 不为空时记录压缩统计。
+        """
+        policy = CompressionPolicy(self.compression_profile(target_ip))
+        sock = None
+        try:
+            with self.scheduler.transfer(target_ip, EGRESS, priority,
+                                         f"目录同步 {remote_dir} → {target_ip}") as transfer:
+                sock = transfer.wrap(self.connection_pool.checkout(target_ip))
+                send_json(sock, {'type': MsgType.DIR_SYNC, 'remote_dir': remote_dir, 'hash': MANIFEST_HASH})
+                ack = sock.recv(1024).decode('utf-8')
+                if ack != 'ready':
+                    return {'status': 'error', 'message': f'客户端未准备就绪: {ack}'}
+
+                sock.settimeout(FILE_TRANSFER_TIMEOUT)
+                sent = 0
+                for rel_path, info in files.items():
+                    path = root / rel_path
+                    method, level = policy.choose_file(path)
+                    sock.sendall(entry_line(rel_path, info, method))
+                    if payload_cache is not None and info['size'] <= DIR_SYNC_CACHE_FILE_MAX:
+                        body = payload_cache.get_or_load(
+                            (str(path), info['hash'], method, level),
+                            lambda: b''.join(iter_frames(path, method, level, stats)))
+                        sock.sendall(body)
+                        sent += len(body)
+                    else:
+                        for frame in iter_frames(path, method, level, stats):
+                            sock.sendall(frame)
+                            sent += len(frame)
+                sock.sendall(end_line(deleted))
+                self.log_callback(f"{target_ip}: 目录同步已发送 {len(files)} 个文件（{policy.profile} 档，"
+                                  f"压缩后 {sent} 字节），删除 {len(deleted)} 个")
+                return recv_json(sock, timeout=COMMAND_TIMEOUT)
+        except socket.timeout:
+            return {'status': 'error', 'message': '目录同步超时'}
+        except ConnectionRefusedError:
+            return {'status': 'error', 'message': '客户端拒绝连接'}
+        except Exception as e:
+            return {'status': 'error', 'message': f'目录同步失败: {e}'}
+        finally:
+            if sock:
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+
     def execute_remote_command(self, target_ip: str, cmd: str,
                                 timeout: int = 30) -> dict[str, Any] | None:
         """在远程节点执行命令"""
@@ -324,10 +816,77 @@ class NetworkManager:
         """在多个远程节点执行命令（并发）"""
         return self.send_command_to_multiple(target_ips, 'execute_command', {'cmd': cmd, 'timeout': timeout})
     
+    def execute_remote_command_stream(self, target_ip: str, cmd: str,
+                                      on_output: Callable[[str, str], None],
+                                      cancel_event: threading.Event | None = None,
+                                      timeout: int = 300) -> dict[str, Any]:
+        """在远程节点流式执行命令。
+
+        输出块到达时调用 on_output(stream, text)；cancel_event 被置位时
+        向客户端发送取消帧。返回客户端的最终执行结果。
+        """
+        sock = None
+        cancel_sent = False
+        try:
+            sock = self.connection_pool.checkout(target_ip)
+            sock.settimeout(CONNECT_TIMEOUT)
+            send_json(sock, {
+                'type': MsgType.COMMAND,
+                'command': 'execute_command_stream',
+                'params': {'cmd': cmd, 'timeout': timeout}
+            })
+            self.log_callback(f"已在节点 {target_ip} 启动流式命令: {cmd}")
+
+            reader = JsonLineReader(sock)
+            # 客户端自身超时后还需要时间回传结束帧
+            deadline = time.time() + timeout + COMMAND_TIMEOUT
+            while True:
+                if cancel_event is not None and cancel_event.is_set() and not cancel_sent:
+                    sock.sendall((json.dumps({'type': MsgType.STREAM_CANCEL}) + '\n').encode('utf-8'))
+                    cancel_sent = True
+                if time.time() > deadline:
+                    return {'status': 'error', 'message': '等待命令结束超时', 'return_code': -1}
+
+                frame = reader.read(timeout=0.5)
+                if frame is None:
+                    continue
+                frame_type = frame.get('type')
+                if frame_type == MsgType.STREAM_OUTPUT:
+                    on_output(frame.get('stream', 'stdout'), frame.get('data', ''))
+                elif frame_type == MsgType.STREAM_END:
+                    return frame.get('result') or {'status': 'error', 'message': '结果为空'}
+                elif frame_type == MsgType.STREAM_START:
+                    continue
+                else:
+                    # 旧版客户端或错误（busy、命令为空等）直接返回普通响应
+                    return frame
+        except socket.timeout:
+            self.log_callback(f"连接节点 {target_ip}:{CLIENT_LISTEN_PORT} 超时")
+            return {'status': 'error', 'message': '连接超时', 'return_code': -1}
+        except ConnectionRefusedError:
+            return {'status': 'error', 'message': '客户端拒绝连接', 'return_code': -1}
+        except NodeUnavailableError as e:
+            return {'status': 'error', 'message': f'节点不可用: {e}', 'return_code': -1}
+        except ConnectionError:
+            return {'status': 'error', 'message': '连接中断，未收到结束帧', 'return_code': -1}
+        except Exception as e:
+            self.log_callback(f"流式命令 {target_ip} 失败: {e}")
+            return {'status': 'error', 'message': f'流式命令失败: {str(e)}', 'return_code': -1}
+        finally:
+            if sock:
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+
     def get_remote_system_info(self, target_ip: str) -> dict[str, Any] | None:
         """获取远程节点系统信息"""
         return self.send_command(target_ip, 'get_system_info', {})
 
+    def get_client_worker_stats(self, target_ip: str) -> dict[str, Any] | None:
+        """获取客户端命令工作池的队列和延迟统计"""
+        return self.send_command(target_ip, 'get_worker_stats', {})
+
     # ==================== 更新相关方法 ====================
 
     def check_client_version(self, target_ip: str) -> dict[str, Any] | None:
@@ -338,48 +897,110 @@ class NetworkManager:
         """获取客户端文件清单"""
         return self.send_command(target_ip, 'get_files_manifest', {})
 
+    def rollback_client_update(self, target_ip: str) -> dict[str, Any] | None:
+        """让客户端回滚（优先切回上一个暂存版本，否则用更新前的备份）并重启"""
+        return self.send_command(target_ip, 'rollback_update', {})
+
+    def activate_client_update(self, target_ip: str, version: str) -> dict[str, Any] | None:
+        """让客户端激活已预分发的版本并重启"""
+        return self.send_command(target_ip, 'activate_update', {'version': version})
+
+    def _send_throttled(self, sock: socket.socket, data: bytes, rate_limit: int) -> None:
+        """按 rate_limit（字节/秒）分块发送，用于后台预分发时不占满带宽"""
+        chunk_size = max(4096, min(LARGE_BUFFER_SIZE, rate_limit // 10))
+        started = time.time()
+        for offset in range(0, len(data), chunk_size):
+            sock.sendall(data[offset:offset + chunk_size])
+            ahead = (offset + chunk_size) / rate_limit - (time.time() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
     def push_update_to_client(self, target_ip: str, update_data: bytes | dict[str, Any],
-                               new_version: str, update_type: str = 'incremental') -> dict[str, Any]:
-        """推送更新到客户端"""
+                               new_version: str, update_type: str = 'incremental',
+                               rate_limit: int = 0, digest: str | None = None,
+                               priority: int = PRIORITY_BULK) -> dict[str, Any]:
+        """推送更新到客户端
+
+        增量更新的 update_data 为 {路径: 内容} 字典，或已序列化好的 JSON 字节
+        （多个节点共用同一更新内容时避免重复编码）。rate_limit 大于 0 时
+        按该速率（字节/秒）限速发送（在传输调度器的限速之外再单独限速）。
+        全量更新和预分发按块校验、可续传，digest 为更新数据的 sha256（向多个节点
+        推送时由调用方预先计算）。
+        """
+        if update_type in ('full', 'stage') and isinstance(update_data, bytes):
+            return self._push_resumable_update(target_ip, update_data, new_version, update_type,
+                                               digest, priority, rate_limit)
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(FILE_TRANSFER_TIMEOUT)
-            self.log_callback(f"尝试连接客户端 {target_ip}:{CLIENT_LISTEN_PORT} 推送更新...")
-            sock.connect((target_ip, CLIENT_LISTEN_PORT))
+            with self.scheduler.transfer(target_ip, EGRESS, priority,
+                                         f"更新 {new_version} → {target_ip}") as transfer:
+                self.log_callback(f"尝试连接客户端 {target_ip}:{CLIENT_LISTEN_PORT} 推送更新...")
+                sock = transfer.wrap(self.connection_pool.checkout(target_ip))
+                sock.settimeout(FILE_TRANSFER_TIMEOUT)
 
-            send_json(sock, {
-                'type': MsgType.UPDATE,
-                'version': new_version,
-                'update_type': update_type
-            })
-            self.log_callback(f"已发送更新请求到 {target_ip}")
+                send_json(sock, {
+                    'type': MsgType.UPDATE,
+                    'version': new_version,
+                    'update_type': update_type
+                })
+                self.log_callback(f"已发送更新请求到 {target_ip}")
 
-            sock.settimeout(COMMAND_TIMEOUT)
-            ack = sock.recv(1024).decode('utf-8')
-            if ack != 'ready':
-                sock.close()
-                return {'status': 'error', 'message': f'客户端未准备就绪: {ack}'}
+                sock.settimeout(COMMAND_TIMEOUT)
+                ack = sock.recv(1024).decode('utf-8')
+                if ack != 'ready':
+                    sock.close()
+                    return {'status': 'error', 'message': f'客户端未准备就绪: {ack}'}
 
-            self.log_callback(f"客户端 {target_ip} 已准备就绪，开始发送更新数据...")
+                self.log_callback(f"客户端 {target_ip} 已准备就绪，开始发送更新数据...")
 
-            if update_type == 'full':
-                sock.sendall(update_data)
-            else:
-                import base64
-                encoded_data = {}
-                for file_path, content in update_data.items():
-                    if isinstance(content, bytes):
-                        encoded_data[file_path] = base64.b64encode(content).decode('utf-8')
-                    else:
-                        encoded_data[file_path] = content
-                sock.sendall(json.dumps(encoded_data).encode('utf-8'))
+                if rate_limit > 0 and isinstance(update_data, bytes):
+                    self._send_throttled(sock, update_data, rate_limit)
+                elif update_type == 'full' or isinstance(update_data, bytes):
+                    sock.sendall(update_data)
+                else:
+                    import base64
+                    encoded_data = {}
+                    for file_path, content in update_data.items():
+                        if isinstance(content, bytes):
+                            encoded_data[file_path] = base64.b64encode(content).decode('utf-8')
+                        else:
+                            encoded_data[file_path] = content
+                    sock.sendall(json.dumps(encoded_data).encode('utf-8'))
+
+                self.log_callback(f"更新数据已发送到 {target_ip}，等待响应...")
+                sock.shutdown(socket.SHUT_WR)
 
-            self.log_callback(f"更新数据已发送到 {target_ip}，等待响应...")
+                response = recv_json(sock, timeout=60)
+                sock.close()
+                return response
+        except socket.timeout:
+            return {'status': 'error', 'message': '连接超时'}
+        except ConnectionRefusedError:
+            return {'status': 'error', 'message': '客户端拒绝连接'}
+        except Exception as e:
+            return {'status': 'error', 'message': f'推送更新失败: {str(e)}'}
+
+    def _push_resumable_update(self, target_ip: str, package: bytes, new_version: str,
+                               update_type: str, digest: str | None = None,
+                               priority: int = PRIORITY_BULK, rate_limit: int = 0) -> dict[str, Any]:
+        """以可续传方式推送全量更新包或预分发数据（旧版客户端整体接收）"""
+        request = {
+            'type': MsgType.UPDATE,
+            'version': new_version,
+            'update_type': update_type,
+            'file_size': len(package),
+            'chunk_size': TRANSFER_CHUNK_SIZE,
+            'sha256': digest or source_sha256(package)
+        }
+
+        def legacy_send(sock: socket.socket) -> None:
+            sock.sendall(package)
             sock.shutdown(socket.SHUT_WR)
 
-            response = recv_json(sock, timeout=60)
-            sock.close()
-            return response
+        try:
+            self.log_callback(f"尝试连接客户端 {target_ip}:{CLIENT_LISTEN_PORT} 推送"
+                              f"{'全量更新' if update_type == 'full' else '预分发'}...")
+            return self._send_resumable(target_ip, request, package, legacy_send, response_timeout=60,
+                                        priority=priority, rate_limit=rate_limit)
         except socket.timeout:
             return {'status': 'error', 'message': '连接超时'}
         except ConnectionRefusedError:
@@ -389,15 +1010,134 @@ class NetworkManager:
 
     def push_update_to_multiple(self, target_ips: list[str], update_data: bytes | dict[str, Any],
                                  new_version: str, update_type: str = 'incremental') -> dict[str, Any]:
-        """向多个客户端推送更新（并发）"""
-        return broadcast(
+        """向多个客户端推送更新（并发数由传输调度器控制）"""
+        digest = source_sha256(update_data) if update_type == 'full' and isinstance(update_data, bytes) else None
+        return fan_out(
             target_ips,
-            lambda ip: self.push_update_to_client(ip, update_data, new_version, update_type),
-            timeout=FILE_TRANSFER_TIMEOUT
+            lambda ip: self.push_update_to_client(ip, update_data, new_version, update_type, digest=digest)
         )
 
+    def probe_rtt(self, target_ip: str, count: int = 3) -> dict[str, Any]:
+        """用 ping 命令测量到节点的 RTT 和时钟偏差
+
+        经由连接池连续 ping count 次（复用池中的连接，只计发送到收到应答的时间，
+        不含等待名额和建连的时间），每次都记入 node_metrics。返回 {'status', 'rtt', 'offset'}，为本次 RTT 最小的样本。
+        """
+        samples: list[tuple[float, float]] = []
+        try:
+            for _ in range(count):
+                timing: list[float] = []
+                response = self.connection_pool.request(target_ip, {
+                    'type': MsgType.COMMAND, 'command': 'ping', 'params': {}
+                }, COMMAND_TIMEOUT, idempotent=True, timing=timing)
+                sent, received = timing
+                if response.get('status') == STATUS_BUSY:
+                    break
+                if response.get('status') != 'success' or 'time' not in response:
+                    return {'status': 'error', 'message': response.get('message', '客户端不支持 ping')}
+                rtt, offset = ntp_sample(sent, response['time'], response['time'], received)
+                self.node_metrics.record_exchange(target_ip, rtt, offset)
+                samples.append((rtt, offset))
+        except NodeUnavailableError as e:
+            return {'status': 'error', 'message': f'节点不可用: {e}'}
+        except (OSError, ValueError) as e:
+            # 已有的样本仍然有效
+            if not samples:
+                return {'status': 'error', 'message': f'ping 失败: {e}'}
+        if not samples:
+            return {'status': STATUS_BUSY, 'message': '节点繁忙，稍后再测'}
+        rtt, offset = min(samples)
+        return {'status': 'success', 'rtt': rtt, 'offset': offset}
+
+    def probe_bandwidth(self, target_ip: str, size: int | None = None,
+                        priority: int = PRIORITY_BULK) -> dict[str, Any]:
+        """向节点发送 size 字节（默认 node_metrics.probe_size）测量带宽
+
+        经由传输调度器排队和限速。用时从开始发送到收到节点确认，扣除一个 RTT。
+        返回 {'status', 'bandwidth'}（字节/秒）；节点繁忙时 status 为 busy。
+        """
+        size = size or self.node_metrics.probe_size
+        payload = bytes(min(size, LARGE_BUFFER_SIZE))
+        sock = None
+        try:
+            with self.scheduler.transfer(target_ip, EGRESS, priority, f"带宽探测 → {target_ip}") as transfer:
+                sock = transfer.wrap(self.connection_pool.checkout(target_ip))
+                send_json(sock, {'type': MsgType.BANDWIDTH_PROBE, 'size': size})
+                try:
+                    read_ready(sock)
+                except ReceiverBusyError:
+                    return {'status': STATUS_BUSY, 'message': '节点繁忙，稍后再测'}
+                except ConnectionError:
+                    return {'status': 'error', 'message': '客户端不支持带宽探测'}
+                sock.settimeout(self.node_metrics.stall_timeout(target_ip))
+                started = time.monotonic()
+                remaining = size
+                while remaining > 0:
+                    sock.sendall(payload[:remaining])
+                    remaining -= min(remaining, len(payload))
+                result = recv_json(sock, timeout=COMMAND_TIMEOUT)
+                elapsed = time.monotonic() - started - (self.node_metrics.rtt(target_ip) or 0.0)
+        except NodeUnavailableError as e:
+            return {'status': 'error', 'message': f'节点不可用: {e}'}
+        except (OSError, ValueError) as e:
+            return {'status': 'error', 'message': f'带宽探测失败: {e}'}
+        finally:
+            if sock:
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+        if result.get('status') != 'success' or result.get('received') != size:
+            return {'status': 'error', 'message': result.get('message', '节点未收到全部探测数据')}
+        self.node_metrics.record_bandwidth(target_ip, size, max(elapsed, 1e-6))
+        return {'status': 'success', 'bandwidth': self.node_metrics.bandwidth(target_ip)}
+
+    def probe_node(self, target_ip: str, bandwidth: bool = True) -> dict[str, Any]:
+        """测量节点的 RTT、时钟偏差，bandwidth 为 True 时同时测量带宽（界面发起，优先排队）"""
+        result = self.probe_rtt(target_ip)
+        if result.get('status') == 'success' and bandwidth:
+            measured = self.probe_bandwidth(target_ip, priority=PRIORITY_INTERACTIVE)
+            if measured.get('status') != 'success':
+                result['message'] = measured.get('message')
+            result['bandwidth'] = measured.get('bandwidth')
+        return result
+
+    def _bandwidth_probe_loop(self) -> None:
+        """定期测量带宽已过期的在线节点（最近有较大传输的节点不必探测）"""
+        failures: dict[str, str] = {}   # 节点上次探测失败的原因，原因不变时不重复记录日志
+        while self.running:
+            time.sleep(self.node_metrics.probe_interval)
+            for ip in self.node_manager.get_online_nodes():
+                if not self.running:
+                    return
+                if not self.node_metrics.needs_bandwidth_probe(ip):
+                    continue
+                result = self.probe_bandwidth(ip)
+                if result.get('status') == 'success':
+                    failures.pop(ip, None)
+                elif result.get('status') == STATUS_BUSY:
+                    continue    # 节点繁忙不算失败，下一轮再测
+                elif failures.get(ip) != result.get('message'):
+                    failures[ip] = result.get('message')
+                    self.log_callback(f"节点 {ip} 带宽探测失败: {result.get('message')}")
+
+    def get_link_metrics(self, target_ip: str) -> dict[str, str]:
+        """节点的 RTT、时钟偏差和带宽说明 {'rtt', 'offset', 'bandwidth'}"""
+        return self.node_metrics.describe(target_ip)
+
+    def get_connection_summary(self, target_ip: str) -> str:
+        """到节点的连接池状态（一行说明）"""
+        return self.connection_pool.node_summary(target_ip)
+
+    def get_node_health_summary(self, target_ip: str) -> str:
+        """节点的熔断状态（一行说明）"""
+        return self.node_health.summary(target_ip) if self.node_health else ''
+
     def stop(self) -> None:
         self.running = False
+        self.connection_pool.close()
+        if self.node_health:
+            self.node_health.stop()
         if self.command_socket:
             self.command_socket.close()
         if self.monitor_socket:
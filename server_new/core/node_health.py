@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+节点熔断
+每个节点一个状态机，发往节点的连接先经过它：
+
+    - closed（正常）：放行。连续 FAILURE_THRESHOLD 次连接或请求失败（连接后请求
+      超时、断开），或心跳已超时且此后没有连接成功过，转为 open
+    - open（熔断）：直接失败，不再等待连接超时。后台线程在冷却时间到后探测节点
+      （只建立 TCP 连接），成功转为 closed，失败则冷却时间加倍（不超过 MAX_COOLDOWN）；
+      熔断后又收到节点的心跳时转为 half-open
+    - half-open（恢复中）：放行一次试探请求，成功转为 closed，失败回到 open；
+      试探进行中的其他请求直接失败
+
+连接成功时的建连耗时（约为一个 RTT）记入 node_metrics，与心跳、ping 测得的
+往返时间共用一个平滑估计（core/node_metrics.py）；连接超时取 srtt + 4 * rttvar，
+限制在 MIN_CONNECT_TIMEOUT 和 CONNECT_TIMEOUT 之间。
+"""
+
+import socket
+import threading
+import time
+from typing import Any, Callable
+
+from shared.protocol import CLIENT_LISTEN_PORT, CONNECT_TIMEOUT
+from .node_manager import NodeManager
+from .node_metrics import NodeMetrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+FAILURE_THRESHOLD = 2      # 连续连接失败多少次后熔断
+BASE_COOLDOWN = 5.0        # 首次熔断后多久探测（秒），之后每次失败加倍
+MAX_COOLDOWN = 120.0
+MIN_CONNECT_TIMEOUT = 3.0  # 自适应连接超时的下限，至少容忍一次 SYN 重传
+PROBE_INTERVAL = 1.0       # 后台探测线程检查的间隔
+
+
+class NodeUnavailableError(ConnectionError):
+    """节点处于熔断状态，请求未发出。"""
+
+
+class _Breaker:
+    def __init__(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self.reason = ''
+        self.opened_at = 0.0
+        self.retry_at = 0.0
+        self.cooldown = 0.0
+        self.trial_started = 0.0
+        self.last_success = 0.0
+
+
+class NodeHealth:
+    """按节点的熔断状态，见模块说明。"""
+
+    def __init__(self, node_manager: NodeManager | None = None, port: int = CLIENT_LISTEN_PORT,
+                 log_callback: Callable[[str], None] | None = None,
+                 metrics: NodeMetrics | None = None) -> None:
+        self.node_manager = node_manager
+        self.port = port
+        self.metrics = metrics or NodeMetrics()
+        self.log_callback = log_callback
+        self._lock = threading.Lock()
+        self._breakers: dict[str, _Breaker] = {}
+        self._probing: set[str] = set()
+        self._running = False
+
+    def _log(self, message: str) -> None:
+        if self.log_callback:
+            self.log_callback(message)
+
+    def _last_heartbeat(self, ip: str) -> tuple[float | None, float]:
+        """节点最后一次心跳的时间（未发过心跳时为 None）和离线判定超时。"""
+        if self.node_manager is None:
+            return None, 0.0
+        node = self.node_manager.get_all_nodes().get(ip)
+        if not node:
+            return None, 0.0
+        return node['last_heartbeat'], self.node_manager.get_offline_timeout()
+
+    # ── 状态转换 ──────────────────────────────────────
+
+    def allow(self, ip: str) -> None:
+        """检查是否可以向节点发起连接，不可以时抛出 NodeUnavailableError。"""
+        heartbeat, offline_timeout = self._last_heartbeat(ip)
+        now = time.time()
+        with self._lock:
+            breaker = self._breakers.setdefault(ip, _Breaker())
+            if breaker.state == CLOSED:
+                if (heartbeat is None or now - heartbeat < offline_timeout
+                        or breaker.last_success > heartbeat):
+                    return
+                self._open(ip, breaker, f'心跳超时 {now - heartbeat:.0f} 秒')
+            if breaker.state == OPEN:
+                if heartbeat is None or heartbeat <= breaker.opened_at:
+                    raise NodeUnavailableError(
+                        f'{breaker.reason}，{max(0.0, breaker.retry_at - now):.0f} 秒后重新探测')
+                # 熔断后又收到了心跳，放行一次试探
+                breaker.state = HALF_OPEN
+                breaker.trial_started = 0.0
+            if breaker.trial_started and now - breaker.trial_started < self.connect_timeout(ip) * 2:
+                raise NodeUnavailableError('节点恢复中，正在试探')
+            breaker.trial_started = now
+
+    def record_success(self, ip: str, rtt: float | None = None) -> None:
+        """连接或请求成功；rtt 为建连耗时（秒）。"""
+        with self._lock:
+            breaker = self._breakers.setdefault(ip, _Breaker())
+            recovered = breaker.state != CLOSED
+            breaker.state = CLOSED
+            breaker.failures = 0
+            breaker.cooldown = 0.0
+            breaker.trial_started = 0.0
+            breaker.last_success = time.time()
+        if rtt is not None:
+            self.metrics.record_rtt(ip, rtt)
+        if recovered:
+            self._log(f"节点 {ip} 已恢复连接")
+
+    def record_connect(self, ip: str, rtt: float) -> None:
+        """请求的连接已建立（耗时 rtt 秒），请求尚未完成：只记录 RTT，熔断状态由请求结果决定。"""
+        self.metrics.record_rtt(ip, rtt)
+
+    def record_failure(self, ip: str, reason: str) -> None:
+        """连接失败（拒绝连接、连接超时等）或连接后请求超时、断开。"""
+        with self._lock:
+            breaker = self._breakers.setdefault(ip, _Breaker())
+            breaker.failures += 1
+            if breaker.state != CLOSED or breaker.failures >= FAILURE_THRESHOLD:
+                self._open(ip, breaker, reason)
+
+    def _open(self, ip: str, breaker: _Breaker, reason: str) -> None:
+        now = time.time()
+        breaker.cooldown = min(MAX_COOLDOWN, breaker.cooldown * 2) if breaker.cooldown else BASE_COOLDOWN
+        breaker.state = OPEN
+        breaker.reason = reason
+        breaker.opened_at = now
+        breaker.retry_at = now + breaker.cooldown
+        breaker.trial_started = 0.0
+        self._log(f"节点 {ip} 不可用（{reason}），{breaker.cooldown:.0f} 秒内直接跳过")
+
+    # ── 超时 ──────────────────────────────────────────
+
+    def connect_timeout(self, ip: str) -> float:
+        """按节点实测 RTT（node_metrics）的连接超时，没有测量值时为 CONNECT_TIMEOUT。"""
+        srtt, rttvar = self.metrics.rtt_estimate(ip)
+        if srtt is None:
+            return CONNECT_TIMEOUT
+        return min(CONNECT_TIMEOUT, max(MIN_CONNECT_TIMEOUT, srtt + 4 * rttvar))
+
+    # ── 后台探测 ──────────────────────────────────────
+
+    def start(self) -> None:
+        self._running = True
+        threading.Thread(target=self._probe_loop, name='node-probe', daemon=True).start()
+
+    def stop(self) -> None:
+        self._running = False
+
+    def _probe_loop(self) -> None:
+        while self._running:
+            time.sleep(PROBE_INTERVAL)
+            now = time.time()
+            with self._lock:
+                due = [ip for ip, breaker in self._breakers.items()
+                       if breaker.state == OPEN and now >= breaker.retry_at and ip not in self._probing]
+                self._probing.update(due)
+            for ip in due:
+                threading.Thread(target=self._probe, args=(ip,), daemon=True).start()
+
+    def _probe(self, ip: str) -> None:
+        """探测熔断的节点：能建立 TCP 连接即视为恢复。"""
+        try:
+            started = time.monotonic()
+            sock = socket.create_connection((ip, self.port), timeout=self.connect_timeout(ip))
+            rtt = time.monotonic() - started
+            sock.close()
+            self.record_success(ip, rtt)
+        except OSError as e:
+            self.record_failure(ip, f'探测失败: {e}')
+        finally:
+            with self._lock:
+                self._probing.discard(ip)
+
+    # ── 查询 ──────────────────────────────────────────
+
+    def get_state(self, ip: str) -> dict[str, Any]:
+        with self._lock:
+            breaker = self._breakers.get(ip) or _Breaker()
+            state = {
+                'state': breaker.state,
+                'failures': breaker.failures,
+                'reason': breaker.reason,
+                'retry_in': max(0.0, breaker.retry_at - time.time()) if breaker.state == OPEN else 0.0
+            }
+        state['connect_timeout'] = self.connect_timeout(ip)
+        return state
+
+    def summary(self, ip: str) -> str:
+        """节点连接状态的简短说明（节点列表使用，RTT 见 node_metrics）。"""
+        state = self.get_state(ip)
+        if state['state'] == OPEN:
+            return f"熔断（{state['reason']}），{state['retry_in']:.0f} 秒后探测"
+        if state['state'] == HALF_OPEN:
+            return '恢复中'
+        return '正常'
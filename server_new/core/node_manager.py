@@ -7,6 +7,13 @@ import json
 from pathlib import Path
 from typing import Any
 
+from shared.protocol import (
+    HEARTBEAT_INTERVAL,
+    HEARTBEAT_MAX_INTERVAL,
+    HEARTBEAT_TARGET_RATE,
+    NODE_OFFLINE_TIMEOUT,
+)
+
 
 class NodeManager:
     """节点管理器"""
@@ -67,12 +74,24 @@ class NodeManager:
                 if node_info:
                     self.nodes[ip]['info'] = node_info
 
+    def get_heartbeat_interval(self) -> int:
+        """根据节点规模计算建议的心跳间隔，在心跳应答中下发给客户端以分摊负载。"""
+        with self.lock:
+            node_count = len(self.nodes)
+        interval = max(HEARTBEAT_INTERVAL, node_count // HEARTBEAT_TARGET_RATE)
+        return min(interval, HEARTBEAT_MAX_INTERVAL)
+
+    def get_offline_timeout(self) -> float:
+        """离线判定超时：至少容忍 3 次心跳丢失。"""
+        return max(NODE_OFFLINE_TIMEOUT, 3 * self.get_heartbeat_interval())
+
     def get_online_nodes(self) -> list[str]:
+        offline_timeout = self.get_offline_timeout()
         with self.lock:
             current_time = time.time()
             online = []
             for ip, node in self.nodes.items():
-                if current_time - node['last_heartbeat'] < 30:
+                if current_time - node['last_heartbeat'] < offline_timeout:
                     online.append(ip)
                 else:
                     node['status'] = 'offline'
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+节点链路测量
+按节点记录服务端到节点的往返时间、时钟偏差和带宽：
+
+    - RTT：心跳和 ping 探测的往返时间（已扣除对端的处理时间）以及建连耗时
+      （node_health 记录），共用一个 EWMA 估计，与 TCP 估计 RTO 的方式相同：
+      srtt 权重 1/8，抖动 rttvar 权重 1/4
+    - 时钟偏差：NTP 方式，offset = ((t1 - t0) + (t2 - t3)) / 2。排队延迟越小，
+      往返路径不对称带来的误差越小，所以取最近 OFFSET_WINDOW 个样本中 RTT 最小的
+      一个；正值表示节点时钟比服务端快
+    - 带宽：主动探测（bandwidth_probe）和较大的传输的吞吐量，按 EWMA 平滑，超过
+      BANDWIDTH_MAX_AGE 的测量视为过期。受传输调度器限速的传输测得的是限速后的速率，
+      即实际可用的速率
+
+测量结果用于连接超时（node_health）、传输的停滞超时（stall_timeout）、传输调度的
+排队顺序（estimate_seconds）、接力分发的种子选择和分批发布的节点顺序（order）。
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any
+
+from shared.protocol import (
+    BANDWIDTH_MAX_AGE,
+    BANDWIDTH_PROBE_INTERVAL,
+    BANDWIDTH_PROBE_SIZE,
+    FILE_TRANSFER_TIMEOUT,
+    TRANSFER_CHUNK_SIZE,
+    TRANSFER_STALL_MIN,
+)
+
+OFFSET_WINDOW = 8          # 估计时钟偏差时参考的最近样本数
+BANDWIDTH_ALPHA = 0.3      # 带宽 EWMA 中新样本的权重（样本稀疏，权重高于 RTT）
+MAX_RTT = 60.0             # 超过该值的往返时间视为无效样本（如客户端休眠后报告的心跳）
+
+
+def ntp_sample(t0: float, t1: float, t2: float, t3: float) -> tuple[float, float]:
+    """一次请求/应答的 (往返时间, 应答方时钟减请求方时钟)。
+
+    t0/t3 为请求方发出请求、收到应答的时间（请求方时钟），t1/t2 为应答方
+    收到请求、发出应答的时间（应答方时钟）。
+    """
+    return (t3 - t0) - (t2 - t1), ((t1 - t0) + (t2 - t3)) / 2
+
+
+class _Link:
+    def __init__(self) -> None:
+        self.srtt: float | None = None
+        self.rttvar = 0.0
+        self.rtt_min: float | None = None
+        self.rtt_at = 0.0
+        self.samples: deque[tuple[float, float]] = deque(maxlen=OFFSET_WINDOW)
+        self.bandwidth: float | None = None
+        self.bandwidth_at = 0.0
+
+
+class NodeMetrics:
+    """按节点的链路测量（线程安全），见模块说明。"""
+
+    def __init__(self, probe_interval: float = BANDWIDTH_PROBE_INTERVAL,
+                 probe_size: int = BANDWIDTH_PROBE_SIZE) -> None:
+        self.probe_interval = probe_interval
+        self.probe_size = max(1, int(probe_size))
+        self._lock = threading.Lock()
+        self._links: dict[str, _Link] = {}
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any]) -> 'NodeMetrics':
+        """按 config.json 的 node_metrics 段创建，探测大小单位为 KB。"""
+        return cls(
+            probe_interval=config.get('bandwidth_probe_interval', BANDWIDTH_PROBE_INTERVAL),
+            probe_size=config.get('bandwidth_probe_kb', BANDWIDTH_PROBE_SIZE // 1024) * 1024
+        )
+
+    # ── 记录 ──────────────────────────────────────────
+
+    @staticmethod
+    def _update_rtt(link: _Link, rtt: float) -> None:
+        if link.srtt is None:
+            link.srtt, link.rttvar = rtt, rtt / 2
+        else:
+            link.rttvar = 0.75 * link.rttvar + 0.25 * abs(link.srtt - rtt)
+            link.srtt = 0.875 * link.srtt + 0.125 * rtt
+        link.rtt_min = rtt if link.rtt_min is None else min(link.rtt_min, rtt)
+        link.rtt_at = time.time()
+
+    def record_exchange(self, ip: str, rtt: float, offset: float) -> None:
+        """记录一次往返：rtt 为扣除对端处理时间后的往返时间，offset 为节点时钟减服务端时钟。"""
+        if not 0 <= rtt <= MAX_RTT:
+            return
+        with self._lock:
+            link = self._links.setdefault(ip, _Link())
+            self._update_rtt(link, rtt)
+            link.samples.append((rtt, offset))
+
+    def record_rtt(self, ip: str, rtt: float) -> None:
+        """记录一个没有时钟信息的 RTT 样本（建连耗时）。"""
+        if not 0 <= rtt <= MAX_RTT:
+            return
+        with self._lock:
+            self._update_rtt(self._links.setdefault(ip, _Link()), rtt)
+
+    def record_bandwidth(self, ip: str, nbytes: int, seconds: float) -> None:
+        """记录一次传输的吞吐量（nbytes 字节用时 seconds 秒）。"""
+        if nbytes <= 0 or seconds <= 0:
+            return
+        sample = nbytes / seconds
+        now = time.time()
+        with self._lock:
+            link = self._links.setdefault(ip, _Link())
+            if link.bandwidth is None or now - link.bandwidth_at > BANDWIDTH_MAX_AGE:
+                link.bandwidth = sample
+            else:
+                link.bandwidth = (1 - BANDWIDTH_ALPHA) * link.bandwidth + BANDWIDTH_ALPHA * sample
+            link.bandwidth_at = now
+
+    # ── 查询 ──────────────────────────────────────────
+
+    @staticmethod
+    def _fresh_bandwidth(link: _Link | None) -> float | None:
+        if link is None or link.bandwidth is None or time.time() - link.bandwidth_at > BANDWIDTH_MAX_AGE:
+            return None
+        return link.bandwidth
+
+    def bandwidth(self, ip: str) -> float | None:
+        """节点的带宽（字节/秒），没有测量或已过期时为 None。"""
+        with self._lock:
+            return self._fresh_bandwidth(self._links.get(ip))
+
+    def needs_bandwidth_probe(self, ip: str) -> bool:
+        return self.bandwidth(ip) is None
+
+    def rtt(self, ip: str) -> float | None:
+        """平滑后的往返时间（秒），没有测量时为 None。"""
+        with self._lock:
+            link = self._links.get(ip)
+            return link.srtt if link else None
+
+    def rtt_estimate(self, ip: str) -> tuple[float | None, float]:
+        """(srtt, rttvar)，没有测量时 srtt 为 None。"""
+        with self._lock:
+            link = self._links.get(ip)
+            return (link.srtt, link.rttvar) if link else (None, 0.0)
+
+    def estimate_seconds(self, ip: str, nbytes: int) -> float | None:
+        """按实测带宽估计向节点发送 nbytes 字节所需的时间，没有带宽测量时为 None。"""
+        with self._lock:
+            link = self._links.get(ip)
+            bandwidth = self._fresh_bandwidth(link)
+            if not bandwidth:
+                return None
+            return nbytes / bandwidth + (link.srtt or 0.0)
+
+    def stall_timeout(self, ip: str) -> float:
+        """传输中单次收发没有进展的超时。
+
+        有带宽测量时取发送 4 个传输块的时间加上 RTO，限制在 TRANSFER_STALL_MIN 和
+        FILE_TRANSFER_TIMEOUT 之间：链路中断后尽快按续传处理，而不是固定等待
+        FILE_TRANSFER_TIMEOUT。没有测量时为 FILE_TRANSFER_TIMEOUT。
+        """
+        with self._lock:
+            link = self._links.get(ip)
+            bandwidth = self._fresh_bandwidth(link)
+            if not bandwidth:
+                return FILE_TRANSFER_TIMEOUT
+            rto = (link.srtt or 0.0) + 4 * link.rttvar
+        return min(FILE_TRANSFER_TIMEOUT, max(TRANSFER_STALL_MIN, 4 * TRANSFER_CHUNK_SIZE / bandwidth + rto))
+
+    def order(self, ips: list[str]) -> list[str]:
+        """按链路从好到差排列节点：带宽高的在前，没有带宽测量的按 RTT 排在其后，
+        都没有测量的保持原顺序排在最后。"""
+        with self._lock:
+            def key(ip: str) -> tuple[int, float]:
+                link = self._links.get(ip)
+                bandwidth = self._fresh_bandwidth(link)
+                if bandwidth:
+                    return 0, -bandwidth
+                if link and link.srtt is not None:
+                    return 1, link.srtt
+                return 2, 0.0
+            return sorted(ips, key=key)
+
+    def get(self, ip: str) -> dict[str, Any]:
+        with self._lock:
+            link = self._links.get(ip) or _Link()
+            best = min(link.samples, default=None)
+            return {
+                'srtt': link.srtt,
+                'rttvar': link.rttvar,
+                'rtt_min': link.rtt_min,
+                'rtt_age': time.time() - link.rtt_at if link.rtt_at else None,
+                'offset': best[1] if best else None,
+                'bandwidth': self._fresh_bandwidth(link),
+                'bandwidth_age': time.time() - link.bandwidth_at if link.bandwidth_at else None
+            }
+
+    def describe(self, ip: str) -> dict[str, str]:
+        """节点列表显示的 {'rtt', 'offset', 'bandwidth'} 说明，没有测量时为空字符串。"""
+        metrics = self.get(ip)
+        rtt = offset = bandwidth = ''
+        if metrics['srtt'] is not None:
+            rtt = f"{metrics['srtt'] * 1000:.1f} ms ±{metrics['rttvar'] * 1000:.1f}"
+        if metrics['offset'] is not None:
+            offset = f"{metrics['offset'] * 1000:+.0f} ms"
+        if metrics['bandwidth'] is not None:
+            bandwidth = f"{metrics['bandwidth'] / 1024 / 1024:.1f} MB/s"
+        return {'rtt': rtt, 'offset': offset, 'bandwidth': bandwidth}
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+分块接力分发
+服务端只把数据发给少数种子节点，节点边接收边转发给下游节点，分发时间随节点数
+按对数增长（fanout=1 时为流水线链）。客户端 core/relay.py 实现节点端，两边需保持一致。
+
+协议：
+    上游 → 节点  接力请求 JSON（type=relay，purpose=file/update 及对应参数）
+    节点 → 上游  'ready'
+    上游 → 节点  一行 JSON 头：file_size、chunk_size、chunk_hashes（每块 sha256）、
+                 sha256（整体）、children（该节点的下游子树 [{ip, children}]）
+    上游 → 节点  原始数据块；节点逐块校验后写入本地并转发给下游
+    节点 → 上游  一行 JSON：{status, result（本节点结果）, results（{下游 ip: 结果}）}
+"""
+
+import hashlib
+import json
+import socket
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from shared.protocol import (
+    CONNECT_TIMEOUT,
+    FILE_TRANSFER_TIMEOUT,
+    send_json,
+)
+
+RelaySource = bytes | str | Path
+
+
+def build_relay_tree(ips: list[str], seeds: int, fanout: int) -> list[dict[str, Any]]:
+    """按层次排列节点，返回种子节点的子树列表。
+
+    前 seeds 个节点直接由服务端发送，第 i 个节点的下游为其后按层次顺序的
+    fanout 个节点；seeds=1、fanout=1 时为一条链。
+    """
+    seeds = max(1, seeds)
+    fanout = max(1, fanout)
+    nodes: list[dict[str, Any]] = [{'ip': ip, 'children': []} for ip in ips]
+    for i, node in enumerate(nodes):
+        start = seeds + i * fanout
+        node['children'] = nodes[start:start + fanout]
+    return nodes[:seeds]
+
+
+def tree_depth(roots: list[dict[str, Any]]) -> int:
+    """子树的层数（仅用于日志展示）。"""
+    depth, level = 0, roots
+    while level:
+        depth += 1
+        level = [child for node in level for child in node['children']]
+    return depth
+
+
+def subtree_ips(node: dict[str, Any]) -> list[str]:
+    """返回子树中所有节点的 IP（含根）。"""
+    ips: list[str] = []
+    pending = [node]
+    while pending:
+        current = pending.pop()
+        ips.append(current['ip'])
+        pending.extend(current.get('children', []))
+    return ips
+
+
+def iter_chunks(source: RelaySource, chunk_size: int) -> Iterator[bytes]:
+    """按 chunk_size 依次产出数据块，source 为内存数据或文件路径。"""
+    if isinstance(source, bytes):
+        for offset in range(0, len(source), chunk_size):
+            yield source[offset:offset + chunk_size]
+        return
+    with open(source, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def build_relay_header(source: RelaySource, chunk_size: int) -> dict[str, Any]:
+    """计算分块哈希，生成不含 children 的数据头。"""
+    whole = hashlib.sha256()
+    chunk_hashes: list[str] = []
+    size = 0
+    for chunk in iter_chunks(source, chunk_size):
+        chunk_hashes.append(hashlib.sha256(chunk).hexdigest())
+        whole.update(chunk)
+        size += len(chunk)
+    return {
+        'file_size': size,
+        'chunk_size': chunk_size,
+        'chunk_hashes': chunk_hashes,
+        'sha256': whole.hexdigest()
+    }
+
+
+class RelayFanout:
+    """把同一份数据转发给下游节点，并汇总整棵子树的结果。"""
+
+    def __init__(self, request: dict[str, Any], header: dict[str, Any], port: int,
+                 log_callback: Callable[[str], None] | None = None) -> None:
+        self.request = request
+        self.header = {k: v for k, v in header.items() if k != 'children'}
+        self.port = port
+        self.log_callback = log_callback
+        self.links: list[list[Any]] = []          # [[子树, socket]]，失败后 socket 置为 None
+        self.results: dict[str, dict[str, Any]] = {}
+
+    def _log(self, message: str) -> None:
+        if self.log_callback:
+            self.log_callback(message)
+
+    def _fail_subtree(self, node: dict[str, Any], message: str) -> None:
+        for ip in subtree_ips(node):
+            self.results.setdefault(ip, {'status': 'error', 'message': message})
+
+    def _open(self, node: dict[str, Any]) -> socket.socket:
+        sock = socket.create_connection((node['ip'], self.port), timeout=CONNECT_TIMEOUT)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            send_json(sock, self.request)
+            ack = sock.recv(1024).decode('utf-8')
+            if ack != 'ready':
+                raise ConnectionError(f'节点未就绪: {ack}')
+            sock.settimeout(FILE_TRANSFER_TIMEOUT)
+            header = dict(self.header, children=node.get('children', []))
+            sock.sendall((json.dumps(header) + '\n').encode('utf-8'))
+            return sock
+        except Exception:
+            sock.close()
+            raise
+
+    def connect(self, children: list[dict[str, Any]]) -> None:
+        """连接下游节点；连接失败的节点由发送方直接接管其下游。"""
+        pending = list(children)
+        while pending:
+            node = pending.pop(0)
+            try:
+                self.links.append([node, self._open(node)])
+            except Exception as e:
+                self._log(f"接力节点 {node['ip']} 连接失败，接管其下游: {e}")
+                self.results[node['ip']] = {'status': 'error', 'message': f'无法连接: {e}'}
+                pending.extend(node.get('children', []))
+
+    def forward(self, chunk: bytes) -> None:
+        """把一个数据块发给所有下游；发送失败的下游整棵子树记为失败。"""
+        for link in self.links:
+            node, sock = link
+            if sock is None:
+                continue
+            try:
+                sock.sendall(chunk)
+            except Exception as e:
+                self._log(f"向 {node['ip']} 转发失败: {e}")
+                self._fail_subtree(node, f'转发中断: {e}')
+                sock.close()
+                link[1] = None
+
+    def collect(self) -> dict[str, dict[str, Any]]:
+        """等待下游返回结果并汇总为 {ip: 结果}。"""
+        for link in self.links:
+            node, sock = link
+            if sock is None:
+                continue
+            try:
+                reader = sock.makefile('rb')
+                try:
+                    response = json.loads(reader.readline().decode('utf-8'))
+                finally:
+                    reader.close()
+                self.results[node['ip']] = response.get('result', response)
+                self.results.update(response.get('results', {}))
+            except Exception as e:
+                self._log(f"接收 {node['ip']} 的接力结果失败: {e}")
+            finally:
+                sock.close()
+                link[1] = None
+            # 下游中途断开时没有带回结果的节点记为失败
+            self._fail_subtree(node, '未收到接力结果')
+        return self.results
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+可续传、逐块校验的文件传输
+用于单文件传输、批量分发、全量更新（服务端发送）和备份文件（服务端接收）。
+客户端 core/transfer.py 实现同一协议，两边需保持一致。
+
+协议：
+    发送方 → 接收方  请求 JSON，带 file_size、chunk_size、sha256（整个文件）
+    接收方 → 发送方  一行 JSON {"status": "ready", "offset": N}，N 为已校验过、
+                     保存在本地的字节数；旧版接收方回复 'ready'，发送方按原方式整体发送
+    发送方 → 接收方  从 offset 开始的数据帧：32 字节块 sha256 + 块数据（最后一块可不足 chunk_size）
+    接收方 → 发送方  结果 JSON；传输中断或块校验失败时带 resumable=True，
+                     已校验的部分保留，重发时从断点继续
+
+部分文件按内容命名（<sha256>.part）。同一内容的多个传输同时进行时，后来的传输改用
+请求中 transfer_id（发送方每次发送生成、重试时不变）命名的专用部分文件，互不干扰。
+
+大文件可先通过多个并行连接分段发送（type=range_put，带 start/end，按块对齐），
+接收方把校验过的块按位置写入预分配的文件并记录已完成的块；全部完成后该文件即为
+完整的部分文件，随后的普通传输从文件末尾"续传"，只做整体校验。
+"""
+
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Iterator
+
+from shared.protocol import STATUS_BUSY
+
+DIGEST_SIZE = 32            # sha256
+PARTIAL_MAX_AGE = 7 * 86400  # 未完成的传输保留时间（秒）
+# 未完成传输的文件：顺序传输的部分文件、分段传输的数据和块记录
+PARTIAL_SUFFIXES = ('.part', '.ranges', '.map')
+
+# 进程内正在接收的部分文件，同一内容的并发传输不共用部分文件
+_receiving_lock = threading.Lock()
+_receiving: set[Path] = set()
+
+TransferSource = bytes | str | Path
+
+
+class ReceiverBusyError(ConnectionError):
+    """接收方的工作池已满，回复了 busy 而不是就绪应答"""
+
+
+def source_size(source: TransferSource) -> int:
+    return len(source) if isinstance(source, bytes) else os.path.getsize(source)
+
+
+def iter_source(source: TransferSource, offset: int, chunk_size: int,
+                end: int | None = None) -> Iterator[bytes]:
+    """从 offset 开始按 chunk_size 依次产出数据块，到 end（不含）为止。"""
+    if isinstance(source, bytes):
+        end = len(source) if end is None else min(end, len(source))
+        for start in range(offset, end, chunk_size):
+            yield source[start:min(start + chunk_size, end)]
+        return
+    with open(source, 'rb') as f:
+        f.seek(offset)
+        position = offset
+        while end is None or position < end:
+            chunk = f.read(chunk_size if end is None else min(chunk_size, end - position))
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk
+
+
+def source_sha256(source: TransferSource) -> str:
+    h = hashlib.sha256()
+    for chunk in iter_source(source, 0, 1024 * 1024):
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def read_ready(sock: socket.socket) -> int | None:
+    """读取接收方的就绪应答，返回续传偏移；旧版接收方回复 'ready' 时返回 None。
+
+    接收方繁忙时抛出 ReceiverBusyError，其他非就绪应答抛出 ConnectionError。
+    只取走应答这一行：接收方已有全部数据时会紧接着发出结果，留给调用方读取。
+    """
+    data = b''
+    while True:
+        peek = sock.recv(1024, socket.MSG_PEEK)
+        if not peek:
+            break
+        if not data and peek == b'ready':
+            sock.recv(len(peek))
+            return None
+        end = peek.find(b'\n')
+        if end >= 0:
+            data += sock.recv(end + 1)
+            break
+        data += sock.recv(len(peek))
+    try:
+        reply = json.loads(data.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise ConnectionError(f"接收方未就绪: {data[:100]!r}")
+    if reply.get('status') == STATUS_BUSY:
+        raise ReceiverBusyError(f"接收方繁忙: {reply.get('message', reply)}")
+    if reply.get('status') != 'ready':
+        raise ConnectionError(f"接收方未就绪: {reply.get('message', reply)}")
+    return int(reply.get('offset', 0))
+
+
+def send_ready(sock: socket.socket, offset: int) -> None:
+    sock.sendall((json.dumps({'status': 'ready', 'offset': offset}) + '\n').encode('utf-8'))
+
+
+def send_chunks(sock: socket.socket, source: TransferSource, offset: int, chunk_size: int,
+                on_progress: Callable[[int], None] | None = None, end: int | None = None) -> None:
+    """从 offset 开始发送数据帧（到 end 为止），on_progress(已发送到的位置) 在每块发送后调用。"""
+    position = offset
+    for chunk in iter_source(source, offset, chunk_size, end):
+        sock.sendall(hashlib.sha256(chunk).digest() + chunk)
+        position += len(chunk)
+        if on_progress:
+            on_progress(position)
+
+
+def split_ranges(file_size: int, chunk_size: int, streams: int) -> list[tuple[int, int]]:
+    """把文件切成按块对齐的分段，分段数约为并行连接数的 4 倍，便于动态分配。"""
+    chunks = -(-file_size // chunk_size)
+    per_range = max(4, -(-chunks // (streams * 4)))
+    step = per_range * chunk_size
+    return [(start, min(start + step, file_size)) for start in range(0, file_size, step)]
+
+
+class StreamController:
+    """根据实测吞吐量调整并行连接数。
+
+    每个测量窗口结束时，吞吐量比此前最好的结果提高 10% 以上就再增加一个连接；
+    不再提高时退回上一个连接数并固定下来。
+    """
+
+    WINDOW = 2.0   # 测量窗口（秒）
+
+    def __init__(self, initial: int, maximum: int) -> None:
+        self.maximum = max(1, maximum)
+        self.target = max(1, min(initial, self.maximum))
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._window_bytes = 0
+        self._best = 0.0
+        self._frozen = False
+        self.history: list[tuple[int, float]] = []   # [(连接数, 字节/秒)]
+
+    def record(self, nbytes: int) -> int:
+        """记录一次发送完成的字节数，返回当前的目标连接数。"""
+        with self._lock:
+            self._window_bytes += nbytes
+            elapsed = time.time() - self._window_start
+            if elapsed < self.WINDOW:
+                return self.target
+            rate = self._window_bytes / elapsed
+            self.history.append((self.target, rate))
+            self._window_start = time.time()
+            self._window_bytes = 0
+            if not self._frozen:
+                if rate > self._best * 1.1:
+                    self._best = rate
+                    if self.target < self.maximum:
+                        self.target += 1
+                    else:
+                        self._frozen = True
+                else:
+                    self.target = max(1, self.target - 1)
+                    self._frozen = True
+            return self.target
+
+
+def cleanup_partials(directory: Path, max_age: int = PARTIAL_MAX_AGE) -> None:
+    """删除长时间未完成的传输留下的部分文件（含分段传输的数据和块记录）。"""
+    if not directory.is_dir():
+        return
+    deadline = time.time() - max_age
+    for path in directory.iterdir():
+        if path.suffix not in PARTIAL_SUFFIXES:
+            continue
+        try:
+            if path.stat().st_mtime < deadline:
+                path.unlink()
+        except OSError:
+            pass
+
+
+@contextmanager
+def receiving_part(partial_dir: Path, name: str, transfer_id: str | None = None) -> Iterator[Path]:
+    """在 with 块中占用本次传输的部分文件 <name>.part。
+
+    已有传输在接收同一内容时改用 <name>-<transfer_id>.part，续传时 transfer_id 不变，
+    仍能找到该文件。with 块结束前调用方应把完成的文件移走。
+    """
+    with _receiving_lock:
+        part_path = partial_dir / f'{name}.part'
+        if part_path in _receiving:
+            part_path = partial_dir / f'{name}-{transfer_id or uuid.uuid4().hex}.part'
+        if part_path in _receiving:
+            part_path = partial_dir / f'{name}-{uuid.uuid4().hex}.part'
+        _receiving.add(part_path)
+    try:
+        yield part_path
+    finally:
+        with _receiving_lock:
+            _receiving.discard(part_path)
+
+
+class ChunkReceiver:
+    """把数据帧逐块校验后追加到部分文件，文件名由整个文件的 sha256 决定，中断后可续传。"""
+
+    def __init__(self, part_path: Path, file_size: int, chunk_size: int, sha256: str) -> None:
+        self.part_path = part_path
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.sha256 = sha256
+        self._hash = hashlib.sha256()
+        self.offset = 0
+
+    def prepare(self) -> int:
+        """检查已有的部分文件，返回可续传的偏移。
+
+        只保留整块的数据（中途退出可能留下写了一半的块），并重新计算已有部分的哈希。
+        """
+        self.part_path.parent.mkdir(parents=True, exist_ok=True)
+        size = self.part_path.stat().st_size if self.part_path.exists() else 0
+        if size == self.file_size:
+            # 已完整（如分段并行传输已全部完成），只需整体校验
+            offset = size
+        elif size > self.file_size:
+            offset = 0
+        else:
+            offset = size // self.chunk_size * self.chunk_size
+        with open(self.part_path, 'ab') as f:
+            f.truncate(offset)
+        with open(self.part_path, 'rb') as f:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                self._hash.update(chunk)
+        self.offset = offset
+        return offset
+
+    def receive(self, reader: BinaryIO,
+                on_progress: Callable[[int], None] | None = None) -> dict[str, Any] | None:
+        """接收剩余的数据帧；成功返回 None，否则返回错误结果。"""
+        with open(self.part_path, 'ab') as f:
+            while self.offset < self.file_size:
+                size = min(self.chunk_size, self.file_size - self.offset)
+                frame = reader.read(DIGEST_SIZE + size)
+                if len(frame) != DIGEST_SIZE + size:
+                    return {'status': 'error', 'message': f'传输中断，已接收 {self.offset}/{self.file_size} 字节',
+                            'resumable': True, 'offset': self.offset}
+                digest, chunk = frame[:DIGEST_SIZE], frame[DIGEST_SIZE:]
+                if hashlib.sha256(chunk).digest() != digest:
+                    return {'status': 'error', 'message': f'数据块校验失败，位置 {self.offset}',
+                            'resumable': True, 'offset': self.offset}
+                f.write(chunk)
+                f.flush()
+                self._hash.update(chunk)
+                self.offset += size
+                if on_progress:
+                    on_progress(self.offset)
+
+        if self._hash.hexdigest() != self.sha256:
+            # 整体校验失败说明已保存的部分已损坏，下次从头传输
+            self.discard()
+            return {'status': 'error', 'message': '文件整体校验失败', 'resumable': True, 'offset': 0}
+        return None
+
+    def discard(self) -> None:
+        try:
+            self.part_path.unlink()
+        except OSError:
+            pass
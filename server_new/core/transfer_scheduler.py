@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+服务端传输调度
+批量分发、更新推送、备份接收等大流量传输都经由调度器进行：
+
+    - 并发上限：同时进行的传输（连接）数不超过 max_concurrent，超出的按优先级
+      排队（界面上单独发起的传输排在批量操作前面）；同一优先级按“到达时间 + 按实测
+      带宽估计的传输时间”排序，预计很快完成的传输先进行，等待久了的传输不会被
+      后来的小传输一直插队；没有带宽测量时按先来先到
+    - 令牌桶限速：全局出站/入站预算、每个节点和每个分组的速率上限，
+      一次传输同时受所经过的各个桶限制
+
+心跳、命令、监控数据等控制流量不经过调度器，既不排队也不限速；
+把预算设得低于链路带宽，控制流量就始终有余量，不会因批量传输被判定离线。
+"""
+
+import heapq
+import itertools
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from shared.protocol import (
+    PRIORITY_BULK,
+    TRANSFER_BURST_SECONDS,
+    TRANSFER_MAX_CONCURRENT,
+)
+
+THROTTLE_SLICE = 64 * 1024   # 限速时每次发送的最大字节数，避免一次透支过多
+
+EGRESS = 'egress'
+INGRESS = 'ingress'
+
+
+class TokenBucket:
+    """令牌桶，rate 为字节/秒，0 表示不限速。
+
+    取令牌时允许透支，返回需要等待的时间；多个桶可以先各自取令牌，
+    再按最长的等待时间休眠。
+    """
+
+    def __init__(self, rate: float = 0) -> None:
+        self._lock = threading.Lock()
+        self.rate = 0.0
+        self.burst = 0.0
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate)
+        self._tokens = self.burst
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self.rate = max(0.0, float(rate))
+            self.burst = max(self.rate * TRANSFER_BURST_SECONDS, THROTTLE_SLICE)
+            self._tokens = min(self._tokens, self.burst)
+            self._updated = time.monotonic()
+
+    def reserve(self, nbytes: int) -> float:
+        """取走 nbytes 个令牌，返回需要等待的秒数。"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= nbytes
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+
+class ScheduledTransfer:
+    """调度器中的一次传输，发送/接收数据前通过 throttle 取令牌。"""
+
+    def __init__(self, buckets: list[TokenBucket]) -> None:
+        self._buckets = buckets
+        self.transferred = 0
+
+    def throttle(self, nbytes: int) -> None:
+        wait = max((bucket.reserve(nbytes) for bucket in self._buckets), default=0.0)
+        self.transferred += nbytes
+        if wait > 0:
+            time.sleep(wait)
+
+    def wrap(self, sock: socket.socket) -> 'ThrottledSocket':
+        return ThrottledSocket(sock, self)
+
+
+class ThrottledSocket:
+    """按调度器的限速发送数据的 socket 包装，其余操作直接交给原 socket。"""
+
+    def __init__(self, sock: socket.socket, transfer: ScheduledTransfer) -> None:
+        self._sock = sock
+        self._transfer = transfer
+
+    def sendall(self, data: bytes) -> None:
+        view = memoryview(data)
+        for offset in range(0, len(view), THROTTLE_SLICE):
+            piece = view[offset:offset + THROTTLE_SLICE]
+            self._transfer.throttle(len(piece))
+            self._sock.sendall(piece)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._sock, name)
+
+
+class TransferScheduler:
+    """全服务端共用的传输调度器，限速参数可在运行中调整（见 configure）。"""
+
+    def __init__(self, max_concurrent: int = TRANSFER_MAX_CONCURRENT,
+                 egress_limit: float = 0, ingress_limit: float = 0,
+                 node_limit: float = 0, group_limits: dict[str, float] | None = None,
+                 group_of: Callable[[str], str | None] | None = None,
+                 estimate_of: Callable[[str, int], float | None] | None = None,
+                 log_callback: Callable[[str], None] | None = None) -> None:
+        self.group_of = group_of
+        self.log_callback = log_callback
+        self._cond = threading.Condition()
+        self.estimate_of = estimate_of
+        self._waiting: list[tuple[int, float, int]] = []   # 堆：(优先级, 到达时间 + 预计用时, 序号)
+        self._seq = itertools.count()
+        self._active = 0                            # 进行中的传输数
+        self._global = {EGRESS: TokenBucket(), INGRESS: TokenBucket()}
+        self._nodes: dict[tuple[str, str], TokenBucket] = {}
+        self._groups: dict[tuple[str, str], TokenBucket] = {}
+        self.max_concurrent = 0
+        self.node_limit = 0.0
+        self.group_limits: dict[str, float] = {}
+        self.configure(max_concurrent, egress_limit, ingress_limit, node_limit, group_limits or {})
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any],
+                    group_of: Callable[[str], str | None] | None = None,
+                    estimate_of: Callable[[str, int], float | None] | None = None,
+                    log_callback: Callable[[str], None] | None = None) -> 'TransferScheduler':
+        """按 config.json 的 transfer 段创建，速率单位为 KB/s（0 为不限速）。"""
+        return cls(
+            max_concurrent=config.get('max_concurrent', TRANSFER_MAX_CONCURRENT),
+            egress_limit=config.get('egress_limit_kb', 0) * 1024,
+            ingress_limit=config.get('ingress_limit_kb', 0) * 1024,
+            node_limit=config.get('node_limit_kb', 0) * 1024,
+            group_limits={name: kb * 1024 for name, kb in config.get('group_limits_kb', {}).items()},
+            group_of=group_of,
+            estimate_of=estimate_of,
+            log_callback=log_callback
+        )
+
+    def _log(self, message: str) -> None:
+        if self.log_callback:
+            self.log_callback(message)
+
+    def configure(self, max_concurrent: int, egress_limit: float, ingress_limit: float,
+                  node_limit: float, group_limits: dict[str, float]) -> None:
+        """调整并发上限和各项速率（字节/秒），对进行中的传输立即生效。"""
+        with self._cond:
+            self.max_concurrent = max(0, max_concurrent)
+            self.node_limit = max(0.0, node_limit)
+            self.group_limits = dict(group_limits)
+            self._cond.notify_all()
+        self._global[EGRESS].set_rate(egress_limit)
+        self._global[INGRESS].set_rate(ingress_limit)
+        for bucket in list(self._nodes.values()):
+            bucket.set_rate(self.node_limit)
+        for (group, _), bucket in list(self._groups.items()):
+            bucket.set_rate(self.group_limits.get(group, 0))
+
+    def _buckets(self, ip: str | None, direction: str) -> list[TokenBucket]:
+        buckets = [self._global[direction]]
+        if ip is None:
+            return buckets
+        with self._cond:
+            if self.node_limit > 0:
+                buckets.append(self._nodes.setdefault((ip, direction), TokenBucket(self.node_limit)))
+            group = self.group_of(ip) if self.group_of else None
+            if group and self.group_limits.get(group, 0) > 0:
+                buckets.append(self._groups.setdefault((group, direction),
+                                                       TokenBucket(self.group_limits[group])))
+        return buckets
+
+    def _ticket(self, ip: str | None, priority: int, nbytes: int) -> tuple[int, float, int]:
+        expected = self.estimate_of(ip, nbytes) if self.estimate_of and ip and nbytes else None
+        return priority, time.monotonic() + (expected or 0.0), next(self._seq)
+
+    def _acquire_slot(self, ticket: tuple[int, float, int], label: str) -> None:
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            if self.max_concurrent and self._active >= self.max_concurrent:
+                self._log(f"传输排队: {label}（进行中 {self._active}，排队 {len(self._waiting)}）")
+            while self._waiting[0] != ticket or (
+                    self.max_concurrent and self._active >= self.max_concurrent):
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._active += 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def transfer(self, ip: str | None, direction: str = EGRESS,
+                 priority: int = PRIORITY_BULK, label: str = '',
+                 queue: bool = True, nbytes: int = 0,
+                 rate_limit: float = 0) -> Iterator[ScheduledTransfer]:
+        """占用一个传输名额，在 with 块中进行传输。
+
+        ip 为 None 时（如接力分发的多个种子节点）只受全局预算限制。
+        queue=False 时不排队等待名额（对端等待就绪的超时很短时使用，如接收
+        客户端的备份），但仍计入进行中的传输并受限速约束。
+        nbytes 为要传输的字节数（已知时），用于按带宽估计用时排队。
+        rate_limit 大于 0 时本次传输另按该速率（字节/秒）限速。
+        """
+        if queue:
+            self._acquire_slot(self._ticket(ip, priority, nbytes), label or ip or '')
+        else:
+            with self._cond:
+                self._active += 1
+        try:
+            buckets = self._buckets(ip, direction)
+            if rate_limit > 0:
+                buckets.append(TokenBucket(rate_limit))
+            yield ScheduledTransfer(buckets)
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
@@ -3,23 +3,47 @@
 """
 服务端更新管理器
 支持版本管理、增量更新、批量推送
+
+存储结构：
+    updates/objects/<md5>          按内容寻址的文件对象，各版本共用
+    updates/manifests/<版本>.json   版本清单 {相对路径: {md5, blake2b, size}}
+    updates/packages/client_v<版本>.zip   全量包，首次使用时由对象生成并缓存
+    updates/packages/client_v<版本>.compression.json   全量包的压缩统计
 """
 
 import os
 import json
 import hashlib
+import uuid
 import zipfile
 import threading
-import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from typing import Any
 
+from shared.protocol import MANIFEST_HASHES, NODE_LOCAL_FILES, PACKAGE_DIRS, PACKAGE_ROOT_FILES
+from .block_delta import make_delta, apply_delta
+from .byte_cache import ByteLRUCache
+from .compression import DEFAULT_PROFILE, CompressionPolicy, CompressionStats, format_report, write_zip_entry
+from .merkle import dir_hashes
+
+# 差异大于新文件的该比例时直接发送整个文件
+DELTA_MAX_RATIO = 0.8
+# 新旧文件任一超过该大小时不计算差异，直接发送整个文件
+DELTA_MAX_SIZE = 16 * 1024 * 1024
+# 创建更新包时并行计算哈希的线程数
+HASH_WORKERS = 4
+# 内存缓存（全量包、文件对象、差异、构造好的更新内容）的容量
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
 
 class UpdateManager:
     """更新管理器 - 管理客户端版本和更新包"""
 
-    def __init__(self, updates_dir: str | Path | None = None) -> None:
+    def __init__(self, updates_dir: str | Path | None = None,
+                 cache_bytes: int = CACHE_MAX_BYTES,
+                 compression_profile: str = DEFAULT_PROFILE) -> None:
         if updates_dir:
             self.updates_dir = Path(updates_dir)
         else:
@@ -28,8 +52,27 @@ class UpdateManager:
         self.updates_dir.mkdir(parents=True, exist_ok=True)
 
         self.version_file = self.updates_dir / 'version.json'
+        self.objects_dir = self.updates_dir / 'objects'
+        self.manifests_dir = self.updates_dir / 'manifests'
+        self.packages_dir = self.updates_dir / 'packages'
+        self.deltas_dir = self.updates_dir / 'deltas'
+        for directory in (self.objects_dir, self.manifests_dir, self.packages_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        self._package_lock = threading.Lock()
         self._lock = threading.Lock()
         self.version_info: dict[str, Any] = self._load_version_info()
+        # 生成全量包时的压缩档位（全量包由所有节点共用）
+        self.compression_profile = compression_profile
+        # 键: ('package', 版本) / ('object', md5) / ('legacy', 版本, 路径) /
+        #     ('delta', 旧md5, 新md5) / ('payload', 版本, ...)（由 UpdateService 构造的更新内容）
+        self.cache = ByteLRUCache(cache_bytes)
+        # 各历史版本的文件索引 {版本: {相对路径: md5}}
+        self._version_files: dict[str, dict[str, str]] = {}
+        # 客户端清单中 blake2b 到 md5 的映射，按需构建，版本变化时失效
+        self._digest_index: dict[str, str] | None = None
+        self._digest_lock = threading.Lock()
+        # 各版本的目录 Merkle 哈希 {(版本, 算法): {'dirs', 'files'}}
+        self._tree_cache: dict[tuple[str, str], dict[str, dict[str, str]]] = {}
 
     def _load_version_info(self) -> dict[str, Any]:
         if self.version_file.exists():
@@ -81,6 +124,59 @@ class UpdateManager:
                 md5.update(chunk)
         return md5.hexdigest()
 
+    def calculate_file_hash(self, file_path: str | Path, hash_name: str) -> str:
+        hasher = MANIFEST_HASHES[hash_name]()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def _store_object(self, src_file: Path) -> dict[str, Any]:
+        """单次读取源文件：边计算 md5/blake2b 边写入对象库临时文件，内容已存在时丢弃副本。"""
+        md5 = hashlib.md5()
+        blake2b = MANIFEST_HASHES['blake2b']()
+        size = 0
+        tmp_path = self.objects_dir / f'.tmp_{uuid.uuid4().hex}'
+        try:
+            with open(src_file, 'rb') as src, open(tmp_path, 'wb') as dst:
+                for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                    md5.update(chunk)
+                    blake2b.update(chunk)
+                    dst.write(chunk)
+                    size += len(chunk)
+            digest = md5.hexdigest()
+            object_path = self.objects_dir / digest
+            created = not object_path.exists()
+            if created:
+                os.replace(tmp_path, object_path)
+            return {'md5': digest, 'blake2b': blake2b.hexdigest(), 'size': size, 'created': created}
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _manifest_path(self, version: str) -> Path:
+        return self.manifests_dir / f'{version}.json'
+
+    def _package_path(self, version: str) -> Path:
+        return self.packages_dir / f'client_v{version}.zip'
+
+    def _package_stats_path(self, version: str) -> Path:
+        return self.packages_dir / f'client_v{version}.compression.json'
+
+    def _legacy_package_path(self, version: str) -> Path:
+        """旧存储结构的全量包 updates/client_v<版本>.zip。"""
+        return self.updates_dir / f'client_v{version}.zip'
+
+    def _load_version_manifest(self, version: str) -> dict[str, dict[str, Any]] | None:
+        path = self._manifest_path(version)
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('files', {})
+        except Exception:
+            return None
+
     def create_update_package(self, source_dir: str, version: str,
                                release_notes: str = '',
                                exclude_dirs: list[str] | None = None) -> dict[str, Any]:
@@ -90,84 +186,83 @@ class UpdateManager:
                 if not source_path.exists():
                     return {'status': 'error', 'message': f'源目录不存在: {source_dir}'}
 
-                include_files = [
-                    'client_main.py',
-                    'config.json',
-                    'requirements.txt',
-                    'start.bat'
-                ]
-
-                version_dir = self.updates_dir / f'v{version}'
-                version_dir.mkdir(parents=True, exist_ok=True)
-
-                files_manifest: dict[str, dict[str, Any]] = {}
+                previous_version = self.version_info.get('current_version')
+                previous_files = self.version_info.get('files', {})
 
-                for file_name in include_files:
+                # 收集需要打包的文件 {相对路径: 源文件}
+                sources: dict[str, Path] = {}
+                for file_name in PACKAGE_ROOT_FILES:
                     src_file = source_path / file_name
                     if src_file.exists():
-                        target_file = version_dir / file_name
-                        target_file.parent.mkdir(parents=True, exist_ok=True)
-
-                        with open(src_file, 'rb') as src, open(target_file, 'wb') as dst:
-                            dst.write(src.read())
+                        sources[file_name] = src_file
 
-                        md5 = self.calculate_file_md5(src_file)
-                        files_manifest[file_name] = {
-                            'md5': md5,
-                            'size': src_file.stat().st_size
-                        }
-
-                core_src = source_path / 'core'
-                core_dst = version_dir / 'core'
-                if core_src.exists():
-                    core_dst.mkdir(parents=True, exist_ok=True)
-
-                    for root, dirs, files in os.walk(core_src):
+                for dir_name in PACKAGE_DIRS:
+                    dir_src = source_path / dir_name
+                    if not dir_src.exists():
+                        continue
+                    for root, dirs, files in os.walk(dir_src):
                         dirs[:] = [d for d in dirs if d not in ['__pycache__']]
 
                         for file in files:
                             file_path = Path(root) / file
                             rel_path = file_path.relative_to(source_path)
-                            target_path = version_dir / rel_path
-                            target_path.parent.mkdir(parents=True, exist_ok=True)
-
-                            with open(file_path, 'rb') as src, open(target_path, 'wb') as dst:
-                                dst.write(src.read())
+                            sources[str(rel_path).replace('\\', '/')] = file_path
 
-                            md5 = self.calculate_file_md5(file_path)
-                            files_manifest[str(rel_path).replace('\\', '/')] = {
-                                'md5': md5,
-                                'size': file_path.stat().st_size
-                            }
+                # 并行计算哈希并写入对象库，每个文件只读一次
+                files_manifest: dict[str, dict[str, Any]] = {}
+                new_objects = 0
+                with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+                    for rel_path, info in zip(sources, pool.map(self._store_object, sources.values())):
+                        new_objects += info.pop('created')
+                        files_manifest[rel_path] = info
+
+                release_date = datetime.now().strftime('%Y-%m-%d')
+                with open(self._manifest_path(version), 'w', encoding='utf-8') as f:
+                    json.dump({
+                        'version': version,
+                        'release_date': release_date,
+                        'release_notes': release_notes,
+                        'files': files_manifest
+                    }, f, indent=2, ensure_ascii=False)
 
                 self.version_info['current_version'] = version
-                self.version_info['release_date'] = datetime.now().strftime('%Y-%m-%d')
+                self.version_info['release_date'] = release_date
                 self.version_info['release_notes'] = release_notes
                 self.version_info['files'] = files_manifest
                 self._save_version_info()
-
-                zip_path = self.updates_dir / f'client_v{version}.zip'
-                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for file_name in include_files:
-                        file_path = version_dir / file_name
-                        if file_path.exists():
-                            zipf.write(file_path, file_name)
-
-                    core_dir = version_dir / 'core'
-                    if core_dir.exists():
-                        for root, dirs, files in os.walk(core_dir):
-                            dirs[:] = [d for d in dirs if d not in ['__pycache__']]
-                            for file in files:
-                                file_path = Path(root) / file
-                                arcname = file_path.relative_to(version_dir)
-                                zipf.write(file_path, arcname)
+                self._version_files.pop(version, None)
+                self._digest_index = None
+                self._drop_tree_cache(version)
+                self._invalidate_cache(version)
+
+                # 同一版本号重新创建时，旧的全量包（包括旧存储结构的）缓存失效
+                package_path = self._package_path(version)
+                for path in (package_path, self._package_stats_path(version),
+                             self._legacy_package_path(version)):
+                    if path.exists():
+                        path.unlink()
+
+                # 上一版本到新版本的块级差异在后台线程中预先计算，不占用版本锁；
+                # 推送时尚未算好的由 get_file_delta 按需计算
+                changed: list[tuple[str, str]] = []
+                if previous_version and previous_version != version:
+                    for rel_path, info in files_manifest.items():
+                        old_md5 = previous_files.get(rel_path, {}).get('md5')
+                        if old_md5 and old_md5 != info['md5'] and info.get('size', 0) <= DELTA_MAX_SIZE:
+                            changed.append((rel_path, old_md5))
+                if changed:
+                    threading.Thread(target=self._precompute_deltas, args=(version, changed),
+                                     name='delta-precompute', daemon=True).start()
 
                 return {
                     'status': 'success',
                     'message': f'更新包创建成功: v{version}',
                     'version': version,
                     'files_count': len(files_manifest),
-                    'package_path': str(zip_path)
+                    'new_objects': new_objects,
+                    'reused_objects': len(files_manifest) - new_objects,
+                    'deltas_pending': len(changed),
+                    'package_path': str(package_path)
                 }
 
             except Exception as e:
@@ -213,14 +308,17 @@ class UpdateManager:
             files_to_update = []
             files_to_delete = []
 
+            # 节点本地的配置和版本记录不参与比较（客户端也不会覆盖它们）
             for file_path, file_info in server_files.items():
+                if file_path in NODE_LOCAL_FILES:
+                    continue
                 if file_path not in client_files:
                     files_to_update.append(file_path)
                 elif client_files.get(file_path) != file_info.get('md5'):
                     files_to_update.append(file_path)
 
             for file_path in client_files:
-                if file_path not in server_files:
+                if file_path not in server_files and file_path not in NODE_LOCAL_FILES:
                     files_to_delete.append(file_path)
 
             return {
@@ -236,56 +334,284 @@ class UpdateManager:
         except Exception as e:
             return {'status': 'error', 'message': f'获取更新清单失败: {str(e)}'}
 
+    def to_md5_manifest(self, client_files: dict[str, str],
+                        hash_name: str = 'md5') -> dict[str, str]:
+        """把客户端按其他算法上报的清单换算成 md5 清单。
+
+        只有服务端存储过的内容能换算；其余文件保留为 "算法:哈希"，
+        与任何 md5 都不相等，按已变化处理。
+        """
+        if hash_name == 'md5':
+            return client_files
+        with self._digest_lock:
+            if self._digest_index is None:
+                self._digest_index = self._build_digest_index()
+            index = self._digest_index
+        return {path: index.get(digest, f'{hash_name}:{digest}') for path, digest in client_files.items()}
+
+    def get_manifest_tree(self, version: str | None = None,
+                          hash_name: str = 'blake2b') -> dict[str, dict[str, str]] | None:
+        """获取某个版本的 {'dirs': 目录 Merkle 哈希, 'files': 文件哈希}（不含节点本地文件），按版本缓存。"""
+        version = version or self.get_current_version()
+        key = (version, hash_name)
+        with self._digest_lock:
+            tree = self._tree_cache.get(key)
+        if tree is not None:
+            return tree
+
+        if version == self.get_current_version():
+            infos = self.version_info.get('files', {})
+        else:
+            infos = self._load_version_manifest(version)
+        if infos is None:
+            return None
+        files: dict[str, str] = {}
+        for path, info in infos.items():
+            if path in NODE_LOCAL_FILES:
+                continue
+            digest = info.get(hash_name)
+            if not digest:
+                # 早期版本清单没有 blake2b，按对象内容补算
+                object_path = self.objects_dir / info.get('md5', '')
+                if not object_path.is_file():
+                    return None
+                digest = self.calculate_file_hash(object_path, hash_name)
+            files[path] = digest
+
+        tree = {'dirs': dir_hashes(files), 'files': files}
+        with self._digest_lock:
+            self._tree_cache[key] = tree
+        return tree
+
+    def _drop_tree_cache(self, version: str) -> None:
+        with self._digest_lock:
+            for key in [k for k in self._tree_cache if k[0] == version]:
+                del self._tree_cache[key]
+
+    def _build_digest_index(self) -> dict[str, str]:
+        infos = list(self.version_info.get('files', {}).values())
+        for version in self.list_versions():
+            infos.extend((self._load_version_manifest(version) or {}).values())
+        index: dict[str, str] = {}
+        for info in infos:
+            md5 = info.get('md5')
+            digest = info.get('blake2b')
+            if md5 and not digest:
+                # 早期版本清单没有 blake2b，按对象内容补算
+                object_path = self.objects_dir / md5
+                if object_path.exists():
+                    digest = self.calculate_file_hash(object_path, 'blake2b')
+            if md5 and digest:
+                index[digest] = md5
+        return index
+
     def get_file_content(self, file_path: str,
                           version: str | None = None) -> bytes | None:
         try:
-            if version:
-                version_dir = self.updates_dir / f'v{version}'
+            version = version or self.get_current_version()
+            md5 = self._get_version_files(version).get(file_path)
+            object_path = self.objects_dir / md5 if md5 else None
+            if object_path is not None:
+                content = self.cache.get_or_load(
+                    ('object', md5), lambda: object_path.read_bytes() if object_path.exists() else None)
+                if content is not None:
+                    return content
+
+            # 旧存储结构：updates/v<版本>/ 下的完整副本
+            file_full_path = self.updates_dir / f'v{version}' / file_path
+            return self.cache.get_or_load(
+                ('legacy', version, file_path),
+                lambda: file_full_path.read_bytes() if file_full_path.exists() else None)
+        except Exception:
+            return None
+
+    def _get_version_files(self, version: str) -> dict[str, str]:
+        """获取某个已存储版本的文件索引 {相对路径: md5}（按需加载并缓存）。"""
+        if version == self.get_current_version():
+            return {path: info.get('md5') for path, info in self.version_info.get('files', {}).items()}
+        files = self._version_files.get(version)
+        if files is None:
+            manifest = self._load_version_manifest(version)
+            if manifest is not None:
+                files = {path: info.get('md5') for path, info in manifest.items()}
             else:
-                version = self.version_info.get('current_version', '1.0.0')
+                # 旧存储结构没有清单，逐个计算
+                files = {}
                 version_dir = self.updates_dir / f'v{version}'
-
-            file_full_path = version_dir / file_path
-            if file_full_path.exists():
-                with open(file_full_path, 'rb') as f:
-                    return f.read()
+                if version_dir.is_dir():
+                    for root, dirs, names in os.walk(version_dir):
+                        dirs[:] = [d for d in dirs if d != '__pycache__']
+                        for name in names:
+                            file_path = Path(root) / name
+                            rel_path = str(file_path.relative_to(version_dir)).replace('\\', '/')
+                            files[rel_path] = self.calculate_file_md5(file_path)
+            self._version_files[version] = files
+        return files
+
+    def _find_stored_file(self, file_path: str, md5: str) -> Path | None:
+        """按内容查找已存储的文件：先查对象库，再查旧存储结构的各版本目录。"""
+        object_path = self.objects_dir / md5
+        if object_path.exists():
+            return object_path
+        for version in self.list_versions():
+            if not (self.updates_dir / f'v{version}').is_dir():
+                continue
+            for other_path, other_md5 in self._get_version_files(version).items():
+                if other_md5 == md5:
+                    return self.updates_dir / f'v{version}' / other_path
+        return None
+
+    def _precompute_deltas(self, version: str, changed: list[tuple[str, str]]) -> None:
+        """后台计算 changed 中各 (相对路径, 旧 md5) 的差异；版本已被替换时停止。"""
+        for rel_path, old_md5 in changed:
+            if self.version_info.get('current_version') != version:
+                return
+            self.get_file_delta(rel_path, old_md5)
+
+    def get_file_delta(self, file_path: str, basis_md5: str) -> bytes | None:
+        """获取把内容为 basis_md5 的旧文件更新为当前版本 file_path 的块级差异。
+
+        差异按（旧 md5, 新 md5）缓存在 updates/deltas 下。找不到旧文件，
+        或差异不比整个文件小多少、新旧文件超过 DELTA_MAX_SIZE 时返回 None，
+        调用方应发送整个文件。
+        """
+        target_info = self.version_info.get('files', {}).get(file_path, {})
+        target_md5 = target_info.get('md5')
+        if not target_md5 or not basis_md5 or basis_md5 == target_md5:
+            return None
+        if target_info.get('size', 0) > DELTA_MAX_SIZE:
             return None
+
+        cache_key = ('delta', basis_md5, target_md5)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached or None
+
+        cache_path = self.deltas_dir / f'{basis_md5}_{target_md5}.delta'
+        try:
+            if cache_path.exists():
+                # 空文件表示已计算过但不划算
+                data = cache_path.read_bytes()
+                self.cache.put(cache_key, data)
+                return data or None
+
+            basis_path = self._find_stored_file(file_path, basis_md5)
+            if basis_path is None or basis_path.stat().st_size > DELTA_MAX_SIZE:
+                return None
+            target = self.get_file_content(file_path)
+            if target is None:
+                return None
+
+            basis = basis_path.read_bytes()
+            delta = make_delta(basis, target)
+            apply_delta(basis, delta)  # 生成后自检一次
+            if len(delta) > len(target) * DELTA_MAX_RATIO:
+                delta = b''
+
+            self.deltas_dir.mkdir(parents=True, exist_ok=True)
+            # 后台预计算和推送时的按需计算可能同时进行，临时文件各自独立
+            tmp_path = cache_path.with_suffix(f'.{uuid.uuid4().hex}.tmp')
+            tmp_path.write_bytes(delta)
+            os.replace(tmp_path, cache_path)
+            self.cache.put(cache_key, delta)
+            return delta or None
         except Exception:
             return None
 
     def get_update_package(self, version: str | None = None) -> bytes | None:
+        """获取全量更新包，首次请求时由对象库生成 zip 并缓存。"""
         try:
-            if version:
-                zip_path = self.updates_dir / f'client_v{version}.zip'
-            else:
-                version = self.version_info.get('current_version', '1.0.0')
-                zip_path = self.updates_dir / f'client_v{version}.zip'
-
-            if zip_path.exists():
-                with open(zip_path, 'rb') as f:
-                    return f.read()
-            return None
+            version = version or self.get_current_version()
+            package_path = self._package_path(version)
+            legacy_path = self._legacy_package_path(version)
+
+            with self._package_lock:
+                if not package_path.exists() and not legacy_path.exists():
+                    files = self._get_version_files(version)
+                    if not files:
+                        return None
+                    tmp_path = package_path.with_suffix('.tmp')
+                    # 每个文件按扩展名和采样探测选择存储、deflate 或 LZMA
+                    policy = CompressionPolicy(self.compression_profile)
+                    stats = CompressionStats()
+                    with zipfile.ZipFile(tmp_path, 'w') as zipf:
+                        for rel_path, md5 in sorted(files.items()):
+                            object_path = self.objects_dir / md5
+                            if object_path.exists():
+                                write_zip_entry(zipf, policy, stats, rel_path, path=object_path)
+                            else:
+                                content = self.get_file_content(rel_path, version)
+                                if content is None:
+                                    raise FileNotFoundError(rel_path)
+                                write_zip_entry(zipf, policy, stats, rel_path, data=content)
+                    os.replace(tmp_path, package_path)
+                    report = dict(stats.report(), profile=policy.profile)
+                    self._package_stats_path(version).write_text(json.dumps(report), encoding='utf-8')
+
+            path = package_path if package_path.exists() else legacy_path
+            return self.cache.get_or_load(('package', version), path.read_bytes)
         except Exception:
             return None
 
+    def get_package_compression(self, version: str | None = None) -> str | None:
+        """全量包的压缩统计（档位、各压缩方式的文件数、节省的字节和 CPU 时间），未生成时返回 None。"""
+        path = self._package_stats_path(version or self.get_current_version())
+        try:
+            report = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+        return f"{report.get('profile', DEFAULT_PROFILE)} 档，{format_report(report)}"
+
+    def _invalidate_cache(self, version: str) -> None:
+        """版本创建或删除后，丢弃该版本的全量包和所有构造好的更新内容。"""
+        self.cache.invalidate(
+            lambda key: key[0] == 'payload' or (key[0] in ('package', 'legacy') and key[1] == version))
+
+    def get_cache_stats(self) -> dict[str, Any]:
+        return self.cache.stats()
+
     def list_versions(self) -> list[str]:
-        versions = []
+        versions = {item.stem for item in self.manifests_dir.glob('*.json')}
         for item in self.updates_dir.iterdir():
             if item.is_dir() and item.name.startswith('v'):
-                versions.append(item.name[1:])
+                versions.add(item.name[1:])
         return sorted(versions, reverse=True)
 
+    def _collect_garbage(self) -> int:
+        """删除不再被任何版本清单引用的对象。"""
+        referenced = {info.get('md5') for info in self.version_info.get('files', {}).values()}
+        for version in self.list_versions():
+            referenced.update(self._get_version_files(version).values())
+        removed = 0
+        for object_path in self.objects_dir.iterdir():
+            if object_path.name not in referenced:
+                try:
+                    object_path.unlink()
+                    self.cache.invalidate(lambda key: key == ('object', object_path.name))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
     def delete_version(self, version: str) -> dict[str, Any]:
         import shutil
         try:
             version_dir = self.updates_dir / f'v{version}'
-            zip_path = self.updates_dir / f'client_v{version}.zip'
+            zip_path = self._legacy_package_path(version)
 
             if version_dir.exists():
                 shutil.rmtree(version_dir)
-            if zip_path.exists():
-                zip_path.unlink()
-
-            return {'status': 'success', 'message': f'版本 v{version} 已删除'}
+            self._version_files.pop(version, None)
+            self._digest_index = None
+            self._drop_tree_cache(version)
+            self._invalidate_cache(version)
+            for path in (zip_path, self._package_path(version), self._package_stats_path(version),
+                         self._manifest_path(version)):
+                if path.exists():
+                    path.unlink()
+
+            with self._lock:
+                removed = self._collect_garbage()
+            return {'status': 'success', 'message': f'版本 v{version} 已删除，清理对象 {removed} 个'}
         except Exception as e:
             return {'status': 'error', 'message': f'删除失败: {str(e)}'}
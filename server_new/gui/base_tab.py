@@ -28,6 +28,7 @@ class ServiceContainer:
         self.update_service: Any = None
         self.monitor_service: Any = None
         self.log_service: Any = None
+        self.command_service: Any = None
 
     def log(self, message: str) -> None:
         if self.log_callback:
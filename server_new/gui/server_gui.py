@@ -10,6 +10,11 @@ from typing import Any
 
 from core.node_manager import NodeManager
 from core.network_manager import NetworkManager
+from core.transfer_scheduler import TransferScheduler
+from core.connection_pool import ConnectionPool
+from core.node_health import NodeHealth
+from core.node_metrics import NodeMetrics
+from core.compression import DEFAULT_PROFILE
 from core.logger import Logger
 from core.update_manager import UpdateManager
 from gui.base_tab import ServiceContainer
@@ -28,6 +33,7 @@ from services.file_service import FileService
 from services.update_service import UpdateService
 from services.monitor_service import MonitorService
 from services.log_service import LogService
+from services.command_service import CommandService
 
 
 class ServerGUI:
@@ -44,13 +50,29 @@ class ServerGUI:
 
         self.node_manager = NodeManager()
         self.logger = Logger(Path(__file__).parent.parent / 'logs')
-        self.update_manager = UpdateManager()
+        compression = self.config.get('compression', {})
+        self.update_manager = UpdateManager(
+            compression_profile=compression.get('default_profile', DEFAULT_PROFILE))
 
+        node_metrics = NodeMetrics.from_config(self.config.get('node_metrics', {}))
         self.network = NetworkManager(
             self.config['server']['command_port'],
             self.config['server']['monitor_port'],
             self.node_manager,
-            self._log_message
+            self._log_message,
+            scheduler=TransferScheduler.from_config(
+                self.config.get('transfer', {}),
+                group_of=self.node_manager.get_node_group,
+                estimate_of=node_metrics.estimate_seconds,
+                log_callback=self._log_message
+            ),
+            compression=compression,
+            connection_pool=ConnectionPool.from_config(
+                self.config.get('connection_pool', {}),
+                health=NodeHealth(self.node_manager, log_callback=self._log_message, metrics=node_metrics),
+                log_callback=self._log_message
+            ),
+            node_metrics=node_metrics
         )
 
         self.services = ServiceContainer(
@@ -62,12 +84,13 @@ class ServerGUI:
         self.services.refresh_callback = self._refresh_all_tabs
 
         # 创建 Service 层实例并注入到容器
-        self.services.node_service = NodeService(self.node_manager)
+        self.services.node_service = NodeService(self.node_manager, self.network)
         self.services.task_service = TaskService(self.node_manager, self.network, self.logger)
         self.services.file_service = FileService(self.node_manager, self.network, self.logger)
         self.services.update_service = UpdateService(self.node_manager, self.network, self.update_manager)
         self.services.monitor_service = MonitorService(self.node_manager, self.network, self.logger)
         self.services.log_service = LogService(self.logger)
+        self.services.command_service = CommandService(self.node_manager, self.network, self.logger)
 
         self._create_ui()
 
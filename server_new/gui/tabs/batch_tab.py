@@ -21,6 +21,13 @@ class BatchTab(BaseTab):
         self.batch_remote_var: Optional[tk.StringVar] = None
         self.batch_result_text: Optional[scrolledtext.ScrolledText] = None
         self.batch_selected_label: Optional[ttk.Label] = None
+        self.batch_relay_var: Optional[tk.BooleanVar] = None
+        self.batch_seeds_var: Optional[tk.StringVar] = None
+        self.batch_fanout_var: Optional[tk.StringVar] = None
+        self.batch_parallel_var: Optional[tk.BooleanVar] = None
+        self.sync_dir_var: Optional[tk.StringVar] = None
+        self.sync_remote_var: Optional[tk.StringVar] = None
+        self.sync_delete_var: Optional[tk.BooleanVar] = None
         super().__init__(notebook, title, services)
 
     def _create_widgets(self) -> None:
@@ -81,8 +88,39 @@ class BatchTab(BaseTab):
         ttk.Entry(remote_frame, textvariable=self.batch_remote_var, width=30).pack(side=tk.LEFT, padx=5)
         ttk.Label(remote_frame, text="（留空则使用原文件名）", foreground="gray").pack(side=tk.LEFT, padx=5)
 
+        relay_frame = ttk.LabelFrame(self.frame, text="接力分发（服务端只发给种子节点，由节点逐级转发）")
+        relay_frame.pack(fill=tk.X, padx=5, pady=5)
+
+        self.batch_relay_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(relay_frame, text="启用接力", variable=self.batch_relay_var).pack(side=tk.LEFT, padx=5)
+        ttk.Label(relay_frame, text="种子节点数:").pack(side=tk.LEFT, padx=5)
+        self.batch_seeds_var = tk.StringVar(value="2")
+        ttk.Entry(relay_frame, textvariable=self.batch_seeds_var, width=5).pack(side=tk.LEFT)
+        ttk.Label(relay_frame, text="每节点转发数:").pack(side=tk.LEFT, padx=5)
+        self.batch_fanout_var = tk.StringVar(value="2")
+        ttk.Entry(relay_frame, textvariable=self.batch_fanout_var, width=5).pack(side=tk.LEFT)
+        ttk.Label(relay_frame, text="（转发数为1时为流水线链）", foreground="gray").pack(side=tk.LEFT, padx=5)
+        self.batch_parallel_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(relay_frame, text="大文件多连接并行传输（不接力时）",
+                        variable=self.batch_parallel_var).pack(side=tk.LEFT, padx=10)
+
         ttk.Button(self.frame, text="开始批量分发", command=self._start_batch).pack(pady=10)
 
+        sync_frame = ttk.LabelFrame(self.frame, text="目录同步（只发送变化的文件）")
+        sync_frame.pack(fill=tk.X, padx=5, pady=5)
+
+        ttk.Label(sync_frame, text="本地目录:").pack(side=tk.LEFT, padx=5)
+        self.sync_dir_var = tk.StringVar()
+        ttk.Entry(sync_frame, textvariable=self.sync_dir_var, width=30).pack(side=tk.LEFT, padx=5)
+        ttk.Button(sync_frame, text="浏览", command=self._browse_dir).pack(side=tk.LEFT, padx=5)
+        ttk.Label(sync_frame, text="节点目录名:").pack(side=tk.LEFT, padx=5)
+        self.sync_remote_var = tk.StringVar()
+        ttk.Entry(sync_frame, textvariable=self.sync_remote_var, width=15).pack(side=tk.LEFT, padx=5)
+        self.sync_delete_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(sync_frame, text="删除节点上多余的文件",
+                        variable=self.sync_delete_var).pack(side=tk.LEFT, padx=5)
+        ttk.Button(sync_frame, text="开始目录同步", command=self._start_sync).pack(side=tk.LEFT, padx=10)
+
         result_frame = ttk.LabelFrame(self.frame, text="分发结果")
         result_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
@@ -124,26 +162,22 @@ class BatchTab(BaseTab):
             if not self.batch_remote_var.get():
                 self.batch_remote_var.set(Path(path).name)
 
-    def _start_batch(self) -> None:
-        file_path = self.batch_file_var.get()
-        if not file_path:
-            messagebox.showerror("错误", "请选择要分发的文件")
-            return
-        if not Path(file_path).exists():
-            messagebox.showerror("错误", "选择的文件不存在")
-            return
-
-        remote_path = self.batch_remote_var.get().strip()
-        if not remote_path:
-            remote_path = Path(file_path).name
+    def _browse_dir(self) -> None:
+        path = filedialog.askdirectory(title="选择要同步的目录")
+        if path:
+            self.sync_dir_var.set(path)
+            if not self.sync_remote_var.get():
+                self.sync_remote_var.set(Path(path).name)
 
+    def _get_target_ips(self) -> list[str] | None:
+        """按分发模式取目标节点，出错时提示并返回 None。"""
         mode = self.batch_mode_var.get()
 
         if mode == "selected":
             selected_indices = self.batch_node_listbox.curselection()
             if not selected_indices:
                 messagebox.showerror("错误", "请选择目标节点")
-                return
+                return None
             target_ips = []
             for index in selected_indices:
                 text = self.batch_node_listbox.get(index)
@@ -154,17 +188,50 @@ class BatchTab(BaseTab):
             target_ips, error = resolve_targets(mode, single_ip, group_name, self.services.node_manager)
             if error:
                 messagebox.showerror("错误", error)
-                return
+                return None
 
         if not target_ips:
             messagebox.showerror("错误", "没有可用的目标节点")
+            return None
+        return target_ips
+
+    def _start_batch(self) -> None:
+        file_path = self.batch_file_var.get()
+        if not file_path:
+            messagebox.showerror("错误", "请选择要分发的文件")
+            return
+        if not Path(file_path).exists():
+            messagebox.showerror("错误", "选择的文件不存在")
+            return
+
+        remote_path = self.batch_remote_var.get().strip()
+        if not remote_path:
+            remote_path = Path(file_path).name
+
+        target_ips = self._get_target_ips()
+        if not target_ips:
             return
 
+        relay = self.batch_relay_var.get()
+        parallel = self.batch_parallel_var.get()
+        if relay:
+            try:
+                seeds = max(1, int(self.batch_seeds_var.get()))
+                fanout = max(1, int(self.batch_fanout_var.get()))
+            except ValueError:
+                messagebox.showerror("错误", "种子节点数和转发数必须为整数")
+                return
+
         self.batch_result_text.insert(tk.END, f"[{datetime.datetime.now()}] 开始批量分发到 {len(target_ips)} 个节点...\n")
         self.batch_result_text.see(tk.END)
 
         def do_batch():
-            result = self.services.file_service.transfer_file_to_multiple(target_ips, file_path, remote_path)
+            if relay:
+                result = self.services.file_service.transfer_file_relay(
+                    target_ips, file_path, remote_path, seeds, fanout)
+            else:
+                result = self.services.file_service.transfer_file_to_multiple(
+                    target_ips, file_path, remote_path, parallel)
             for ip, r in result['results'].items():
                 if r and r.get('status') == 'success':
                     self.batch_result_text.insert(tk.END, f"[{datetime.datetime.now()}] {ip}: 成功 - {r.get('message', '')}\n")
@@ -176,3 +243,42 @@ class BatchTab(BaseTab):
             self.batch_result_text.see(tk.END)
 
         self.run_async(do_batch)
+
+    def _start_sync(self) -> None:
+        local_dir = self.sync_dir_var.get()
+        if not local_dir:
+            messagebox.showerror("错误", "请选择要同步的目录")
+            return
+        if not Path(local_dir).is_dir():
+            messagebox.showerror("错误", "选择的目录不存在")
+            return
+        remote_dir = self.sync_remote_var.get().strip() or Path(local_dir).name
+
+        target_ips = self._get_target_ips()
+        if not target_ips:
+            return
+        delete = self.sync_delete_var.get()
+
+        self.batch_result_text.insert(tk.END, f"[{datetime.datetime.now()}] 开始同步目录 {remote_dir} 到 {len(target_ips)} 个节点...\n")
+        self.batch_result_text.see(tk.END)
+
+        def do_sync():
+            result = self.services.file_service.sync_directory(target_ips, local_dir, remote_dir, delete)
+            if result.get('status') == 'error':
+                self.batch_result_text.insert(tk.END, f"[{datetime.datetime.now()}] 目录同步失败: {result.get('message')}\n")
+                self.batch_result_text.see(tk.END)
+                return
+            for ip, r in result['results'].items():
+                if r and r.get('status') == 'success':
+                    self.batch_result_text.insert(tk.END, f"[{datetime.datetime.now()}] {ip}: 成功 - {r.get('message', '')}\n")
+                else:
+                    self.batch_result_text.insert(tk.END, f"[{datetime.datetime.now()}] {ip}: 失败 - {r.get('message', '未知错误') if r else '无响应'}\n")
+                    for error in (r or {}).get('errors', []):
+                        self.batch_result_text.insert(tk.END, f"    {error}\n")
+                self.batch_result_text.see(tk.END)
+
+            self.batch_result_text.insert(tk.END, f"[{datetime.datetime.now()}] 目录同步完成: 成功 {result['success_count']}, 失败 {result['fail_count']}\n")
+            self.batch_result_text.insert(tk.END, f"    压缩: {result['compression_summary']}\n")
+            self.batch_result_text.see(tk.END)
+
+        self.run_async(do_sync)
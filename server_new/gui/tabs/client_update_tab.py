@@ -21,6 +21,9 @@ class ClientUpdateTab(BaseTab):
         self.client_update_group_var: Optional[tk.StringVar] = None
         self.client_update_group_combo: Optional[ttk.Combobox] = None
         self.client_update_result_text: Optional[scrolledtext.ScrolledText] = None
+        self.rollout_vars: dict[str, tk.Variable] = {}
+        self.stage_rate_var: Optional[tk.StringVar] = None
+        self.push_relay_var: Optional[tk.BooleanVar] = None
         super().__init__(notebook, title, services)
 
     def _create_widgets(self) -> None:
@@ -77,7 +80,53 @@ class ClientUpdateTab(BaseTab):
         btn_frame.pack(fill=tk.X, padx=5, pady=5)
         ttk.Button(btn_frame, text="检查客户端版本", command=self._check_versions).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="推送更新", command=self._push_update).pack(side=tk.LEFT, padx=5)
+        self.push_relay_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(btn_frame, text="接力推送", variable=self.push_relay_var).pack(side=tk.LEFT)
         ttk.Button(btn_frame, text="增量更新（智能）", command=self._smart_update).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="后台预分发", command=self._stage_update).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="激活版本", command=self._activate_update).pack(side=tk.LEFT, padx=5)
+        ttk.Label(btn_frame, text="预分发限速(KB/s, 0不限):").pack(side=tk.LEFT, padx=5)
+        self.stage_rate_var = tk.StringVar(value="0")
+        ttk.Entry(btn_frame, textvariable=self.stage_rate_var, width=6).pack(side=tk.LEFT)
+
+        rollout_frame = ttk.LabelFrame(self.frame, text="分批发布（灰度）")
+        rollout_frame.pack(fill=tk.X, padx=5, pady=5)
+
+        rollout_row1 = ttk.Frame(rollout_frame)
+        rollout_row1.pack(fill=tk.X, padx=5, pady=2)
+        self.rollout_vars = {
+            'mode': tk.StringVar(value="smart"),
+            'canary_percent': tk.StringVar(value="5"),
+            'batch_size': tk.StringVar(value="50"),
+            'max_parallel': tk.StringVar(value="16"),
+            'failure_threshold': tk.StringVar(value="20"),
+            'health_timeout': tk.StringVar(value="120"),
+            'rollback_on_failure': tk.BooleanVar(value=False),
+            'order_by_link': tk.BooleanVar(value=True)
+        }
+        ttk.Radiobutton(rollout_row1, text="增量", variable=self.rollout_vars['mode'], value="smart").pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(rollout_row1, text="全量", variable=self.rollout_vars['mode'], value="full").pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(rollout_row1, text="预分发+激活", variable=self.rollout_vars['mode'], value="staged").pack(side=tk.LEFT, padx=5)
+        for key, label in (('canary_percent', "金丝雀(%):"), ('batch_size', "每批节点数:"),
+                           ('max_parallel', "并发数:"), ('failure_threshold', "失败率阈值(%):"),
+                           ('health_timeout', "健康检查超时(秒):")):
+            ttk.Label(rollout_row1, text=label).pack(side=tk.LEFT, padx=5)
+            ttk.Entry(rollout_row1, textvariable=self.rollout_vars[key], width=5).pack(side=tk.LEFT)
+        ttk.Checkbutton(rollout_row1, text="失败时自动回滚",
+                        variable=self.rollout_vars['rollback_on_failure']).pack(side=tk.LEFT, padx=10)
+        ttk.Checkbutton(rollout_row1, text="链路好的节点先更新",
+                        variable=self.rollout_vars['order_by_link']).pack(side=tk.LEFT, padx=5)
+
+        rollout_row2 = ttk.Frame(rollout_frame)
+        rollout_row2.pack(fill=tk.X, padx=5, pady=2)
+        ttk.Button(rollout_row2, text="开始分批发布", command=self._start_rollout).pack(side=tk.LEFT, padx=5)
+        ttk.Button(rollout_row2, text="暂停", command=self._pause_rollout).pack(side=tk.LEFT, padx=5)
+        ttk.Button(rollout_row2, text="继续", command=self._resume_rollout).pack(side=tk.LEFT, padx=5)
+        ttk.Button(rollout_row2, text="终止", command=self._abort_rollout).pack(side=tk.LEFT, padx=5)
+        ttk.Button(rollout_row2, text="发布状态", command=self._show_rollout_status).pack(side=tk.LEFT, padx=5)
+
+        self.services.update_service.set_rollout_callback(
+            lambda text: self._append_result(f"[{datetime.datetime.now()}] {text}\n"))
 
         result_frame = ttk.LabelFrame(self.frame, text="更新结果")
         result_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -101,6 +150,13 @@ class ClientUpdateTab(BaseTab):
         self._append_result(f"发布日期: {version_info.get('release_date', 'N/A')}\n")
         self._append_result(f"更新说明: {version_info.get('release_notes', 'N/A')}\n")
         self._append_result(f"文件数量: {len(version_info.get('files', {}))}\n")
+        stats = self.services.update_service.get_cache_stats()
+        self._append_result(f"更新缓存: {stats['entries']} 项, {stats['bytes'] / 1024 / 1024:.1f}/"
+                            f"{stats['max_bytes'] / 1024 / 1024:.0f} MB, 命中率 {stats['hit_rate']:.1%} "
+                            f"(命中 {stats['hits']}, 未命中 {stats['misses']}, 淘汰 {stats['evictions']})\n")
+        compression = self.services.update_service.get_package_compression()
+        if compression:
+            self._append_result(f"全量包压缩: {compression}\n")
 
     def _browse_source(self) -> None:
         path = filedialog.askdirectory(title="选择客户端源目录")
@@ -125,7 +181,7 @@ class ClientUpdateTab(BaseTab):
             if result['status'] == 'success':
                 self._append_result(f"[{datetime.datetime.now()}] {result['message']}\n")
                 self._append_result(f"  文件数量: {result.get('files_count', 0)}\n")
-                self._append_result(f"  ZIP包: {result.get('package_path', 'N/A')}\n")
+                self._append_result(f"  新增对象: {result.get('new_objects', 0)}, 复用对象: {result.get('reused_objects', 0)}\n")
                 if result.get('exe_path'):
                     self._append_result(f"  EXE文件: {result.get('exe_path')}\n")
             else:
@@ -171,10 +227,14 @@ class ClientUpdateTab(BaseTab):
             messagebox.showerror("错误", "没有可用的目标节点")
             return
 
-        self._append_result(f"[{datetime.datetime.now()}] 开始推送更新到 {len(target_ips)} 个节点...\n")
+        relay = self.push_relay_var.get()
+        self._append_result(f"[{datetime.datetime.now()}] 开始{'接力' if relay else ''}推送更新到 {len(target_ips)} 个节点...\n")
 
         def do_push():
-            result = self.services.update_service.push_full_update(target_ips)
+            if relay:
+                result = self.services.update_service.push_full_update_relay(target_ips)
+            else:
+                result = self.services.update_service.push_full_update(target_ips)
             if result.get('status') == 'error':
                 self._append_result(f"[{datetime.datetime.now()}] 错误: {result.get('message')}\n")
                 return
@@ -199,13 +259,137 @@ class ClientUpdateTab(BaseTab):
 
         self._append_result(f"[{datetime.datetime.now()}] 开始智能增量更新...\n")
 
+        def on_result(ip: str, r: dict) -> None:
+            if r.get('status') == 'success':
+                self._append_result(f"[{datetime.datetime.now()}] {ip}: {r.get('message', '更新成功')}\n")
+            else:
+                self._append_result(f"[{datetime.datetime.now()}] {ip}: 失败 - {r.get('message', '未知错误')}\n")
+
         def do_smart():
-            result = self.services.update_service.push_smart_update(target_ips)
-            for ip, r in result['results'].items():
-                if r.get('status') == 'success':
-                    self._append_result(f"[{datetime.datetime.now()}] {ip}: {r.get('message', '更新成功')}\n")
-                else:
-                    self._append_result(f"[{datetime.datetime.now()}] {ip}: 失败 - {r.get('message', '未知错误')}\n")
-            self._append_result(f"[{datetime.datetime.now()}] 智能增量更新完成: 成功 {result['success_count']}, 失败 {result['fail_count']}\n")
+            result = self.services.update_service.push_smart_update(target_ips, on_result)
+            self._append_result(f"[{datetime.datetime.now()}] 智能增量更新完成: 成功 {result['success_count']}, "
+                                f"失败 {result['fail_count']}, 不同文件清单 {result['distinct_manifests']} 种\n")
 
         self.run_async(do_smart)
+
+    def _get_stage_rate(self) -> int | None:
+        try:
+            return max(0, int(self.stage_rate_var.get() or 0)) * 1024
+        except ValueError:
+            messagebox.showerror("错误", "限速必须为整数")
+            return None
+
+    def _stage_update(self) -> None:
+        target_ips, error = self._get_targets()
+        if error:
+            messagebox.showerror("错误", error)
+            return
+        if not target_ips:
+            messagebox.showerror("错误", "没有可用的目标节点")
+            return
+        rate_limit = self._get_stage_rate()
+        if rate_limit is None:
+            return
+
+        self._append_result(f"[{datetime.datetime.now()}] 开始后台预分发到 {len(target_ips)} 个节点...\n")
+
+        def on_result(ip: str, r: dict) -> None:
+            if r.get('status') == 'success':
+                self._append_result(f"[{datetime.datetime.now()}] {ip}: {r.get('message', '预分发完成')}\n")
+            else:
+                self._append_result(f"[{datetime.datetime.now()}] {ip}: 失败 - {r.get('message', '未知错误')}\n")
+
+        def do_stage():
+            result = self.services.update_service.stage_update(target_ips, on_result, rate_limit=rate_limit)
+            self._append_result(f"[{datetime.datetime.now()}] 预分发完成: 成功 {result['success_count']}, "
+                                f"失败 {result['fail_count']}（失败的节点再次预分发会续传）\n")
+
+        self.run_async(do_stage)
+
+    def _activate_update(self) -> None:
+        target_ips, error = self._get_targets()
+        if error:
+            messagebox.showerror("错误", error)
+            return
+        if not target_ips:
+            messagebox.showerror("错误", "没有可用的目标节点")
+            return
+        version = self.services.update_service.get_current_version()
+        if not messagebox.askyesno("确认", f"确定在 {len(target_ips)} 个节点上激活版本 {version} 并重启客户端？"):
+            return
+
+        self._append_result(f"[{datetime.datetime.now()}] 开始激活版本 {version}...\n")
+
+        def on_result(ip: str, r: dict) -> None:
+            if r and r.get('status') == 'success':
+                self._append_result(f"[{datetime.datetime.now()}] {ip}: {r.get('message', '激活成功')}\n")
+            else:
+                msg = r.get('message', '未知错误') if r else '无响应'
+                self._append_result(f"[{datetime.datetime.now()}] {ip}: 激活失败 - {msg}\n")
+
+        def do_activate():
+            result = self.services.update_service.activate_update(target_ips, on_result)
+            self._append_result(f"[{datetime.datetime.now()}] 激活完成: 成功 {result['success_count']}, "
+                                f"失败 {result['fail_count']}\n")
+
+        self.run_async(do_activate)
+
+    # ── 分批发布 ──────────────────────────────────────
+
+    def _start_rollout(self) -> None:
+        target_ips, error = self._get_targets()
+        if error:
+            messagebox.showerror("错误", error)
+            return
+        if not target_ips:
+            messagebox.showerror("错误", "没有可用的目标节点")
+            return
+        try:
+            config = {
+                key: int(var.get()) for key, var in self.rollout_vars.items()
+                if key not in ('mode', 'rollback_on_failure', 'order_by_link')
+            }
+        except ValueError:
+            messagebox.showerror("错误", "分批发布参数必须为整数")
+            return
+        config['mode'] = self.rollout_vars['mode'].get()
+        config['rollback_on_failure'] = self.rollout_vars['rollback_on_failure'].get()
+        config['order_by_link'] = self.rollout_vars['order_by_link'].get()
+        rate_limit = self._get_stage_rate()
+        if rate_limit is None:
+            return
+        config['rate_limit'] = rate_limit
+
+        result = self.services.update_service.start_rollout(target_ips, config)
+        if result.get('status') == 'success':
+            self._append_result(f"[{datetime.datetime.now()}] 分批发布 {result['rollout_id']} 已开始: "
+                                f"{len(target_ips)} 个节点, {result['waves']} 个波次\n")
+        else:
+            messagebox.showerror("错误", result.get('message', '无法开始发布'))
+
+    def _pause_rollout(self) -> None:
+        self.services.update_service.pause_rollout()
+        self._append_result(f"[{datetime.datetime.now()}] 已请求暂停，当前波次完成后生效\n")
+
+    def _resume_rollout(self) -> None:
+        result = self.services.update_service.resume_rollout()
+        if result.get('status') == 'success':
+            self._append_result(f"[{datetime.datetime.now()}] 分批发布 {result['rollout_id']} 已继续\n")
+        else:
+            messagebox.showerror("错误", result.get('message', '无法继续发布'))
+
+    def _abort_rollout(self) -> None:
+        self.services.update_service.abort_rollout()
+        self._append_result(f"[{datetime.datetime.now()}] 已请求终止分批发布\n")
+
+    def _show_rollout_status(self) -> None:
+        status = self.services.update_service.get_rollout_status()
+        if not status:
+            self._append_result("没有分批发布记录\n")
+            return
+        counts = ', '.join(f"{k}: {v}" for k, v in sorted(status['counts'].items()))
+        self._append_result(
+            f"分批发布 {status['id']} (v{status['version']}): {status['status']} "
+            f"波次 {status['current_wave']}/{status['total_waves']}  {counts}"
+            f"{'  ' + status['message'] if status['message'] else ''}\n"
+        )
@@ -17,6 +17,7 @@ class FileTransferTab(BaseTab):
         self.update_file_var: Optional[tk.StringVar] = None
         self.update_remote_var: Optional[tk.StringVar] = None
         self.update_result_text: Optional[scrolledtext.ScrolledText] = None
+        self.parallel_var: Optional[tk.BooleanVar] = None
         super().__init__(notebook, title, services)
 
     def _create_widgets(self) -> None:
@@ -43,6 +44,12 @@ class FileTransferTab(BaseTab):
         ttk.Entry(remote_frame, textvariable=self.update_remote_var, width=50).pack(side=tk.LEFT, padx=5)
         ttk.Label(remote_frame, text="（文件将保存到客户端的 Transfer Files 文件夹）", foreground="gray").pack(side=tk.LEFT, padx=5)
 
+        option_frame = ttk.Frame(self.frame)
+        option_frame.pack(fill=tk.X, padx=5, pady=5)
+        self.parallel_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(option_frame, text="大文件多连接并行传输", variable=self.parallel_var).pack(side=tk.LEFT, padx=5)
+        ttk.Label(option_frame, text="（64MB 以上的文件分段发送，连接数按实测吞吐量自动调整）", foreground="gray").pack(side=tk.LEFT, padx=5)
+
         ttk.Button(self.frame, text="开始传输", command=self._start_transfer).pack(pady=10)
 
         result_frame = ttk.LabelFrame(self.frame, text="传输结果")
@@ -81,14 +88,16 @@ class FileTransferTab(BaseTab):
         if not remote_path:
             remote_path = Path(file_path).name
 
-        self.run_async(lambda: self._do_transfer(target_ip, file_path, remote_path))
+        parallel = self.parallel_var.get()
+        self.run_async(lambda: self._do_transfer(target_ip, file_path, remote_path, parallel))
 
-    def _do_transfer(self, target_ip: str, file_path: str, remote_path: str) -> None:
+    def _do_transfer(self, target_ip: str, file_path: str, remote_path: str,
+                     parallel: bool = False) -> None:
         now_str = f"[{datetime.datetime.now()}]"
         self.update_result_text.insert(tk.END, f"{now_str} {target_ip}: 开始传输文件...\n")
         self.update_result_text.see(tk.END)
 
-        result = self.services.file_service.transfer_file(target_ip, file_path, remote_path)
+        result = self.services.file_service.transfer_file(target_ip, file_path, remote_path, parallel)
 
         now_str = f"[{datetime.datetime.now()}]"
         message = result.get('message', str(result))
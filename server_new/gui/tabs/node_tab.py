@@ -23,12 +23,12 @@ class NodeTab(BaseTab):
         tree_frame = ttk.Frame(self.frame)
         tree_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
-        columns = ('IP', '操作系统', '状态', '最后心跳')
+        columns = ('IP', '操作系统', '状态', '最后心跳', '连接', 'RTT', '时钟偏差', '带宽')
         self.node_tree = ttk.Treeview(tree_frame, columns=columns, show='headings')
 
         for col in columns:
             self.node_tree.heading(col, text=col)
-            self.node_tree.column(col, width=200)
+            self.node_tree.column(col, width=110 if col in ('RTT', '时钟偏差', '带宽') else 200)
 
         scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.node_tree.yview)
         self.node_tree.configure(yscrollcommand=scrollbar.set)
@@ -60,15 +60,38 @@ class NodeTab(BaseTab):
 
         nodes = self.get_all_nodes()
         online_nodes = self.get_online_nodes()
+        connections = self.services.node_service.get_connection_states()
+        links = self.services.node_service.get_link_metrics()
 
         for ip, node in nodes.items():
             status = '在线' if ip in online_nodes else '离线'
             last_heartbeat = datetime.datetime.fromtimestamp(node['last_heartbeat']).strftime("%Y-%m-%d %H:%M:%S")
-            self.node_tree.insert('', 'end', values=(ip, node.get('os', 'Unknown'), status, last_heartbeat))
+            link = links.get(ip, {})
+            self.node_tree.insert('', 'end', values=(ip, node.get('os', 'Unknown'), status, last_heartbeat,
+                                                     connections.get(ip, ''), link.get('rtt', ''),
+                                                     link.get('offset', ''), link.get('bandwidth', '')))
 
     def _probe_nodes(self) -> None:
-        self.services.refresh_all()
-        messagebox.showinfo("提示", "节点探测完成")
+        """测量在线节点的 RTT、时钟偏差和带宽，完成后刷新列表。"""
+        online_nodes = self.get_online_nodes()
+        if not online_nodes:
+            messagebox.showinfo("提示", "没有在线节点")
+            return
+        self.log(f"开始探测 {len(online_nodes)} 个节点的链路...")
+
+        def do_probe():
+            result = self.services.node_service.probe_nodes(online_nodes)
+
+            def done():
+                self.services.refresh_all()
+                if result['status'] == 'success':
+                    messagebox.showinfo("提示", f"节点探测完成: {result['message']}")
+                else:
+                    messagebox.showwarning("提示", f"节点探测完成: {result['message']}")
+
+            self.schedule(0, done)
+
+        self.run_async(do_probe)
 
     def _on_double_click(self, event: tk.Event) -> None:
         selection = self.node_tree.selection()
@@ -6,28 +6,49 @@ import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 import datetime
 import platform
-from typing import Optional
+import threading
+from typing import Any, Optional
 from gui.base_tab import BaseTab, ServiceContainer
+from gui.widgets.target_selector import resolve_targets
 
 
 class RemoteCmdTab(BaseTab):
     def __init__(self, notebook: ttk.Notebook, title: str, services: ServiceContainer) -> None:
+        self.remote_mode_var: Optional[tk.StringVar] = None
         self.remote_ip_var: Optional[tk.StringVar] = None
         self.remote_ip_combo: Optional[ttk.Combobox] = None
+        self.remote_group_var: Optional[tk.StringVar] = None
+        self.remote_group_combo: Optional[ttk.Combobox] = None
         self.remote_cmd_var: Optional[tk.StringVar] = None
         self.remote_timeout_var: Optional[tk.StringVar] = None
+        self.remote_stream_var: Optional[tk.BooleanVar] = None
         self.remote_result_text: Optional[scrolledtext.ScrolledText] = None
+        self.remote_progress_var: Optional[tk.StringVar] = None
+        self.history_search_var: Optional[tk.StringVar] = None
+        self._stream_cancel: Optional[threading.Event] = None
+        self._line_buffers: dict[tuple[str, str], str] = {}
+        self._line_lock = threading.Lock()
         super().__init__(notebook, title, services)
 
     def _create_widgets(self) -> None:
         target_frame = ttk.LabelFrame(self.frame, text="目标节点")
         target_frame.pack(fill=tk.X, padx=5, pady=5)
 
+        self.remote_mode_var = tk.StringVar(value="selected")
+        ttk.Radiobutton(target_frame, text="指定节点", variable=self.remote_mode_var, value="selected").pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(target_frame, text="所有在线节点", variable=self.remote_mode_var, value="all").pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(target_frame, text="按分组", variable=self.remote_mode_var, value="group").pack(side=tk.LEFT, padx=5)
+
         ttk.Label(target_frame, text="节点IP:").pack(side=tk.LEFT, padx=5)
         self.remote_ip_var = tk.StringVar()
         self.remote_ip_combo = ttk.Combobox(target_frame, textvariable=self.remote_ip_var, width=18)
         self.remote_ip_combo.pack(side=tk.LEFT, padx=5)
 
+        ttk.Label(target_frame, text="分组:").pack(side=tk.LEFT, padx=5)
+        self.remote_group_var = tk.StringVar()
+        self.remote_group_combo = ttk.Combobox(target_frame, textvariable=self.remote_group_var, width=15, state="readonly")
+        self.remote_group_combo.pack(side=tk.LEFT, padx=5)
+
         ttk.Button(target_frame, text="获取系统信息", command=self._get_remote_info).pack(side=tk.LEFT, padx=10)
 
         cmd_frame = ttk.LabelFrame(self.frame, text="命令输入")
@@ -41,7 +62,14 @@ class RemoteCmdTab(BaseTab):
         self.remote_timeout_var = tk.StringVar(value="30")
         ttk.Entry(cmd_frame, textvariable=self.remote_timeout_var, width=5).pack(side=tk.LEFT, padx=5)
 
+        self.remote_stream_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(cmd_frame, text="实时输出", variable=self.remote_stream_var).pack(side=tk.LEFT, padx=5)
+
         ttk.Button(cmd_frame, text="执行", command=self._execute_cmd).pack(side=tk.LEFT, padx=10)
+        ttk.Button(cmd_frame, text="取消", command=self._cancel_cmd).pack(side=tk.LEFT, padx=5)
+
+        self.remote_progress_var = tk.StringVar()
+        ttk.Label(cmd_frame, textvariable=self.remote_progress_var).pack(side=tk.LEFT, padx=5)
 
         quick_frame = ttk.LabelFrame(self.frame, text="快捷命令")
         quick_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -56,6 +84,14 @@ class RemoteCmdTab(BaseTab):
         ttk.Button(quick_frame, text="查看网络连接",
                    command=lambda: self._quick_cmd("netstat -an")).pack(side=tk.LEFT, padx=5)
 
+        history_frame = ttk.LabelFrame(self.frame, text="批量执行历史")
+        history_frame.pack(fill=tk.X, padx=5, pady=5)
+
+        ttk.Label(history_frame, text="搜索命令/输出:").pack(side=tk.LEFT, padx=5)
+        self.history_search_var = tk.StringVar()
+        ttk.Entry(history_frame, textvariable=self.history_search_var, width=40).pack(side=tk.LEFT, padx=5)
+        ttk.Button(history_frame, text="搜索", command=self._search_history).pack(side=tk.LEFT, padx=5)
+
         result_frame = ttk.LabelFrame(self.frame, text="执行结果")
         result_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
@@ -65,6 +101,8 @@ class RemoteCmdTab(BaseTab):
     def refresh_tab(self) -> None:
         if self.remote_ip_combo:
             self.remote_ip_combo['values'] = self.get_online_nodes()
+        if self.remote_group_combo:
+            self.remote_group_combo['values'] = list(self.services.node_manager.get_all_groups().keys())
 
     def _append_result(self, text: str) -> None:
         self.remote_result_text.insert(tk.END, text)
@@ -79,7 +117,7 @@ class RemoteCmdTab(BaseTab):
         self._append_result(f"[{datetime.datetime.now()}] 获取节点 {ip} 的系统信息...\n")
 
         def do_get():
-            result = self.services.network.get_remote_system_info(ip)
+            result = self.services.monitor_service.get_node_overview(ip)
             if result and result.get('status') == 'success':
                 info = f"═══════════════════════════════════════\n"
                 info += f"节点IP: {ip}\n"
@@ -91,6 +129,16 @@ class RemoteCmdTab(BaseTab):
                 info += f"总内存: {result.get('memory_total', 0) / (1024**3):.2f} GB\n"
                 info += f"可用内存: {result.get('memory_available', 0) / (1024**3):.2f} GB\n"
                 info += f"Python版本: {result.get('python_version', 'N/A')}\n"
+                info += f"客户端版本: {result.get('version', 'N/A')}\n"
+                stats = result.get('worker_stats')
+                if stats:
+                    info += (f"命令队列: 处理中 {stats.get('active')}/{stats.get('max_workers')}, "
+                             f"排队 {stats.get('queued')}/{stats.get('max_queue')}, "
+                             f"拒绝 {stats.get('rejected')}\n")
+                    if 'keep_alive' in stats:
+                        info += f"客户端保留的长连接: {stats['keep_alive']}\n"
+                info += f"连接池: {result.get('connections', 'N/A')}\n"
+                info += f"链路: {result.get('link') or '未测量'}\n"
                 info += f"磁盘信息:\n"
                 for disk in result.get('disks', []):
                     info += f"  {disk['mountpoint']}: {disk['used']/(1024**3):.1f}/{disk['total']/(1024**3):.1f} GB ({disk['percent']}%)\n"
@@ -101,10 +149,21 @@ class RemoteCmdTab(BaseTab):
 
         self.run_async(do_get)
 
+    def _get_targets(self) -> tuple[list[str], str | None]:
+        return resolve_targets(
+            self.remote_mode_var.get(),
+            self.remote_ip_var.get().strip(),
+            self.remote_group_var.get().strip(),
+            self.services.node_manager
+        )
+
     def _execute_cmd(self) -> None:
-        ip = self.remote_ip_var.get().strip()
-        if not ip:
-            messagebox.showerror("错误", "请输入节点IP")
+        target_ips, error = self._get_targets()
+        if error:
+            messagebox.showerror("错误", error)
+            return
+        if not target_ips:
+            messagebox.showerror("错误", "没有可用的目标节点")
             return
         cmd = self.remote_cmd_var.get().strip()
         if not cmd:
@@ -115,23 +174,139 @@ class RemoteCmdTab(BaseTab):
         except ValueError:
             timeout = 30
 
+        if self.remote_stream_var.get():
+            self._execute_stream(target_ips, cmd, timeout)
+            return
+        if len(target_ips) > 1:
+            self._execute_grouped(target_ips, cmd, timeout)
+            return
+
+        ip = target_ips[0]
         self._append_result(f"[{datetime.datetime.now()}] 在节点 {ip} 执行命令: {cmd}\n")
 
         def do_execute():
-            result = self.services.network.execute_remote_command(ip, cmd, timeout)
-            if result:
+            result = self.services.command_service.execute(ip, cmd, timeout)
+            if result.get('return_code') is not None or result.get('stdout') or result.get('stderr'):
                 self._append_result(f"返回码: {result.get('return_code', 'N/A')}\n")
                 self._append_result(f"状态: {result.get('status', 'N/A')}\n")
                 if result.get('stdout'):
                     self._append_result(f"输出:\n{result['stdout']}\n")
                 if result.get('stderr'):
                     self._append_result(f"错误:\n{result['stderr']}\n")
-                self.services.logger.log_operation('远程命令执行', ip, f"命令: {cmd}, 返回码: {result.get('return_code', 'N/A')}")
             else:
-                self._append_result(f"[{datetime.datetime.now()}] 命令执行失败: 无响应\n")
+                self._append_result(f"[{datetime.datetime.now()}] 命令执行失败: {result.get('message', '无响应')}\n")
+
+        self.run_async(do_execute)
+
+    # ── 流式执行 ──────────────────────────────────────
+
+    def _execute_stream(self, target_ips: list[str], cmd: str, timeout: int) -> None:
+        multi = len(target_ips) > 1
+        self._line_buffers = {}
+        self._append_result(f"[{datetime.datetime.now()}] 在 {len(target_ips)} 个节点流式执行命令: {cmd}\n")
+
+        def on_output(ip: str, stream: str, text: str) -> None:
+            if not multi:
+                self._append_result(text)
+                return
+            # 多节点时按行加上节点前缀，不完整的行暂存到下一块
+            with self._line_lock:
+                buffered = self._line_buffers.get((ip, stream), '') + text
+                lines = buffered.split('\n')
+                self._line_buffers[(ip, stream)] = lines.pop()
+            tag = f"[{ip}]" if stream == 'stdout' else f"[{ip}][stderr]"
+            if lines:
+                self._append_result(''.join(f"{tag} {line}\n" for line in lines))
+
+        def on_done(ip: str, result: dict[str, Any]) -> None:
+            with self._line_lock:
+                rest = ''.join(self._line_buffers.pop((ip, s), '') for s in ('stdout', 'stderr'))
+            if rest:
+                self._append_result(f"[{ip}] {rest}\n" if multi else f"{rest}\n")
+            self._append_result(
+                f"[{datetime.datetime.now()}] {ip}: 结束 - 返回码 {result.get('return_code', 'N/A')}, "
+                f"{result.get('message', '')}\n"
+            )
+
+        self._stream_cancel = self.services.command_service.execute_stream(
+            target_ips, cmd, timeout, on_output, on_done)
+
+    def _cancel_cmd(self) -> None:
+        if self._stream_cancel is None or self._stream_cancel.is_set():
+            return
+        self.services.command_service.cancel_stream(self._stream_cancel)
+        self._append_result(f"[{datetime.datetime.now()}] 已请求取消命令\n")
+
+    # ── 批量分组执行 ──────────────────────────────────
+
+    def _execute_grouped(self, target_ips: list[str], cmd: str, timeout: int) -> None:
+        total = len(target_ips)
+        self._append_result(f"[{datetime.datetime.now()}] 在 {total} 个节点批量执行命令: {cmd}\n")
+
+        def on_progress(done: int, total: int, clusters: list[dict[str, Any]]) -> None:
+            self.remote_progress_var.set(f"进度: {done}/{total}, 结果分组: {len(clusters)}")
+
+        def do_execute():
+            result = self.services.command_service.execute_fanout(target_ips, cmd, timeout, on_progress)
+            self._append_result(self._format_clusters(result))
 
         self.run_async(do_execute)
 
+    def _format_clusters(self, result: dict[str, Any], max_output: int = 2000,
+                         max_ips: int = 10) -> str:
+        clusters = result['clusters']
+        grouper = result['grouper']
+        lines = [
+            "═══════════════════════════════════════\n",
+            f"共 {result['total']} 个节点, {len(clusters)} 种不同结果, "
+            f"耗时 {result['duration']}s, 记录: {result['run_id']}\n"
+        ]
+        majority = clusters[0]['fingerprint'] if clusters else None
+        for index, cluster in enumerate(clusters):
+            res = cluster['result']
+            ips = cluster['ips']
+            shown = ', '.join(ips[:max_ips]) + (f" 等 {len(ips)} 个" if len(ips) > max_ips else '')
+            lines.append("───────────────────────────────────────\n")
+            lines.append(f"{cluster['count']} 个节点返回 [{cluster['fingerprint']}] "
+                         f"返回码: {res.get('return_code', 'N/A')}\n")
+            lines.append(f"节点: {shown}\n")
+            if index == 0:
+                output = res.get('stdout') or res.get('message', '')
+                if res.get('stderr'):
+                    output += f"\n[stderr]\n{res['stderr']}"
+                if len(output) > max_output:
+                    output = output[:max_output] + f"\n... (截断, 共 {len(output)} 字符)"
+                lines.append(f"输出:\n{output}\n")
+            else:
+                # 少数派结果只显示与多数结果的差异
+                diff = grouper.diff(majority, cluster['fingerprint'])
+                if len(diff) > max_output:
+                    diff = diff[:max_output] + f"\n... (截断, 共 {len(diff)} 字符)\n"
+                lines.append(f"与多数结果的差异:\n{diff}" if diff else "与多数结果的差异: (输出相同)\n")
+        lines.append("═══════════════════════════════════════\n")
+        return ''.join(lines)
+
+    def _search_history(self) -> None:
+        text = self.history_search_var.get().strip()
+        if not text:
+            messagebox.showerror("错误", "请输入搜索内容")
+            return
+
+        def do_search():
+            matches = self.services.command_service.search_history(text)
+            if not matches:
+                self._append_result(f"[{datetime.datetime.now()}] 历史记录中未找到: {text}\n")
+                return
+            out = f"[{datetime.datetime.now()}] 历史搜索 '{text}': {len(matches)} 条匹配\n"
+            for m in matches:
+                started = datetime.datetime.fromtimestamp(m['started']).strftime("%Y-%m-%d %H:%M:%S")
+                ips = ', '.join(m['ips'][:5]) + (f" 等 {len(m['ips'])} 个" if len(m['ips']) > 5 else '')
+                out += (f"  {started} [{m['run_id']}] {m['command']} -> "
+                        f"返回码 {m['return_code']}, 节点: {ips}\n")
+            self._append_result(out)
+
+        self.run_async(do_search)
+
     def _quick_cmd(self, cmd: str) -> None:
         self.remote_cmd_var.set(cmd)
         self._execute_cmd()
@@ -24,5 +24,11 @@ def resolve_targets(mode: str,
     if mode == "group":
         if not group_name:
             return [], "请选择分组"
-        return node_manager.get_group_nodes(group_name), None
+        # 离线的成员不作为目标，避免每个都等待连接超时
+        members = node_manager.get_group_nodes(group_name)
+        online = set(node_manager.get_online_nodes())
+        targets = [ip for ip in members if ip in online]
+        if members and not targets:
+            return [], f"分组 '{group_name}' 中没有在线节点"
+        return targets, None
     return [], "未知的选择模式"
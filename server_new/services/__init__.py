@@ -4,3 +4,4 @@ from services.file_service import FileService
 from services.update_service import UpdateService
 from services.monitor_service import MonitorService
 from services.log_service import LogService
+from services.command_service import CommandService
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""命令服务 — 远程命令执行（普通 / 流式 / 批量分组）。"""
+
+import threading
+import time
+from typing import Any, Callable
+
+from core.node_manager import NodeManager
+from core.network_manager import NetworkManager
+from core.logger import Logger
+from core.command_history import CommandHistory, ResultGrouper
+from shared.protocol import fan_out
+
+
+class CommandService:
+    """远程命令的业务编排层。"""
+
+    def __init__(self, node_manager: NodeManager,
+                 network: NetworkManager, logger: Logger) -> None:
+        self._nm = node_manager
+        self._net = network
+        self._log = logger
+        self._history = CommandHistory()
+
+    def execute(self, target_ip: str, cmd: str, timeout: int = 30) -> dict[str, Any]:
+        """在单个节点执行命令，等待完整结果。"""
+        result = self._net.execute_remote_command(target_ip, cmd, timeout)
+        if result is None:
+            return {'status': 'error', 'message': '无响应', 'return_code': -1}
+        self._log.log_operation('远程命令执行', target_ip,
+                                f"命令: {cmd}, 返回码: {result.get('return_code', 'N/A')}")
+        return result
+
+    def execute_stream(self, target_ips: list[str], cmd: str, timeout: int,
+                       on_output: Callable[[str, str, str], None],
+                       on_done: Callable[[str, dict[str, Any]], None]) -> threading.Event:
+        """在一个或多个节点流式执行命令。
+
+        on_output(ip, stream, text) 在输出到达时调用，on_done(ip, result)
+        在每个节点结束时调用。返回取消事件，置位后所有节点的命令被终止。
+        各节点在后台以有界并发（fan_out）执行。
+        """
+        cancel_event = threading.Event()
+
+        def run_one(ip: str) -> None:
+            result = self._net.execute_remote_command_stream(
+                ip, cmd,
+                lambda stream, text: on_output(ip, stream, text),
+                cancel_event, timeout
+            )
+            self._log.log_operation(
+                '远程命令执行(流式)', ip,
+                f"命令: {cmd}, 返回码: {result.get('return_code', 'N/A')}, "
+                f"{result.get('message', '')}"
+            )
+            on_done(ip, result)
+
+        threading.Thread(target=fan_out, args=(target_ips, run_one), daemon=True).start()
+        return cancel_event
+
+    def cancel_stream(self, cancel_event: threading.Event | None) -> None:
+        """取消一次流式执行。"""
+        if cancel_event is not None:
+            cancel_event.set()
+
+    def execute_fanout(self, target_ips: list[str], cmd: str, timeout: int = 30,
+                       on_progress: Callable[[int, int, list[dict[str, Any]]], None] | None = None
+                       ) -> dict[str, Any]:
+        """在大量节点执行命令，按输出内容分组。
+
+        结果按完成顺序归并，相同的（返回码, stdout, stderr）合并为一个结果簇；
+        on_progress(done, total, clusters) 在每个节点完成后调用。
+        执行记录压缩保存，可通过 search_history 检索。
+        """
+        target_ips = list(dict.fromkeys(target_ips))
+        grouper = ResultGrouper()
+        run_id = self._history.new_run_id()
+        started = time.time()
+        done = 0
+        lock = threading.Lock()
+
+        def worker(ip: str) -> dict[str, Any] | None:
+            return self._net.execute_remote_command(ip, cmd, timeout)
+
+        def on_result(ip: str, result: dict[str, Any] | None) -> None:
+            nonlocal done
+            fp = grouper.add(ip, result)
+            self._log.log_operation(
+                '远程命令执行(批量)', ip,
+                f"命令: {cmd}, 返回码: {(result or {}).get('return_code', 'N/A')}, "
+                f"结果: {fp}, 记录: {run_id}"
+            )
+            with lock:
+                done += 1
+                current = done
+            if on_progress:
+                on_progress(current, len(target_ips), grouper.clusters())
+
+        fan_out(target_ips, worker, on_result)
+
+        clusters = grouper.clusters()
+        self._history.save_run(run_id, cmd, grouper, started)
+        return {
+            'run_id': run_id,
+            'total': len(target_ips),
+            'clusters': clusters,
+            'duration': round(time.time() - started, 2),
+            'grouper': grouper
+        }
+
+    def search_history(self, text: str, limit: int = 50) -> list[dict[str, Any]]:
+        """在批量命令历史中按命令或输出内容检索。"""
+        return self._history.search(text, limit)
+
+    def get_run(self, run_id: str) -> dict[str, Any] | None:
+        """读取一次批量执行的完整记录。"""
+        return self._history.load_run(run_id)
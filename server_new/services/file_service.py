@@ -1,13 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-"""文件服务 — 单文件传输、批量分发。"""
+"""文件服务 — 单文件传输、批量分发、目录同步。"""
 
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
+from core.byte_cache import ByteLRUCache
+from core.compression import CompressionStats
+from core.dir_sync import diff_manifest, scan_directory
 from core.node_manager import NodeManager
 from core.network_manager import NetworkManager
 from core.logger import Logger
+from shared.protocol import (
+    DIR_SYNC_CACHE_BYTES,
+    MANIFEST_HASH,
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    RELAY_FANOUT,
+    RELAY_SEEDS,
+    fan_out,
+)
 
 
 class FileService:
@@ -18,10 +30,13 @@ class FileService:
         self._nm = node_manager
         self._net = network
         self._log = logger
+        # 目录同步时压缩后的文件内容，多个节点共用
+        self._sync_cache = ByteLRUCache(DIR_SYNC_CACHE_BYTES)
 
     def transfer_file(self, target_ip: str, file_path: str,
-                      remote_path: str = '') -> dict[str, Any]:
-        """向单个节点传输文件。"""
+                      remote_path: str = '', parallel: bool = False,
+                      priority: int = PRIORITY_INTERACTIVE) -> dict[str, Any]:
+        """向单个节点传输文件；parallel 为 True 时大文件分段并行传输。"""
         path = Path(file_path)
         if not remote_path:
             remote_path = path.name
@@ -30,7 +45,7 @@ class FileService:
         self._log.log_operation('文件传输', target_ip,
                                 f"文件: {file_path}, 保存为: {remote_path}")
 
-        result = self._net.send_file(target_ip, file_path, remote_path)
+        result = self._net.send_file(target_ip, file_path, remote_path, parallel=parallel, priority=priority)
         if result is None:
             return {'status': 'error', 'message': '未收到响应'}
         if isinstance(result, dict):
@@ -38,13 +53,14 @@ class FileService:
         return {'status': 'error', 'message': str(result)}
 
     def transfer_file_to_multiple(self, target_ips: list[str],
-                                  file_path: str, remote_path: str = '') -> dict[str, Any]:
+                                  file_path: str, remote_path: str = '',
+                                  parallel: bool = False) -> dict[str, Any]:
         """向多个节点批量传输文件。"""
         path = Path(file_path)
         if not remote_path:
             remote_path = path.name
 
-        results = self._net.send_file_to_multiple(target_ips, file_path, remote_path)
+        results = self._net.send_file_to_multiple(target_ips, file_path, remote_path, parallel)
         success_count = sum(1 for r in results.values() if r and r.get('status') == 'success')
         fail_count = len(results) - success_count
 
@@ -56,3 +72,77 @@ class FileService:
             'success_count': success_count,
             'fail_count': fail_count
         }
+
+    def transfer_file_relay(self, target_ips: list[str], file_path: str,
+                            remote_path: str = '', seeds: int = RELAY_SEEDS,
+                            fanout: int = RELAY_FANOUT) -> dict[str, Any]:
+        """以接力方式向多个节点分发文件，接力失败的节点改为直接发送。"""
+        path = Path(file_path)
+        if not remote_path:
+            remote_path = path.name
+
+        target_ips = list(dict.fromkeys(target_ips))
+        results = self._net.send_file_relay(target_ips, file_path, remote_path, seeds, fanout)
+        retry = [ip for ip in target_ips
+                 if not (results.get(ip) and results[ip].get('status') == 'success')]
+        results.update(fan_out(retry, lambda ip: self.transfer_file(ip, file_path, remote_path,
+                                                                    priority=PRIORITY_BULK)))
+
+        success_count = sum(1 for r in results.values() if r and r.get('status') == 'success')
+        fail_count = len(results) - success_count
+
+        self._log.log_operation('接力文件分发', '多个节点',
+                                f"文件: {file_path}, 种子: {seeds}, 扇出: {fanout}, "
+                                f"接力: {len(target_ips) - len(retry)}, 成功: {success_count}, 失败: {fail_count}")
+        return {
+            'status': 'success' if fail_count == 0 else 'partial',
+            'results': results,
+            'success_count': success_count,
+            'fail_count': fail_count
+        }
+
+    def sync_directory(self, target_ips: list[str], local_dir: str, remote_dir: str = '',
+                       delete: bool = True,
+                       on_result: Callable[[str, Any], None] | None = None) -> dict[str, Any]:
+        """把本地目录同步到多个节点的 Transfer Files/<remote_dir>。
+
+        按文件清单比较，只发送新增或变化的文件；delete 为 True 时删除节点上
+        本地目录中没有的文件。各节点并行同步，压缩后的文件内容在节点之间共用。
+        """
+        root = Path(local_dir)
+        if not root.is_dir():
+            return {'status': 'error', 'message': '选择的路径不是目录', 'results': {},
+                    'success_count': 0, 'fail_count': len(target_ips)}
+        remote_dir = remote_dir or root.name
+        local = scan_directory(root, MANIFEST_HASH)
+        stats = CompressionStats()
+
+        def sync_one(ip: str) -> dict[str, Any]:
+            manifest = self._net.get_dir_manifest(ip, remote_dir)
+            if not manifest or manifest.get('status') != 'success':
+                message = manifest.get('message') if manifest else None
+                return {'status': 'error', 'message': message or '未获取到节点的文件清单'}
+            if manifest.get('hash') != MANIFEST_HASH:
+                return {'status': 'error', 'message': f"节点的文件清单算法不一致: {manifest.get('hash')}"}
+            changed, deleted = diff_manifest(local, manifest.get('manifest', {}), delete)
+            if not changed and not deleted:
+                return {'status': 'success', 'message': '已是最新', 'written': 0, 'deleted': 0}
+            return self._net.sync_directory(ip, root, remote_dir, {path: local[path] for path in changed},
+                                            deleted, self._sync_cache, stats=stats)
+
+        results = fan_out(list(dict.fromkeys(target_ips)), sync_one, on_result)
+        success_count = sum(1 for r in results.values() if r and r.get('status') == 'success')
+        fail_count = len(results) - success_count
+
+        summary = stats.summary()
+        self._log.log_operation('目录同步', '多个节点',
+                                f"目录: {local_dir} -> {remote_dir}, 文件: {len(local)}, "
+                                f"成功: {success_count}, 失败: {fail_count}, 压缩: {summary}")
+        return {
+            'status': 'success' if fail_count == 0 else 'partial',
+            'results': results,
+            'success_count': success_count,
+            'fail_count': fail_count,
+            'compression': stats.report(),
+            'compression_summary': summary
+        }
@@ -80,6 +80,30 @@ class MonitorService:
         self._threads.clear()
         self._alert_times.clear()
 
+    def get_node_overview(self, ip: str) -> dict[str, Any] | None:
+        """一次往返获取节点的系统信息、客户端版本和命令队列统计。
+
+        返回系统信息字典，附加 version、worker_stats、connections（到该节点的
+        连接池状态）和 link（RTT、时钟偏差、带宽）字段；系统信息获取失败时返回 None。
+        """
+        system_info, version, worker = self._net.send_batch(
+            ip, [('get_system_info', None), ('get_version', None), ('get_worker_stats', None)],
+            parallel=True
+        )
+        if not system_info or system_info.get('status') != 'success':
+            return system_info
+        overview = dict(system_info)
+        if version and version.get('status') == 'success':
+            overview['version'] = version.get('version')
+        if worker and worker.get('status') == 'success':
+            overview['worker_stats'] = worker.get('stats', {})
+        overview['connections'] = self._net.get_connection_summary(ip)
+        link = self._net.get_link_metrics(ip)
+        overview['link'] = '，'.join(f"{label} {link[key]}" for key, label in
+                                    (('rtt', 'RTT'), ('offset', '时钟偏差'), ('bandwidth', '带宽'))
+                                    if link[key])
+        return overview
+
     def check_alerts(self, ip: str, data: dict[str, Any],
                      cpu_threshold: float, memory_threshold: float) -> list[str]:
         """检查告警阈值，返回告警消息列表。"""
@@ -4,14 +4,17 @@
 
 from typing import Any
 
+from core.network_manager import NetworkManager
 from core.node_manager import NodeManager
+from shared.protocol import fan_out
 
 
 class NodeService:
     """节点管理的业务编排层。"""
 
-    def __init__(self, node_manager: NodeManager) -> None:
+    def __init__(self, node_manager: NodeManager, network: NetworkManager) -> None:
         self._nm = node_manager
+        self._net = network
 
     def get_online_nodes(self) -> list[str]:
         return self._nm.get_online_nodes()
@@ -22,6 +25,25 @@ class NodeService:
     def get_node_info(self, ip: str) -> dict[str, Any]:
         return self._nm.get_all_nodes().get(ip, {})
 
+    def get_connection_states(self) -> dict[str, str]:
+        """各节点的连接状态说明（正常 / 熔断 / 恢复中）。"""
+        return {ip: self._net.get_node_health_summary(ip) for ip in self._nm.get_all_nodes()}
+
+    def get_link_metrics(self) -> dict[str, dict[str, str]]:
+        """各节点的 RTT、时钟偏差和带宽说明 {ip: {'rtt', 'offset', 'bandwidth'}}。"""
+        return {ip: self._net.get_link_metrics(ip) for ip in self._nm.get_all_nodes()}
+
+    def probe_nodes(self, ips: list[str]) -> dict[str, Any]:
+        """测量节点的 RTT、时钟偏差和带宽，返回 {'status', 'message', 'results': {ip: 结果}}。"""
+        results = fan_out(ips, self._net.probe_node)
+        ok = sum(1 for result in results.values() if result.get('status') == 'success')
+        failed = [f"{ip}: {result.get('message')}" for ip, result in results.items()
+                  if result.get('status') != 'success']
+        message = f"成功 {ok}/{len(ips)} 个节点"
+        if failed:
+            message += '\n' + '\n'.join(failed)
+        return {'status': 'success' if ok == len(ips) else 'error', 'message': message, 'results': results}
+
     # ── 分组 ──────────────────────────────────────────
 
     def create_group(self, group_name: str) -> dict[str, Any]:
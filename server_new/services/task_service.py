@@ -3,11 +3,13 @@
 """任务服务 — 日志清理、文件备份。"""
 
 import datetime
+import shutil
 from pathlib import Path
 from typing import Any
 
 from core.node_manager import NodeManager
 from core.network_manager import NetworkManager
+from core.compression import format_report
 from core.logger import Logger
 
 
@@ -37,9 +39,10 @@ class TaskService:
         }
 
     def start_backup(self, target_ip: str, save_path: str) -> dict[str, Any]:
-        """向客户端发送备份命令。"""
+        """向客户端发送备份命令，带上节点所在分组的压缩档位。"""
         self._log.log(target_ip, 'backup', save_path)
-        result = self._net.send_command(target_ip, 'backup', {})
+        result = self._net.send_command(target_ip, 'backup',
+                                        {'compression': self._net.compression_profile(target_ip)})
         return result if result else {'status': 'error', 'message': '未收到响应'}
 
     def save_backup_file(self, target_ip: str, save_path: str) -> dict[str, Any]:
@@ -62,11 +65,17 @@ class TaskService:
                 zip_path = save_dir / zip_filename
                 counter += 1
 
-            with open(zip_path, 'wb') as f:
-                f.write(backup_info['data'])
+            if 'path' in backup_info:
+                # 逐块接收的备份已在磁盘上，直接移动
+                shutil.move(backup_info['path'], zip_path)
+            else:
+                with open(zip_path, 'wb') as f:
+                    f.write(backup_info['data'])
 
-            self._log.log_operation('文件备份', target_ip,
-                                    f"保存路径: {zip_path}, 大小: {backup_info['size']} 字节")
+            details = f"保存路径: {zip_path}, 大小: {backup_info['size']} 字节"
+            if backup_info.get('compression'):
+                details += f", 压缩: {format_report(backup_info['compression'])}"
+            self._log.log_operation('文件备份', target_ip, details)
             del self._net.pending_backups[target_ip]
             return {'status': 'success', 'path': str(zip_path), 'size': backup_info['size']}
 
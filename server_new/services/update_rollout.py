@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""分批（灰度）发布引擎 — 按波次推送更新，波次之间做健康检查。"""
+
+import json
+import math
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable
+
+from core.node_manager import NodeManager
+from core.network_manager import NetworkManager
+from shared.protocol import UPDATE_MAX_PARALLEL, fan_out
+
+# 客户端更新成功后延迟 2 秒重启，此前的心跳来自旧进程
+RESTART_GRACE = 3
+HEALTH_POLL_INTERVAL = 2
+
+DEFAULT_ROLLOUT_CONFIG: dict[str, Any] = {
+    'mode': 'smart',              # smart（增量）/ full（全量）/ staged（预分发后激活）
+    'canary_percent': 5,          # 首个波次（金丝雀）占比
+    'batch_size': 50,             # 后续每个波次的节点数
+    'max_parallel': UPDATE_MAX_PARALLEL,
+    'failure_threshold': 20,      # 单个波次失败率超过该百分比时停止
+    'health_timeout': 120,        # 等待节点重启并上报新版本的最长秒数
+    'rollback_on_failure': False, # 停止时是否回滚本次发布已更新的节点
+    'order_by_link': True,        # 按实测带宽/RTT 排列节点，链路好的先更新，金丝雀波次更快完成
+    'rate_limit': 0               # staged 模式下每个节点的预分发限速（字节/秒），0 不限速
+}
+
+# 节点状态：pending → pushing → pushed → healthy / failed；
+# skipped 表示无需更新，rolled_back 表示已回滚
+
+
+class RolloutEngine:
+    """分批发布引擎，状态持久化到 JSON 文件，服务端重启后可继续。"""
+
+    def __init__(self, update_service: Any, node_manager: NodeManager,
+                 network: NetworkManager, state_file: str | Path) -> None:
+        self._updates = update_service
+        self._nm = node_manager
+        self._net = network
+        self._state_file = Path(state_file)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stop_requested: str | None = None   # 'pause' / 'abort'
+        self._event_callback: Callable[[str], None] | None = None
+        self.state: dict[str, Any] | None = self._load_state()
+
+        # 服务端重启时正在执行的发布标记为暂停，由用户决定是否继续
+        if self.state and self.state['status'] == 'running':
+            self.state['status'] = 'paused'
+            self.state['message'] = '服务端重启，发布已暂停'
+            self._save_state()
+
+    def set_event_callback(self, cb: Callable[[str], None]) -> None:
+        self._event_callback = cb
+
+    def _emit(self, text: str) -> None:
+        if self._event_callback:
+            self._event_callback(text)
+
+    # ── 状态持久化 ────────────────────────────────────
+
+    def _load_state(self) -> dict[str, Any] | None:
+        if self._state_file.exists():
+            try:
+                with open(self._state_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception:
+                pass
+        return None
+
+    def _save_state(self) -> None:
+        """原子写入状态文件（调用方持有 _lock 或处于单线程阶段）。"""
+        if self.state is None:
+            return
+        self.state['updated'] = datetime.now().isoformat()
+        tmp_path = self._state_file.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        tmp_path.replace(self._state_file)
+
+    def _set_node(self, ip: str, node_state: str, message: str = '', **extra: Any) -> None:
+        with self._lock:
+            node = self.state['nodes'].setdefault(ip, {})
+            node.update(extra)
+            node['state'] = node_state
+            node['message'] = message
+            self._save_state()
+
+    # ── 控制接口 ──────────────────────────────────────
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, target_ips: list[str], config: dict[str, Any] | None = None) -> dict[str, Any]:
+        if self.is_running():
+            return {'status': 'error', 'message': '已有发布正在进行'}
+        target_ips = list(dict.fromkeys(target_ips))
+        if not target_ips:
+            return {'status': 'error', 'message': '没有目标节点'}
+
+        cfg = dict(DEFAULT_ROLLOUT_CONFIG)
+        cfg.update(config or {})
+        if cfg['order_by_link']:
+            target_ips = self._net.node_metrics.order(target_ips)
+        canary = max(1, math.ceil(len(target_ips) * cfg['canary_percent'] / 100))
+        batch_size = max(1, int(cfg['batch_size']))
+        waves = [target_ips[:canary]]
+        waves += [target_ips[i:i + batch_size] for i in range(canary, len(target_ips), batch_size)]
+
+        with self._lock:
+            self.state = {
+                'id': uuid.uuid4().hex[:8],
+                'version': self._updates.get_current_version(),
+                'status': 'running',
+                'message': '',
+                'created': datetime.now().isoformat(),
+                'config': cfg,
+                'waves': waves,
+                'current_wave': 0,
+                'nodes': {ip: {'state': 'pending', 'message': ''} for ip in target_ips}
+            }
+            self._save_state()
+        self._launch()
+        return {'status': 'success', 'rollout_id': self.state['id'], 'waves': len(waves)}
+
+    def resume(self) -> dict[str, Any]:
+        if self.is_running():
+            return {'status': 'error', 'message': '发布正在进行'}
+        if not self.state or self.state['status'] not in ('paused', 'halted'):
+            return {'status': 'error', 'message': '没有可继续的发布'}
+        if self.state['version'] != self._updates.get_current_version():
+            return {'status': 'error', 'message': '更新包版本已变化，无法继续原发布'}
+        with self._lock:
+            # 因失败率停止后继续，视为人工确认放行，从下一波开始
+            if self.state.pop('threshold_exceeded', False):
+                self.state['current_wave'] += 1
+            self.state['status'] = 'running'
+            self.state['message'] = ''
+            self._save_state()
+        self._launch()
+        return {'status': 'success', 'rollout_id': self.state['id']}
+
+    def pause(self) -> None:
+        """当前波次完成后暂停。"""
+        if self.is_running():
+            self._stop_requested = 'pause'
+
+    def abort(self) -> None:
+        """尽快终止（不会中断已开始的推送）。"""
+        if self.is_running():
+            self._stop_requested = 'abort'
+        elif self.state and self.state['status'] in ('paused', 'halted'):
+            with self._lock:
+                self.state['status'] = 'aborted'
+                self._save_state()
+
+    def get_status(self) -> dict[str, Any] | None:
+        if self.state is None:
+            return None
+        with self._lock:
+            counts: dict[str, int] = {}
+            for node in self.state['nodes'].values():
+                counts[node['state']] = counts.get(node['state'], 0) + 1
+            return {
+                'id': self.state['id'],
+                'version': self.state['version'],
+                'status': self.state['status'],
+                'message': self.state['message'],
+                'current_wave': self.state['current_wave'],
+                'total_waves': len(self.state['waves']),
+                'counts': counts,
+                'config': dict(self.state['config'])
+            }
+
+    # ── 执行 ──────────────────────────────────────────
+
+    def _launch(self) -> None:
+        self._stop_requested = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _finish(self, status: str, message: str) -> None:
+        with self._lock:
+            self.state['status'] = status
+            self.state['message'] = message
+            self._save_state()
+        self._emit(f"发布 {self.state['id']} {message}")
+
+    def _run(self) -> None:
+        try:
+            waves = self.state['waves']
+            while self.state['current_wave'] < len(waves):
+                if self._stop_requested:
+                    self._finish('aborted' if self._stop_requested == 'abort' else 'paused',
+                                 '已终止' if self._stop_requested == 'abort' else '已暂停')
+                    return
+
+                index = self.state['current_wave']
+                wave = waves[index]
+                self._emit(f"开始第 {index + 1}/{len(waves)} 波: {len(wave)} 个节点")
+                self._push_wave(wave)
+                self._wait_healthy(wave)
+
+                failed = [ip for ip in wave if self.state['nodes'][ip]['state'] == 'failed']
+                failure_rate = len(failed) * 100 / len(wave)
+                self._emit(f"第 {index + 1} 波完成: 失败 {len(failed)}/{len(wave)} ({failure_rate:.0f}%)")
+                if failure_rate > self.state['config']['failure_threshold']:
+                    if self.state['config']['rollback_on_failure']:
+                        self._rollback_updated()
+                        self._finish('rolled_back', f"第 {index + 1} 波失败率 {failure_rate:.0f}% 超过阈值，已回滚")
+                    else:
+                        self.state['threshold_exceeded'] = True
+                        self._finish('halted', f"第 {index + 1} 波失败率 {failure_rate:.0f}% 超过阈值，已停止")
+                    return
+
+                with self._lock:
+                    self.state['current_wave'] = index + 1
+                    self._save_state()
+
+            self._finish('completed', '全部波次完成')
+        except Exception as e:
+            self._finish('halted', f'发布异常停止: {e}')
+
+    def _push_wave(self, wave: list[str]) -> None:
+        """推送当前波次中尚未推送的节点（恢复时跳过已完成的节点）。"""
+        nodes = self.state['nodes']
+        # 服务端重启前已推送但未确认的节点直接进入健康检查
+        for ip in wave:
+            if nodes[ip]['state'] == 'pushing':
+                self._set_node(ip, 'pushed', '恢复后重新检查', pushed_at=time.time())
+        pending = [ip for ip in wave if nodes[ip]['state'] == 'pending']
+        if not pending:
+            return
+        for ip in pending:
+            self._set_node(ip, 'pushing')
+
+        def on_result(ip: str, result: dict[str, Any]) -> None:
+            if result.get('status') != 'success':
+                self._set_node(ip, 'failed', result.get('message', '推送失败'))
+            elif result.get('up_to_date'):
+                self._set_node(ip, 'skipped', result.get('message', '已是最新版本'))
+            else:
+                self._set_node(ip, 'pushed', result.get('message', ''), pushed_at=time.time(),
+                               from_version=result.get('from_version'))
+            self._emit(f"  {ip}: {self.state['nodes'][ip]['state']} {self.state['nodes'][ip]['message']}")
+
+        max_workers = self.state['config']['max_parallel']
+        if self.state['config']['mode'] == 'staged':
+            result = self._stage_and_activate(pending, on_result, max_workers)
+        elif self.state['config']['mode'] == 'full':
+            result = self._updates.push_full_update(pending, on_result, max_workers)
+        else:
+            result = self._updates.push_smart_update(pending, on_result, max_workers)
+        if result.get('status') == 'error':
+            for ip in pending:
+                self._set_node(ip, 'failed', result.get('message', '推送失败'))
+
+    def _stage_and_activate(self, ips: list[str],
+                            on_result: Callable[[str, dict[str, Any]], None],
+                            max_workers: int) -> dict[str, Any]:
+        """先补齐预分发（已提前预分发的节点几乎无需传输），再激活。"""
+        staged: list[str] = []
+
+        def on_staged(ip: str, result: dict[str, Any]) -> None:
+            if result.get('status') != 'success' or result.get('up_to_date'):
+                on_result(ip, result)
+            else:
+                staged.append(ip)
+
+        self._updates.stage_update(ips, on_staged, max_workers,
+                                   self.state['config'].get('rate_limit', 0))
+        if not staged:
+            return {'status': 'success'}
+        return self._updates.activate_update(staged, on_result, max_workers)
+
+    def _wait_healthy(self, wave: list[str]) -> None:
+        """等待已推送节点重启后恢复心跳并上报目标版本。"""
+        nodes = self.state['nodes']
+        target_version = self.state['version']
+        deadline = time.time() + self.state['config']['health_timeout']
+        while True:
+            waiting = [ip for ip in wave if nodes[ip]['state'] == 'pushed']
+            if not waiting or self._stop_requested == 'abort':
+                break
+            if time.time() > deadline:
+                for ip in waiting:
+                    self._set_node(ip, 'failed', '升级后未在限定时间内恢复')
+                    self._emit(f"  {ip}: 升级后未在限定时间内恢复")
+                break
+
+            all_nodes = self._nm.get_all_nodes()
+            for ip in waiting:
+                heartbeat = all_nodes.get(ip, {}).get('last_heartbeat', 0)
+                if heartbeat < nodes[ip].get('pushed_at', 0) + RESTART_GRACE:
+                    continue
+                result = self._net.check_client_version(ip)
+                if result and result.get('status') == 'success':
+                    version = result.get('version')
+                    if version == target_version:
+                        self._set_node(ip, 'healthy', f'已运行 {version}')
+                    else:
+                        self._set_node(ip, 'failed', f'重启后版本为 {version}')
+                    self._emit(f"  {ip}: {nodes[ip]['message']}")
+            time.sleep(HEALTH_POLL_INTERVAL)
+
+    def _rollback_updated(self) -> None:
+        """回滚本次发布中已推送过更新的节点。"""
+        targets = [ip for ip, node in self.state['nodes'].items()
+                   if node['state'] in ('pushed', 'healthy')
+                   or (node['state'] == 'failed' and node.get('pushed_at'))]
+        self._emit(f"开始回滚 {len(targets)} 个节点")
+
+        def rollback(ip: str) -> dict[str, Any] | None:
+            return self._net.rollback_client_update(ip)
+
+        def on_result(ip: str, result: Any) -> None:
+            if result and result.get('status') == 'success':
+                self._set_node(ip, 'rolled_back', result.get('message', '已回滚'))
+            else:
+                message = result.get('message', '无响应') if result else '无响应'
+                self._set_node(ip, self.state['nodes'][ip]['state'], f'回滚失败: {message}')
+            self._emit(f"  {ip}: {self.state['nodes'][ip]['message']}")
+
+        fan_out(targets, rollback, on_result, max_workers=self.state['config']['max_parallel'])
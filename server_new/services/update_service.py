@@ -3,11 +3,19 @@
 """更新服务 — 版本管理、更新推送。"""
 
 import base64
-from typing import Any
+import hashlib
+import json
+import threading
+from typing import Any, Callable
 
 from core.node_manager import NodeManager
 from core.network_manager import NetworkManager
 from core.update_manager import UpdateManager
+from shared.protocol import (
+    MANIFEST_HASH, NODE_LOCAL_FILES, RELAY_FANOUT, RELAY_SEEDS, UPDATE_MAX_PARALLEL, fan_out,
+)
+from services.update_rollout import RolloutEngine
+from core.merkle import parent_dir
 
 
 class UpdateService:
@@ -18,6 +26,11 @@ class UpdateService:
         self._nm = node_manager
         self._net = network
         self._um = update_manager
+        # 构造好的更新内容放在 UpdateManager 的内存缓存中，
+        # 键为 ('payload', 版本, 类型, 需更新的文件 或 清单指纹)，版本变化时失效
+        self._payload_lock = threading.Lock()
+        self._rollout = RolloutEngine(self, node_manager, network,
+                                      update_manager.updates_dir / 'rollout_state.json')
 
     def get_version_info(self) -> dict[str, Any]:
         return self._um.get_version_info()
@@ -49,14 +62,22 @@ class UpdateService:
             'results': results
         }
 
-    def push_full_update(self, target_ips: list[str]) -> dict[str, Any]:
-        """全量更新推送到多个节点。"""
+    def push_full_update(self, target_ips: list[str],
+                         on_result: Callable[[str, dict[str, Any]], None] | None = None,
+                         max_workers: int = UPDATE_MAX_PARALLEL) -> dict[str, Any]:
+        """全量更新推送到多个节点（并发不超过 max_workers）。"""
         update_data = self._um.get_update_package()
         if not update_data:
             return {'status': 'error', 'message': '更新包不存在，请先创建更新包'}
 
         new_version = self._um.get_current_version()
-        results = self._net.push_update_to_multiple(target_ips, update_data, new_version, 'full')
+        digest = hashlib.sha256(update_data).hexdigest()
+
+        def push(ip: str) -> dict[str, Any]:
+            result = self._net.push_update_to_client(ip, update_data, new_version, 'full', digest=digest)
+            return result if result else {'status': 'error', 'message': '无响应'}
+
+        results = fan_out(list(dict.fromkeys(target_ips)), push, on_result, max_workers=max_workers)
 
         success_count = sum(1 for r in results.values() if r and r.get('status') == 'success')
         fail_count = len(results) - success_count
@@ -68,38 +89,244 @@ class UpdateService:
             'fail_count': fail_count
         }
 
-    def push_smart_update(self, target_ips: list[str]) -> dict[str, Any]:
-        """智能增量更新 —— 按文件差异推送。"""
+    def push_full_update_relay(self, target_ips: list[str],
+                               on_result: Callable[[str, dict[str, Any]], None] | None = None,
+                               seeds: int = RELAY_SEEDS, fanout: int = RELAY_FANOUT,
+                               max_workers: int = UPDATE_MAX_PARALLEL) -> dict[str, Any]:
+        """以接力方式推送全量更新：服务端只发给种子节点，由节点逐级转发。
+
+        接力失败的节点（旧客户端、链路中断等）改为由服务端直接推送。
+        """
+        update_data = self._um.get_update_package()
+        if not update_data:
+            return {'status': 'error', 'message': '更新包不存在，请先创建更新包'}
+
         new_version = self._um.get_current_version()
-        all_results: dict[str, Any] = {}
+        target_ips = list(dict.fromkeys(target_ips))
+        relayed = self._net.push_full_update_relay(target_ips, update_data, new_version, seeds, fanout)
 
+        results: dict[str, Any] = {}
+        retry: list[str] = []
         for ip in target_ips:
-            manifest_result = self._net.get_client_files_manifest(ip)
-            if not manifest_result or manifest_result.get('status') != 'success':
-                all_results[ip] = {'status': 'error', 'message': '无法获取文件清单'}
-                continue
+            result = relayed.get(ip)
+            if result and result.get('status') == 'success':
+                results[ip] = result
+                if on_result:
+                    on_result(ip, result)
+            else:
+                retry.append(ip)
+
+        digest = hashlib.sha256(update_data).hexdigest()
+
+        def push(ip: str) -> dict[str, Any]:
+            result = self._net.push_update_to_client(ip, update_data, new_version, 'full', digest=digest)
+            return result if result else {'status': 'error', 'message': '无响应'}
+
+        results.update(fan_out(retry, push, on_result, max_workers=max_workers))
+
+        success_count = sum(1 for r in results.values() if r and r.get('status') == 'success')
+        fail_count = len(results) - success_count
+        return {
+            'status': 'success' if fail_count == 0 else 'partial',
+            'version': new_version,
+            'results': results,
+            'success_count': success_count,
+            'fail_count': fail_count,
+            'relay_count': len(target_ips) - len(retry)
+        }
 
-            client_manifest = manifest_result.get('manifest', {})
-            update_manifest = self._um.get_update_manifest(None, client_manifest)
-            if not update_manifest.get('need_update'):
-                all_results[ip] = {'status': 'success', 'message': '已是最新版本'}
+    def push_smart_update(self, target_ips: list[str],
+                          on_result: Callable[[str, dict[str, Any]], None] | None = None,
+                          max_workers: int = UPDATE_MAX_PARALLEL) -> dict[str, Any]:
+        """智能增量更新 —— 按文件差异推送。
+
+        1. 并发获取所有节点的版本和文件清单；
+        2. 按清单指纹分组，同组节点共用一份差异计算和更新内容（内容按版本缓存）；
+           支持块级差异的客户端只接收变化的字节；
+        3. 以不超过 max_workers 的并发推送。
+        每个节点得出结果时立即调用 on_result(ip, result)；无需更新的节点结果带
+        'up_to_date': True。
+        """
+        target_ips = list(dict.fromkeys(target_ips))
+        new_version = self._um.get_current_version()
+        all_results: dict[str, Any] = {}
+        lock = threading.Lock()
+
+        def record(ip: str, result: dict[str, Any]) -> None:
+            with lock:
+                all_results[ip] = result
+            if on_result:
+                on_result(ip, result)
+
+        # 清单指纹 -> {'manifest', 'delta', 'ips': [(ip, 客户端版本)]}
+        buckets: dict[str, dict[str, Any]] = {}
+
+        manifest_request = self._manifest_request()
+
+        def fetch(ip: str) -> tuple[Any, Any]:
+            # 版本和文件清单在一次往返中获取
+            version_result, manifest_result = self._net.send_batch(
+                ip, [('get_version', None), manifest_request], parallel=True)
+            return version_result, self._client_manifest(ip, manifest_result)
+
+        def on_manifest(ip: str, fetched: Any) -> None:
+            version_result, client_manifest = fetched if isinstance(fetched, tuple) else (None, None)
+            if client_manifest is None:
+                record(ip, {'status': 'error', 'message': '无法获取文件清单'})
+                return
+            client_version = (version_result or {}).get('version', 'unknown')
+            supports_delta = 'delta' in (version_result or {}).get('capabilities', [])
+            fingerprint = hashlib.sha256(
+                json.dumps(client_manifest, sort_keys=True).encode('utf-8')).hexdigest()
+            key = f"{fingerprint}:{'delta' if supports_delta else 'incremental'}"
+            with lock:
+                bucket = buckets.setdefault(key, {
+                    'manifest': client_manifest, 'fingerprint': fingerprint,
+                    'delta': supports_delta, 'ips': []
+                })
+                bucket['ips'].append((ip, client_version))
+
+        fan_out(target_ips, fetch, on_manifest)
+
+        # 每个清单分组只计算一次差异和更新内容
+        pushes: dict[str, tuple[bytes, str, str]] = {}
+        for bucket in buckets.values():
+            update_manifest = self._um.get_update_manifest(None, bucket['manifest'])
+            # 只推送需要更新的文件，客户端多出的文件不影响判断
+            if not update_manifest.get('files_to_update'):
+                for ip, client_version in bucket['ips']:
+                    record(ip, {'status': 'success', 'message': '已是最新版本', 'up_to_date': True,
+                                'from_version': client_version})
                 continue
 
             files_to_update = update_manifest.get('files_to_update', [])
-            files_to_delete = update_manifest.get('files_to_delete', [])
+            if bucket['delta']:
+                update_type = 'delta'
+                payload = self._build_delta_payload(
+                    new_version, bucket['fingerprint'], bucket['manifest'], files_to_update)
+            else:
+                update_type = 'incremental'
+                payload = self._build_incremental_payload(new_version, files_to_update)
+            if payload is None:
+                for ip, _ in bucket['ips']:
+                    record(ip, {'status': 'error', 'message': '没有需要更新的文件'})
+                continue
+            for ip, client_version in bucket['ips']:
+                pushes[ip] = (payload, update_type, client_version)
 
-            update_data: dict[str, str] = {}
-            for file_path in files_to_update:
-                content = self._um.get_file_content(file_path)
-                if content:
-                    update_data[file_path] = base64.b64encode(content).decode('utf-8')
+        def push(ip: str) -> dict[str, Any]:
+            payload, update_type, client_version = pushes[ip]
+            result = self._net.push_update_to_client(ip, payload, new_version, update_type)
+            result = result if result else {'status': 'error', 'message': '无响应'}
+            result['from_version'] = client_version
+            return result
 
-            if not update_data:
-                all_results[ip] = {'status': 'error', 'message': '没有需要更新的文件'}
-                continue
+        fan_out(list(pushes), push, record, max_workers=max_workers)
+
+        success_count = sum(1 for r in all_results.values() if r.get('status') == 'success')
+        return {
+            'status': 'success' if success_count == len(target_ips) else 'partial',
+            'version': new_version,
+            'results': all_results,
+            'success_count': success_count,
+            'fail_count': len(target_ips) - success_count,
+            'distinct_manifests': len(buckets)
+        }
 
-            result = self._net.push_update_to_client(ip, update_data, new_version, 'incremental')
-            all_results[ip] = result if result else {'status': 'error', 'message': '无响应'}
+    # ── 预分发与激活 ──────────────────────────────────
+
+    def stage_update(self, target_ips: list[str],
+                     on_result: Callable[[str, dict[str, Any]], None] | None = None,
+                     max_workers: int = UPDATE_MAX_PARALLEL,
+                     rate_limit: int = 0) -> dict[str, Any]:
+        """把当前版本预分发到节点的暂存目录，不影响节点上正在运行的版本。
+
+        只发送暂存目录和运行目录中都没有的文件（中断后再次执行即续传），
+        能做块级差异的文件以运行中的文件为基准发送差异。rate_limit 为
+        每个节点的发送速率上限（字节/秒），0 表示不限速。已是该版本的节点
+        结果带 'up_to_date': True。
+        """
+        target_ips = list(dict.fromkeys(target_ips))
+        new_version = self._um.get_current_version()
+        server_files = {path: info.get('md5') for path, info
+                        in self._um.get_version_info().get('files', {}).items()
+                        if path not in NODE_LOCAL_FILES}
+        all_results: dict[str, Any] = {}
+        lock = threading.Lock()
+
+        def record(ip: str, result: dict[str, Any]) -> None:
+            with lock:
+                all_results[ip] = result
+            if on_result:
+                on_result(ip, result)
+
+        # 分组指纹 -> {'manifest', 'files', 'ips': [(ip, 客户端版本)]}
+        buckets: dict[str, dict[str, Any]] = {}
+
+        manifest_request = self._manifest_request()
+
+        def fetch(ip: str) -> tuple[Any, Any, Any]:
+            version_result, manifest_result, staged_result = self._net.send_batch(ip, [
+                ('get_version', None),
+                manifest_request,
+                ('get_staged_manifest', {'version': new_version})
+            ], parallel=True)
+            return version_result, self._client_manifest(ip, manifest_result), staged_result
+
+        def on_manifest(ip: str, fetched: Any) -> None:
+            version_result, client_manifest, staged_result = (
+                fetched if isinstance(fetched, tuple) else (None, None, None))
+            if not version_result or version_result.get('status') != 'success':
+                record(ip, {'status': 'error', 'message': '无法获取客户端版本'})
+                return
+            client_version = version_result.get('version', 'unknown')
+            if client_version == new_version:
+                record(ip, {'status': 'success', 'message': '已是最新版本', 'up_to_date': True,
+                            'from_version': client_version})
+                return
+            if 'stage' not in version_result.get('capabilities', []):
+                record(ip, {'status': 'error', 'message': '客户端不支持预分发，请先用普通更新升级'})
+                return
+            if client_manifest is None:
+                record(ip, {'status': 'error', 'message': '无法获取文件清单'})
+                return
+            staged = (staged_result or {}).get('manifest', {})
+            if (staged_result or {}).get('complete') and staged == server_files:
+                record(ip, {'status': 'success', 'message': f'版本 {new_version} 已预分发',
+                            'from_version': client_version})
+                return
+
+            files = sorted(path for path, md5 in server_files.items()
+                           if staged.get(path) != md5 and client_manifest.get(path) != md5)
+            fingerprint = hashlib.sha256(json.dumps(
+                [client_manifest, files], sort_keys=True).encode('utf-8')).hexdigest()
+            with lock:
+                bucket = buckets.setdefault(fingerprint, {
+                    'manifest': client_manifest, 'files': files, 'ips': []
+                })
+                bucket['ips'].append((ip, client_version))
+
+        fan_out(target_ips, fetch, on_manifest)
+
+        pushes: dict[str, tuple[bytes, str, str]] = {}
+        for fingerprint, bucket in buckets.items():
+            payload = self._build_delta_payload(
+                new_version, f'stage:{fingerprint}', bucket['manifest'], bucket['files'],
+                extra_header={'files': server_files})
+            # 同组节点共用一份内容，按块校验的整体哈希只计算一次
+            digest = hashlib.sha256(payload).hexdigest()
+            for ip, client_version in bucket['ips']:
+                pushes[ip] = (payload, digest, client_version)
+
+        def push(ip: str) -> dict[str, Any]:
+            payload, digest, client_version = pushes[ip]
+            result = self._net.push_update_to_client(ip, payload, new_version, 'stage', rate_limit,
+                                                     digest=digest)
+            result = result if result else {'status': 'error', 'message': '无响应'}
+            result['from_version'] = client_version
+            return result
+
+        fan_out(list(pushes), push, record, max_workers=max_workers)
 
         success_count = sum(1 for r in all_results.values() if r.get('status') == 'success')
         return {
@@ -109,3 +336,149 @@ class UpdateService:
             'success_count': success_count,
             'fail_count': len(target_ips) - success_count
         }
+
+    def activate_update(self, target_ips: list[str],
+                        on_result: Callable[[str, dict[str, Any]], None] | None = None,
+                        max_workers: int = UPDATE_MAX_PARALLEL) -> dict[str, Any]:
+        """让节点激活已预分发的当前版本（只做文件切换和重启）。"""
+        new_version = self._um.get_current_version()
+
+        def activate(ip: str) -> dict[str, Any]:
+            result = self._net.activate_client_update(ip, new_version)
+            return result if result else {'status': 'error', 'message': '无响应'}
+
+        results = fan_out(list(dict.fromkeys(target_ips)), activate, on_result, max_workers=max_workers)
+
+        success_count = sum(1 for r in results.values() if r and r.get('status') == 'success')
+        return {
+            'status': 'success' if success_count == len(results) else 'partial',
+            'version': new_version,
+            'results': results,
+            'success_count': success_count,
+            'fail_count': len(results) - success_count
+        }
+
+    # ── 分批发布 ──────────────────────────────────────
+
+    def start_rollout(self, target_ips: list[str],
+                      config: dict[str, Any] | None = None) -> dict[str, Any]:
+        """按波次发布当前版本：金丝雀 → 固定大小批次，波次间检查健康状态。"""
+        return self._rollout.start(target_ips, config)
+
+    def resume_rollout(self) -> dict[str, Any]:
+        return self._rollout.resume()
+
+    def pause_rollout(self) -> None:
+        self._rollout.pause()
+
+    def abort_rollout(self) -> None:
+        self._rollout.abort()
+
+    def get_rollout_status(self) -> dict[str, Any] | None:
+        return self._rollout.get_status()
+
+    def set_rollout_callback(self, cb: Callable[[str], None]) -> None:
+        self._rollout.set_event_callback(cb)
+
+    def _manifest_request(self) -> tuple[str, dict[str, Any]]:
+        """获取客户端清单的批量命令：带上当前版本的目录 Merkle 哈希，客户端只返回不同的部分。"""
+        tree = self._um.get_manifest_tree(hash_name=MANIFEST_HASH)
+        if tree is None:
+            return 'get_files_manifest', {'hash': MANIFEST_HASH}
+        return 'get_manifest_tree', {'hash': MANIFEST_HASH, 'dirs': tree['dirs']}
+
+    def _client_manifest(self, ip: str, manifest_result: dict[str, Any] | None) -> dict[str, str] | None:
+        """把客户端应答还原为 md5 清单，无法获取时返回 None。
+
+        Merkle 应答中哈希相同的目录直接取服务端的文件；不支持 get_manifest_tree
+        的旧客户端改为获取完整清单（其应答没有 hash 字段，本身就是 md5）。
+        """
+        if manifest_result is None:
+            return None
+        if manifest_result.get('status') == 'success' and 'root' in manifest_result:
+            hash_name = manifest_result.get('hash', MANIFEST_HASH)
+            tree = self._um.get_manifest_tree(hash_name=hash_name)
+            if tree is not None:
+                same_dirs = set(manifest_result.get('same_dirs', []))
+                files = {path: digest for path, digest in tree['files'].items()
+                         if manifest_result.get('in_sync') or parent_dir(path) in same_dirs}
+                files.update(manifest_result.get('entries', {}))
+                return self._um.to_md5_manifest(files, hash_name)
+            manifest_result = None
+        if manifest_result is None or manifest_result.get('status') != 'success':
+            manifest_result = self._net.send_command(ip, 'get_files_manifest', {'hash': MANIFEST_HASH})
+            if not manifest_result or manifest_result.get('status') != 'success':
+                return None
+        return self._um.to_md5_manifest(manifest_result.get('manifest', {}),
+                                        manifest_result.get('hash', 'md5'))
+
+    def _build_incremental_payload(self, version: str,
+                                   files_to_update: list[str]) -> bytes | None:
+        """构造（或从缓存取出）增量更新内容，返回序列化后的 JSON 字节。"""
+        key = ('payload', version, 'incremental', tuple(sorted(files_to_update)))
+        with self._payload_lock:
+            cached = self._um.cache.get(key)
+            if cached is not None:
+                return cached
+
+            update_data: dict[str, str] = {}
+            for file_path in files_to_update:
+                content = self._um.get_file_content(file_path, version)
+                if content is not None:
+                    update_data[file_path] = base64.b64encode(content).decode('utf-8')
+            if not update_data:
+                return None
+
+            payload = json.dumps(update_data).encode('utf-8')
+            self._um.cache.put(key, payload)
+            return payload
+
+    def _build_delta_payload(self, version: str, fingerprint: str,
+                             client_manifest: dict[str, str],
+                             files_to_update: list[str],
+                             extra_header: dict[str, Any] | None = None) -> bytes | None:
+        """构造（或从缓存取出）块级差异更新内容。
+
+        格式：一行 JSON 头 {"entries": [{path, kind, size, md5}]}，随后依次是
+        各条目的原始字节；kind 为 delta（块级差异）或 full（整个文件）。
+        extra_header 合并进头部（预分发时携带完整文件清单），此时允许条目为空。
+        """
+        key = ('payload', version, 'delta', fingerprint)
+        with self._payload_lock:
+            cached = self._um.cache.get(key)
+            if cached is not None:
+                return cached
+
+            server_files = self._um.get_version_info().get('files', {})
+            entries: list[dict[str, Any]] = []
+            bodies: list[bytes] = []
+            for file_path in files_to_update:
+                body = self._um.get_file_delta(file_path, client_manifest.get(file_path, ''))
+                kind = 'delta'
+                if body is None:
+                    body = self._um.get_file_content(file_path, version)
+                    kind = 'full'
+                if body is None:
+                    continue
+                entries.append({
+                    'path': file_path,
+                    'kind': kind,
+                    'size': len(body),
+                    'md5': server_files.get(file_path, {}).get('md5')
+                })
+                bodies.append(body)
+            if not entries and extra_header is None:
+                return None
+
+            header = json.dumps(dict(extra_header or {}, entries=entries)).encode('utf-8') + b'\n'
+            payload = header + b''.join(bodies)
+            self._um.cache.put(key, payload)
+            return payload
+
+    def get_cache_stats(self) -> dict[str, Any]:
+        """更新内容内存缓存的条目数、占用字节和命中率。"""
+        return self._um.get_cache_stats()
+
+    def get_package_compression(self) -> str | None:
+        """当前版本全量包的压缩统计说明，全量包尚未生成时返回 None。"""
+        return self._um.get_package_compression()
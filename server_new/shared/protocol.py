@@ -6,7 +6,9 @@
 
 import socket
 import json
+import hashlib
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Any, Callable, TypedDict
 
 # ── 端口定义 ──────────────────────────────────────────
@@ -19,14 +21,80 @@ STREAM_BUFFER_SIZE = 4096
 FILE_BUFFER_SIZE = 131072   # 128KB
 LARGE_BUFFER_SIZE = 65536   # 64KB
 
+# ── 并发 ──────────────────────────────────────────
+FANOUT_MAX_WORKERS = 64     # 大规模扇出时的最大并发连接数
+UPDATE_MAX_PARALLEL = 16    # 同时推送更新的节点数上限
+
+# ── 可续传传输 ────────────────────────────────────────
+TRANSFER_CHUNK_SIZE = 1024 * 1024   # 逐块校验的单位
+TRANSFER_RETRIES = 3                # 传输中断后自动续传的次数
+TRANSFER_RETRY_DELAY = 2            # 续传前的等待（秒）
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024   # 达到该大小的文件才分段并行传输
+PARALLEL_INITIAL_STREAMS = 2           # 并行传输的初始连接数，按实测吞吐量自动增减
+PARALLEL_MAX_STREAMS = 8               # 并行传输的最大连接数
+
+# ── 传输调度（core/transfer_scheduler.py）──────────────
+TRANSFER_MAX_CONCURRENT = 8      # 同时进行的传输（连接）数上限，0 为不限；控制流量不受限
+TRANSFER_BURST_SECONDS = 0.5     # 令牌桶容量，按速率折算的秒数
+PRIORITY_INTERACTIVE = 0         # 界面上单独发起的传输，排在批量操作之前
+PRIORITY_BULK = 1                # 批量分发、更新推送、备份
+
+# ── 目录同步 ──────────────────────────────────────────
+DIR_SYNC_CACHE_BYTES = 256 * 1024 * 1024    # 多个节点共用的压缩后文件内容缓存
+DIR_SYNC_CACHE_FILE_MAX = 16 * 1024 * 1024  # 超过该大小的文件不缓存，每个节点各自边读边压缩
+
+# ── 接力分发 ──────────────────────────────────────────
+RELAY_CHUNK_SIZE = 1024 * 1024   # 接力分发的校验/转发单位
+RELAY_SEEDS = 2                  # 服务端直接发送的种子节点数
+RELAY_FANOUT = 2                 # 每个节点转发的下游节点数（1 为流水线链）
+
+# ── 文件清单 ──────────────────────────────────────────
+# 名称与客户端 core/client_updater.py 的 MANIFEST_HASHES 保持一致
+MANIFEST_HASHES: dict[str, Callable[[], Any]] = {
+    'md5': hashlib.md5,
+    'blake2b': lambda: hashlib.blake2b(digest_size=16)
+}
+MANIFEST_HASH = 'blake2b'        # 向客户端请求文件清单时使用的算法
+MANIFEST_FORMAT_VERSION = 2      # 清单应答带 hash 字段的格式版本；旧客户端无此字段，按 md5 处理
+# 节点本地的文件（配置和版本记录）：不预分发，也不计入 Merkle 哈希
+NODE_LOCAL_FILES = ('config.json', 'version.json')
+# 更新包包含的文件：根目录下的这些文件和以下目录（客户端据此确定参与 Merkle 比较的文件）
+PACKAGE_ROOT_FILES = ('client_main.py', 'config.json', 'requirements.txt', 'start.bat')
+PACKAGE_DIRS = ('core',)
+
+# 只读命令：连接池的请求在发出后连接断开时可以换新连接重发（见 core/connection_pool.py）
+READ_ONLY_COMMANDS = frozenset({
+    'get_system_info', 'get_version', 'get_worker_stats', 'get_files_manifest',
+    'get_staged_manifest', 'get_manifest_tree', 'get_dir_manifest', 'ping'
+})
+
 # ── 超时（秒）─────────────────────────────────────────
 CONNECT_TIMEOUT = 10
 COMMAND_TIMEOUT = 30
 FILE_TRANSFER_TIMEOUT = 300
 HEARTBEAT_INTERVAL = 10
+HEARTBEAT_MAX_INTERVAL = 60      # 服务端建议的心跳间隔上限
+HEARTBEAT_TARGET_RATE = 50       # 期望的心跳到达速率上限（次/秒），节点多时拉长间隔
+NODE_OFFLINE_TIMEOUT = 30        # 心跳超时判定离线（至少为 3 个心跳间隔）
 MONITOR_INTERVAL = 5
 REGISTER_TIMEOUT = 3
 
+# ── 连接池（服务端到客户端的命令连接）────────────────────
+POOL_MAX_PER_NODE = 4            # 每个节点同时使用的命令连接数上限，超出的请求等待
+POOL_IDLE_TIMEOUT = 60           # 服务端空闲连接的保留时间，须短于客户端的 KEEP_ALIVE_IDLE_TIMEOUT
+KEEP_ALIVE_IDLE_TIMEOUT = 120    # 客户端保留空闲长连接的时间
+KEEP_ALIVE_RETRY = 300           # 节点不支持长连接时，该时间内不再尝试
+TCP_KEEPIDLE = 10                # TCP keepalive：空闲多久后开始探测
+TCP_KEEPINTVL = 5                # 探测间隔
+TCP_KEEPCNT = 3                  # 连续无应答多少次判定对端已断开
+
+# ── 节点链路测量（core/node_metrics.py）─────────────────
+BANDWIDTH_PROBE_SIZE = 1024 * 1024       # 主动带宽探测发送的字节数
+BANDWIDTH_PROBE_INTERVAL = 600           # 后台带宽探测的检查间隔（秒），0 为不主动探测
+BANDWIDTH_MAX_AGE = 1800                 # 带宽测量超过该时间视为过期，需要重新探测
+BANDWIDTH_SAMPLE_MIN = 8 * 1024 * 1024   # 传输达到该大小才作为带宽样本
+TRANSFER_STALL_MIN = 30                  # 按带宽估算的传输停滞超时的下限（上限为 FILE_TRANSFER_TIMEOUT）
+
 # ── 消息类型 ──────────────────────────────────────────
 class MsgType:
     REGISTER = "register"
@@ -37,6 +105,27 @@ class MsgType:
     UPDATE = "update"
     MONITOR_DATA = "monitor_data"
     BACKUP_FILE = "backup_file"
+    # 流式命令帧（按行分隔的 JSON）
+    STREAM_START = "stream_start"
+    STREAM_OUTPUT = "stream_output"
+    STREAM_END = "stream_end"
+    STREAM_CANCEL = "stream_cancel"
+    # 批量命令（一次往返执行多条命令）
+    BATCH = "batch"
+    # 接力分发（节点边接收边转发给下游节点）
+    RELAY = "relay"
+    # 大文件分段并行传输（每个连接发送一段）
+    RANGE_PUT = "range_put"
+    # 目录同步（只发送变化的文件并删除多余的文件）
+    DIR_SYNC = "dir_sync"
+    # 建立长连接（服务端连接池），之后在同一连接上逐个发送请求
+    KEEP_ALIVE = "keep_alive"
+    # 带宽探测（服务端发送指定字节数的数据）
+    BANDWIDTH_PROBE = "bandwidth_probe"
+
+
+# 客户端工作池饱和时返回的状态
+STATUS_BUSY = "busy"
 
 
 # ── JSON 消息类型定义 ──────────────────────────────────
@@ -45,6 +134,15 @@ class HeartbeatMessage(TypedDict):
     type: str          # "heartbeat"
     os: str
     info: dict[str, Any]
+    # 可选 link: 上一次心跳的 [t0, t1, t2, t3]（客户端发出、服务端收到、服务端应答、
+    # 客户端收到的时间），服务端据此计算 RTT 和时钟偏差，见 core/node_metrics.py
+
+
+class HeartbeatAck(TypedDict, total=False):
+    status: str                # "ok"
+    heartbeat_interval: int    # 服务端建议的心跳间隔（秒）
+    server_recv: float         # 服务端收到心跳的时间（t1）
+    server_send: float         # 服务端发出应答的时间（t2）
 
 
 class RegisterMessage(TypedDict):
@@ -78,6 +176,53 @@ class UpdateMessage(TypedDict):
     update_type: str
 
 
+class RangePutMessage(TypedDict):
+    type: str          # "range_put"
+    sha256: str        # 整个文件的 sha256
+    file_size: int
+    chunk_size: int
+    start: int         # 分段起止位置（按 chunk_size 对齐，end 不含）
+    end: int
+
+
+class DirSyncMessage(TypedDict):
+    type: str          # "dir_sync"
+    remote_dir: str    # 客户端 Transfer Files 下的目录名
+    hash: str          # 文件哈希算法，见 MANIFEST_HASHES
+
+
+class KeepAliveMessage(TypedDict):
+    type: str          # "keep_alive"
+    idle_timeout: int  # 服务端保留空闲连接的时间（秒）
+
+
+class BandwidthProbeMessage(TypedDict):
+    type: str          # "bandwidth_probe"
+    size: int          # 随后发送的字节数；客户端就绪后全部接收，回复 {'status', 'received'}
+
+
+class KeepAliveAck(TypedDict, total=False):
+    status: str
+    keep_alive: bool   # 客户端接受长连接；旧版客户端不认识该消息，直接关闭连接
+    idle_timeout: int  # 客户端保留空闲连接的时间（秒），服务端在此之前回收
+
+
+class RelayMessage(TypedDict, total=False):
+    type: str          # "relay"
+    purpose: str       # "file" / "update"
+    remote_path: str   # purpose=file
+    is_zip: bool       # purpose=file
+    version: str       # purpose=update（全量更新包）
+
+
+class RelayHeader(TypedDict):
+    file_size: int
+    chunk_size: int
+    chunk_hashes: list[str]        # 每块的 sha256
+    sha256: str
+    children: list[dict[str, Any]]  # 下游子树 [{ip, children}]
+
+
 class MonitorDataMessage(TypedDict):
     type: str          # "monitor_data"
     data: dict[str, Any]
@@ -89,6 +234,36 @@ class BackupFileMessage(TypedDict):
     folder_name: str
 
 
+class BatchItem(TypedDict, total=False):
+    command: str
+    params: dict[str, Any]
+
+
+class BatchMessage(TypedDict, total=False):
+    type: str          # "batch"
+    commands: list[BatchItem]
+    parallel: bool         # 命令互不依赖时可并发执行
+    stop_on_error: bool    # 顺序执行时遇到失败跳过后续命令
+
+
+class BatchResponse(TypedDict):
+    status: str
+    results: list[dict[str, Any]]   # 与 commands 一一对应
+    duration: float
+
+
+class StreamOutputFrame(TypedDict):
+    type: str          # "stream_output"
+    seq: int
+    stream: str        # "stdout" / "stderr"
+    data: str
+
+
+class StreamEndFrame(TypedDict):
+    type: str          # "stream_end"
+    result: dict[str, Any]
+
+
 class ResponseMessage(TypedDict, total=False):
     status: str
     message: str
@@ -114,6 +289,9 @@ class ResponseMessage(TypedDict, total=False):
     files_count: int
     package_path: str
     exe_path: str
+    active: int
+    queued: int
+    stats: dict[str, Any]
 
 
 # ── 工具函数 ──────────────────────────────────────────
@@ -148,6 +326,41 @@ def send_json(sock: socket.socket, data: dict) -> None:
     sock.sendall(json.dumps(data).encode('utf-8'))
 
 
+class JsonLineReader:
+    """按行读取 JSON 帧（流式命令使用，每帧以换行结尾）。
+
+    对端若按旧协议只回一个不带换行的 JSON，连接关闭时也能解析出来。
+    """
+
+    def __init__(self, sock: socket.socket,
+                 buffer_size: int = STREAM_BUFFER_SIZE) -> None:
+        self._sock = sock
+        self._buffer_size = buffer_size
+        self._buf = b''
+        self.closed = False
+
+    def read(self, timeout: float | None = None) -> dict | None:
+        """读取下一帧；超时返回 None，连接关闭且无剩余数据时抛出 ConnectionError。"""
+        while b'\n' not in self._buf:
+            if self.closed:
+                if self._buf.strip():
+                    line, self._buf = self._buf, b''
+                    return json.loads(line.decode('utf-8'))
+                raise ConnectionError("连接已关闭")
+            self._sock.settimeout(timeout)
+            try:
+                chunk = self._sock.recv(self._buffer_size)
+            except socket.timeout:
+                return None
+            if not chunk:
+                self.closed = True
+            self._buf += chunk
+        line, self._buf = self._buf.split(b'\n', 1)
+        if not line.strip():
+            return self.read(timeout)
+        return json.loads(line.decode('utf-8'))
+
+
 def broadcast(targets: list[str],
               worker: Callable[[str], Any],
               timeout: float = COMMAND_TIMEOUT) -> dict[str, Any]:
@@ -174,3 +387,32 @@ def broadcast(targets: list[str],
         t.join(timeout=timeout)
 
     return results
+
+
+def fan_out(targets: list[str],
+            worker: Callable[[str], Any],
+            on_result: Callable[[str, Any], None] | None = None,
+            max_workers: int = FANOUT_MAX_WORKERS) -> dict[str, Any]:
+    """以有界并发向多个目标执行 worker，结果按完成顺序回调。
+
+    与 broadcast 不同，线程数不超过 max_workers，适合数百节点的扇出；
+    on_result(ip, result) 在每个目标完成时立即调用。worker 抛出的异常
+    会被转换为 {'status': 'error'} 结果。返回 {ip: result} 字典。
+    """
+    results: dict[str, Any] = {}
+    if not targets:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets)))) as pool:
+        futures = {pool.submit(worker, ip): ip for ip in targets}
+        for future in as_completed(futures):
+            ip = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'status': 'error', 'message': str(e)}
+            results[ip] = result
+            if on_result:
+                on_result(ip, result)
+
+    return results